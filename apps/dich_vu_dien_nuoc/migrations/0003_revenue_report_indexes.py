@@ -0,0 +1,24 @@
+from django.db import migrations
+
+
+# Index cho báo cáo doanh thu: lọc thông báo theo khoảng ThoigianTao và nối chi tiết theo thông báo
+CREATE_REVENUE_REPORT_INDEXES_SQL = '''
+CREATE INDEX IF NOT EXISTS "ThanhToan_DichVu_ThoigianTao_idx" ON "public"."ThanhToan_DichVu" ("ThoigianTao");
+CREATE INDEX IF NOT EXISTS "CT_ThanhToan_DichVu_ThanhToan_idx" ON "public"."CT_ThanhToan_DichVu" ("ID_ThanhToan_DichVu");
+'''
+
+DROP_REVENUE_REPORT_INDEXES_SQL = '''
+DROP INDEX IF EXISTS "public"."ThanhToan_DichVu_ThoigianTao_idx";
+DROP INDEX IF EXISTS "public"."CT_ThanhToan_DichVu_ThanhToan_idx";
+'''
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dich_vu_dien_nuoc', '0002_alter_ctthanhtoandichvu_table_alter_dichvu_table_and_more'),
+    ]
+
+    operations = [
+        migrations.RunSQL(CREATE_REVENUE_REPORT_INDEXES_SQL, DROP_REVENUE_REPORT_INDEXES_SQL),
+    ]
@@ -0,0 +1,74 @@
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+CREATE_TONG_HOP_DOANH_THU_THANG_SQL = '''
+CREATE TABLE IF NOT EXISTS "public"."TongHop_DoanhThu_Thang" (
+    "id" bigserial PRIMARY KEY,
+    "created_at" timestamp with time zone NOT NULL,
+    "updated_at" timestamp with time zone NULL,
+    "Thang" date NOT NULL,
+    "Id_HopDong" bigint NOT NULL REFERENCES "public"."HopDong" ("Id_HopDong") ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED,
+    "Id_DichVu" bigint NOT NULL REFERENCES "public"."DichVu" ("Id_DichVu") ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED,
+    "DonViTinh" varchar NULL,
+    "TongTienSauThue" double precision NOT NULL DEFAULT 0,
+    "TongSoSuDung" double precision NOT NULL DEFAULT 0,
+    CONSTRAINT "TongHop_DoanhThu_Thang_thang_hopdong_dichvu_uniq" UNIQUE ("Thang", "Id_HopDong", "Id_DichVu")
+);
+CREATE INDEX IF NOT EXISTS "TongHop_DoanhThu_Thang_HopDong_Thang_idx" ON "public"."TongHop_DoanhThu_Thang" ("Id_HopDong", "Thang");
+
+-- Dựng dữ liệu ban đầu từ chi tiết thanh toán hiện có (tháng theo giờ địa phương, giống TruncMonth của Django)
+INSERT INTO "public"."TongHop_DoanhThu_Thang" (
+    "created_at", "updated_at", "Thang", "Id_HopDong", "Id_DichVu", "DonViTinh", "TongTienSauThue", "TongSoSuDung"
+)
+SELECT
+    now(), now(), date_trunc('month', tt."ThoigianTao" AT TIME ZONE '{time_zone}')::date, tt."Id_HopDong", ct."Id_DichVu",
+    MIN(ct."DonViTinh"),
+    COALESCE(SUM(ct."TienSauThue"), 0),
+    COALESCE(SUM(ct."SoSuDung"), 0)
+FROM "public"."CT_ThanhToan_DichVu" ct
+JOIN "public"."ThanhToan_DichVu" tt ON tt."id" = ct."ID_ThanhToan_DichVu"
+WHERE tt."ThoigianTao" IS NOT NULL AND tt."Id_HopDong" IS NOT NULL AND ct."Id_DichVu" IS NOT NULL
+GROUP BY date_trunc('month', tt."ThoigianTao" AT TIME ZONE '{time_zone}'), tt."Id_HopDong", ct."Id_DichVu"
+ON CONFLICT ("Thang", "Id_HopDong", "Id_DichVu") DO NOTHING;
+'''.format(time_zone=settings.TIME_ZONE)
+
+DROP_TONG_HOP_DOANH_THU_THANG_SQL = 'DROP TABLE IF EXISTS "public"."TongHop_DoanhThu_Thang";'
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dich_vu_dien_nuoc', '0003_revenue_report_indexes'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunSQL(CREATE_TONG_HOP_DOANH_THU_THANG_SQL, DROP_TONG_HOP_DOANH_THU_THANG_SQL),
+            ],
+            state_operations=[
+                migrations.CreateModel(
+                    name='TonghopDoanhthuThang',
+                    fields=[
+                        ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                        ('created_at', models.DateTimeField()),
+                        ('updated_at', models.DateTimeField(blank=True, null=True)),
+                        ('thang', models.DateField(db_column='Thang')),
+                        ('donvitinh', models.CharField(blank=True, db_column='DonViTinh', null=True)),
+                        ('tongtiensauthue', models.FloatField(db_column='TongTienSauThue', default=0)),
+                        ('tongsosudung', models.FloatField(db_column='TongSoSuDung', default=0)),
+                        ('id_hopdong', models.ForeignKey(db_column='Id_HopDong', on_delete=django.db.models.deletion.DO_NOTHING, to='dich_vu_dien_nuoc.hopdong')),
+                        ('id_dichvu', models.ForeignKey(db_column='Id_DichVu', on_delete=django.db.models.deletion.DO_NOTHING, to='dich_vu_dien_nuoc.dichvu')),
+                    ],
+                    options={
+                        'db_table': '"public"."TongHop_DoanhThu_Thang"',
+                        'db_table_comment': 'Tổng hợp doanh thu dịch vụ theo tháng, khách thuê và dịch vụ, dùng cho báo cáo doanh thu',
+                        'managed': False,
+                        'unique_together': {('thang', 'id_hopdong', 'id_dichvu')},
+                    },
+                ),
+            ],
+        ),
+    ]
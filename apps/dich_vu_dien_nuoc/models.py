@@ -135,4 +135,22 @@ class ThanhtoanNhaxuong(models.Model):
 
     class Meta:
         managed = False
-        db_table = '"public"."ThanhToan_NhaXuong"'
\ No newline at end of file
+        db_table = '"public"."ThanhToan_NhaXuong"'
+
+class TonghopDoanhthuThang(models.Model):
+    """Model tổng hợp doanh thu dịch vụ theo Tháng × Khách thuê (hợp đồng) × Dịch vụ (cập nhật tăng dần khi ghi thông báo)"""
+    id = models.BigAutoField(primary_key=True)
+    created_at = models.DateTimeField()
+    updated_at = models.DateTimeField(blank=True, null=True)
+    thang = models.DateField(db_column='Thang')  # Ngày đầu tháng (theo ThoigianTao của thông báo, giờ địa phương)
+    id_hopdong = models.ForeignKey(Hopdong, models.DO_NOTHING, db_column='Id_HopDong')
+    id_dichvu = models.ForeignKey(Dichvu, models.DO_NOTHING, db_column='Id_DichVu')
+    donvitinh = models.CharField(db_column='DonViTinh', blank=True, null=True)
+    tongtiensauthue = models.FloatField(db_column='TongTienSauThue', default=0)
+    tongsosudung = models.FloatField(db_column='TongSoSuDung', default=0)
+
+    class Meta:
+        managed = False
+        db_table = '"public"."TongHop_DoanhThu_Thang"'
+        db_table_comment = 'Tổng hợp doanh thu dịch vụ theo tháng, khách thuê và dịch vụ, dùng cho báo cáo doanh thu'
+        unique_together = (('thang', 'id_hopdong', 'id_dichvu'),)
@@ -0,0 +1,257 @@
+import datetime as dt
+
+from django.db import transaction
+from django.db.models import DateField, F, FloatField, Min, Q, Sum
+from django.db.models.functions import Coalesce, TruncMonth
+from django.utils import timezone
+
+from .models import CtThanhtoanDichvu, TonghopDoanhthuThang
+from apps.hrm_manager.utils.report_export_jobs import DATA_DOANH_THU, invalidate_report_data
+
+
+class DoanhThuThangService:
+    """
+    Quản lý bảng tổng hợp doanh thu Tháng × Khách thuê × Dịch vụ (TonghopDoanhthuThang).
+    - refresh: tính lại đúng các ô (khách thuê, tháng) bị ảnh hưởng sau mỗi lần tạo/sửa/xóa thông báo
+    - rebuild: dựng lại toàn bộ/khoảng tháng (management command rebuild_doanh_thu_thang)
+    - get_service_totals: tổng theo (công ty, dịch vụ) cho 1 khoảng ngày, tháng tròn đọc bảng tổng hợp,
+      chỉ các ngày lẻ ở 2 đầu khoảng mới đọc chi tiết thanh toán
+    """
+
+    ROLLUP_FIELDS = ['donvitinh', 'tongtiensauthue', 'tongsosudung']
+
+    @staticmethod
+    def month_start(value):
+        return value.replace(day=1)
+
+    @staticmethod
+    def next_month_start(value):
+        return (value.replace(day=1) + dt.timedelta(days=32)).replace(day=1)
+
+    @staticmethod
+    def local_midnight(ngay):
+        """0h của ngày theo múi giờ hệ thống (so sánh trực tiếp với cột ThoigianTao, dùng được index)."""
+        return timezone.make_aware(dt.datetime.combine(ngay, dt.time.min))
+
+    @staticmethod
+    def local_bounds(ngay_tu, ngay_den):
+        """Khoảng ngày [ngay_tu, ngay_den) → khoảng thời điểm [0h ngay_tu, 0h ngay_den)."""
+        return DoanhThuThangService.local_midnight(ngay_tu), DoanhThuThangService.local_midnight(ngay_den)
+
+    @staticmethod
+    def local_month(thoigian):
+        """Tháng (ngày đầu tháng) của thời điểm tạo thông báo theo giờ địa phương."""
+        if timezone.is_aware(thoigian):
+            thoigian = timezone.localtime(thoigian)
+        return thoigian.date().replace(day=1)
+
+    @staticmethod
+    def aggregate_expressions(from_rollup=False):
+        """
+        Các biểu thức aggregate, tên khớp với cột của TonghopDoanhthuThang.
+        from_rollup=True: cộng lại các ô tổng hợp thay vì chi tiết thanh toán.
+        """
+        tien, so_su_dung = ('tongtiensauthue', 'tongsosudung') if from_rollup else ('tiensauthue', 'sosudung')
+        return {
+            'donvitinh': Min('donvitinh'),
+            'tongtiensauthue': Coalesce(Sum(tien), 0.0, output_field=FloatField()),
+            'tongsosudung': Coalesce(Sum(so_su_dung), 0.0, output_field=FloatField()),
+        }
+
+    @staticmethod
+    def _aggregate_by_month(queryset):
+        return (
+            queryset
+            .filter(
+                id_thanhtoan_dichvu__thoigiantao__isnull=False,
+                id_thanhtoan_dichvu__id_hopdong__isnull=False,
+                id_dichvu__isnull=False,
+            )
+            .annotate(thang=TruncMonth('id_thanhtoan_dichvu__thoigiantao', output_field=DateField()))
+            .values('thang', 'id_dichvu_id', hopdong_id=F('id_thanhtoan_dichvu__id_hopdong_id'))
+            .annotate(**DoanhThuThangService.aggregate_expressions())
+            .order_by('thang', 'hopdong_id', 'id_dichvu_id')
+        )
+
+    @staticmethod
+    def _upsert(rows):
+        now = timezone.now()
+        objs = [
+            TonghopDoanhthuThang(
+                created_at=now, updated_at=now, thang=row['thang'],
+                id_hopdong_id=row['hopdong_id'], id_dichvu_id=row['id_dichvu_id'],
+                **{field: row[field] for field in DoanhThuThangService.ROLLUP_FIELDS}
+            )
+            for row in rows
+        ]
+        if objs:
+            TonghopDoanhthuThang.objects.bulk_create(
+                objs,
+                batch_size=1000,
+                update_conflicts=True,
+                unique_fields=['thang', 'id_hopdong', 'id_dichvu'],
+                update_fields=DoanhThuThangService.ROLLUP_FIELDS + ['updated_at'],
+            )
+        return len(objs)
+
+    @staticmethod
+    def refresh(hopdong_thoigian_pairs):
+        """
+        Tính lại các ô (khách thuê, tháng) chứa các cặp (id_hopdong, thoigiantao) của thông báo vừa tạo/sửa/xóa.
+        Chỉ aggregate lại chi tiết của đúng các khách thuê/tháng đó (1 query), dịch vụ không còn chi tiết nào bị xóa khỏi ô.
+        """
+        keys = {
+            (int(hopdong_id), DoanhThuThangService.local_month(thoigian))
+            for hopdong_id, thoigian in hopdong_thoigian_pairs
+            if hopdong_id is not None and thoigian is not None
+        }
+        if not keys:
+            return 0
+
+        hopdong_ids = {hopdong_id for hopdong_id, _ in keys}
+        thang_list = {thang for _, thang in keys}
+        time_from, time_to = DoanhThuThangService.local_bounds(
+            min(thang_list), DoanhThuThangService.next_month_start(max(thang_list))
+        )
+        rows = [
+            row for row in DoanhThuThangService._aggregate_by_month(
+                CtThanhtoanDichvu.objects.filter(
+                    id_thanhtoan_dichvu__id_hopdong_id__in=hopdong_ids,
+                    id_thanhtoan_dichvu__thoigiantao__gte=time_from,
+                    id_thanhtoan_dichvu__thoigiantao__lt=time_to,
+                )
+            )
+            if (row['hopdong_id'], row['thang']) in keys
+        ]
+
+        # Ô cũ của các khách thuê/tháng này mà dịch vụ không còn trong kết quả mới → xóa
+        dichvu_con_lai = {key: set() for key in keys}
+        for row in rows:
+            dichvu_con_lai[(row['hopdong_id'], row['thang'])].add(row['id_dichvu_id'])
+        stale_q = Q()
+        for (hopdong_id, thang), dichvu_ids in dichvu_con_lai.items():
+            key_q = Q(id_hopdong_id=hopdong_id, thang=thang)
+            if dichvu_ids:
+                key_q &= ~Q(id_dichvu_id__in=dichvu_ids)
+            stale_q |= key_q
+
+        with transaction.atomic():
+            TonghopDoanhthuThang.objects.filter(stale_q).delete()
+            count = DoanhThuThangService._upsert(rows)
+
+        # Doanh thu đã đổi → file báo cáo doanh thu xuất trước đó không còn dùng lại được
+        invalidate_report_data(DATA_DOANH_THU)
+        return count
+
+    @staticmethod
+    def rebuild(thang_tu=None, thang_den=None):
+        """
+        Dựng lại bảng tổng hợp từ chi tiết thanh toán cho khoảng tháng [thang_tu, thang_den] (None = không giới hạn).
+        Trả về số ô (tháng, khách thuê, dịch vụ) đã ghi.
+        """
+        ct_qs = CtThanhtoanDichvu.objects.all()
+        rollup_qs = TonghopDoanhthuThang.objects.all()
+        if thang_tu:
+            thang_tu = DoanhThuThangService.month_start(thang_tu)
+            ct_qs = ct_qs.filter(id_thanhtoan_dichvu__thoigiantao__gte=DoanhThuThangService.local_midnight(thang_tu))
+            rollup_qs = rollup_qs.filter(thang__gte=thang_tu)
+        if thang_den:
+            thang_ke_tiep = DoanhThuThangService.next_month_start(thang_den)
+            ct_qs = ct_qs.filter(id_thanhtoan_dichvu__thoigiantao__lt=DoanhThuThangService.local_midnight(thang_ke_tiep))
+            rollup_qs = rollup_qs.filter(thang__lt=thang_ke_tiep)
+
+        rollup_qs.delete()
+        invalidate_report_data(DATA_DOANH_THU)
+        return DoanhThuThangService._upsert(
+            DoanhThuThangService._aggregate_by_month(ct_qs).iterator(chunk_size=2000)
+        )
+
+    @staticmethod
+    def split_whole_months(ngay_bat_dau, ngay_ket_thuc):
+        """
+        Tách khoảng ngày [ngay_bat_dau, ngay_ket_thuc] thành:
+        - khoảng tháng tròn [thang_tu, thang_den) (None nếu không có tháng nào nằm trọn trong khoảng)
+        - các khoảng ngày lẻ [tu, den) ở 2 đầu, không thuộc tháng tròn nào
+        """
+        ngay_sau_cung = ngay_ket_thuc + dt.timedelta(days=1)
+        thang_tu = ngay_bat_dau if ngay_bat_dau.day == 1 else DoanhThuThangService.next_month_start(ngay_bat_dau)
+        thang_den = DoanhThuThangService.month_start(ngay_sau_cung)
+        if thang_tu >= thang_den:
+            return None, [(ngay_bat_dau, ngay_sau_cung)] if ngay_bat_dau < ngay_sau_cung else []
+
+        ngay_le = []
+        if ngay_bat_dau < thang_tu:
+            ngay_le.append((ngay_bat_dau, thang_tu))
+        if thang_den < ngay_sau_cung:
+            ngay_le.append((thang_den, ngay_sau_cung))
+        return (thang_tu, thang_den), ngay_le
+
+    @staticmethod
+    def get_service_totals(ngay_bat_dau=None, ngay_ket_thuc=None, hopdong_id=None, dichvu_id=None):
+        """
+        Tổng tiền sau thuế / số sử dụng theo (công ty, dịch vụ), sắp theo tên công ty.
+        Không lọc ngày → cộng toàn bộ bảng tổng hợp; có lọc ngày → cộng các ô tháng tròn,
+        ngày lẻ ở 2 đầu khoảng aggregate trực tiếp trên chi tiết thanh toán (UNION ALL 2 GROUP BY, 1 query).
+
+        Returns:
+            list[dict]: {'tencongty', 'id_dichvu__tendichvu', 'id_dichvu_id', 'id_dichvu__id_loaidichvu_id',
+                         'donvitinh', 'tongtiensauthue', 'tongsosudung'}
+        """
+        rollup_qs = TonghopDoanhthuThang.objects.all()
+        ct_q = Q()
+        if hopdong_id:
+            rollup_qs = rollup_qs.filter(id_hopdong_id=hopdong_id)
+            ct_q &= Q(id_thanhtoan_dichvu__id_hopdong_id=hopdong_id)
+        if dichvu_id:
+            rollup_qs = rollup_qs.filter(id_dichvu_id=dichvu_id)
+            ct_q &= Q(id_dichvu_id=dichvu_id)
+
+        khoang_thang, ngay_le = None, []
+        if ngay_bat_dau and ngay_ket_thuc:
+            khoang_thang, ngay_le = DoanhThuThangService.split_whole_months(ngay_bat_dau, ngay_ket_thuc)
+
+        sources = []
+        if khoang_thang or not (ngay_bat_dau and ngay_ket_thuc):
+            if khoang_thang:
+                rollup_qs = rollup_qs.filter(thang__gte=khoang_thang[0], thang__lt=khoang_thang[1])
+            sources.append(
+                rollup_qs
+                .values('id_dichvu__tendichvu', 'id_dichvu_id', 'id_dichvu__id_loaidichvu_id', tencongty=F('id_hopdong__tencongty'))
+                .annotate(**DoanhThuThangService.aggregate_expressions(from_rollup=True))
+                .order_by()
+            )
+        if ngay_le:
+            ngay_le_q = Q()
+            for ngay_tu, ngay_den in ngay_le:
+                time_from, time_to = DoanhThuThangService.local_bounds(ngay_tu, ngay_den)
+                ngay_le_q |= Q(id_thanhtoan_dichvu__thoigiantao__gte=time_from, id_thanhtoan_dichvu__thoigiantao__lt=time_to)
+            sources.append(
+                CtThanhtoanDichvu.objects.filter(ct_q & ngay_le_q)
+                .values(
+                    'id_dichvu__tendichvu', 'id_dichvu_id', 'id_dichvu__id_loaidichvu_id',
+                    tencongty=F('id_thanhtoan_dichvu__id_hopdong__tencongty'),
+                )
+                .annotate(**DoanhThuThangService.aggregate_expressions())
+                .order_by()
+            )
+        if not sources:
+            return []
+
+        # 1 query: UNION ALL 2 nguồn, sắp theo collation của DB ở cả 2 trường hợp (1 hay 2 nguồn)
+        rows = sources[0] if len(sources) == 1 else sources[0].union(*sources[1:], all=True)
+        rows = rows.order_by('tencongty', 'donvitinh')
+
+        # Cộng dồn ô tháng tròn + ngày lẻ của cùng (công ty, dịch vụ); giữ thứ tự xuất hiện đầu tiên từ DB.
+        # Đơn vị tính: bản ghi đầu tiên có giá trị (ORDER BY donvitinh, NULL xếp cuối) = MIN của DB
+        merged = {}
+        for row in rows:
+            key = (row['tencongty'], row['id_dichvu_id'])
+            current = merged.get(key)
+            if current is None:
+                merged[key] = dict(row)
+                continue
+            current['tongtiensauthue'] += row['tongtiensauthue']
+            current['tongsosudung'] += row['tongsosudung']
+            if current['donvitinh'] is None:
+                current['donvitinh'] = row['donvitinh']
+        return list(merged.values())
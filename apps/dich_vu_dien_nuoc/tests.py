@@ -1,3 +1,134 @@
-from django.test import TestCase
+import datetime as dt
+from unittest import mock
 
-# Create your tests here.
+from django.test import SimpleTestCase
+
+
+class RevenueReportQueryTests(SimpleTestCase):
+	def test_date_bounds_become_a_half_open_timestamp_range(self):
+		from apps.dich_vu_dien_nuoc.views import _revenue_time_range
+
+		start, end = _revenue_time_range('2026-01-01', dt.date(2026, 1, 31))
+
+		self.assertEqual((start.date(), start.hour), (dt.date(2026, 1, 1), 0))
+		self.assertEqual((end.date(), end.hour), (dt.date(2026, 2, 1), 0))
+		self.assertEqual(str(start.tzinfo), 'Asia/Ho_Chi_Minh')
+
+	@mock.patch('apps.dich_vu_dien_nuoc.services.CtThanhtoanDichvu')
+	@mock.patch('apps.dich_vu_dien_nuoc.services.TonghopDoanhthuThang')
+	@mock.patch('apps.dich_vu_dien_nuoc.views.ThanhtoanDichvu')
+	@mock.patch('apps.dich_vu_dien_nuoc.views.CtThanhtoanDichvu')
+	def test_whole_month_report_is_read_from_the_monthly_rollup(self, ct_model, tb_model, rollup_model, service_ct_model):
+		from apps.dich_vu_dien_nuoc.views import get_filtered_revenue_data
+
+		def row(cong_ty, dich_vu_id, loai, tien, so):
+			return {
+				'tencongty': cong_ty, 'id_dichvu__tendichvu': f'DV {dich_vu_id}',
+				'id_dichvu_id': dich_vu_id, 'id_dichvu__id_loaidichvu_id': loai,
+				'donvitinh': 'kWh', 'tongtiensauthue': tien, 'tongsosudung': so,
+			}
+
+		rollup_qs = rollup_model.objects.all.return_value.filter.return_value
+		rollup_qs.values.return_value.annotate.return_value.order_by.return_value.order_by.return_value = [
+			row('Cty A', 1, 19, 100.0, 10.0), row('Cty A', 2, 20, 50.0, 5.0), row('Cty A', 3, 7, 30.0, 1.0),
+			row('Cty B', 1, 19, 200.0, 20.0),
+		]
+		tb_model.objects.filter.return_value.filter.return_value.values.return_value.order_by.return_value = [
+			{'sotbdv': 'TB2', 'tongtiensauthue': 200.0, 'thoigiantao': None, 'tencongty': 'Cty B', 'giam_tru': 10.0, 'tongtienthanhtoan': 190.0},
+			{'sotbdv': 'TB1', 'tongtiensauthue': 180.0, 'thoigiantao': None, 'tencongty': 'Cty A', 'giam_tru': None, 'tongtienthanhtoan': None},
+		]
+
+		report = get_filtered_revenue_data('2026-01-01', '2026-01-31')
+
+		self.assertEqual(report['summary'], {'total_revenue': 370.0, 'total_revenue_dien': 300.0, 'total_revenue_nuoc': 50.0})
+		self.assertEqual(report['data']['tong_hop_dien_nuoc'], [
+			{'tencongty': 'Cty A', 'tong_tien_dien': 100.0, 'so_dien': 10.0, 'tong_tien_nuoc': 50.0, 'so_nuoc': 5.0},
+			{'tencongty': 'Cty B', 'tong_tien_dien': 200.0, 'so_dien': 20.0, 'tong_tien_nuoc': 0.0, 'so_nuoc': 0.0},
+		])
+		cong_ty_a = report['data']['chi_tiet_dich_vu'][0]
+		self.assertEqual(cong_ty_a['tong_tien_dich_vu'], 180.0)
+		self.assertEqual(cong_ty_a['dich_vu'][1]['id_thanhtoan_dichvu__id_hopdong__tencongty'], 'Cty A')
+		self.assertNotIn('id_dichvu__id_loaidichvu_id', cong_ty_a['dich_vu'][1])
+		rollup_model.objects.all.return_value.filter.assert_called_once_with(
+			thang__gte=dt.date(2026, 1, 1), thang__lt=dt.date(2026, 2, 1)
+		)
+		# Tháng tròn → không quét chi tiết thanh toán
+		service_ct_model.objects.filter.assert_not_called()
+		lookups = dict(tb_model.objects.filter.call_args.args[0].children)
+		self.assertIn('thoigiantao__gte', lookups)
+
+
+class DoanhThuThangServiceTests(SimpleTestCase):
+	def test_date_range_is_split_into_whole_months_and_edge_days(self):
+		from apps.dich_vu_dien_nuoc.services import DoanhThuThangService
+
+		split = DoanhThuThangService.split_whole_months
+		self.assertEqual(
+			split(dt.date(2026, 1, 15), dt.date(2026, 3, 10)),
+			((dt.date(2026, 2, 1), dt.date(2026, 3, 1)), [(dt.date(2026, 1, 15), dt.date(2026, 2, 1)), (dt.date(2026, 3, 1), dt.date(2026, 3, 11))]),
+		)
+		self.assertEqual(split(dt.date(2025, 12, 1), dt.date(2026, 1, 31)), ((dt.date(2025, 12, 1), dt.date(2026, 2, 1)), []))
+		self.assertEqual(split(dt.date(2026, 1, 5), dt.date(2026, 1, 20)), (None, [(dt.date(2026, 1, 5), dt.date(2026, 1, 21))]))
+
+	@mock.patch('apps.dich_vu_dien_nuoc.services.CtThanhtoanDichvu')
+	@mock.patch('apps.dich_vu_dien_nuoc.services.TonghopDoanhthuThang')
+	def test_partial_range_adds_edge_day_details_to_rollup_cells(self, rollup_model, ct_model):
+		from apps.dich_vu_dien_nuoc.services import DoanhThuThangService
+
+		def row(cong_ty, dich_vu_id, tien, so, don_vi='kWh'):
+			return {
+				'tencongty': cong_ty, 'id_dichvu__tendichvu': f'DV {dich_vu_id}', 'id_dichvu_id': dich_vu_id,
+				'id_dichvu__id_loaidichvu_id': 19, 'donvitinh': don_vi, 'tongtiensauthue': tien, 'tongsosudung': so,
+			}
+
+		rollup_source = rollup_model.objects.all.return_value.filter.return_value.values.return_value.annotate.return_value.order_by.return_value
+		edge_source = ct_model.objects.filter.return_value.values.return_value.annotate.return_value.order_by.return_value
+		# UNION ALL sắp theo (tencongty, donvitinh) trong DB: 'Kwh' (ngày lẻ) đứng trước 'kWh' (tháng tròn)
+		rollup_source.union.return_value.order_by.return_value = [
+			row('Cty A', 1, 40.0, 4.0), row('Cty B', 1, 10.0, 1.0, don_vi='Kwh'), row('Cty B', 1, 200.0, 20.0),
+		]
+
+		totals = DoanhThuThangService.get_service_totals(dt.date(2026, 1, 15), dt.date(2026, 2, 28))
+
+		self.assertEqual([(item['tencongty'], item['tongtiensauthue'], item['tongsosudung']) for item in totals], [
+			('Cty A', 40.0, 4.0), ('Cty B', 210.0, 21.0),
+		])
+		self.assertEqual(totals[1]['donvitinh'], 'Kwh')
+		rollup_source.union.assert_called_once_with(edge_source, all=True)
+		rollup_source.union.return_value.order_by.assert_called_once_with('tencongty', 'donvitinh')
+		rollup_model.objects.all.return_value.filter.assert_called_once_with(
+			thang__gte=dt.date(2026, 2, 1), thang__lt=dt.date(2026, 3, 1)
+		)
+		edge_lookups = dict(ct_model.objects.filter.call_args.args[0].children)
+		self.assertEqual(edge_lookups['id_thanhtoan_dichvu__thoigiantao__gte'].date(), dt.date(2026, 1, 15))
+		self.assertEqual(edge_lookups['id_thanhtoan_dichvu__thoigiantao__lt'].date(), dt.date(2026, 2, 1))
+
+	@mock.patch('apps.dich_vu_dien_nuoc.services.invalidate_report_data')
+	@mock.patch('apps.dich_vu_dien_nuoc.services.transaction')
+	@mock.patch('apps.dich_vu_dien_nuoc.services.TonghopDoanhthuThang')
+	@mock.patch('apps.dich_vu_dien_nuoc.services.DoanhThuThangService._aggregate_by_month')
+	def test_refresh_rewrites_only_the_notification_cells(self, aggregate, rollup_model, transaction, invalidate):
+		from apps.dich_vu_dien_nuoc.services import DoanhThuThangService
+		from django.utils import timezone
+
+		aggregate.return_value = [
+			{'thang': dt.date(2026, 1, 1), 'hopdong_id': 7, 'id_dichvu_id': 1, 'donvitinh': 'kWh', 'tongtiensauthue': 100.0, 'tongsosudung': 10.0},
+			# Cùng khách thuê, tháng khác → không thuộc ô cần tính lại
+			{'thang': dt.date(2026, 2, 1), 'hopdong_id': 7, 'id_dichvu_id': 1, 'donvitinh': 'kWh', 'tongtiensauthue': 90.0, 'tongsosudung': 9.0},
+		]
+
+		# 31/01 20:00 UTC = 01/02 03:00 giờ VN → ô tháng 2
+		count = DoanhThuThangService.refresh([
+			(7, timezone.make_aware(dt.datetime(2026, 1, 10, 12))),
+			(8, dt.datetime(2026, 1, 31, 20, tzinfo=dt.timezone.utc)),
+			(None, timezone.now()),
+		])
+
+		self.assertEqual(count, 1)
+		cells = [(call.kwargs['id_hopdong_id'], call.kwargs['thang'], call.kwargs['tongtiensauthue']) for call in rollup_model.call_args_list]
+		self.assertEqual(cells, [(7, dt.date(2026, 1, 1), 100.0)])
+		rollup_model.objects.bulk_create.assert_called_once()
+		stale_q = rollup_model.objects.filter.call_args.args[0]
+		self.assertEqual(len(stale_q.children), 2)
+		self.assertIn(('id_hopdong_id', 8), [child for q in stale_q.children for child in q.children if isinstance(child, tuple)])
+		invalidate.assert_called_once_with('doanh_thu')
@@ -7,20 +7,18 @@ from django.http import JsonResponse, HttpResponse
 from django.utils import timezone
 
 from django.db import transaction
-from django.db.models import Sum, Q, F, Case, When, FloatField, Min, Max
-from django.db.models.functions import Coalesce
+from django.db.models import Q, F, Exists, OuterRef
 from django.contrib.auth.decorators import login_required
 
 from .models import *
+from .services import DoanhThuThangService
+from apps.hrm_manager.utils.report_export_jobs import DATA_DOANH_THU, invalidate_report_data
+from apps.hrm_manager.utils.xlsx_export import XlsxSheet, xlsx_streaming_response
 
 from json import loads, dumps
-from io import BytesIO
 from django.template.loader import render_to_string
-import openpyxl
-from openpyxl.styles import Font
-from openpyxl.utils import get_column_letter
 
-from datetime import datetime,timedelta
+from datetime import date, datetime, timedelta
 import json
 from num2words import num2words
 
@@ -30,65 +28,70 @@ from urllib.parse import quote
 
 # ------------------------------------ VIEW BÁO CÁO DOANH THU ------------------------------------
 
-def get_filtered_revenue_data(start_date=None, end_date=None, customer_id=None, service_id=None):
-    """Hàm logic trung tâm để lấy tất cả dữ liệu báo cáo từ database"""
+# ID loại dịch vụ Điện / Nước
+LOAI_DICH_VU_DIEN = 19
+LOAI_DICH_VU_NUOC = 20
 
-    # 1. Xây dựng bộ lọc cơ sở
-    filters = Q()
-    if start_date and end_date:
-        filters = Q(id_thanhtoan_dichvu__thoigiantao__date__range=[start_date, end_date])
-    if customer_id and customer_id != 'all':
-        filters &= Q(id_thanhtoan_dichvu__id_hopdong_id=customer_id)
-    if service_id and service_id != 'all':
-        filters &= Q(id_dichvu_id=service_id)
-
-    # Lấy queryset cơ sở đã lọc
-    ct_thanhtoan_qs = CtThanhtoanDichvu.objects.filter(filters).select_related(
-        'id_thanhtoan_dichvu__id_hopdong', 'id_dichvu'
-    )
-    
-    # 2. Lấy dữ liệu cho Thẻ tóm tắt (Summary Cards)
-    # Lấy ID các thông báo thanh toán duy nhất từ kết quả đã lọc
-    thanhtoan_ids = ct_thanhtoan_qs.values_list('id_thanhtoan_dichvu_id', flat=True).distinct()
-    thanhtoan_qs = ThanhtoanDichvu.objects.filter(id__in=thanhtoan_ids)
-    
-    summary_agg_thanhtoan_qs = thanhtoan_qs.aggregate(
-        total_revenue=Coalesce(Sum('tongtiensauthue') - Sum(F('giamtru')/100 * F('tongtientruocthue')), 0.0)
-    )
 
-    summary_agg_ct_thanhtoan_qs = ct_thanhtoan_qs.aggregate(
-        total_revenue_dien=Coalesce(Sum('tiensauthue', filter=Q(id_dichvu__id_loaidichvu_id=19)), 0.0),
-        total_revenue_nuoc=Coalesce(Sum('tiensauthue', filter=Q(id_dichvu__id_loaidichvu_id=20)), 0.0),
+def _parse_report_date(value):
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return datetime.strptime(str(value), '%Y-%m-%d').date()
+
+
+def _revenue_time_range(start_date, end_date):
+    """
+    Đổi khoảng ngày [start_date, end_date] thành khoảng thời điểm [đầu ngày bắt đầu, đầu ngày sau ngày kết thúc)
+    theo múi giờ hệ thống → so sánh trực tiếp trên cột timestamp (dùng được index), kết quả giống lọc __date__range.
+    """
+    return DoanhThuThangService.local_bounds(
+        _parse_report_date(start_date), _parse_report_date(end_date) + timedelta(days=1)
     )
 
-    summary = {
-        "total_revenue": summary_agg_thanhtoan_qs['total_revenue'],
-        "total_revenue_dien": summary_agg_ct_thanhtoan_qs['total_revenue_dien'],
-        "total_revenue_nuoc": summary_agg_ct_thanhtoan_qs['total_revenue_nuoc']
-    }
 
-    # 3. Lấy dữ liệu Bảng thông báo
-    thong_bao = list(thanhtoan_qs.order_by('-thoigiantao').values(
-        'sotbdv', 'tongtiensauthue', 'thoigiantao',
-        tencongty=F('id_hopdong__tencongty'),
-        giam_tru = F('giamtru')/100 * F('tongtientruocthue'),
-        tongtienthanhtoan = F('tongtiensauthue') - F('giamtru')/100 * F('tongtientruocthue')
-    ).order_by("-thoigiantao", "tencongty", "-sotbdv"))
+def get_filtered_revenue_data(start_date=None, end_date=None, customer_id=None, service_id=None):
+    """
+    Hàm logic trung tâm để lấy tất cả dữ liệu báo cáo từ database.
+    ✅ TỐI ƯU:
+    - Tổng theo (công ty, dịch vụ) đọc từ bảng tổng hợp doanh thu theo tháng (TonghopDoanhthuThang),
+      chỉ các ngày lẻ ở 2 đầu khoảng lọc mới aggregate chi tiết thanh toán
+      → ma trận dịch vụ, bảng Điện - Nước và thẻ Điện/Nước
+    - 1 query danh sách thông báo (EXISTS chi tiết khớp bộ lọc) → bảng thông báo và thẻ Tổng doanh thu
+    Lọc ngày bằng khoảng thời điểm [từ, đến) trên ThoigianTao thay vì __date (không dùng được index).
+    """
 
-    # 4. Lấy dữ liệu Bảng chi tiết dịch vụ
-    chi_tiet_dich_vu_raw = list(ct_thanhtoan_qs
-        .values('id_thanhtoan_dichvu__id_hopdong__tencongty', 'id_dichvu__tendichvu', 'id_dichvu_id')
-        .annotate(
-            donvitinh=Min('donvitinh'),
-            tongtiensauthue=Sum('tiensauthue'),
-            tongsosudung=Sum('sosudung')
-        ).order_by('id_thanhtoan_dichvu__id_hopdong__tencongty')
+    # 1. Xây dựng bộ lọc thông báo
+    tb_filters = Q()
+    ngay_bat_dau = ngay_ket_thuc = None
+    if start_date and end_date:
+        ngay_bat_dau, ngay_ket_thuc = _parse_report_date(start_date), _parse_report_date(end_date)
+        time_from, time_to = _revenue_time_range(ngay_bat_dau, ngay_ket_thuc)
+        tb_filters &= Q(thoigiantao__gte=time_from, thoigiantao__lt=time_to)
+    if customer_id == 'all':
+        customer_id = None
+    if service_id == 'all':
+        service_id = None
+    if customer_id:
+        tb_filters &= Q(id_hopdong_id=customer_id)
+    ct_match = CtThanhtoanDichvu.objects.filter(id_thanhtoan_dichvu=OuterRef('pk'))
+    if service_id:
+        ct_match = ct_match.filter(id_dichvu_id=service_id)
+
+    # 2. Tổng theo (công ty, dịch vụ): tháng tròn cộng ô tổng hợp, ngày lẻ aggregate chi tiết
+    chi_tiet_dich_vu_raw = DoanhThuThangService.get_service_totals(
+        ngay_bat_dau, ngay_ket_thuc, hopdong_id=customer_id, dichvu_id=service_id
     )
-    
-    # Gom nhóm lại cho frontend
+
+    # Gom nhóm lại cho frontend + bảng Điện - Nước + thẻ Điện/Nước từ cùng kết quả
     chi_tiet_dich_vu = {}
+    dien_nuoc = {}
+    total_revenue_dien = 0.0
+    total_revenue_nuoc = 0.0
     for item in chi_tiet_dich_vu_raw:
-        ten_cong_ty = item['id_thanhtoan_dichvu__id_hopdong__tencongty']
+        loai_dich_vu = item.pop('id_dichvu__id_loaidichvu_id')
+        ten_cong_ty = item['id_thanhtoan_dichvu__id_hopdong__tencongty'] = item.pop('tencongty')
         if ten_cong_ty not in chi_tiet_dich_vu:
             chi_tiet_dich_vu[ten_cong_ty] = {
                 'tencongty': ten_cong_ty,
@@ -97,25 +100,48 @@ def get_filtered_revenue_data(start_date=None, end_date=None, customer_id=None,
             }
         chi_tiet_dich_vu[ten_cong_ty]['dich_vu'][item['id_dichvu_id']] = item
         chi_tiet_dich_vu[ten_cong_ty]['tong_tien_dich_vu'] += item['tongtiensauthue']
-        
-    # 5. Lấy dữ liệu Bảng tổng hợp Điện - Nước (ID loại dịch vụ 19: Điện, 20: Nước)
-    dien_nuoc_qs = ct_thanhtoan_qs.filter(id_dichvu__id_loaidichvu_id__in=[19, 20])
-    tong_hop_dien_nuoc = list(dien_nuoc_qs
-        .values(tencongty=F('id_thanhtoan_dichvu__id_hopdong__tencongty'))
-        .annotate(
-            tong_tien_dien=Sum(Case(When(id_dichvu__id_loaidichvu_id=19, then=F('tiensauthue')), default=0.0, output_field=FloatField())),
-            so_dien=Sum(Case(When(id_dichvu__id_loaidichvu_id=19, then=F('sosudung')), default=0.0, output_field=FloatField())),
-            tong_tien_nuoc=Sum(Case(When(id_dichvu__id_loaidichvu_id=20, then=F('tiensauthue')), default=0.0, output_field=FloatField())),
-            so_nuoc=Sum(Case(When(id_dichvu__id_loaidichvu_id=20, then=F('sosudung')), default=0.0, output_field=FloatField())),
-        ).order_by('tencongty')
-    )
+
+        if loai_dich_vu in (LOAI_DICH_VU_DIEN, LOAI_DICH_VU_NUOC):
+            cong_ty = dien_nuoc.setdefault(ten_cong_ty, {
+                'tencongty': ten_cong_ty, 'tong_tien_dien': 0.0, 'so_dien': 0.0, 'tong_tien_nuoc': 0.0, 'so_nuoc': 0.0,
+            })
+            tien = item['tongtiensauthue'] or 0.0
+            so_su_dung = item['tongsosudung'] or 0.0
+            if loai_dich_vu == LOAI_DICH_VU_DIEN:
+                cong_ty['tong_tien_dien'] += tien
+                cong_ty['so_dien'] += so_su_dung
+                total_revenue_dien += tien
+            else:
+                cong_ty['tong_tien_nuoc'] += tien
+                cong_ty['so_nuoc'] += so_su_dung
+                total_revenue_nuoc += tien
+
+    # 3. Lấy dữ liệu Bảng thông báo (chỉ thông báo có chi tiết khớp bộ lọc)
+    thong_bao = list(ThanhtoanDichvu.objects.filter(tb_filters).filter(Exists(ct_match)).values(
+        'sotbdv', 'tongtiensauthue', 'thoigiantao',
+        tencongty=F('id_hopdong__tencongty'),
+        giam_tru = F('giamtru')/100 * F('tongtientruocthue'),
+        tongtienthanhtoan = F('tongtiensauthue') - F('giamtru')/100 * F('tongtientruocthue')
+    ).order_by("-thoigiantao", "tencongty", "-sotbdv"))
+
+    # 4. Thẻ Tổng doanh thu = SUM(tổng sau thuế) - SUM(giảm trừ) trên danh sách thông báo (giữ cách bỏ qua NULL của SQL)
+    tong_sau_thue = [item['tongtiensauthue'] for item in thong_bao if item['tongtiensauthue'] is not None]
+    tong_giam_tru = [item['giam_tru'] for item in thong_bao if item['giam_tru'] is not None]
+    total_revenue = sum(tong_sau_thue) - sum(tong_giam_tru) if tong_sau_thue and tong_giam_tru else 0.0
+
+    summary = {
+        "total_revenue": total_revenue,
+        "total_revenue_dien": total_revenue_dien,
+        "total_revenue_nuoc": total_revenue_nuoc
+    }
 
     return {
         "summary": summary,
         "data": {
             "thong_bao": thong_bao,
             "chi_tiet_dich_vu": list(chi_tiet_dich_vu.values()),
-            "tong_hop_dien_nuoc": tong_hop_dien_nuoc,
+            # Thứ tự công ty theo ORDER BY tencongty của query tổng hợp
+            "tong_hop_dien_nuoc": list(dien_nuoc.values()),
         }
     }
 
@@ -185,32 +211,13 @@ def api_bao_cao_doanh_thu_filter(request):
     
     return JsonResponse(data)
 
-@login_required
-def api_bao_cao_doanh_thu_export(request):
+def build_revenue_export_sheets(data):
     """
-    API để xuất báo cáo doanh thu ra file Excel với 3 sheet.
+    Mô tả 3 sheet của báo cáo doanh thu cho bộ xuất Excel dùng chung.
+    Các dòng được sinh lần lượt (generator) khi ghi file.
     """
-    # 1. Lấy dữ liệu đã được tối ưu
-    start_date = request.GET.get('start_date')
-    end_date = request.GET.get('end_date')
-    customer_id = request.GET.get('customer')
-    service_id = request.GET.get('service')
-    
-    # Tái sử dụng hàm logic chung để lấy toàn bộ dữ liệu cần thiết
-    report_data = get_filtered_revenue_data(start_date, end_date, customer_id, service_id)
-    data = report_data['data']
-
-    # 2. Tạo Workbook và các Sheet trong bộ nhớ
-    workbook = openpyxl.Workbook()
-    
-    # --- Sheet 1: Danh sách Thông báo ---
-    sheet1 = workbook.active
-    sheet1.title = "Danh sách Thông báo"
-    headers1 = ["Mã TB", "Khách thuê", "Tổng tiền gồm thuế", "Giảm trừ", "Tổng tiền TT", "Ngày tạo"]
-    sheet1.append(headers1)
-    
-    for item in data['thong_bao']:
-        row = [
+    thong_bao_rows = (
+        [
             item['sotbdv'],
             item['tencongty'],
             item['tongtiensauthue'],
@@ -218,80 +225,78 @@ def api_bao_cao_doanh_thu_export(request):
             item['tongtienthanhtoan'],
             item['thoigiantao'].strftime('%d/%m/%Y %H:%M') if item.get('thoigiantao') else ''
         ]
-        sheet1.append(row)
-        
-    # --- Sheet 2: Chi tiết Dịch vụ ---
-    sheet2 = workbook.create_sheet(title="Chi tiết Dịch vụ")
-    
+        for item in data['thong_bao']
+    )
+
     # Lấy danh sách dịch vụ để làm header động
     all_services = {
-        s['id_dichvu_id']: s['id_dichvu__tendichvu'] 
-        for company in data['chi_tiet_dich_vu'] 
+        s['id_dichvu_id']: s['id_dichvu__tendichvu']
+        for company in data['chi_tiet_dich_vu']
         for s in company['dich_vu'].values()
     }
     sorted_service_ids = sorted(all_services.keys())
-    
-    headers2 = ["Công ty"] + [all_services[sid] for sid in sorted_service_ids] + ['Tổng cộng']
-    sheet2.append(headers2)
-
-    # In đậm header "Tổng cộng"
-    sheet2.cell(row=1, column=len(headers2)).font = Font(bold=True)
-
-    for company in data['chi_tiet_dich_vu']:
-        row = [company['tencongty']]
-        for service_id in sorted_service_ids:
-            service_data = company['dich_vu'].get(service_id)
-            # Ghi cả thành tiền và số lượng sử dụng
-            cell_value = service_data['tongtiensauthue'] if service_data else ""
-            row.append(cell_value)
-        row.append(company['tong_tien_dich_vu'])
-        sheet2.append(row)
-
-        # In đậm ô Tổng cộng
-        sheet2.cell(row=sheet2.max_row, column=len(row)).font = Font(bold=True)
-
-    # --- Sheet 3: Tổng hợp Điện - Nước ---
-    sheet3 = workbook.create_sheet(title="Tổng hợp Điện - Nước")
-    headers3 = ["Công ty", "Tổng tiền điện", "Số điện sử dụng (kWh)", "Tổng tiền nước", "Số nước sử dụng (m³)"]
-    sheet3.append(headers3)
-    
-    for item in data['tong_hop_dien_nuoc']:
-        row = [
+
+    def chi_tiet_rows():
+        for company in data['chi_tiet_dich_vu']:
+            row = [company['tencongty']]
+            for service_id in sorted_service_ids:
+                service_data = company['dich_vu'].get(service_id)
+                row.append(service_data['tongtiensauthue'] if service_data else "")
+            row.append(company['tong_tien_dich_vu'])
+            yield row
+
+    dien_nuoc_rows = (
+        [
             item['tencongty'],
             item['tong_tien_dien'],
             item['so_dien'],
             item['tong_tien_nuoc'],
             item['so_nuoc'],
         ]
-        sheet3.append(row)
-
-    # 3. Tối ưu độ rộng cột cho tất cả sheet
-    for sheet in workbook.worksheets:
-        for col in sheet.columns:
-            max_length = 0
-            column = get_column_letter(col[0].column)
-            for cell in col:
-                try:
-                    if len(str(cell.value)) > max_length:
-                        max_length = len(str(cell.value))
-                except:
-                    pass
-            adjusted_width = (max_length + 2)
-            sheet.column_dimensions[column].width = adjusted_width
-
-    # 4. Lưu file vào buffer và trả về response
-    buffer = BytesIO()
-    workbook.save(buffer)
-    buffer.seek(0)
-    
-    response = HttpResponse(
-        buffer,
-        content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+        for item in data['tong_hop_dien_nuoc']
+    )
+
+    return [
+        XlsxSheet(
+            "Danh sách Thông báo",
+            ["Mã TB", "Khách thuê", "Tổng tiền gồm thuế", "Giảm trừ", "Tổng tiền TT", "Ngày tạo"],
+            thong_bao_rows,
+        ),
+        XlsxSheet(
+            "Chi tiết Dịch vụ",
+            ["Công ty"] + [all_services[sid] for sid in sorted_service_ids] + ['Tổng cộng'],
+            chi_tiet_rows(),
+            # In đậm cột Tổng cộng
+            bold_columns=(-1,),
+        ),
+        XlsxSheet(
+            "Tổng hợp Điện - Nước",
+            ["Công ty", "Tổng tiền điện", "Số điện sử dụng (kWh)", "Tổng tiền nước", "Số nước sử dụng (m³)"],
+            dien_nuoc_rows,
+        ),
+    ]
+
+def export_revenue_report(params):
+    """
+    Producer xuất Excel báo cáo doanh thu (dùng cho API export đồng bộ và job xuất nền).
+    params: start_date, end_date, customer, service (cùng tên với query string của API lọc).
+    """
+    report_data = get_filtered_revenue_data(
+        params.get('start_date'), params.get('end_date'), params.get('customer'), params.get('service')
     )
     filename = f"BaoCaoDoanhThu_{timezone.now().strftime('%Y%m%d')}.xlsx"
-    response['Content-Disposition'] = f'attachment; filename="{filename}"'
-    
-    return response
+    return build_revenue_export_sheets(report_data['data']), filename
+
+@login_required
+def api_bao_cao_doanh_thu_export(request):
+    """
+    API để xuất báo cáo doanh thu ra file Excel với 3 sheet.
+    ✅ TỐI ƯU: Ghi write-only (streaming) qua bộ xuất dùng chung, độ rộng cột tính ngay khi ghi,
+    file tạm trả về theo từng khối thay vì dựng cả workbook + BytesIO trong bộ nhớ.
+    Khoảng thời gian lớn (cả năm) nên dùng job xuất nền: POST /hrm/core/api/report-export/job {report: 'doanh_thu'}.
+    """
+    sheets, filename = export_revenue_report(request.GET)
+    return xlsx_streaming_response(sheets, filename)
 
 
 # ------------------------------------ VIEW QUẢN LÝ DỊCH VỤ ------------------------------------
@@ -425,7 +430,10 @@ def api_xoa_thong_bao(request, notification_id):
     if request.method == 'DELETE':
         try:
             notification = ThanhtoanDichvu.objects.get(id=notification_id)
+            # Giữ (khách thuê, thời điểm) trước khi xóa để tính lại đúng ô tổng hợp doanh thu
+            o_tong_hop = (notification.id_hopdong_id, notification.thoigiantao)
             notification.delete()
+            DoanhThuThangService.refresh([o_tong_hop])
             
             return JsonResponse({
                 'success': True,
@@ -748,6 +756,8 @@ def api_tao_moi_thong_bao(request):
                 tendichvu=dich_vu.tendichvu
             )
         
+        # Cập nhật ô tổng hợp doanh thu (khách thuê, tháng) của thông báo
+        DoanhThuThangService.refresh([(thong_bao.id_hopdong_id, thong_bao.thoigiantao)])
         return JsonResponse({
             'success': True,
             'message': 'Tạo thông báo thành công',
@@ -902,6 +912,8 @@ def api_cap_nhat_thong_bao(request, notification_id):
                 tendichvu=dich_vu.tendichvu
             )
         
+        # Cập nhật ô tổng hợp doanh thu (khách thuê, tháng) của thông báo
+        DoanhThuThangService.refresh([(thong_bao.id_hopdong_id, thong_bao.thoigiantao)])
         return JsonResponse({
             'success': True,
             'message': 'Cập nhật thông báo thành công'
@@ -1160,6 +1172,7 @@ def api_dich_vu_update_or_create(request):
                 ngayghi=timezone.now()
             )
         
+        invalidate_report_data(DATA_DOANH_THU)
         return JsonResponse({'success': True, 'message': 'Lưu loại dịch vụ thành công!', 'data': model_to_dict(dich_vu_instance)})
     
     except Exception as e:
@@ -1212,6 +1225,7 @@ def api_dich_vu_delete(request, pk):
     try: 
         dichvu = get_object_or_404(Dichvu, id_dichvu = pk)
         dichvu.delete()
+        invalidate_report_data(DATA_DOANH_THU)
         return JsonResponse({'success': True, 'message': 'Xóa dịch vụ thành công!'})
     except Exception as e:
         return JsonResponse({'success': False, 'message': str(e)}, status=400)
@@ -1331,6 +1345,7 @@ def api_quan_ly_khach_thue_update_or_create(request):
                     **defaults
                 )
         
+        invalidate_report_data(DATA_DOANH_THU)
         return JsonResponse({'success': True, 'message': 'Lưu hợp đồng thành công!'})
 
     except Exception as e:
@@ -1344,6 +1359,7 @@ def api_quan_ly_khach_thue_delete(request, pk):
     try:
         hopdong = get_object_or_404(Hopdong, id_hopdong=pk)
         hopdong.delete()
+        invalidate_report_data(DATA_DOANH_THU)
         return JsonResponse({'success': True, 'message': 'Xóa hợp đồng thành công!'})
     except Exception as e:
         return JsonResponse({'success': False, 'message': str(e)}, status=400)
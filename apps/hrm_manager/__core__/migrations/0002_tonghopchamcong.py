@@ -0,0 +1,98 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+CREATE_TONG_HOP_CHAM_CONG_SQL = '''
+CREATE TABLE IF NOT EXISTS "hrm"."TongHopChamCong" (
+    "id" bigserial PRIMARY KEY,
+    "created_at" timestamp with time zone NOT NULL,
+    "updated_at" timestamp with time zone NULL,
+    "nhanvien_id" bigint NOT NULL REFERENCES "hrm"."NhanVien" ("id") DEFERRABLE INITIALLY DEFERRED,
+    "Thang" date NOT NULL,
+    "SoNgayChamCong" integer NOT NULL DEFAULT 0,
+    "TongCongLamViec" double precision NOT NULL DEFAULT 0,
+    "TongCongVP" double precision NOT NULL DEFAULT 0,
+    "TongPhutLamViec" double precision NOT NULL DEFAULT 0,
+    "TongPhutLamThem" double precision NOT NULL DEFAULT 0,
+    "TongTienSX" double precision NOT NULL DEFAULT 0,
+    "TongSoLuongAn" integer NOT NULL DEFAULT 0,
+    "TongAnChuNhat" integer NOT NULL DEFAULT 0,
+    "TongAnDem" integer NOT NULL DEFAULT 0,
+    "TongPhutDiMuon" double precision NOT NULL DEFAULT 0,
+    "TongPhutVeSom" double precision NOT NULL DEFAULT 0,
+    "TongNgayVang" integer NOT NULL DEFAULT 0,
+    CONSTRAINT "TongHopChamCong_nhanvien_thang_uniq" UNIQUE ("nhanvien_id", "Thang")
+);
+CREATE INDEX IF NOT EXISTS "TongHopChamCong_Thang_idx" ON "hrm"."TongHopChamCong" ("Thang");
+
+-- Dựng dữ liệu ban đầu từ Bảng chấm công hiện có
+INSERT INTO "hrm"."TongHopChamCong" (
+    "created_at", "updated_at", "nhanvien_id", "Thang", "SoNgayChamCong",
+    "TongCongLamViec", "TongCongVP", "TongPhutLamViec", "TongPhutLamThem", "TongTienSX",
+    "TongSoLuongAn", "TongAnChuNhat", "TongAnDem", "TongPhutDiMuon", "TongPhutVeSom", "TongNgayVang"
+)
+SELECT
+    now(), now(), bcc."nhanvien_id", date_trunc('month', bcc."NgayLamViec")::date, COUNT(*),
+    SUM(COALESCE(bcc."CongLamViec", 0)),
+    COALESCE(SUM(COALESCE(bcc."CongLamViec", 0)) FILTER (WHERE bcc."LoaiChamCong" = 'VP'), 0),
+    SUM(COALESCE(bcc."ThoiGianLamViec", 0) + COALESCE(bcc."ThoiGianDiSom", 0) + COALESCE(bcc."ThoiGianVeMuon", 0)),
+    SUM(COALESCE(bcc."ThoiGianLamThem", 0)),
+    SUM(COALESCE(bcc."ThanhTien", 0)),
+    COUNT(*) FILTER (WHERE bcc."CoAnTrua"),
+    COUNT(*) FILTER (WHERE bcc."CoAnChuNhat"),
+    COUNT(*) FILTER (WHERE bcc."CoAnDem"),
+    SUM(COALESCE(bcc."ThoiGianDiMuon", 0)),
+    SUM(COALESCE(bcc."ThoiGianVeSom", 0)),
+    COUNT(*) FILTER (WHERE NOT COALESCE(bcc."CoDiLam", false) AND NOT COALESCE(bcc."CoPhaiNgayNghi", false))
+FROM "hrm"."BangChamCong" bcc
+WHERE bcc."nhanvien_id" IS NOT NULL AND bcc."NgayLamViec" IS NOT NULL
+GROUP BY bcc."nhanvien_id", date_trunc('month', bcc."NgayLamViec")
+ON CONFLICT ("nhanvien_id", "Thang") DO NOTHING;
+'''
+
+DROP_TONG_HOP_CHAM_CONG_SQL = 'DROP TABLE IF EXISTS "hrm"."TongHopChamCong";'
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('__core__', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunSQL(CREATE_TONG_HOP_CHAM_CONG_SQL, DROP_TONG_HOP_CHAM_CONG_SQL),
+            ],
+            state_operations=[
+                migrations.CreateModel(
+                    name='Tonghopchamcong',
+                    fields=[
+                        ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                        ('created_at', models.DateTimeField()),
+                        ('updated_at', models.DateTimeField(blank=True, null=True)),
+                        ('thang', models.DateField(db_column='Thang')),
+                        ('songaychamcong', models.IntegerField(db_column='SoNgayChamCong', default=0)),
+                        ('tongconglamviec', models.FloatField(db_column='TongCongLamViec', default=0)),
+                        ('tongcongvp', models.FloatField(db_column='TongCongVP', default=0)),
+                        ('tongphutlamviec', models.FloatField(db_column='TongPhutLamViec', default=0)),
+                        ('tongphutlamthem', models.FloatField(db_column='TongPhutLamThem', default=0)),
+                        ('tongtiensx', models.FloatField(db_column='TongTienSX', default=0)),
+                        ('tongsoluongan', models.IntegerField(db_column='TongSoLuongAn', default=0)),
+                        ('tonganchunhat', models.IntegerField(db_column='TongAnChuNhat', default=0)),
+                        ('tongandem', models.IntegerField(db_column='TongAnDem', default=0)),
+                        ('tongphutdimuon', models.FloatField(db_column='TongPhutDiMuon', default=0)),
+                        ('tongphutvesom', models.FloatField(db_column='TongPhutVeSom', default=0)),
+                        ('tongngayvang', models.IntegerField(db_column='TongNgayVang', default=0)),
+                        ('nhanvien', models.ForeignKey(on_delete=django.db.models.deletion.DO_NOTHING, to='__core__.nhanvien')),
+                    ],
+                    options={
+                        'db_table': '"hrm"."TongHopChamCong"',
+                        'db_table_comment': 'Tổng hợp chấm công theo nhân viên và tháng, dùng cho tính lương và báo cáo',
+                        'managed': False,
+                        'unique_together': {('nhanvien', 'thang')},
+                    },
+                ),
+            ],
+        ),
+    ]
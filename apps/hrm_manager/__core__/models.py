@@ -931,4 +931,30 @@ class NhanvienBaohiem(models.Model):
     class Meta:
         managed = False
         db_table = '"hrm"."NhanVien_BaoHiem"'
-        db_table_comment = 'Bảng quan hệ giữa Nhân viên và Bảo hiểm'
\ No newline at end of file
+        db_table_comment = 'Bảng quan hệ giữa Nhân viên và Bảo hiểm'
+
+class Tonghopchamcong(models.Model):
+    """Model tổng hợp chấm công theo Nhân viên × Tháng (cập nhật tăng dần khi ghi Bảng chấm công)"""
+    id = models.BigAutoField(primary_key=True)
+    created_at = models.DateTimeField()
+    updated_at = models.DateTimeField(blank=True, null=True)
+    nhanvien = models.ForeignKey(Nhanvien, models.DO_NOTHING)
+    thang = models.DateField(db_column='Thang')  # Ngày đầu tháng
+    songaychamcong = models.IntegerField(db_column='SoNgayChamCong', default=0)
+    tongconglamviec = models.FloatField(db_column='TongCongLamViec', default=0)
+    tongcongvp = models.FloatField(db_column='TongCongVP', default=0)
+    tongphutlamviec = models.FloatField(db_column='TongPhutLamViec', default=0)  # Gồm cả phút đi sớm, về muộn
+    tongphutlamthem = models.FloatField(db_column='TongPhutLamThem', default=0)
+    tongtiensx = models.FloatField(db_column='TongTienSX', default=0)
+    tongsoluongan = models.IntegerField(db_column='TongSoLuongAn', default=0)
+    tonganchunhat = models.IntegerField(db_column='TongAnChuNhat', default=0)
+    tongandem = models.IntegerField(db_column='TongAnDem', default=0)
+    tongphutdimuon = models.FloatField(db_column='TongPhutDiMuon', default=0)
+    tongphutvesom = models.FloatField(db_column='TongPhutVeSom', default=0)
+    tongngayvang = models.IntegerField(db_column='TongNgayVang', default=0)
+
+    class Meta:
+        managed = False
+        db_table = '"hrm"."TongHopChamCong"'
+        db_table_comment = 'Tổng hợp chấm công theo nhân viên và tháng, dùng cho tính lương và báo cáo'
+        unique_together = (('nhanvien', 'thang'),)
@@ -1,3 +1,108 @@
-from django.test import TestCase
+import datetime as dt
+from unittest.mock import MagicMock, patch
 
-# Create your tests here.
+from django.test import SimpleTestCase
+
+
+class ReportExportJobTests(SimpleTestCase):
+	def setUp(self):
+		import tempfile
+
+		from django.test import override_settings
+
+		self.export_dir = tempfile.TemporaryDirectory()
+		self.addCleanup(self.export_dir.cleanup)
+		settings_override = override_settings(
+			CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "report-export-tests"}},
+			REPORT_EXPORT_DIR=self.export_dir.name,
+		)
+		settings_override.enable()
+		self.addCleanup(settings_override.disable)
+		# LocMemCache cùng LOCATION dùng chung dữ liệu giữa các test
+		from django.core.cache import cache
+
+		cache.clear()
+		# Không có transaction mở → callback on_commit chạy ngay
+		on_commit = patch("django.db.transaction.on_commit", side_effect=lambda func, *args, **kwargs: func())
+		on_commit.start()
+		self.addCleanup(on_commit.stop)
+
+	@patch("apps.hrm_manager.__core__.views.generate_report_export_task")
+	@patch("apps.hrm_manager.utils.report_export_jobs.import_string")
+	def test_identical_filters_reuse_artifact_until_data_changes(self, mock_import, mock_task):
+		from apps.hrm_manager.__core__.views import _submit_report_export_job
+		from apps.hrm_manager.tasks import generate_report_export_task
+		from apps.hrm_manager.utils.report_export_jobs import (
+			DATA_DOANH_THU, invalidate_report_data, open_report_artifact,
+		)
+		from apps.hrm_manager.utils.xlsx_export import XlsxSheet
+
+		producer = MagicMock(side_effect=lambda params: ([XlsxSheet("Doanh thu", ["Công ty"], [["Cty A"]])], "BaoCao.xlsx"))
+		mock_import.return_value = producer
+
+		job = _submit_report_export_job("doanh_thu", {"start_date": "2026-01-01", "end_date": "", "other": "x"})
+		self.assertEqual(job["status"], "PENDING")
+		report, params, artifact_key = mock_task.apply_async.call_args.kwargs["args"]
+		self.assertEqual(params, {"start_date": "2026-01-01"})
+
+		result = generate_report_export_task.run(report, params, artifact_key)
+		self.assertTrue(result["success"])
+		path, artifact = open_report_artifact(result["token"])
+		self.assertTrue(path.exists())
+		self.assertEqual(artifact["filename"], "BaoCao.xlsx")
+
+		reused = _submit_report_export_job("doanh_thu", {"start_date": "2026-01-01"})
+		self.assertEqual(reused["status"], "SUCCESS")
+		self.assertEqual(reused["token"], result["token"])
+		self.assertEqual(mock_task.apply_async.call_count, 1)
+		producer.assert_called_once()
+
+		invalidate_report_data(DATA_DOANH_THU)
+		job = _submit_report_export_job("doanh_thu", {"start_date": "2026-01-01"})
+		self.assertEqual(job["status"], "PENDING")
+		self.assertEqual(mock_task.apply_async.call_count, 2)
+		self.assertNotEqual(mock_task.apply_async.call_args.kwargs["args"][2], artifact_key)
+
+	@patch("apps.hrm_manager.utils.celery_jobs.AsyncResult")
+	@patch("apps.hrm_manager.__core__.views.generate_report_export_task")
+	def test_failed_enqueue_does_not_block_the_report(self, mock_task, mock_async_result):
+		from apps.hrm_manager.__core__.views import _submit_report_export_job
+
+		mock_async_result.return_value.state = "PENDING"
+		mock_task.apply_async.side_effect = ConnectionError("broker down")
+		failed = _submit_report_export_job("doanh_thu", {"start_date": "2026-01-01"})
+
+		mock_task.apply_async.side_effect = None
+		retried = _submit_report_export_job("doanh_thu", {"start_date": "2026-01-01"})
+		reused = _submit_report_export_job("doanh_thu", {"start_date": "2026-01-01"})
+
+		self.assertFalse(retried["reused"])
+		self.assertNotEqual(retried["job_id"], failed["job_id"])
+		self.assertTrue(reused["reused"])
+		self.assertEqual(reused["job_id"], retried["job_id"])
+		self.assertEqual(mock_task.apply_async.call_count, 2)
+
+	@patch("apps.hrm_manager.utils.report_export_jobs.import_string")
+	def test_invalid_filters_fail_the_job_with_a_message(self, mock_import):
+		from apps.hrm_manager.tasks import generate_report_export_task
+
+		mock_import.return_value = MagicMock(side_effect=ValueError("Thiếu tham số bangluong_id hoặc kyluong_id"))
+
+		result = generate_report_export_task.run("phieu_luong", {}, "key")
+
+		self.assertFalse(result["success"])
+		self.assertEqual(result["message"], "Thiếu tham số bangluong_id hoặc kyluong_id")
+
+	@patch("apps.hrm_manager.utils.report_export_jobs.timezone.localdate", return_value=dt.date(2026, 5, 20))
+	def test_default_filters_hash_to_the_same_artifact(self, _localdate):
+		from apps.hrm_manager.utils.report_export_jobs import normalize_report_params, report_artifact_key
+
+		implicit = normalize_report_params("tong_hop_cham_cong_thang", {"loai_chamcong": "all", "search": " "})
+		explicit = normalize_report_params("tong_hop_cham_cong_thang", {"thang": "2026-05"})
+
+		self.assertEqual(implicit, {"thang": "2026-05"})
+		self.assertEqual(
+			report_artifact_key("tong_hop_cham_cong_thang", implicit),
+			report_artifact_key("tong_hop_cham_cong_thang", explicit),
+		)
+		self.assertEqual(normalize_report_params("doanh_thu", {"customer": "all", "service": "3"}), {"service": "3"})
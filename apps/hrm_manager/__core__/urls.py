@@ -4,4 +4,9 @@ from . import views
 app_name = "core"
 urlpatterns = [
     path("", views.index, name="index"),
+
+    # Xuất báo cáo nền
+    path("api/report-export/job", views.api_report_export_job, name="api_report_export_job"),
+    path("api/report-export/job/<uuid:job_id>", views.api_report_export_job_status, name="api_report_export_job_status"),
+    path("api/report-export/download/<str:token>", views.api_report_export_download, name="api_report_export_download"),
 ]
\ No newline at end of file
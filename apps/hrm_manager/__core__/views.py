@@ -1,10 +1,135 @@
 from django.shortcuts import render
 from django.contrib.auth.decorators import login_required,permission_required
+from django.http import FileResponse
+from django.urls import reverse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_http_methods
+from celery.result import AsyncResult
+from json import loads
 from .models import *
 
+from apps.hrm_manager.tasks import generate_report_export_task
+from apps.hrm_manager.utils.celery_jobs import enqueue_on_commit, get_active_job, get_job_state
+from apps.hrm_manager.utils.permissions import _has_permission
+from apps.hrm_manager.utils.report_export_jobs import (
+    REPORT_EXPORTS, REPORT_JOB_KEY, REPORT_JOB_TTL,
+    get_report_artifact, normalize_report_params, open_report_artifact, report_artifact_key,
+)
+from apps.hrm_manager.utils.view_helpers import json_error, json_success
+from apps.hrm_manager.utils.xlsx_export import XLSX_CONTENT_TYPE
+
 # Create your views here.
 @login_required
 def index(request):
     models_Hopdong = Hopdong.objects.all()
     print(models_Hopdong)
-    return render(request, "hrm_manager/index.html")
\ No newline at end of file
+    return render(request, "hrm_manager/index.html")
+
+# ------------------------------ XUẤT BÁO CÁO NỀN (CELERY) ------------------------------
+REPORT_EXPORT_JOB_ACTIVE_STATES = {'PENDING', 'RECEIVED', 'STARTED', 'RETRY'}
+
+
+def _report_download_url(token):
+    return reverse('hrm:core:api_report_export_download', args=[token])
+
+
+def _submit_report_export_job(report, params):
+    """
+    Đẩy job xuất báo cáo sang Celery.
+    - Đã có file cho cùng bộ lọc + dữ liệu chưa đổi → trả token ngay, không chạy job
+    - Đang có job cho cùng bộ lọc → trả về job đó (không đẩy trùng)
+    """
+    params = normalize_report_params(report, params)
+    artifact_key = report_artifact_key(report, params)
+
+    artifact = get_report_artifact(artifact_key)
+    if artifact:
+        return {
+            'job_id': None, 'status': 'SUCCESS', 'reused': True,
+            'token': artifact['token'], 'filename': artifact['filename'],
+            'download_url': _report_download_url(artifact['token']),
+        }
+
+    job_key = REPORT_JOB_KEY.format(artifact_key=artifact_key)
+    active_job = get_active_job(job_key, REPORT_EXPORT_JOB_ACTIVE_STATES)
+    if active_job:
+        return {'job_id': active_job[0], 'status': active_job[1], 'reused': True}
+
+    # Đẩy job sau khi transaction hiện tại commit để worker thấy đúng dữ liệu
+    job_id = enqueue_on_commit(
+        generate_report_export_task, job_key, REPORT_JOB_TTL, args=[report, params, artifact_key],
+    )
+    return {'job_id': job_id, 'status': 'PENDING', 'reused': False}
+
+
+def _report_permission_error(request, report):
+    perm_code = REPORT_EXPORTS[report]['permission']
+    if perm_code and not _has_permission(request.user, perm_code):
+        return json_error('Bạn không có quyền thực hiện thao tác này.', status=403, required_permission=perm_code)
+    return None
+
+
+@login_required
+@require_http_methods(["POST"])
+@csrf_exempt
+def api_report_export_job(request):
+    """API đẩy job xuất báo cáo Excel chạy nền. Body: {report, params: {bộ lọc của báo cáo}}"""
+    try:
+        data = loads(request.body)
+        report = data.get('report')
+        params = data.get('params') or {}
+    except Exception:
+        return json_error('Dữ liệu không hợp lệ', status=400)
+
+    if report not in REPORT_EXPORTS or not isinstance(params, dict):
+        return json_error('Báo cáo không hợp lệ', status=400)
+
+    permission_error = _report_permission_error(request, report)
+    if permission_error:
+        return permission_error
+
+    job = _submit_report_export_job(report, params)
+    return json_success('Đã tiếp nhận yêu cầu xuất báo cáo', data=job)
+
+
+@login_required
+@require_http_methods(["GET"])
+def api_report_export_job_status(request, job_id):
+    """API theo dõi job xuất báo cáo; xong thì trả về token + link tải file."""
+    state = get_job_state(job_id)
+    payload = {'job_id': str(job_id), 'status': state}
+    if state is None:
+        return json_error('Job xuất báo cáo không tồn tại hoặc đã hết hạn', status=404, data=payload)
+
+    if state == 'SUCCESS':
+        task_result = AsyncResult(str(job_id)).result or {}
+        if not task_result.get('success'):
+            payload['status'] = 'FAILURE'
+            return json_error(task_result.get('message') or 'Không thể xuất báo cáo', data=payload)
+        payload.update({
+            'token': task_result['token'],
+            'filename': task_result['filename'],
+            'download_url': _report_download_url(task_result['token']),
+        })
+    elif state == 'FAILURE':
+        return json_error('Job xuất báo cáo bị lỗi', data=payload)
+
+    return json_success('Lấy trạng thái xuất báo cáo thành công', data=payload)
+
+
+@login_required
+@require_http_methods(["GET"])
+def api_report_export_download(request, token):
+    """API tải file báo cáo đã xuất theo token."""
+    opened = open_report_artifact(token)
+    if opened is None:
+        return json_error('File báo cáo không tồn tại hoặc đã hết hạn', status=404)
+
+    path, artifact = opened
+    permission_error = _report_permission_error(request, artifact['report'])
+    if permission_error:
+        return permission_error
+
+    return FileResponse(
+        open(path, 'rb'), as_attachment=True, filename=artifact['filename'], content_type=XLSX_CONTENT_TYPE
+    )
@@ -0,0 +1,33 @@
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from apps.hrm_manager.cham_cong.services import TongHopChamCongService
+
+
+def _parse_month(value):
+    if not value:
+        return None
+    try:
+        return datetime.strptime(value, "%Y-%m").date()
+    except ValueError:
+        raise CommandError(f"Tháng không hợp lệ: {value} (định dạng YYYY-MM)")
+
+
+class Command(BaseCommand):
+    help = "Rebuild the per-employee monthly attendance rollup (TongHopChamCong) from BangChamCong"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--tu-thang", help="First month to rebuild (YYYY-MM)")
+        parser.add_argument("--den-thang", help="Last month to rebuild (YYYY-MM)")
+
+    def handle(self, *args, **options):
+        thang_tu = _parse_month(options["tu_thang"])
+        thang_den = _parse_month(options["den_thang"])
+        if thang_tu and thang_den and thang_tu > thang_den:
+            raise CommandError("--tu-thang phải nhỏ hơn hoặc bằng --den-thang")
+
+        with transaction.atomic():
+            count = TongHopChamCongService.rebuild(thang_tu=thang_tu, thang_den=thang_den)
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {count} rollup rows."))
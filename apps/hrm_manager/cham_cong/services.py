@@ -1,81 +1,342 @@
 
 # Sử dụng thư viện simpleeval để đánh giá biểu thức toán học và logic một cách an toàn, tránh thực thi code nguy hiểm.
 from simpleeval import SimpleEval
+from functools import lru_cache
 import ast
+import datetime as dt
+
+from django.db.models import Count, FloatField, Q, Sum
+from django.db.models.functions import Coalesce, TruncMonth
+from django.utils import timezone
+
+from apps.hrm_manager.__core__.models import Bangchamcong, Tonghopchamcong
+from apps.hrm_manager.utils.report_export_jobs import DATA_CHAM_CONG, invalidate_report_data
+
+# --- BỘ NHỚ ĐỆM CÔNG THỨC ĐÃ BIÊN DỊCH (COMPILED FORMULA CACHE) ---
+# Số công thức (theo nội dung chuỗi) giữ lại trong cache toàn tiến trình, vượt quá sẽ loại bỏ theo LRU.
+FORMULA_CACHE_SIZE = 1024
+
+# Tên các hàm được phép gọi trong công thức lương động (khớp với PayrollCalculator.simple_eval.functions)
+FORMULA_FUNCTION_NAMES = frozenset({
+    'IF', 'SUM', 'COUNT', 'AVG', 'MIN', 'MAX', 'ABS', 'ROUND', 'POW', 'int', 'float',
+})
+
+# Hàm tổng hợp theo nhóm: tham số là TÊN trường (đọc giá trị thô của cả nhóm), không phải giá trị của nhân sự hiện tại
+FORMULA_AGGREGATE_FUNCTION_NAMES = frozenset({'SUM', 'AVG', 'MIN', 'MAX'})
+
+# Các node biểu thức được phép xuất hiện trong công thức (toán học, so sánh, logic, gọi hàm)
+_ALLOWED_EXPR_NODES = (
+    ast.Name, ast.Constant, ast.UnaryOp, ast.BinOp, ast.BoolOp,
+    ast.Compare, ast.IfExp, ast.Call,
+)
+
+
+class CompiledFormula:
+    """
+    Công thức đã được parse thành AST và kiểm tra hợp lệ đúng 1 lần.
+    - node: cây AST dùng lại cho mọi lần đánh giá (không parse lại chuỗi)
+    - names: tập tên biến/hàm xuất hiện trong công thức (dùng cho trích xuất tham số)
+    - refs: tập biến thực sự được đọc khi đánh giá (không gồm tên hàm và tên trường truyền vào hàm tổng hợp),
+      dùng để lập đồ thị phụ thuộc giữa các quy tắc
+    - error: thông báo lỗi nếu công thức không hợp lệ (cache luôn cả kết quả lỗi để không parse lại)
+    """
+    __slots__ = ('source', 'node', 'names', 'refs', 'error')
+
+    def __init__(self, source):
+        self.source = source
+        self.node = None
+        self.names = None
+        self.refs = None
+        self.error = None
+
+        if not isinstance(source, str) or not source.strip():
+            self.error = 'Công thức rỗng'
+            return
 
-# --- LỚP BAO ĐÓNG GIÁ TRỊ TRƯỜNG (WRAPPER CLASS) ---
-# FieldProxy dùng để gắn thêm tên trường gốc cho giá trị số, giúp truy vết nguồn gốc khi tính toán phức tạp hoặc tổng hợp.
-# Kế thừa float để có thể sử dụng như số thực bình thường trong các phép toán.
-class FieldProxy(float):
-    def __new__(cls, name, value):
-        # Nếu value là None thì trả về None (giúp propagate giá trị None trong các phép toán/phụ thuộc)
-        if value is None:
-            return None
-        return float.__new__(cls, value)
-    def __init__(self, name, value):
-        # Lưu tên trường gốc để phục vụ truy vết khi cần thiết
-        self.original_name = name
-
-# --- LỚP ÁNH XẠ LƯỜI (LAZY MAPPING CLASS) ---
-# Cho phép truy xuất giá trị trường theo tên, tự động tính toán nếu là công thức (string),
-# hỗ trợ cache giá trị đã tính và chống vòng lặp đệ quy khi các trường tham chiếu lẫn nhau.
-# Điều này giúp việc tính toán các trường phụ thuộc lẫn nhau trở nên đơn giản và an toàn.
-class LazyProxyMap(dict):
-    def __init__(self, calculator, params, group_id):
-        self.calculator = calculator  # Đối tượng PayrollCalculator quản lý logic tính toán
-        self.params = params          # Tham số đầu vào của từng nhân sự (dict)
-        self.group_id = group_id      # ID nhóm (dùng cho các phép tổng hợp)
-        self.resolved = {}           # Cache giá trị đã tính xong cho từng key
-        self.calculating = set()     # Đánh dấu các trường đang tính (chống vòng lặp đệ quy vô hạn)
-        super().__init__(params)
-
-    def __getitem__(self, key):
-        # Nếu đã tính rồi thì trả về luôn (giảm lặp lại tính toán)
-        if key in self.resolved:
-            return self.resolved[key]
-
-        # Lấy giá trị thô từ params (có thể là số, chuỗi công thức, hoặc kiểu khác)
         try:
-            raw_val = super().__getitem__(key)
-        except KeyError:
-            # Nếu không tìm thấy biến, trả về None (giúp propagate None trong các phép toán/phụ thuộc)
-            return None
+            node = SimpleEval.parse(source)
+        except SyntaxError as e:
+            self.error = f'Công thức sai cú pháp: {e.msg}'
+            return
+
+        self.names = frozenset(n.id for n in ast.walk(node) if isinstance(n, ast.Name))
+        self.error = self._validate(node)
+        if self.error is None:
+            self._bind_aggregate_fields(node)
+            self.refs = frozenset(
+                n.id for n in ast.walk(node)
+                if isinstance(n, ast.Name) and n.id not in FORMULA_FUNCTION_NAMES
+            )
+            self.node = node
+
+    @staticmethod
+    def _validate(node):
+        # Chỉ chấp nhận một biểu thức đơn (không gán, không import, ...)
+        if not isinstance(node, ast.Expr):
+            return 'Công thức phải là một biểu thức'
+
+        for sub in ast.walk(node.value):
+            if not isinstance(sub, ast.expr):
+                continue  # Bỏ qua toán tử, context (Load, Add, And, ...)
+            if not isinstance(sub, _ALLOWED_EXPR_NODES):
+                return f'Công thức chứa cú pháp không được hỗ trợ: {type(sub).__name__}'
+            if isinstance(sub, ast.Call):
+                if not isinstance(sub.func, ast.Name) or sub.func.id not in FORMULA_FUNCTION_NAMES:
+                    return 'Công thức gọi hàm không được hỗ trợ'
+        return None
 
-        # Nếu trường này đang được tính ở call stack hiện tại, trả về None để tránh vòng lặp đệ quy
-        if key in self.calculating:
-            return None
+    @staticmethod
+    def _bind_aggregate_fields(node):
+        # SUM(LUONG_CB) -> SUM('LUONG_CB'): hàm tổng hợp nhận tên trường, không cần bọc giá trị để truy vết tên
+        for sub in ast.walk(node):
+            if isinstance(sub, ast.Call) and sub.func.id in FORMULA_AGGREGATE_FUNCTION_NAMES:
+                sub.args = [
+                    ast.copy_location(ast.Constant(arg.id), arg) if isinstance(arg, ast.Name) else arg
+                    for arg in sub.args
+                ]
+
+    def evaluate(self, evaluator):
+        # Đánh giá lại cây AST đã parse với evaluator (names đã được gán sẵn)
+        if self.error is not None:
+            raise ValueError(self.error)
+        return evaluator.eval(self.source, previously_parsed=self.node)
+
+
+@lru_cache(maxsize=FORMULA_CACHE_SIZE)
+def compile_formula(formula_str):
+    """
+    Biên dịch (parse + validate) công thức, cache theo nội dung chuỗi trong toàn tiến trình.
+    Cùng một bieuthuctinhtoan dùng cho hàng nghìn nhân sự chỉ bị parse đúng 1 lần.
+    """
+    return CompiledFormula(formula_str)
+
+
+# --- KẾ HOẠCH TÍNH QUY TẮC LƯƠNG (RULE PLAN / DAG) ---
+class FormulaCycleError(ValueError):
+    """Các quy tắc công thức tham chiếu vòng lẫn nhau (A -> B -> A)."""
+    def __init__(self, cycle):
+        self.cycle = list(cycle)
+        super().__init__(f"Công thức tham chiếu vòng: {' -> '.join(self.cycle)}")
+
+
+class RulePlan:
+    """
+    Đồ thị phụ thuộc giữa các quy tắc công thức, sắp xếp topo đúng 1 lần cho cả lượt tính lương.
+    - formulas: {maquytac: CompiledFormula}
+    - order: thứ tự tính (quy tắc được tham chiếu luôn đứng trước quy tắc tham chiếu tới nó)
+    Tham chiếu vòng bị phát hiện ngay khi lập kế hoạch (FormulaCycleError) thay vì âm thầm trả None.
+    """
+    __slots__ = ('formulas', 'order')
+
+    def __init__(self, formula_map):
+        # formula_map: {maquytac: bieuthuctinhtoan}, thứ tự key được giữ khi không có ràng buộc phụ thuộc
+        self.formulas = {key: compile_formula(expr) for key, expr in formula_map.items()}
+        self.order = self._topological_order()
+
+    def _topological_order(self):
+        # Thuật toán Kahn: cạnh dep -> key (chỉ tính phụ thuộc giữa các quy tắc công thức với nhau)
+        deps_map = {
+            key: {ref for ref in (compiled.refs or ()) if ref in self.formulas}
+            for key, compiled in self.formulas.items()
+        }
+        dependents = {key: [] for key in self.formulas}
+        for key, deps in deps_map.items():
+            for dep in deps:
+                dependents[dep].append(key)
+
+        remaining = {key: len(deps) for key, deps in deps_map.items()}
+        ready = [key for key in self.formulas if remaining[key] == 0]
+        order = []
+        while ready:
+            key = ready.pop(0)
+            order.append(key)
+            for child in dependents[key]:
+                remaining[child] -= 1
+                if remaining[child] == 0:
+                    ready.append(child)
+
+        if len(order) < len(self.formulas):
+            raise FormulaCycleError(self._find_cycle(deps_map, remaining))
+        return order
+
+    @staticmethod
+    def _find_cycle(deps_map, remaining):
+        # Mọi quy tắc còn lại đều có ít nhất 1 phụ thuộc còn lại -> đi theo phụ thuộc chắc chắn gặp lại 1 đỉnh
+        key = next(k for k, count in remaining.items() if count > 0)
+        path, seen = [], {}
+        while key not in seen:
+            seen[key] = len(path)
+            path.append(key)
+            key = next(dep for dep in sorted(deps_map[key]) if remaining[dep] > 0)
+        return path[seen[key]:] + [key]
+
+    @staticmethod
+    def collect_formulas(roots, params):
+        """
+        Thu thập các trường công thức (string) trong params mà roots phụ thuộc trực tiếp hoặc gián tiếp.
+        Trả về {key: bieuthuc}.
+        """
+        formula_map = {}
+        stack = [key for key in roots if isinstance(params.get(key), str)]
+        while stack:
+            key = stack.pop()
+            if key in formula_map:
+                continue
+            formula_map[key] = params[key]
+            refs = compile_formula(params[key]).refs or ()
+            stack.extend(ref for ref in refs if isinstance(params.get(ref), str))
+        return formula_map
+
+
+class _ValueMap(dict):
+    # Biến không có trong tham số -> None (giữ cách xử lý cũ: propagate None trong công thức)
+    def __missing__(self, key):
+        return None
 
-        # Nếu là số (int, float), trả về FieldProxy để giữ tên trường gốc
-        if isinstance(raw_val, (int, float)):
-            proxy = FieldProxy(key, raw_val)
-            self.resolved[key] = proxy
-            return proxy
 
-        # Nếu là string (công thức), tính toán đệ quy qua PayrollCalculator
-        if isinstance(raw_val, str):
-            self.calculating.add(key)
+# --- ĐÁNH GIÁ THEO CỘT (COLUMN-WISE EVALUATION) ---
+# Giá trị lỗi của một phần tử trong cột (tương đương công thức của nhân sự đó raise lỗi -> kết quả None).
+# Khác với None: None là giá trị hợp lệ (IF(X, 1, 0) với X None vẫn ra 0), còn lỗi lan ra cả biểu thức.
+_ERR = object()
+
+
+class ColumnEvaluator:
+    """
+    Đánh giá một công thức đã biên dịch 1 lần cho cả danh sách nhân sự: mỗi node AST được duyệt đúng 1 lần,
+    phép toán áp dụng theo từng phần tử trên cột giá trị (list có độ dài = số nhân sự).
+    Ngữ nghĩa từng phần tử giống hệt đánh giá từng dòng bằng SimpleEval (cùng bảng toán tử, cùng hàm),
+    nên tính lại cả bảng lương chỉ tốn "số quy tắc × một lượt phép toán trên cột".
+    """
+
+    def __init__(self, calculator, columns, group_ids):
+        self.calculator = calculator
+        self.operators = calculator.simple_eval.operators
+        self.functions = calculator.simple_eval.functions
+        self.columns = columns        # {tên biến: list giá trị theo nhân sự}, thiếu biến -> cột None
+        self.group_ids = group_ids    # group_id theo từng nhân sự (context cho hàm tổng hợp)
+        self.size = len(group_ids)
+
+    def evaluate(self, compiled):
+        if compiled.error is not None:
+            return [_ERR] * self.size
+        return self._eval(compiled.node.value)
+
+    def _eval(self, node):
+        handler = getattr(self, f'_eval_{type(node).__name__.lower()}')
+        return handler(node)
+
+    def _eval_constant(self, node):
+        return [node.value] * self.size
+
+    def _eval_name(self, node):
+        column = self.columns.get(node.id)
+        return column if column is not None else [None] * self.size
+
+    @staticmethod
+    def _apply(func, *columns):
+        # Áp dụng func theo từng phần tử; phần tử lỗi (hoặc func raise) -> _ERR
+        out = []
+        for args in zip(*columns):
+            if _ERR in args:
+                out.append(_ERR)
+                continue
             try:
-                res = self.calculator._internal_eval(raw_val, self)
-                # Nếu kết quả là None (do công thức con bị None), giữ nguyên None
-                if res is None:
-                    self.resolved[key] = None
-                    return None
-                proxy = FieldProxy(key, res)
-                self.resolved[key] = proxy
-                return proxy
+                out.append(func(*args))
             except Exception:
-                # Nếu có lỗi khi tính công thức, trả về None
-                self.resolved[key] = None
-                return None
-            finally:
-                self.calculating.remove(key)
+                out.append(_ERR)
+        return out
+
+    def _operator(self, op):
+        operator = self.operators.get(type(op))
+        if operator is None:
+            raise KeyError(type(op).__name__)
+        return operator
+
+    def _eval_binop(self, node):
+        try:
+            operator = self._operator(node.op)
+        except KeyError:
+            return [_ERR] * self.size
+        return self._apply(operator, self._eval(node.left), self._eval(node.right))
+
+    def _eval_unaryop(self, node):
+        try:
+            operator = self._operator(node.op)
+        except KeyError:
+            return [_ERR] * self.size
+        return self._apply(operator, self._eval(node.operand))
 
-        # Nếu là kiểu khác (list, dict, ...), trả về luôn
-        self.resolved[key] = raw_val
-        return raw_val
+    def _eval_compare(self, node):
+        try:
+            operators = [self._operator(op) for op in node.ops]
+        except KeyError:
+            return [_ERR] * self.size
+        columns = [self._eval(node.left)] + [self._eval(comp) for comp in node.comparators]
+
+        out = []
+        for values in zip(*columns):
+            # So sánh chuỗi (a < b < c) dừng ở vế sai đầu tiên như SimpleEval, vế sau không được đánh giá
+            right = values[0]
+            res = True
+            for operator, comp in zip(operators, values[1:]):
+                if not res:
+                    break
+                left, right = right, comp
+                if left is _ERR or right is _ERR:
+                    res = _ERR
+                    break
+                try:
+                    res = operator(left, right)
+                except Exception:
+                    res = _ERR
+                    break
+            out.append(res)
+        return out
+
+    def _eval_boolop(self, node):
+        is_and = isinstance(node.op, ast.And)
+        columns = [self._eval(value) for value in node.values]
+
+        out = []
+        for values in zip(*columns):
+            res = False
+            for value in values:
+                res = value
+                if value is _ERR or (not value if is_and else value):
+                    break
+            out.append(res)
+        return out
+
+    def _eval_ifexp(self, node):
+        tests = self._eval(node.test)
+        bodies = self._eval(node.body)
+        orelses = self._eval(node.orelse)
+        return [
+            _ERR if test is _ERR else (body if test else orelse)
+            for test, body, orelse in zip(tests, bodies, orelses)
+        ]
+
+    def _eval_call(self, node):
+        func_name = node.func.id
+        func = self.functions[func_name]
+        arg_columns = [self._eval(arg) for arg in node.args]
+
+        if func_name not in FORMULA_AGGREGATE_FUNCTION_NAMES and func_name != 'COUNT':
+            return self._apply(func, *arg_columns)
+
+        # Hàm tổng hợp: cần context group_id của từng nhân sự (kết quả đã được cache theo nhóm)
+        calculator = self.calculator
+        old_group_id = calculator.current_group_id
+        out = []
+        try:
+            for group_id, args in zip(self.group_ids, zip(*arg_columns) if arg_columns else [()] * self.size):
+                calculator.current_group_id = group_id
+                out.extend(self._apply(func, *([arg] for arg in args)))
+        finally:
+            calculator.current_group_id = old_group_id
+        return out
 
 
- 
 # --- LỚP TÍNH LƯƠNG TỔNG HỢP (PAYROLL CALCULATOR) ---
 # Quản lý dữ liệu nhóm nhân sự, đánh giá công thức động, tổng hợp số liệu, và tính toán hàng loạt cho từng thành viên.
 # Hỗ trợ các hàm tổng hợp như SUM, AVG, COUNT, MIN, MAX dùng trực tiếp trong công thức lương.
@@ -87,6 +348,7 @@ class PayrollCalculator:
         self.data_groups_map = data_groups_map if data_groups_map else {}
         self.aggregation_cache = {}    # Cache kết quả tổng hợp (giảm lặp lại phép tổng hợp)
         self.current_group_id = None   # ID nhóm hiện tại khi tính toán (dùng cho các hàm tổng hợp)
+        self.plan_cache = {}           # Cache RulePlan theo tập công thức (các nhân sự cùng công thức dùng chung)
 
         # Cấu hình SimpleEval với các hàm hỗ trợ trong công thức lương động
         self.simple_eval = SimpleEval()
@@ -103,10 +365,8 @@ class PayrollCalculator:
 
     # --- HÀM HỖ TRỢ TỔNG HỢP ---
     def _extract_field_name(self, field_input):
-        # Lấy tên trường từ FieldProxy (giá trị đã được wrap) hoặc từ string
+        # Lấy tên trường (công thức đã biên dịch truyền tên trường dạng string vào hàm tổng hợp)
         # Trả về None nếu không hợp lệ (giúp kiểm soát lỗi khi tổng hợp)
-        if isinstance(field_input, FieldProxy):
-            return field_input.original_name
         if isinstance(field_input, str):
             return field_input
         return None
@@ -125,7 +385,7 @@ class PayrollCalculator:
 
     def _calculate_aggregate(self, group_id, field_input, func_type):
         # Tổng hợp (sum, max, min, avg) cho một trường trong nhóm
-        # Nếu field_input là FieldProxy thì lấy tên trường gốc, nếu là số thì trả về luôn
+        # Nếu field_input là tên trường thì tổng hợp theo nhóm, nếu là số thì trả về luôn
         field_name = self._extract_field_name(field_input)
         if field_name is None:
             # Nếu không xác định được tên trường, chỉ trả về giá trị nếu là số, ngược lại trả về 0
@@ -181,28 +441,98 @@ class PayrollCalculator:
         return len(self.data_groups_map.get(self.current_group_id, []))
 
     # --- MÁY TÍNH LÕI ---
-    def _internal_eval(self, expr, lazy_names):
+    def _internal_eval(self, expr, names):
         """
-        Đánh giá một biểu thức công thức với context là lazy_names (LazyProxyMap).
-        Dùng cho cả LazyProxyMap và các hàm tính toán động.
-        Nếu có lỗi hoặc biến phụ thuộc bị None, trả về None.
+        Đánh giá một biểu thức công thức với context là names (dict giá trị đã tính sẵn).
+        Công thức được lấy từ cache biên dịch (compile_formula), evaluator được dùng lại
+        thay vì tạo SimpleEval mới cho mỗi lần gọi.
         """
-        evaluator = SimpleEval(functions=self.simple_eval.functions)
-        evaluator.names = lazy_names
-        return evaluator.eval(expr)
+        return self._evaluate_compiled(compile_formula(expr), names)
+
+    def _evaluate_compiled(self, compiled, names):
+        # Đánh giá công thức đã biên dịch sẵn (không tra lại cache compile_formula)
+        evaluator = self.simple_eval
+        old_names = evaluator.names
+        evaluator.names = names
+        try:
+            return compiled.evaluate(evaluator)
+        finally:
+            evaluator.names = old_names
+
+    def build_plan(self, formula_map):
+        """
+        Lập kế hoạch tính (RulePlan) cho {maquytac: bieuthuctinhtoan}, dùng chung cho mọi nhân sự trong lượt tính.
+        Raise FormulaCycleError nếu các quy tắc tham chiếu vòng.
+        """
+        return RulePlan(formula_map)
+
+    def _plan_for_params(self, roots, params):
+        # Kế hoạch suy ra từ params của nhân sự, cache theo tập công thức để các nhân sự giống nhau dùng chung
+        formula_map = RulePlan.collect_formulas(roots, params)
+        cache_key = tuple(sorted(formula_map.items()))
+        plan = self.plan_cache.get(cache_key)
+        if plan is None:
+            plan = RulePlan(formula_map)
+            self.plan_cache[cache_key] = plan
+        return plan
+
+    def _evaluate_plan(self, plan, params):
+        """
+        Tính tuần tự các quy tắc theo thứ tự topo của plan (không đệ quy).
+        Trả về _ValueMap gồm params và giá trị các quy tắc đã tính; quy tắc lỗi/phụ thuộc None -> None.
+        """
+        values = _ValueMap(params)
+        for key in plan.order:
+            compiled = plan.formulas[key]
+            if compiled.error is not None:
+                values[key] = None
+                continue
+            try:
+                res = self._evaluate_compiled(compiled, values)
+            except Exception:
+                res = None
+            values[key] = float(res) if isinstance(res, (int, float)) else res
+        return values
+
+    def calculate_columns(self, plan, params_list, group_ids):
+        """
+        Tính toàn bộ quy tắc của plan cho cả danh sách nhân sự theo cột (mỗi quy tắc đánh giá 1 lần cho tất cả).
+        - params_list: list tham số của từng nhân sự
+        - group_ids: group_id tương ứng từng nhân sự (dùng cho các hàm tổng hợp)
+        Trả về {maquytac: list giá trị theo thứ tự params_list}, giá trị lỗi hoặc phụ thuộc None -> None.
+        Kết quả giống hệt gọi calculate_batch_fields(plan=plan) cho từng nhân sự.
+        """
+        columns = {}
+        names = set()
+        for compiled in plan.formulas.values():
+            names.update(compiled.refs or ())
+        for name in names:
+            if name not in plan.formulas:
+                columns[name] = [params.get(name) for params in params_list]
+
+        evaluator = ColumnEvaluator(self, columns, list(group_ids))
+        results = {}
+        for key in plan.order:
+            column = [
+                None if val is _ERR else (float(val) if isinstance(val, (int, float)) else val)
+                for val in evaluator.evaluate(plan.formulas[key])
+            ]
+            columns[key] = column
+            results[key] = column
+        return results
 
     def _core_evaluate(self, formula_str, params, group_id):
         """
-        Hàm lõi: Tạo LazyProxyMap và tính toán một công thức bất kỳ cho một nhân sự.
+        Hàm lõi: Tính các trường công thức mà formula_str phụ thuộc theo đồ thị, rồi tính formula_str cho một nhân sự.
         Tự động thiết lập context group_id cho các hàm tổng hợp.
-        Nếu có lỗi hoặc biến phụ thuộc bị None, trả về None.
+        Nếu có lỗi (kể cả tham chiếu vòng) hoặc biến phụ thuộc bị None, trả về None.
         """
         old_group_id = self.current_group_id
         self.current_group_id = group_id
         try:
-            # Luôn tạo LazyProxyMap để tự động giải quyết phụ thuộc giữa các trường
-            lazy_map = LazyProxyMap(self, params, group_id)
-            return self._internal_eval(formula_str, lazy_map)
+            compiled = compile_formula(formula_str)
+            values = self._evaluate_plan(self._plan_for_params(compiled.refs or (), params), params)
+            return self._evaluate_compiled(compiled, values)
         except Exception:
             return None
         finally:
@@ -217,31 +547,23 @@ class PayrollCalculator:
         """
         return self._core_evaluate(formula_str, params, group_id)
 
-    def calculate_batch_fields(self, field_keys, params, group_id):
+    def calculate_batch_fields(self, field_keys, params, group_id, plan=None):
         """
-        Tính hàng loạt các trường (field_keys) cho một nhân sự.
+        Tính hàng loạt các trường (field_keys) cho một nhân sự theo thứ tự phụ thuộc.
+        - plan: RulePlan lập sẵn 1 lần cho cả lượt tính (khuyến nghị); nếu không truyền sẽ suy ra từ params.
         Trả về dict {field: value}, value có thể là float hoặc None nếu lỗi hoặc phụ thuộc bị None.
+        Raise FormulaCycleError nếu các trường công thức tham chiếu vòng.
         """
+        if plan is None:
+            plan = self._plan_for_params(field_keys, params)
+
         old_group_id = self.current_group_id
         self.current_group_id = group_id
-        results = {}
         try:
-            lazy_map = LazyProxyMap(self, params, group_id)
-            for key in field_keys:
-                try:
-                    val = lazy_map[key]
-                    if isinstance(val, FieldProxy):
-                        results[key] = float(val)
-                    elif val is None:
-                        results[key] = None
-                    else:
-                        results[key] = val
-                except Exception:
-                    # Nếu lỗi khi tính trường này, trả về None
-                    results[key] = None
+            values = self._evaluate_plan(plan, params)
         finally:
             self.current_group_id = old_group_id
-        return results
+        return {key: values[key] for key in field_keys}
 
     def calculate_all(self, field_formula='bieu_thuc', field_params='tham_so', field_id='id'):
         """
@@ -288,17 +610,9 @@ class PayrollCalculator:
         if not formula or not isinstance(formula, str):
             return {}
 
-        used_names = set()
-        try:
-            # 1. Parse công thức thành AST (An toàn: Không thực thi code)
-            tree = ast.parse(formula, mode='eval')
-            
-            # 2. Duyệt cây để tìm các định danh (biến)
-            for node in ast.walk(tree):
-                if isinstance(node, ast.Name):
-                    used_names.add(node.id)
-                    
-        except SyntaxError:
+        # 1 + 2. Lấy tập định danh (biến) từ công thức đã biên dịch sẵn trong cache (không parse lại)
+        used_names = compile_formula(formula).names
+        if used_names is None:
             # Xử lý trường hợp công thức bị lỗi cú pháp
             return {}
 
@@ -310,4 +624,171 @@ class PayrollCalculator:
             if key in input_params
         }
         
-        return result
\ No newline at end of file
+        return result
+
+
+# --- TỔNG HỢP CHẤM CÔNG THEO THÁNG (ROLLUP NHÂN VIÊN × THÁNG) ---
+def _float_or_zero(field_name):
+    return Coalesce(field_name, 0.0, output_field=FloatField())
+
+
+class TongHopChamCongService:
+    """
+    Quản lý bảng tổng hợp chấm công Nhân viên × Tháng (Tonghopchamcong).
+    - refresh: tính lại đúng các ô (nhân viên, tháng) bị ảnh hưởng sau mỗi lần ghi Bảng chấm công
+    - rebuild: dựng lại toàn bộ/khoảng tháng (management command rebuild_tong_hop_cham_cong)
+    - get_period_totals: tổng theo nhân viên cho 1 khoảng ngày, đọc rollup nếu khoảng trùng tròn tháng
+    """
+
+    ROLLUP_FIELDS = [
+        'songaychamcong', 'tongconglamviec', 'tongcongvp', 'tongphutlamviec', 'tongphutlamthem',
+        'tongtiensx', 'tongsoluongan', 'tonganchunhat', 'tongandem', 'tongphutdimuon',
+        'tongphutvesom', 'tongngayvang',
+    ]
+
+    @staticmethod
+    def month_start(value):
+        return value.replace(day=1)
+
+    @staticmethod
+    def next_month_start(value):
+        return (value.replace(day=1) + dt.timedelta(days=32)).replace(day=1)
+
+    @staticmethod
+    def aggregate_expressions():
+        """Các biểu thức aggregate có điều kiện trên Bangchamcong, tên khớp với cột của Tonghopchamcong."""
+        return {
+            'songaychamcong': Count('id'),
+            'tongconglamviec': Sum(_float_or_zero('conglamviec')),
+            'tongcongvp': Coalesce(
+                Sum(_float_or_zero('conglamviec'), filter=Q(loaichamcong='VP')), 0.0, output_field=FloatField()
+            ),
+            'tongphutlamviec': Sum(
+                _float_or_zero('thoigianlamviec') + _float_or_zero('thoigiandisom') + _float_or_zero('thoigianvemuon')
+            ),
+            'tongphutlamthem': Sum(_float_or_zero('thoigianlamthem')),
+            'tongtiensx': Sum(_float_or_zero('thanhtien')),
+            'tongsoluongan': Count('id', filter=Q(coantrua=True)),
+            'tonganchunhat': Count('id', filter=Q(coanchunhat=True)),
+            'tongandem': Count('id', filter=Q(coandem=True)),
+            'tongphutdimuon': Sum(_float_or_zero('thoigiandimuon')),
+            'tongphutvesom': Sum(_float_or_zero('thoigianvesom')),
+            'tongngayvang': Count('id', filter=~Q(codilam=True) & ~Q(cophaingaynghi=True)),
+        }
+
+    @staticmethod
+    def _aggregate_by_month(queryset):
+        return (
+            queryset
+            .annotate(thang=TruncMonth('ngaylamviec'))
+            .values('nhanvien_id', 'thang')
+            .annotate(**TongHopChamCongService.aggregate_expressions())
+            .order_by('nhanvien_id', 'thang')
+        )
+
+    @staticmethod
+    def _upsert(rows):
+        now = timezone.now()
+        objs = [
+            Tonghopchamcong(
+                created_at=now, updated_at=now, nhanvien_id=row['nhanvien_id'], thang=row['thang'],
+                **{field: row[field] for field in TongHopChamCongService.ROLLUP_FIELDS}
+            )
+            for row in rows
+        ]
+        if objs:
+            Tonghopchamcong.objects.bulk_create(
+                objs,
+                batch_size=1000,
+                update_conflicts=True,
+                unique_fields=['nhanvien', 'thang'],
+                update_fields=TongHopChamCongService.ROLLUP_FIELDS + ['updated_at'],
+            )
+        return len(objs)
+
+    @staticmethod
+    def refresh(nhanvien_ngay_pairs):
+        """
+        Tính lại rollup cho các ô (nhân viên, tháng) chứa các cặp (nhanvien_id, ngaylamviec) vừa bị ghi/xóa.
+        Chỉ aggregate lại dữ liệu của đúng các nhân viên/tháng đó (1 query), ô không còn bản ghi nào sẽ bị xóa.
+        """
+        keys = {
+            (int(nv_id), TongHopChamCongService.month_start(ngay))
+            for nv_id, ngay in nhanvien_ngay_pairs
+            if nv_id is not None and ngay is not None
+        }
+        if not keys:
+            return 0
+
+        nhanvien_ids = {nv_id for nv_id, _ in keys}
+        thang_list = {thang for _, thang in keys}
+        rows = [
+            row for row in TongHopChamCongService._aggregate_by_month(
+                Bangchamcong.objects.filter(
+                    nhanvien_id__in=nhanvien_ids,
+                    ngaylamviec__gte=min(thang_list),
+                    ngaylamviec__lt=TongHopChamCongService.next_month_start(max(thang_list)),
+                )
+            )
+            if (row['nhanvien_id'], row['thang']) in keys
+        ]
+
+        empty_keys = keys - {(row['nhanvien_id'], row['thang']) for row in rows}
+        if empty_keys:
+            empty_q = Q()
+            for nv_id, thang in empty_keys:
+                empty_q |= Q(nhanvien_id=nv_id, thang=thang)
+            Tonghopchamcong.objects.filter(empty_q).delete()
+
+        # Chấm công đã đổi → file báo cáo chấm công xuất trước đó không còn dùng lại được
+        invalidate_report_data(DATA_CHAM_CONG)
+        return TongHopChamCongService._upsert(rows)
+
+    @staticmethod
+    def rebuild(thang_tu=None, thang_den=None):
+        """
+        Dựng lại rollup từ Bảng chấm công cho khoảng tháng [thang_tu, thang_den] (None = không giới hạn).
+        Trả về số ô (nhân viên, tháng) đã ghi.
+        """
+        bcc_qs = Bangchamcong.objects.filter(nhanvien_id__isnull=False, ngaylamviec__isnull=False)
+        rollup_qs = Tonghopchamcong.objects.all()
+        if thang_tu:
+            thang_tu = TongHopChamCongService.month_start(thang_tu)
+            bcc_qs = bcc_qs.filter(ngaylamviec__gte=thang_tu)
+            rollup_qs = rollup_qs.filter(thang__gte=thang_tu)
+        if thang_den:
+            thang_ke_tiep = TongHopChamCongService.next_month_start(thang_den)
+            bcc_qs = bcc_qs.filter(ngaylamviec__lt=thang_ke_tiep)
+            rollup_qs = rollup_qs.filter(thang__lt=thang_ke_tiep)
+
+        rollup_qs.delete()
+        invalidate_report_data(DATA_CHAM_CONG)
+        return TongHopChamCongService._upsert(
+            TongHopChamCongService._aggregate_by_month(bcc_qs).iterator(chunk_size=2000)
+        )
+
+    @staticmethod
+    def get_period_totals(nhanvien_ids, ngay_bat_dau, ngay_ket_thuc):
+        """
+        Tổng chấm công theo nhân viên trong [ngay_bat_dau, ngay_ket_thuc], trả về {nhanvien_id: {cột rollup: tổng}}.
+        Khoảng ngày tròn tháng -> cộng các ô rollup (chi phí theo số nhân viên);
+        ngược lại -> aggregate trực tiếp Bảng chấm công trong DB (1 query GROUP BY).
+        """
+        is_whole_months = (
+            ngay_bat_dau.day == 1 and (ngay_ket_thuc + dt.timedelta(days=1)).day == 1
+        )
+        if is_whole_months:
+            rows = (
+                Tonghopchamcong.objects
+                .filter(nhanvien_id__in=nhanvien_ids, thang__range=[ngay_bat_dau, ngay_ket_thuc])
+                .values('nhanvien_id')
+                .annotate(**{field: Sum(field) for field in TongHopChamCongService.ROLLUP_FIELDS})
+            )
+        else:
+            rows = (
+                Bangchamcong.objects
+                .filter(nhanvien_id__in=nhanvien_ids, ngaylamviec__range=[ngay_bat_dau, ngay_ket_thuc])
+                .values('nhanvien_id')
+                .annotate(**TongHopChamCongService.aggregate_expressions())
+            )
+        return {row['nhanvien_id']: row for row in rows.order_by('nhanvien_id')}
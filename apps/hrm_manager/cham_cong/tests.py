@@ -1,3 +1,425 @@
-from django.test import TestCase
+import datetime as dt
+import json
+from unittest import mock
 
-# Create your tests here.
+from django.test import SimpleTestCase
+
+from apps.hrm_manager.cham_cong.services import (
+	FormulaCycleError,
+	PayrollCalculator,
+	RulePlan,
+	TongHopChamCongService,
+	compile_formula,
+)
+
+
+class CompiledFormulaCacheTests(SimpleTestCase):
+	def setUp(self):
+		compile_formula.cache_clear()
+
+	def test_same_formula_is_parsed_once_for_many_employees(self):
+		groups = {
+			str(nv_id): [{'tham_so': {'LUONG_CB': 1000 * nv_id, 'PHU_CAP': 50}, 'nhanvien_id': nv_id}]
+			for nv_id in range(1, 51)
+		}
+		calculator = PayrollCalculator(groups)
+
+		for nv_id, members in groups.items():
+			result = calculator.calculate_single_item('LUONG_CB * 0.1 + PHU_CAP', members[0]['tham_so'], nv_id)
+			self.assertEqual(result, members[0]['tham_so']['LUONG_CB'] * 0.1 + 50)
+
+		info = compile_formula.cache_info()
+		self.assertEqual(info.misses, 1)
+		self.assertEqual(info.hits, 49)
+
+	def test_nested_formula_fields_are_resolved(self):
+		params = {
+			'LUONG_CB': 1000,
+			'THUONG': 'LUONG_CB * 0.2',
+			'THUC_LINH': 'ROUND(LUONG_CB + THUONG, 0)',
+		}
+		calculator = PayrollCalculator({'1': [{'tham_so': params}]})
+
+		result = calculator.calculate_batch_fields(['THUONG', 'THUC_LINH'], params, '1')
+
+		self.assertEqual(result, {'THUONG': 200.0, 'THUC_LINH': 1200.0})
+
+	def test_invalid_formula_is_rejected_and_cached(self):
+		compiled = compile_formula('__import__("os").getcwd()')
+
+		self.assertIsNotNone(compiled.error)
+		self.assertIs(compile_formula('__import__("os").getcwd()'), compiled)
+
+		calculator = PayrollCalculator({'1': [{'tham_so': {}}]})
+		self.assertIsNone(calculator.calculate_single_item('__import__("os").getcwd()', {}, '1'))
+		self.assertIsNone(calculator.calculate_single_item('LUONG_CB +', {'LUONG_CB': 1}, '1'))
+
+	def test_extract_formula_params_uses_compiled_names(self):
+		calculator = PayrollCalculator({})
+
+		result = calculator.extract_formula_params('IF(NGAY_CONG > 20, LUONG_CB, 0)', {
+			'NGAY_CONG': 22, 'LUONG_CB': 1000, 'THUONG': 5,
+		})
+
+		self.assertEqual(result, {'NGAY_CONG': 22, 'LUONG_CB': 1000})
+
+
+class RulePlanTests(SimpleTestCase):
+	def test_rules_are_ordered_by_dependency(self):
+		plan = RulePlan({
+			'THUC_LINH': 'TONG_THU_NHAP - KHAU_TRU',
+			'KHAU_TRU': 'TONG_THU_NHAP * 0.1',
+			'TONG_THU_NHAP': 'LUONG_CB + PHU_CAP',
+		})
+
+		order = plan.order
+		self.assertLess(order.index('TONG_THU_NHAP'), order.index('KHAU_TRU'))
+		self.assertLess(order.index('KHAU_TRU'), order.index('THUC_LINH'))
+
+	def test_cycle_is_reported_up_front(self):
+		with self.assertRaises(FormulaCycleError) as ctx:
+			RulePlan({
+				'A': 'B + 1',
+				'B': 'C + 1',
+				'C': 'A + 1',
+				'D': 'LUONG_CB',
+			})
+
+		cycle = ctx.exception.cycle
+		self.assertEqual(cycle[0], cycle[-1])
+		self.assertEqual(set(cycle), {'A', 'B', 'C'})
+
+	def test_batch_fields_raise_on_cycle(self):
+		params = {'A': 'B + 1', 'B': 'A + 1'}
+		calculator = PayrollCalculator({'1': [{'tham_so': params}]})
+
+		with self.assertRaises(FormulaCycleError):
+			calculator.calculate_batch_fields(['A'], params, '1')
+
+	def test_shared_plan_evaluates_each_employee(self):
+		plan = RulePlan({'THUONG': 'IF(NGAY_CONG >= 26, LUONG_CB * 0.1, 0)', 'TONG': 'LUONG_CB + THUONG'})
+		groups = {
+			'1': [{'tham_so': {'LUONG_CB': 1000, 'NGAY_CONG': 26, 'THUONG': plan.formulas['THUONG'].source}}],
+			'2': [{'tham_so': {'LUONG_CB': 2000, 'NGAY_CONG': 20}}],
+			'3': [{'tham_so': {'LUONG_CB': None, 'NGAY_CONG': 26}}],
+		}
+		calculator = PayrollCalculator(groups)
+
+		results = {
+			group_id: calculator.calculate_batch_fields(['THUONG', 'TONG'], members[0]['tham_so'], group_id, plan=plan)
+			for group_id, members in groups.items()
+		}
+
+		self.assertEqual(results['1'], {'THUONG': 100.0, 'TONG': 1100.0})
+		self.assertEqual(results['2'], {'THUONG': 0.0, 'TONG': 2000.0})
+		self.assertEqual(results['3'], {'THUONG': None, 'TONG': None})
+
+	def test_aggregate_functions_read_group_field_by_name(self):
+		groups = {'TEAM_1': [
+			{'nhanvien_id': 1, 'tham_so': {'SAN_LUONG': 30}, 'bieu_thuc': 'SAN_LUONG / SUM(SAN_LUONG) * 1000'},
+			{'nhanvien_id': 2, 'tham_so': {'SAN_LUONG': 70}},
+		]}
+
+		results = PayrollCalculator(groups).calculate_all(field_id='nhanvien_id')
+
+		self.assertEqual(results, {1: 300.0, 2: 700.0})
+
+
+class ColumnEvaluationTests(SimpleTestCase):
+	def test_columns_match_row_by_row_evaluation(self):
+		plan = RulePlan({
+			'LUONG_NGAY': 'LUONG_CB / CONG_CHUAN',
+			'LUONG_CONG': 'ROUND(LUONG_NGAY * NGAY_CONG, 2)',
+			'THUONG': 'IF(NGAY_CONG >= CONG_CHUAN and DI_MUON == 0, 500, 0)',
+			'PHAT': 'DI_MUON * 1000 if 0 < DI_MUON <= 30 else MAX(DI_MUON) * 2000',
+			'TY_LE': 'SAN_LUONG / SUM(SAN_LUONG)',
+			'THUC_LINH': 'MAX(0, LUONG_CONG + THUONG - PHAT) or ABS(-1)',
+		})
+		params_list = [
+			{'LUONG_CB': 5200000, 'CONG_CHUAN': 26, 'NGAY_CONG': 26, 'DI_MUON': 0, 'SAN_LUONG': 10},
+			{'LUONG_CB': 5200000, 'CONG_CHUAN': 26, 'NGAY_CONG': 20, 'DI_MUON': 15, 'SAN_LUONG': 30},
+			{'LUONG_CB': 4000000, 'CONG_CHUAN': 0, 'NGAY_CONG': 20, 'DI_MUON': 45, 'SAN_LUONG': 0},
+			{'LUONG_CB': None, 'CONG_CHUAN': 26, 'NGAY_CONG': None, 'DI_MUON': None},
+		]
+		group_ids = ['A', 'A', 'B', 'C']
+		groups = {}
+		for group_id, params in zip(group_ids, params_list):
+			groups.setdefault(group_id, []).append({'tham_so': params})
+
+		columns = PayrollCalculator(groups).calculate_columns(plan, params_list, group_ids)
+
+		row_calculator = PayrollCalculator(groups)
+		for idx, (group_id, params) in enumerate(zip(group_ids, params_list)):
+			expected = row_calculator.calculate_batch_fields(plan.order, params, group_id, plan=plan)
+			self.assertEqual({key: column[idx] for key, column in columns.items()}, expected)
+
+		self.assertEqual(columns['TY_LE'][:2], [0.25, 0.75])
+		self.assertIsNone(columns['LUONG_NGAY'][2])
+		self.assertEqual(columns['PHAT'][:2], [30000.0, 15000.0])
+		self.assertIsNone(columns['THUONG'][3])
+
+	def test_chunked_columns_match_single_pass(self):
+		# Sinh phiếu lương tính theo từng lô nhân viên: hàm tổng hợp lấy context theo group_id nên chia lô không đổi kết quả
+		plan = RulePlan({
+			'TY_LE': 'SAN_LUONG / SUM(SAN_LUONG)',
+			'THUONG': 'ROUND(TY_LE * 1000, 2)',
+		})
+		params_list = [{'SAN_LUONG': 10}, {'SAN_LUONG': 30}, {'SAN_LUONG': 5}, {'SAN_LUONG': 0}]
+		group_ids = ['A', 'A', 'B', 'C']
+		groups = {}
+		for group_id, params in zip(group_ids, params_list):
+			groups.setdefault(group_id, []).append({'tham_so': params})
+
+		calculator = PayrollCalculator(groups)
+		expected = calculator.calculate_columns(plan, params_list, group_ids)
+		chunked = {key: [] for key in expected}
+		for start in range(0, len(params_list), 3):
+			part = calculator.calculate_columns(plan, params_list[start:start + 3], group_ids[start:start + 3])
+			for key, column in part.items():
+				chunked[key].extend(column)
+
+		self.assertEqual(chunked, expected)
+		self.assertEqual(chunked['THUONG'], [250.0, 750.0, 1000.0, None])
+
+
+class TongHopChamCongTests(SimpleTestCase):
+	def test_month_boundaries(self):
+		self.assertEqual(TongHopChamCongService.month_start(dt.date(2025, 2, 17)), dt.date(2025, 2, 1))
+		self.assertEqual(TongHopChamCongService.next_month_start(dt.date(2025, 12, 31)), dt.date(2026, 1, 1))
+
+	@mock.patch('apps.hrm_manager.cham_cong.services.Bangchamcong')
+	@mock.patch('apps.hrm_manager.cham_cong.services.Tonghopchamcong')
+	def test_whole_month_period_reads_rollup(self, rollup_model, bcc_model):
+		TongHopChamCongService.get_period_totals([1, 2], dt.date(2025, 1, 1), dt.date(2025, 2, 28))
+		rollup_model.objects.filter.assert_called_once()
+		bcc_model.objects.filter.assert_not_called()
+
+	@mock.patch('apps.hrm_manager.cham_cong.services.Bangchamcong')
+	@mock.patch('apps.hrm_manager.cham_cong.services.Tonghopchamcong')
+	def test_partial_month_period_falls_back_to_raw_rows(self, rollup_model, bcc_model):
+		TongHopChamCongService.get_period_totals([1, 2], dt.date(2025, 1, 26), dt.date(2025, 2, 25))
+		bcc_model.objects.filter.assert_called_once()
+		rollup_model.objects.filter.assert_not_called()
+
+
+class BulkUpdateBangChamCongTests(SimpleTestCase):
+	@mock.patch('apps.hrm_manager.cham_cong.views.Bangchamcong')
+	def test_recalculated_rows_keep_snapshot_and_are_written_in_one_pass(self, model):
+		from apps.hrm_manager.cham_cong.views import _bulk_update_bang_cham_cong
+
+		model.objects.filter.return_value.exclude.return_value.values_list.return_value = [(1, '{"loaicalamviec": "CO_DINH"}')]
+		objs = [mock.Mock(id=1, snapshot_khunggio='{"moi": 1}'), mock.Mock(id=2, snapshot_khunggio='{"moi": 2}')]
+
+		_bulk_update_bang_cham_cong(objs)
+
+		self.assertEqual(objs[0].snapshot_khunggio, '{"loaicalamviec": "CO_DINH"}')
+		self.assertEqual(objs[1].snapshot_khunggio, '{"moi": 2}')
+		model.objects.bulk_update.assert_called_once()
+		for o in objs:
+			o.save.assert_not_called()
+
+
+class TeamJobExpansionTests(SimpleTestCase):
+	@staticmethod
+	def _tsl(*cv_ids):
+		from json import dumps
+		return dumps({'details': [{'congviec_id': cv, 'thamsotinhluong': {'loaicv': 'nhom'}} for cv in cv_ids]})
+
+	@mock.patch('apps.hrm_manager.cham_cong.views.build_cham_cong_data_for_update')
+	@mock.patch('apps.hrm_manager.cham_cong.views.Bangchamcong')
+	def test_closure_walks_index_and_hydrates_only_reached_rows(self, model, build_mock):
+		from apps.hrm_manager.cham_cong.views import _expand_payload_for_team_jobs
+
+		ngay = dt.date(2025, 3, 3)
+		model.objects.filter.return_value.values_list.return_value = [
+			(100, ngay, 7, 1, True, self._tsl(10, 20)),
+			(101, ngay, 8, 1, True, self._tsl(20)),
+			(102, ngay, 9, 1, True, self._tsl(30)),
+		]
+		build_mock.return_value = [
+			{'id': 100, 'nhanvien_id': 7, 'ngaylamviec': ngay, 'calamviec_id': 1, 'codilam': False},
+			{'id': 101, 'nhanvien_id': 8, 'ngaylamviec': ngay, 'calamviec_id': 1, 'codilam': False},
+		]
+		payload = [{'id': 1, 'nhanvien_id': 5, 'calamviec_id': 1, 'congviec_id': 10, 'thamsotinhluong': {'loaicv': 'nhom'}}]
+
+		rows = _expand_payload_for_team_jobs(payload, {ngay})
+
+		build_mock.assert_called_once_with(ngay, nhanvien_ids={7, 8})
+		self.assertEqual(sorted(r['id'] for r in rows[1:]), [100, 101])
+
+
+class ShiftTimeProfileTests(SimpleTestCase):
+	KHUNG_GIO = {
+		'thoigianbatdau': '08:00', 'thoigianketthuc': '17:00', 'congcuakhunggio': 1,
+		'thoigianchophepdenmuon': 5, 'thoigianchophepvesomnhat': 5,
+	}
+	NGHI_TRUA = [{'giobatdau': '12:00', 'gioketthuc': '13:00'}]
+
+	def test_break_overlap_matches_string_helper(self):
+		from apps.hrm_manager.cham_cong.views import ShiftTimeProfile
+		from apps.hrm_manager.utils.view_helpers import tinh_phut_nghi_trua_trong_khoang
+
+		ds_nghi = self.NGHI_TRUA + [{'giobatdau': '23:30', 'gioketthuc': '00:30'}, {'giobatdau': '02:00', 'gioketthuc': '02:15'}]
+		profile = ShiftTimeProfile(self.KHUNG_GIO, ds_nghi)
+		for bat_dau in range(0, 1440, 45):
+			for ket_thuc in range(0, 1440, 50):
+				self.assertEqual(
+					profile.phut_nghi(bat_dau, ket_thuc),
+					tinh_phut_nghi_trua_trong_khoang(bat_dau, ket_thuc, ds_nghi),
+				)
+
+	def test_profile_is_compiled_once_per_shift(self):
+		from apps.hrm_manager.cham_cong.views import _compile_shift_profile, get_shift_profile
+
+		_compile_shift_profile.cache_clear()
+		for _ in range(20):
+			profile = get_shift_profile(3, dict(self.KHUNG_GIO), list(self.NGHI_TRUA))
+		self.assertEqual(_compile_shift_profile.cache_info().misses, 1)
+		self.assertEqual(profile.tg_lam_viec_chuan, 480)
+
+	@mock.patch('apps.hrm_manager.cham_cong.views.tinh_luong_cham_cong', return_value={})
+	def test_late_arrival_minus_break_on_fixed_shift(self, _tinh_luong):
+		from apps.hrm_manager.cham_cong.views import calculate_bang_cham_cong_objects
+
+		obj, = calculate_bang_cham_cong_objects([{
+			'nhanvien_id': 1, 'calamviec_id': 3, 'ngaylamviec': '2025-03-03', 'codilam': True,
+			'loaicalamviec': 'CO_DINH', 'phuongthuctinhluong': 'monthly',
+			'thoigianchamcongvao': '13:30', 'thoigianchamcongra': '17:00',
+			'khunggiolamviec': dict(self.KHUNG_GIO), 'khunggionghitrua': list(self.NGHI_TRUA),
+		}])
+		self.assertEqual(obj.thoigiandimuon, 270)
+		self.assertEqual(obj.thoigianlamviec, 210)
+		self.assertEqual(obj.conglamviec, 0.44)
+
+
+class TongHopChamCongThangApiTests(SimpleTestCase):
+	@mock.patch('apps.hrm_manager.cham_cong.views._tong_hop_thang_totals', return_value={2: (8.5, 1.0)})
+	@mock.patch('apps.hrm_manager.cham_cong.views.Bangchamcong')
+	@mock.patch('apps.hrm_manager.cham_cong.views.Lichsucongtac')
+	def test_attendance_is_loaded_only_for_the_page_employees(self, lichsu_model, bcc_model, totals_mock):
+		from django.contrib.auth import get_user_model
+		from django.test import RequestFactory
+
+		from apps.hrm_manager.cham_cong.views import api_tong_hop_cham_cong_thang
+
+		employees = [
+			{'nhanvien_id': nv_id, 'ten_nv': f'NV {nv_id}', 'ma_nv': f'NV{nv_id}', 'phongban_id': 1, 'ten_cv': None, 'loai_chamcong': ''}
+			for nv_id in range(1, 6)
+		]
+		lichsu_model.objects.filter.return_value.annotate.return_value.values.return_value.order_by.return_value = employees
+		cc_thang = bcc_model.objects.filter.return_value
+		cc_thang.filter.return_value.values.return_value.order_by.return_value = [{
+			'nhanvien_id': 2, 'ngaylamviec': dt.date(2026, 5, 4), 'thoigianlamviec': 480, 'thoigianvemuon': 30,
+			'thoigiandisom': None, 'thoigianchamcongvao': dt.time(8, 0), 'thoigianchamcongra': dt.time(17, 0),
+			'thoigiandimuon': 0, 'thoigianvesom': 0, 'conglamviec': 1.0, 'codilam': True,
+			'tencongviec': 'Ca hành chính', 'ghichu': None,
+		}]
+
+		request = RequestFactory().get('/', {'thang': '2026-05', 'page': 1, 'page_size': 2})
+		request.user = get_user_model()(username='tester', is_superuser=True, is_active=True)
+		response = api_tong_hop_cham_cong_thang(request)
+
+		body = json.loads(response.content)
+		self.assertEqual([nv['nhanvien_id'] for nv in body['data']], [1, 2])
+		self.assertEqual(body['pagination']['total'], 5)
+		self.assertEqual(body['pagination']['total_pages'], 3)
+		self.assertEqual(body['data'][1]['logs']['04'][0]['tg_lamviec'], 8.5)
+		self.assertEqual(body['data'][1]['tongthoigianlamviec'], 8.5)
+		self.assertEqual(body['data'][0]['tongconglamviec'], 0)
+		cc_thang.filter.assert_any_call(nhanvien_id__in={1, 2})
+		cc_thang.filter.return_value.values.assert_called_once_with(
+			'nhanvien_id', 'ngaylamviec', 'thoigianlamviec', 'thoigianvemuon', 'thoigiandisom',
+			'thoigianchamcongvao', 'thoigianchamcongra', 'thoigiandimuon', 'thoigianvesom',
+			'conglamviec', 'codilam', 'tencongviec', 'ghichu',
+		)
+		totals_mock.assert_called_once_with({1, 2}, dt.date(2026, 5, 1), dt.date(2026, 6, 1))
+
+	def test_bad_department_and_bad_month_get_their_own_message(self):
+		from django.contrib.auth import get_user_model
+		from django.test import RequestFactory
+
+		from apps.hrm_manager.cham_cong.views import api_tong_hop_cham_cong_thang, export_tong_hop_cham_cong_thang
+
+		with self.assertRaisesMessage(ValueError, 'Phòng ban không hợp lệ'):
+			export_tong_hop_cham_cong_thang({'thang': '2026-05', 'phongban_id': 'abc'})
+		with self.assertRaisesMessage(ValueError, 'Thời gian không hợp lệ'):
+			export_tong_hop_cham_cong_thang({'thang': '2026-13'})
+
+		request = RequestFactory().get('/', {'thang': '2026-05', 'phongban_id': 'abc'})
+		request.user = get_user_model()(username='tester', is_superuser=True, is_active=True)
+		response = api_tong_hop_cham_cong_thang(request)
+
+		self.assertEqual(response.status_code, 400)
+		self.assertEqual(json.loads(response.content)['message'], 'Phòng ban không hợp lệ')
+
+	@mock.patch('apps.hrm_manager.cham_cong.views.TongHopChamCongService.get_period_totals')
+	def test_month_totals_are_read_from_the_rollup(self, period_totals):
+		from apps.hrm_manager.cham_cong.views import _tong_hop_thang_totals
+
+		period_totals.return_value = {2: {'tongphutlamviec': 1530.0, 'tongconglamviec': 3.0}}
+
+		totals = _tong_hop_thang_totals({2}, dt.date(2026, 5, 1), dt.date(2026, 6, 1))
+
+		self.assertEqual(totals, {2: (25.5, 3.0)})
+		# Ngày kết thúc của get_period_totals là ngày cuối tháng (bao gồm) → khoảng tròn tháng, đọc rollup
+		period_totals.assert_called_once_with({2}, dt.date(2026, 5, 1), dt.date(2026, 5, 31))
+
+
+class XlsxExportTests(SimpleTestCase):
+	def test_rows_are_streamed_with_widths_from_written_rows(self):
+		import io
+
+		from openpyxl import load_workbook
+
+		from apps.hrm_manager.utils.xlsx_export import XlsxSheet, write_xlsx
+
+		rows = (['NV%d' % i, 'Nhân viên có tên rất dài' if i == 3 else 'A', i] for i in range(1, 6))
+		buffer = io.BytesIO()
+		write_xlsx([XlsxSheet('Tổng hợp', ['Mã', 'Tên', 'Tổng'], rows, bold_columns=(-1,))], buffer)
+
+		sheet = load_workbook(buffer)['Tổng hợp']
+		self.assertEqual(sheet.max_row, 6)
+		self.assertEqual(sheet['B4'].value, 'Nhân viên có tên rất dài')
+		self.assertEqual(sheet.column_dimensions['B'].width, len('Nhân viên có tên rất dài') + 2)
+		self.assertEqual(sheet.column_dimensions['C'].width, len('Tổng') + 2)
+		self.assertTrue(sheet['A1'].font.b)
+		self.assertTrue(sheet['C2'].font.b)
+		self.assertFalse(sheet['A2'].font.b)
+
+	@mock.patch('apps.hrm_manager.cham_cong.views._tong_hop_thang_totals', return_value={2: (8.5, 1.0)})
+	@mock.patch('apps.hrm_manager.cham_cong.views.Bangchamcong')
+	@mock.patch('apps.hrm_manager.cham_cong.views.Lichsucongtac')
+	def test_monthly_summary_export_reads_employees_in_batches(self, lichsu_model, bcc_model, totals_mock):
+		import io
+
+		from django.contrib.auth import get_user_model
+		from django.test import RequestFactory
+		from openpyxl import load_workbook
+
+		from apps.hrm_manager.cham_cong import views
+
+		employees = [
+			{'nhanvien_id': nv_id, 'ten_nv': f'NV {nv_id}', 'ma_nv': f'NV{nv_id}', 'phongban_id': 1, 'ten_cv': None, 'loai_chamcong': ''}
+			for nv_id in range(1, 4)
+		]
+		qs_nv = lichsu_model.objects.filter.return_value.annotate.return_value.values.return_value.order_by.return_value
+		qs_nv.iterator.return_value = iter(employees)
+		cc_thang = bcc_model.objects.filter.return_value
+		cc_thang.filter.return_value.values.return_value.annotate.return_value.order_by.return_value = [
+			{'nhanvien_id': 2, 'ngaylamviec': dt.date(2026, 2, 4), 'cong': 1.0},
+		]
+
+		request = RequestFactory().get('/', {'thang': '2026-02'})
+		request.user = get_user_model()(username='tester', is_superuser=True, is_active=True)
+		with mock.patch.object(views, 'TONG_HOP_THANG_EXPORT_CHUNK', 2):
+			response = views.api_tong_hop_cham_cong_thang_export(request)
+			content = b''.join(response.streaming_content)
+
+		sheet = load_workbook(io.BytesIO(content))['Tháng 02-2026']
+		rows = list(sheet.iter_rows(values_only=True))
+		self.assertEqual(len(rows[0]), 4 + 28 + 2)
+		self.assertEqual(rows[2][:4], ('NV2', 'NV 2', None, None))
+		self.assertEqual(rows[2][4 + 3], 1.0)
+		self.assertEqual(rows[2][-2:], (8.5, 1.0))
+		self.assertEqual(len(rows), 4)
+		self.assertEqual([call.args[0] for call in totals_mock.call_args_list], [{1, 2}, {3}])
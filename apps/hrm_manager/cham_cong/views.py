@@ -6,24 +6,30 @@ from django.contrib.auth.decorators import login_required
 from django.views.decorators.http import require_http_methods
 from django.views.decorators.csrf import csrf_exempt
 from django.utils import timezone
-from django.db.models import CharField, F, Value, Func, Count, OuterRef, Subquery, IntegerField, Q, Exists, Min, Max
+from django.db.models import (
+    CharField, F, FloatField, Value, Func, Count, OuterRef, Subquery, IntegerField, Q, Exists, Min, Max, Sum,
+)
 from django.db.models.functions import Cast, Coalesce
+from django.core.paginator import Paginator
 from django.db import transaction
 from django.contrib.postgres.aggregates import JSONBAgg
 
 from json import loads, dumps
 import datetime as dt
-from collections import defaultdict
+from collections import defaultdict, deque
+from functools import lru_cache
+from itertools import islice
 
 from apps.hrm_manager.__core__.models import Bangchamcong, Khunggionghitrua, Phongban, Lichlamviecthucte, Calamviec, Lichsucongtac
-from apps.hrm_manager.cham_cong.services import PayrollCalculator
+from apps.hrm_manager.cham_cong.services import PayrollCalculator, TongHopChamCongService
 from apps.hrm_manager.utils.permissions import require_api_permission, require_view_permission
+from apps.hrm_manager.utils.shift_snapshot_cache import KIND_CHAM_CONG, get_shift_snapshots, shift_version
 from apps.hrm_manager.utils.view_helpers import (
-    diff_minutes, parse_time_to_minutes, parse_minutes_to_time,
-    calculate_work_minutes_with_overnight, tinh_phut_nghi_trua_trong_khoang,
+    parse_time_to_minutes, calculate_work_minutes_with_overnight,
     serialize_time_value, json_error, json_success, handle_exceptions, get_request_data
 )
-from apps.hrm_manager.to_chuc_nhan_su.views import get_all_child_department_ids
+from apps.hrm_manager.utils.department_tree import department_subtree_q
+from apps.hrm_manager.utils.xlsx_export import XlsxSheet, xlsx_streaming_response
 
 # ============================================================
 # HELPERS
@@ -40,6 +46,7 @@ _BANGCHAMCONG_UPDATE_FIELDS = [
     'thamsotinhluong', 'thanhtien', 'thanhtienthanhphan',
     'ghichu', 'congviec', 'nhanvien', 'calamviec', 'snapshot_khunggio',
 ]
+_BANGCHAMCONG_UPDATE_BATCH_SIZE = 500
 
 def get_lam_them_tabs():
     """Tabs cho nhóm Quản lý Làm thêm"""
@@ -174,6 +181,17 @@ def _collect_team_job_keys(data_list):
     return keys
 
 
+def _team_job_keys_of_record(thamsotinhluong, calamviec_id):
+    """Các team job keys (congviec_id, calamviec_id) mà 1 bản ghi DB tham gia (details có loaicv='nhom')."""
+    keys = set()
+    for d in (_parse_salary_config(thamsotinhluong).get('details') or []):
+        if isinstance(d, dict):
+            d_cv_id = _normalize_job_id(d.get('congviec_id'))
+            if d_cv_id is not None and _parse_salary_config(d.get('thamsotinhluong')).get('loaicv') == 'nhom':
+                keys.add((d_cv_id, calamviec_id))
+    return keys
+
+
 def _collect_team_job_keys_from_db(records):
     """
     Trích xuất team job keys (congviec_id, calamviec_id) từ DB records.
@@ -181,21 +199,36 @@ def _collect_team_job_keys_from_db(records):
     """
     keys = set()
     for item in records:
-        ca_id = item.get('calamviec_id')
-        tsl = _parse_salary_config(item.get('thamsotinhluong'))
-
-        for d in (tsl.get('details') or []):
-            if isinstance(d, dict):
-                d_cv_id = _normalize_job_id(d.get('congviec_id'))
-                if d_cv_id is not None and _parse_salary_config(d.get('thamsotinhluong')).get('loaicv') == 'nhom':
-                    keys.add((d_cv_id, ca_id))
+        keys.update(_team_job_keys_of_record(item.get('thamsotinhluong'), item.get('calamviec_id')))
     return keys
 
 
+def _build_team_job_index(ngay_lam_viec_set):
+    """
+    Chỉ mục team job cho các ngày: (ngày, congviec_id, calamviec_id) → {id bản ghi} và id → thông tin bản ghi.
+    Chỉ đọc vài cột của các bản ghi có job nhóm (lọc sơ bộ bằng chuỗi 'nhom'), mỗi JSON parse đúng 1 lần.
+    """
+    ids_by_key = defaultdict(set)
+    record_info = {}
+    rows = Bangchamcong.objects.filter(
+        ngaylamviec__in=ngay_lam_viec_set, thamsotinhluong__contains='nhom'
+    ).values_list('id', 'ngaylamviec', 'nhanvien_id', 'calamviec_id', 'codilam', 'thamsotinhluong')
+    for rec_id, ngay, nv_id, ca_id, co_di_lam, tsl in rows:
+        keys = _team_job_keys_of_record(tsl, ca_id)
+        if not keys:
+            continue
+        for cv_id, key_ca_id in keys:
+            ids_by_key[(ngay, cv_id, key_ca_id)].add(rec_id)
+        # Bản ghi nghỉ (codilam=False) được tính lại nhưng không loang tiếp (payload không mang congviec_id)
+        record_info[rec_id] = (ngay, nv_id, keys if co_di_lam is not False else set())
+    return ids_by_key, record_info
+
+
 def _expand_payload_for_team_jobs(data_list, ngay_lam_viec_set, old_team_job_keys=None):
     """
     Mở rộng payload bằng thuật toán loang (transitive closure):
     Thêm tất cả các nhân viên có liên quan qua team jobs (bao gồm cả chuỗi liên kết).
+    BFS trên chỉ mục team job, chỉ nạp đầy đủ dữ liệu cho các bản ghi được loang tới.
     """
     initial_keys = _collect_team_job_keys(data_list)
     if old_team_job_keys:
@@ -204,64 +237,75 @@ def _expand_payload_for_team_jobs(data_list, ngay_lam_viec_set, old_team_job_key
     if not initial_keys:
         return data_list
 
-    # Cache DB records theo ngày để tránh query nhiều lần trong vòng lặp loang
-    db_records_by_date = {}
-    for ngay in ngay_lam_viec_set:
-        db_records_by_date[ngay] = build_cham_cong_data_for_update(ngay)
+    ids_by_key, record_info = _build_team_job_index(ngay_lam_viec_set)
 
     existing_ids = {item.get('id') for item in data_list if item.get('id') is not None}
-    processed_keys = set()
-    keys_to_process = set(initial_keys)
-    
-    all_extra_rows = []
-    
-    while keys_to_process:
-        processed_keys.update(keys_to_process)
-        extra_rows = []
-        
+    processed_keys = set(initial_keys)
+    queue = deque(initial_keys)
+    reached_ids = set()
+
+    while queue:
+        cv_id, ca_id = queue.popleft()
         for ngay in ngay_lam_viec_set:
-            for record in db_records_by_date.get(ngay, []):
-                rec_id = record.get('id')
-                if rec_id in existing_ids:
+            for rec_id in ids_by_key.get((ngay, cv_id, ca_id), ()):
+                if rec_id in existing_ids or rec_id in reached_ids:
                     continue
-                    
-                details = _parse_salary_config(record.get('thamsotinhluong')).get('details') or []
-                record_ca_id = record.get('calamviec_id')
-                has_related = any(
-                    isinstance(d, dict)
-                    and (_normalize_job_id(d.get('congviec_id')), record_ca_id) in keys_to_process
-                    and _parse_salary_config(d.get('thamsotinhluong')).get('loaicv') == 'nhom'
-                    for d in details
-                )
-                
-                if has_related:
-                    extra_rows.extend(_build_payload_rows_from_saved_record(record))
-                    if rec_id is not None:
-                        existing_ids.add(rec_id)
-        
-        if extra_rows:
-            all_extra_rows.extend(extra_rows)
-            new_keys = _collect_team_job_keys(extra_rows)
-            keys_to_process = new_keys - processed_keys
-        else:
-            keys_to_process = set()
+                reached_ids.add(rec_id)
+                for key in record_info[rec_id][2] - processed_keys:
+                    processed_keys.add(key)
+                    queue.append(key)
+
+    if not reached_ids:
+        return data_list
+
+    # Chỉ nạp các nhân viên có bản ghi được loang tới (giữ đúng thứ tự khung giờ theo nhân viên trong ngày)
+    nhanvien_ids_by_date = defaultdict(set)
+    for rec_id in reached_ids:
+        ngay, nv_id, _ = record_info[rec_id]
+        nhanvien_ids_by_date[ngay].add(nv_id)
+
+    all_extra_rows = []
+    for ngay in sorted(nhanvien_ids_by_date):
+        for record in build_cham_cong_data_for_update(ngay, nhanvien_ids=nhanvien_ids_by_date[ngay]):
+            if record.get('id') in reached_ids:
+                all_extra_rows.extend(_build_payload_rows_from_saved_record(record))
 
     return list(data_list) + all_extra_rows if all_extra_rows else data_list
 
 
 def _recalculate_team_members(team_job_keys, ngay_lam_viec_set):
-    """Tính lại và lưu tất cả bản ghi liên quan đến team jobs (dùng sau DELETE)."""
+    """Tính lại và lưu tất cả bản ghi liên quan đến team jobs (dùng sau DELETE). Trả về các bản ghi đã lưu."""
     # Dùng một payload ảo (rỗng) và truyền team_job_keys vào old_team_job_keys
     # để tận dụng thuật toán loang của _expand_payload_for_team_jobs
     rows = _expand_payload_for_team_jobs([], ngay_lam_viec_set, old_team_job_keys=team_job_keys)
     if not rows:
+        return []
+    objs = [o for o in calculate_bang_cham_cong_objects(rows) if o.id is not None]
+    _bulk_update_bang_cham_cong(objs)
+    return objs
+
+
+def _bulk_update_bang_cham_cong(update_objs):
+    """
+    Ghi các bản ghi chấm công đã tính lại trong một lượt: giữ nguyên snapshot khung giờ đã đóng băng
+    (1 query đọc) rồi bulk_update theo lô thay vì save() từng dòng.
+    """
+    if not update_objs:
         return
-    objs = calculate_bang_cham_cong_objects(rows)
     now = timezone.now()
-    for o in objs:
-        if o.id is not None:
-            o.updated_at = now
-            o.save(update_fields=_BANGCHAMCONG_UPDATE_FIELDS)
+    existing_snapshots = dict(
+        Bangchamcong.objects.filter(
+            id__in=[o.id for o in update_objs], snapshot_khunggio__isnull=False
+        ).exclude(snapshot_khunggio='').values_list('id', 'snapshot_khunggio')
+    )
+    for o in update_objs:
+        o.updated_at = now
+        val = existing_snapshots.get(o.id)
+        if val:
+            o.snapshot_khunggio = dumps(val) if isinstance(val, (dict, list)) else val
+
+    # ✅ BULK UPDATE thay vì loop save()
+    Bangchamcong.objects.bulk_update(update_objs, _BANGCHAMCONG_UPDATE_FIELDS, batch_size=_BANGCHAMCONG_UPDATE_BATCH_SIZE)
 
 
 def tinh_luong_cham_cong(data_list):
@@ -288,74 +332,166 @@ def tinh_luong_cham_cong(data_list):
     return PayrollCalculator(groups).calculate_all(field_formula='bieu_thuc', field_params='tham_so', field_id='nhanvien_id')
 
 
-def _tinh_time_deviation(khung_gio, tg_vao, tg_ra, loai_calamviec, item, in_min, out_min, start_min, end_min,
-                          tg_lam_viec_thuc, tg_lam_viec_chuan_ca, ds_nghi_trua):
+# Số profile khung giờ đã biên dịch giữ lại (mỗi khung giờ của mỗi ca/snapshot → 1 profile)
+SHIFT_PROFILE_CACHE_SIZE = 512
+
+
+class ShiftTimeProfile:
+    """
+    Khung giờ của 1 ca đã quy đổi sẵn sang phút: giờ bắt đầu/kết thúc, các khoảng nghỉ trưa,
+    số phút làm việc chuẩn và các ngưỡng. Chỉ phụ thuộc vào ca → dùng chung cho mọi nhân viên.
+    """
+    __slots__ = (
+        'start_min', 'end_min', 'breaks', 'tg_lam_viec_chuan',
+        'limit_muon', 'limit_som', 'phut_muon_linh_dong', 'phut_som_linh_dong',
+        'limit_vesom_0', 'limit_dimuon_0', 'tg_toi_thieu', 'cong_chuan',
+    )
+
+    def __init__(self, khung_gio, ds_nghi_trua):
+        self.start_min = parse_time_to_minutes(khung_gio.get("thoigianbatdau"))
+        self.end_min = parse_time_to_minutes(khung_gio.get("thoigianketthuc"))
+
+        breaks = []
+        for nghi_trua in ds_nghi_trua:
+            nt_bat_dau = parse_time_to_minutes(nghi_trua.get('giobatdau'))
+            nt_ket_thuc = parse_time_to_minutes(nghi_trua.get('gioketthuc'))
+            if nt_bat_dau is None or nt_ket_thuc is None:
+                continue
+            if nt_bat_dau > nt_ket_thuc:
+                nt_ket_thuc += 1440
+            breaks.append((nt_bat_dau, nt_ket_thuc))
+        self.breaks = tuple(breaks)
+
+        self.tg_lam_viec_chuan = calculate_work_minutes_with_overnight(
+            self.start_min, self.end_min, self.start_min, self.end_min
+        ) - self.phut_nghi(self.start_min, self.end_min)
+
+        self.limit_muon = khung_gio.get("thoigianchophepdenmuon", 0)
+        self.limit_som = khung_gio.get("thoigianchophepvesomnhat", 0)
+        self.phut_muon_linh_dong = khung_gio.get("sophutdenmuon", 0)
+        self.phut_som_linh_dong = khung_gio.get("sophutdensom", 0)
+        self.limit_vesom_0 = khung_gio.get("thoigianvesomkhongtinhchamcong", 0)
+        self.limit_dimuon_0 = khung_gio.get("thoigiandimuonkhongtinhchamcong", 0)
+        self.tg_toi_thieu = khung_gio.get("thoigianlamviectoithieu", 0)
+        self.cong_chuan = khung_gio.get("congcuakhunggio", 0) or 0
+
+    def phut_nghi(self, bat_dau, ket_thuc):
+        """Như tinh_phut_nghi_trua_trong_khoang nhưng trên các khoảng nghỉ đã quy đổi phút."""
+        if bat_dau is None or ket_thuc is None:
+            return 0
+        is_overnight = bat_dau > ket_thuc
+        if is_overnight:
+            ket_thuc += 1440
+
+        tong = 0
+        for nt_bat_dau, nt_ket_thuc in self.breaks:
+            if is_overnight and nt_bat_dau < bat_dau:
+                nt_bat_dau += 1440
+                nt_ket_thuc += 1440
+            overlap = min(ket_thuc, nt_ket_thuc) - max(bat_dau, nt_bat_dau)
+            if overlap > 0:
+                tong += overlap
+        return tong
+
+
+def _shift_profile_key(khung_gio, ds_nghi_trua):
+    """Khóa cache theo nội dung khung giờ + nghỉ trưa (tương đương hash snapshot của ca)."""
+    try:
+        kg_key = tuple(sorted(khung_gio.items()))
+        hash(kg_key)
+    except TypeError:
+        kg_key = dumps(khung_gio, sort_keys=True, default=str)
+    nt_key = tuple((nt.get('giobatdau'), nt.get('gioketthuc')) for nt in ds_nghi_trua)
+    return kg_key, nt_key
+
+
+@lru_cache(maxsize=SHIFT_PROFILE_CACHE_SIZE)
+def _compile_shift_profile(calamviec_id, kg_key, nt_key):
+    if isinstance(kg_key, str):
+        khung_gio = loads(kg_key)
+    else:
+        khung_gio = dict(kg_key)
+    ds_nghi_trua = [{'giobatdau': bd, 'gioketthuc': kt} for bd, kt in nt_key]
+    return ShiftTimeProfile(khung_gio, ds_nghi_trua)
+
+
+def get_shift_profile(calamviec_id, khung_gio, ds_nghi_trua):
+    """Lấy profile khung giờ đã biên dịch (cache theo calamviec_id + nội dung snapshot)."""
+    return _compile_shift_profile(calamviec_id, *_shift_profile_key(khung_gio or {}, ds_nghi_trua or []))
+
+
+def _diff(minutes1, minutes2):
+    """Hiệu phút (minutes2 - minutes1), 0 nếu thiếu 1 trong 2 (giống diff_minutes)."""
+    if minutes1 is None or minutes2 is None:
+        return 0
+    return minutes2 - minutes1
+
+
+def _tinh_time_deviation(profile, loai_calamviec, in_min, out_min, tg_lam_viec_thuc):
     """
     Tính toán sai lệch giờ vào/ra (đi muộn, về sớm, đi sớm, về muộn)
     theo từng loại ca: CO_DINH, LINH_DONG, TU_DO.
     Returns: (thoigiandimuon, thoigianvesom, thoigiandisom, thoigianvemuon, tg_lam_viec)
     """
     thoigiandimuon = thoigianvesom = thoigiandisom = thoigianvemuon = 0
+    start_min, end_min = profile.start_min, profile.end_min
 
     # Sai lệch giờ vào (dương: đi muộn, âm: đi sớm)
-    khoang_vao = diff_minutes(khung_gio.get("thoigianbatdau"), tg_vao)
+    khoang_vao = _diff(start_min, in_min)
 
     # Trừ nghỉ trưa nếu đi muộn cắt qua giờ nghỉ
     if khoang_vao > 0:
-        khoang_vao -= tinh_phut_nghi_trua_trong_khoang(start_min, in_min, ds_nghi_trua)
+        khoang_vao -= profile.phut_nghi(start_min, in_min)
 
     if loai_calamviec == "CO_DINH":
         # So sánh với ngưỡng cho phép
-        limit_muon = khung_gio.get("thoigianchophepdenmuon", 0)
-        limit_som = khung_gio.get("thoigianchophepvesomnhat", 0)
-
-        if khoang_vao > limit_muon:
+        if khoang_vao > profile.limit_muon:
             thoigiandimuon = khoang_vao
         elif khoang_vao < 0:
             thoigiandisom = abs(khoang_vao)
 
-        khoang_ra = diff_minutes(tg_ra, khung_gio.get("thoigianketthuc"))
+        khoang_ra = _diff(out_min, end_min)
         if khoang_ra > 0:
-            khoang_ra -= tinh_phut_nghi_trua_trong_khoang(out_min, end_min, ds_nghi_trua)
-        if khoang_ra > limit_som:
+            khoang_ra -= profile.phut_nghi(out_min, end_min)
+        if khoang_ra > profile.limit_som:
             thoigianvesom = khoang_ra
         elif khoang_ra < 0:
             thoigianvemuon = abs(khoang_ra)
 
-        tg_lam_viec = tg_lam_viec_chuan_ca - thoigiandimuon - thoigianvesom
+        tg_lam_viec = profile.tg_lam_viec_chuan - thoigiandimuon - thoigianvesom
 
     elif loai_calamviec == "LINH_DONG":
         # Kiểm tra biên độ linh động
-        phut_muon_cho_phep = khung_gio.get("sophutdenmuon", 0)
-        phut_som_cho_phep = khung_gio.get("sophutdensom", 0)
+        phut_muon_cho_phep = profile.phut_muon_linh_dong
+        phut_som_cho_phep = profile.phut_som_linh_dong
         is_hop_le = (0 < khoang_vao <= phut_muon_cho_phep) or (khoang_vao < 0 and abs(khoang_vao) <= phut_som_cho_phep)
 
         if is_hop_le:
-            # Dời giờ kết thúc tương ứng
-            khung_gio['thoigianketthuc'] = parse_minutes_to_time(
-                parse_time_to_minutes(khung_gio.get("thoigianketthuc")) + khoang_vao
-            )
+            # Dời giờ kết thúc tương ứng (ngoài khoảng 00:00-23:59 → không xác định)
+            if end_min is not None:
+                end_min += khoang_vao
+                if not 0 <= end_min < 1440:
+                    end_min = None
         else:
             if khoang_vao > phut_muon_cho_phep:
                 thoigiandimuon = khoang_vao
             elif khoang_vao < 0:
                 thoigiandisom = abs(khoang_vao)
 
-        khoang_ra = diff_minutes(tg_ra, khung_gio.get("thoigianketthuc"))
+        khoang_ra = _diff(out_min, end_min)
         if khoang_ra > 0:
-            end_min_hien_tai = parse_time_to_minutes(khung_gio.get("thoigianketthuc"))
-            khoang_ra -= tinh_phut_nghi_trua_trong_khoang(out_min, end_min_hien_tai, ds_nghi_trua)
+            khoang_ra -= profile.phut_nghi(out_min, end_min)
         if khoang_ra > 0:
             thoigianvesom = khoang_ra
         elif khoang_ra < 0:
             thoigianvemuon = abs(khoang_ra)
 
-        tg_lam_viec = tg_lam_viec_chuan_ca - thoigiandimuon - thoigianvesom
+        tg_lam_viec = profile.tg_lam_viec_chuan - thoigiandimuon - thoigianvesom
 
     elif loai_calamviec == "TU_DO":
         if khoang_vao < 0:
             thoigiandisom = abs(khoang_vao)
-        khoang_ra = diff_minutes(tg_ra, khung_gio.get("thoigianketthuc"))
+        khoang_ra = _diff(out_min, end_min)
         if khoang_ra < 0:
             thoigianvemuon = abs(khoang_ra)
         tg_lam_viec = tg_lam_viec_thuc
@@ -387,7 +523,7 @@ def calculate_bang_cham_cong_objects(data_list):
         ten_cv_list = [s.get('tencongviec', '') for s in items if s.get('tencongviec')]
         combined_ten_cv = ", ".join(dict.fromkeys(ten_cv_list))
 
-        khung_gio = item.get("khunggiolamviec", {}).copy()
+        khung_gio = item.get("khunggiolamviec", {})
         tg_vao = item.get("thoigianchamcongvao")
         tg_ra = item.get("thoigianchamcongra")
         loai_calamviec = item.get("loaicalamviec", "CO_DINH")
@@ -406,25 +542,19 @@ def calculate_bang_cham_cong_objects(data_list):
                 tg_ra = khung_gio.get("thoigianketthuc")
                 item['thoigianchamcongra'] = tg_ra
 
+            # Profile khung giờ của ca đã quy đổi sẵn sang phút → phần còn lại chỉ là số học nguyên
+            profile = get_shift_profile(item.get('calamviec_id'), khung_gio, item.get('khunggionghitrua'))
             in_min = parse_time_to_minutes(tg_vao)
             out_min = parse_time_to_minutes(tg_ra)
-            start_min = parse_time_to_minutes(khung_gio.get("thoigianbatdau"))
-            end_min = parse_time_to_minutes(khung_gio.get("thoigianketthuc"))
-            ds_nghi_trua = item.get('khunggionghitrua', [])
 
-            # Tính thời gian làm việc thực tế và chuẩn
-            tg_lam_viec_thuc = calculate_work_minutes_with_overnight(in_min, out_min, start_min, end_min)
-            tg_lam_viec_chuan_ca = calculate_work_minutes_with_overnight(start_min, end_min, start_min, end_min)
-
-            # Trừ nghỉ trưa
-            tg_lam_viec_thuc -= tinh_phut_nghi_trua_trong_khoang(in_min, out_min, ds_nghi_trua)
-            tg_lam_viec_chuan_ca -= tinh_phut_nghi_trua_trong_khoang(start_min, end_min, ds_nghi_trua)
+            # Tính thời gian làm việc thực tế (trừ nghỉ trưa); giờ chuẩn của ca đã có trong profile
+            tg_lam_viec_thuc = calculate_work_minutes_with_overnight(in_min, out_min, profile.start_min, profile.end_min)
+            tg_lam_viec_thuc -= profile.phut_nghi(in_min, out_min)
+            tg_lam_viec_chuan_ca = profile.tg_lam_viec_chuan
 
             # Tính sai lệch giờ theo loại ca
             thoigiandimuon, thoigianvesom, thoigiandisom, thoigianvemuon, tg_lam_viec = _tinh_time_deviation(
-                khung_gio, tg_vao, tg_ra, loai_calamviec, item,
-                in_min, out_min, start_min, end_min,
-                tg_lam_viec_thuc, tg_lam_viec_chuan_ca, ds_nghi_trua
+                profile, loai_calamviec, in_min, out_min, tg_lam_viec_thuc
             )
 
             # OT: chỉ tính khi có cấu hình và có về muộn
@@ -432,18 +562,18 @@ def calculate_bang_cham_cong_objects(data_list):
                 tg_lam_them = item.get("sophutot", 0)
 
             # Vi phạm ngưỡng nặng → 0 công
-            limit_vesom_0 = khung_gio.get("thoigianvesomkhongtinhchamcong", 0)
-            limit_dimuon_0 = khung_gio.get("thoigiandimuonkhongtinhchamcong", 0)
+            limit_vesom_0 = profile.limit_vesom_0
+            limit_dimuon_0 = profile.limit_dimuon_0
             if (limit_vesom_0 > 0 and thoigianvesom > limit_vesom_0) or \
                (limit_dimuon_0 > 0 and thoigiandimuon > limit_dimuon_0):
                 tg_lam_viec = 0
 
             # Không đạt ngưỡng phút tối thiểu → 0 công
-            if tg_lam_viec < khung_gio.get("thoigianlamviectoithieu", 0):
+            if tg_lam_viec < profile.tg_toi_thieu:
                 tg_lam_viec = 0
 
             # Quy đổi phút → số công
-            so_cong_chuan = khung_gio.get("congcuakhunggio", 0) or 0
+            so_cong_chuan = profile.cong_chuan
             if tg_lam_viec_chuan_ca > 0 and so_cong_chuan > 0:
                 so_cong_thuc_te = min(round((tg_lam_viec / tg_lam_viec_chuan_ca) * so_cong_chuan, 2), so_cong_chuan)
 
@@ -546,33 +676,35 @@ def _get_department_map(nhanvien_ids):
     return {p['nhanvien_id']: p['phongban_id'] for p in qs}
 
 
-def _get_calamviec_meta(calamviec_ids, include_khung_gio=False):
-    """Lấy metadata ca làm (nghỉ trưa + khung giờ nếu cần)"""
-    if not calamviec_ids:
-        return {}
-
-    annotations = {
-        'json_nghitrua': JSONBAgg(
+def _load_calamviec_meta(calamviec_ids):
+    """Loader cho cache snapshot ca: nghỉ trưa + khung giờ của nhiều ca trong 1 query."""
+    qs = Calamviec.objects.filter(id__in=calamviec_ids).values('id', 'updated_at', 'created_at').annotate(
+        json_nghitrua=JSONBAgg(
             Func(
                 Value('giobatdau'), Cast('khunggionghitrua__giobatdau', CharField()),
                 Value('gioketthuc'), Cast('khunggionghitrua__gioketthuc', CharField()),
                 function='jsonb_build_object'
             )
-        )
-    }
-    if include_khung_gio:
-        annotations['list_khung_gio_json'] = _build_khung_gio_jsonb_agg('khunggiolamviec__')
-
-    qs = Calamviec.objects.filter(id__in=calamviec_ids).values('id').annotate(**annotations)
+        ),
+        list_khung_gio_json=_build_khung_gio_jsonb_agg('khunggiolamviec__'),
+    )
     return {
-        c['id']: {
-            'khunggionghitrua': c.get('json_nghitrua') or [],
-            'list_khung_gio': c.get('list_khung_gio_json') or []
-        }
+        c['id']: (
+            shift_version(c['updated_at'], c['created_at']),
+            {
+                'khunggionghitrua': c.get('json_nghitrua') or [],
+                'list_khung_gio': c.get('list_khung_gio_json') or []
+            }
+        )
         for c in qs
     }
 
 
+def _get_calamviec_meta(calamviec_ids):
+    """Lấy metadata ca làm (nghỉ trưa + khung giờ), đọc qua cache snapshot ca"""
+    return get_shift_snapshots(KIND_CHAM_CONG, calamviec_ids, _load_calamviec_meta)
+
+
 def _build_merged_khung_gio(item, list_khung_gio):
     """Gộp nhiều khung giờ → 1 khung khi ca chỉ chấm công 1 lần."""
     if not list_khung_gio:
@@ -663,12 +795,14 @@ def _build_snapshot_from_item(item):
     }
 
 
-def build_cham_cong_data_for_update(ngay_lam_viec, calamviec_id=None):
-    """Lấy dữ liệu chấm công đã lưu cho mode update."""
+def build_cham_cong_data_for_update(ngay_lam_viec, calamviec_id=None, nhanvien_ids=None):
+    """Lấy dữ liệu chấm công đã lưu cho mode update (nhanvien_ids: chỉ nạp các nhân viên này)."""
     # Query chấm công + join metadata nhân viên/ca
     qs = Bangchamcong.objects.filter(ngaylamviec=ngay_lam_viec)
     if calamviec_id:
         qs = qs.filter(calamviec_id=calamviec_id)
+    if nhanvien_ids is not None:
+        qs = qs.filter(nhanvien_id__in=nhanvien_ids)
     qs = qs.annotate(
         hovaten=F('nhanvien__hovaten'), manhanvien=F('nhanvien__manhanvien'),
         loainv=F('nhanvien__loainv__id'), phuongthuctinhluong=F('nhanvien__loainv__phuongthuctinhluong'),
@@ -695,7 +829,7 @@ def build_cham_cong_data_for_update(ngay_lam_viec, calamviec_id=None):
     nv_ids = list({item['nhanvien_id'] for item in ds})
     ca_ids = {item['calamviec_id'] for item in ds if item.get('calamviec_id')}
     map_pb = _get_department_map(nv_ids)
-    map_ca = _get_calamviec_meta(ca_ids, include_khung_gio=True)
+    map_ca = _get_calamviec_meta(ca_ids)
 
     # Xử lý từng bản ghi
     row_idx_by_emp = defaultdict(int)
@@ -729,7 +863,7 @@ def build_cham_cong_data_for_update(ngay_lam_viec, calamviec_id=None):
         else:
             shift_meta = map_ca.get(item.get('calamviec_id'), {})
             list_kg = shift_meta.get('list_khung_gio', [])
-            item['khunggionghitrua'] = shift_meta.get('khunggionghitrua', [])
+            item['khunggionghitrua'] = list(shift_meta.get('khunggionghitrua', []))  # copy: không sửa dữ liệu trong cache
 
             item['khunggiolamviec'] = _resolve_khung_gio_lam_viec(item, list_kg, idx)
             if item['khunggiolamviec'] is None:
@@ -826,12 +960,12 @@ def build_cham_cong_data_by_status(ngay_lam_viec, da_cham_cong=False, mode='crea
     nv_ids = [item['nhanvien_id'] for item in ds]
     ca_ids = {item['calamviec_id'] for item in ds}
     map_pb = _get_department_map(nv_ids)
-    map_ca = _get_calamviec_meta(ca_ids, include_khung_gio=False)
+    map_ca = _get_calamviec_meta(ca_ids)
 
     result = []
     for item in ds:
         item['phongban_id'] = map_pb.get(item['nhanvien_id'])
-        item['khunggionghitrua'] = map_ca.get(item['calamviec_id'], {}).get('khunggionghitrua', [])
+        item['khunggionghitrua'] = list(map_ca.get(item['calamviec_id'], {}).get('khunggionghitrua', []))
 
         list_kg = item.pop('list_khung_gio_json', [])
         if not list_kg:
@@ -943,7 +1077,7 @@ def api_bang_cham_cong_list(request):
 
             # Thu thập team job keys & ngày trước khi xóa
             records_to_delete = list(Bangchamcong.objects.filter(id__in=ids).values(
-                'id', 'calamviec_id', 'ngaylamviec', 'thamsotinhluong'
+                'id', 'nhanvien_id', 'calamviec_id', 'ngaylamviec', 'thamsotinhluong'
             ))
             team_job_keys = _collect_team_job_keys_from_db(records_to_delete)
             ngay_set = {rec['ngaylamviec'] for rec in records_to_delete} if team_job_keys else set()
@@ -951,8 +1085,13 @@ def api_bang_cham_cong_list(request):
             deleted_count, _ = Bangchamcong.objects.filter(id__in=ids).delete()
 
             # Tính lại cho các nhân viên còn lại cùng team job
-            if team_job_keys:
-                _recalculate_team_members(team_job_keys, ngay_set)
+            recalculated_objs = _recalculate_team_members(team_job_keys, ngay_set) if team_job_keys else []
+
+            # Cập nhật bảng tổng hợp tháng cho các nhân viên/tháng bị ảnh hưởng
+            TongHopChamCongService.refresh(
+                [(rec['nhanvien_id'], rec['ngaylamviec']) for rec in records_to_delete]
+                + [(o.nhanvien_id, o.ngaylamviec) for o in recalculated_objs]
+            )
 
             return JsonResponse({'success': True, 'message': f'Đã xóa {deleted_count} bản ghi', 'deleted_count': deleted_count}, status=200)
 
@@ -970,8 +1109,11 @@ def api_bang_cham_cong_list(request):
         # Lấy team job keys từ DB cũ (để xử lý case xóa/sửa team job trong PUT)
         update_ids = [item.get('id') for item in data_list if item.get('id') is not None]
         old_team_job_keys = set()
+        old_records = []
         if update_ids:
-            old_records = Bangchamcong.objects.filter(id__in=update_ids).values('calamviec_id', 'thamsotinhluong')
+            old_records = list(Bangchamcong.objects.filter(id__in=update_ids).values(
+                'nhanvien_id', 'ngaylamviec', 'calamviec_id', 'thamsotinhluong'
+            ))
             old_team_job_keys = _collect_team_job_keys_from_db(old_records)
 
         # Expand payload với team members (chung cho cả POST & PUT)
@@ -984,22 +1126,13 @@ def api_bang_cham_cong_list(request):
         if create_objs:
             Bangchamcong.objects.bulk_create(create_objs)
         if update_objs:
-            now = timezone.now()
-            existing_snapshots = {
-                obj.id: obj.snapshot_khunggio
-                for obj in Bangchamcong.objects.filter(
-                    id__in=[o.id for o in update_objs]
-                ).only('id', 'snapshot_khunggio')
-            }
-            for o in update_objs:
-                o.updated_at = now
-                if o.id in existing_snapshots and existing_snapshots[o.id]:
-                    val = existing_snapshots[o.id]
-                    if isinstance(val, (dict, list)):
-                        o.snapshot_khunggio = dumps(val)
-                    else:
-                        o.snapshot_khunggio = val
-                o.save(update_fields=_BANGCHAMCONG_UPDATE_FIELDS)
+            _bulk_update_bang_cham_cong(update_objs)
+
+        # Cập nhật bảng tổng hợp tháng (gồm cả nhân viên/ngày cũ của bản ghi được sửa)
+        TongHopChamCongService.refresh(
+            [(rec['nhanvien_id'], rec['ngaylamviec']) for rec in old_records]
+            + [(o.nhanvien_id, o.ngaylamviec) for o in objs]
+        )
 
         is_create = request.method == 'POST'
         return JsonResponse({
@@ -1039,48 +1172,118 @@ def api_bang_cham_cong_nhan_vien_list(request):
     return JsonResponse({'success': True, 'data': data, 'ds_calamviec': ds_ca, 'selected_calamviec_id': ca_id}, status=200)
 
 
-@login_required
-@require_api_permission('access_control.view_cham_cong')
-@require_http_methods(["GET"])
-def api_tong_hop_cham_cong_thang(request):
-    """API Tổng hợp chấm công tháng"""
+# Số nhân viên mỗi trang của bảng tổng hợp tháng
+TONG_HOP_THANG_PAGE_SIZE = 20
+TONG_HOP_THANG_MAX_PAGE_SIZE = 500
+# Số nhân viên mỗi lô khi xuất Excel bảng tổng hợp tháng
+TONG_HOP_THANG_EXPORT_CHUNK = 500
+
+# Các cột Bảng chấm công thực sự hiển thị trong log từng ngày của bảng tổng hợp tháng
+_TONG_HOP_THANG_LOG_FIELDS = (
+    'nhanvien_id', 'ngaylamviec', 'thoigianlamviec', 'thoigianvemuon', 'thoigiandisom',
+    'thoigianchamcongvao', 'thoigianchamcongra', 'thoigiandimuon', 'thoigianvesom',
+    'conglamviec', 'codilam', 'tencongviec', 'ghichu',
+)
+
+
+def _tong_hop_thang_totals(nhanvien_ids, ngay_bat_dau, ngay_ket_thuc):
+    """
+    Tổng giờ / công theo nhân viên trong [ngay_bat_dau, ngay_ket_thuc).
+    ✅ TỐI ƯU: Tháng tròn đọc bảng tổng hợp Tonghopchamcong (TongHopChamCongService.get_period_totals),
+    khoảng lẻ mới GROUP BY trực tiếp Bảng chấm công.
+    Giờ làm = tổng phút làm việc (gồm đi sớm, về muộn) / 60, làm tròn 1 chữ số.
+    """
+    totals = TongHopChamCongService.get_period_totals(
+        nhanvien_ids, ngay_bat_dau, ngay_ket_thuc - dt.timedelta(days=1)
+    )
+    return {
+        nv_id: (round(float(row['tongphutlamviec'] or 0) / 60, 1), row['tongconglamviec'] or 0)
+        for nv_id, row in totals.items()
+    }
+
+
+def _tong_hop_thang_query(params):
+    """
+    Dựng truy vấn dùng chung cho bảng tổng hợp tháng (xem trên web + xuất Excel).
+    params: request.GET hoặc dict bộ lọc (thang, phongban_id, search, loai_chamcong)
+    Returns: (ngày đầu tháng, ngày đầu tháng sau, queryset chấm công tháng, queryset nhân viên đã sắp xếp)
+    Raises: ValueError (message hiển thị cho người dùng) nếu tháng / phòng ban không hợp lệ
+    """
+    phongban_id = params.get('phongban_id')
+    # ✅ TỐI ƯU: Lọc cây con phòng ban ngay trong câu SQL (WITH RECURSIVE), không bung list ID
     try:
-        phongban_id = request.GET.get('phongban_id')
-        pb_ids = get_all_child_department_ids(phongban_id, isnclude_root=True) if phongban_id else None
-        search = request.GET.get('search')
-        loai_cc = request.GET.get('loai_chamcong', "all")
-        thoi_gian = dt.datetime.strptime(request.GET.get('thang', dt.datetime.now().strftime("%Y-%m")), "%Y-%m")
+        pb_filter = department_subtree_q('phongban_id', [phongban_id]) if phongban_id else None
     except ValueError:
-        return JsonResponse({'success': False, 'message': 'Thời gian không hợp lệ'})
+        raise ValueError('Phòng ban không hợp lệ')
+    search = params.get('search')
+    loai_cc = params.get('loai_chamcong', "all")
+    try:
+        thoi_gian = dt.datetime.strptime(params.get('thang', dt.datetime.now().strftime("%Y-%m")), "%Y-%m")
+    except (TypeError, ValueError):
+        raise ValueError('Thời gian không hợp lệ')
+
+    ngay_bat_dau = thoi_gian.date().replace(day=1)
+    ngay_ket_thuc = TongHopChamCongService.next_month_start(ngay_bat_dau)
+    cc_thang = Bangchamcong.objects.filter(ngaylamviec__gte=ngay_bat_dau, ngaylamviec__lt=ngay_ket_thuc)
 
     # Query nhân viên active
     qs_nv = Lichsucongtac.objects.filter(trangthai='active')
-    if pb_ids is not None:
-        qs_nv = qs_nv.filter(phongban_id__in=pb_ids)
+    if pb_filter is not None:
+        qs_nv = qs_nv.filter(pb_filter)
     if search:
         qs_nv = qs_nv.filter(Q(nhanvien__hovaten__icontains=search) | Q(nhanvien__manhanvien__icontains=search))
 
-    ds_nv = list(qs_nv.annotate(
-        ten_nv=F('nhanvien__hovaten'), ma_nv=F('nhanvien__manhanvien'), ten_cv=F("chucvu__tenvitricongviec")
-    ).values('nhanvien_id', 'ten_nv', 'ma_nv', 'phongban_id', 'ten_cv').order_by('nhanvien_id'))
+    # Loại chấm công = loại của bản ghi chấm công ghi sau cùng trong tháng (lọc ngay trong SQL để phân trang đúng)
+    qs_nv = qs_nv.annotate(
+        ten_nv=F('nhanvien__hovaten'), ma_nv=F('nhanvien__manhanvien'), ten_cv=F("chucvu__tenvitricongviec"),
+        loai_chamcong=Coalesce(
+            Subquery(
+                cc_thang.filter(nhanvien_id=OuterRef('nhanvien_id'))
+                .order_by('-created_at').values('loaichamcong')[:1]
+            ),
+            Value(''),
+            output_field=CharField(),
+        ),
+    )
+    if loai_cc != 'all':
+        qs_nv = qs_nv.filter(loai_chamcong=loai_cc)
 
-    # Query chấm công tháng
-    ds_cc = Bangchamcong.objects.filter(
-        ngaylamviec__year=thoi_gian.year, ngaylamviec__month=thoi_gian.month
-    ).values().order_by('created_at')
+    qs_nv = qs_nv.values('nhanvien_id', 'ten_nv', 'ma_nv', 'phongban_id', 'ten_cv', 'loai_chamcong').order_by('nhanvien_id')
+    return ngay_bat_dau, ngay_ket_thuc, cc_thang, qs_nv
 
-    # Gom nhóm theo nhân viên
-    map_cc = defaultdict(lambda: {'tong_gio': 0, 'tong_cong': 0, 'logs': defaultdict(list), 'loai_chamcong': ''})
-    for cc in ds_cc:
-        nv_id = cc['nhanvien_id']
-        tg_lam = round(float((cc['thoigianlamviec'] + (cc['thoigianvemuon'] or 0) + (cc['thoigiandisom'] or 0)) / 60 or 0), 1)
-        ngay_str = f"{cc['ngaylamviec'].day:02d}"
 
-        map_cc[nv_id]['tong_gio'] += tg_lam
-        map_cc[nv_id]['tong_cong'] += cc['conglamviec'] or 0
+@login_required
+@require_api_permission('access_control.view_cham_cong')
+@require_http_methods(["GET"])
+def api_tong_hop_cham_cong_thang(request):
+    """
+    API Tổng hợp chấm công tháng
+    ✅ TỐI ƯU: Phân trang theo nhân viên; chỉ đọc Bảng chấm công của nhân viên trong trang,
+    chỉ lấy các cột hiển thị, tổng giờ/công đọc từ bảng tổng hợp tháng.
+    """
+    try:
+        ngay_bat_dau, ngay_ket_thuc, cc_thang, qs_nv = _tong_hop_thang_query(request.GET)
+    except ValueError as exc:
+        return JsonResponse({'success': False, 'message': str(exc)}, status=400)
+
+    try:
+        page_size = int(request.GET.get('page_size', TONG_HOP_THANG_PAGE_SIZE))
+    except (TypeError, ValueError):
+        page_size = TONG_HOP_THANG_PAGE_SIZE
+    page_size = min(max(page_size, 1), TONG_HOP_THANG_MAX_PAGE_SIZE)
+
+    paginator = Paginator(qs_nv, page_size)
+    page_obj = paginator.get_page(request.GET.get('page', 1))
+    ds_nv = list(page_obj.object_list)
+    page_nv_ids = {nv['nhanvien_id'] for nv in ds_nv}
 
+    # Chấm công tháng: chỉ nhân viên của trang, chỉ các cột hiển thị
+    map_logs = defaultdict(lambda: defaultdict(list))
+    ds_cc = cc_thang.filter(nhanvien_id__in=page_nv_ids).values(*_TONG_HOP_THANG_LOG_FIELDS).order_by('created_at')
+    for cc in ds_cc:
+        tg_lam = round(float(((cc['thoigianlamviec'] or 0) + (cc['thoigianvemuon'] or 0) + (cc['thoigiandisom'] or 0)) / 60), 1)
         tg_vao, tg_ra = cc['thoigianchamcongvao'], cc['thoigianchamcongra']
-        map_cc[nv_id]['logs'][ngay_str].append({
+        map_logs[cc['nhanvien_id']][f"{cc['ngaylamviec'].day:02d}"].append({
             'tg_vao': tg_vao.strftime("%H:%M") if tg_vao else '',
             'tg_ra': tg_ra.strftime("%H:%M") if tg_ra else '',
             'tg_lamviec': tg_lam,
@@ -1093,21 +1296,102 @@ def api_tong_hop_cham_cong_thang(request):
             'tencalamviec': cc['tencongviec'],
             'ghichu': cc['ghichu'],
         })
-        map_cc[nv_id]['loai_chamcong'] = cc.get('loaichamcong', None)
+
+    totals = _tong_hop_thang_totals(page_nv_ids, ngay_bat_dau, ngay_ket_thuc) if page_nv_ids else {}
 
     # Merge kết quả
-    result = []
     for nv in ds_nv:
-        data = map_cc.get(nv['nhanvien_id'])
-        if data:
-            nv.update({'logs': data['logs'], 'tongthoigianlamviec': data['tong_gio'],
-                       'tongconglamviec': data['tong_cong'], 'loai_chamcong': data['loai_chamcong']})
-        else:
-            nv.update({'logs': {}, 'tongthoigianlamviec': 0, 'tongconglamviec': 0, 'loai_chamcong': ''})
-        if loai_cc == 'all' or loai_cc == nv['loai_chamcong']:
-            result.append(nv)
+        tong_gio, tong_cong = totals.get(nv['nhanvien_id'], (0, 0))
+        nv.update({
+            'logs': map_logs.get(nv['nhanvien_id'], {}),
+            'tongthoigianlamviec': tong_gio,
+            'tongconglamviec': tong_cong,
+        })
+
+    return JsonResponse({
+        'success': True,
+        'data': ds_nv,
+        'total': paginator.count,
+        'pagination': {
+            'page': page_obj.number,
+            'page_size': page_size,
+            'total': paginator.count,
+            'total_pages': paginator.num_pages,
+            'has_next': page_obj.has_next(),
+            'has_prev': page_obj.has_previous(),
+        },
+    }, status=200)
+
+
+def _tong_hop_thang_export_rows(qs_nv, cc_thang, ngay_bat_dau, ngay_ket_thuc):
+    """
+    Sinh từng dòng Excel của bảng tổng hợp tháng: đọc nhân viên theo lô, mỗi lô 2 query
+    (công theo ngày + tổng giờ/công) → bộ nhớ không tăng theo số nhân viên.
+    """
+    so_ngay = (ngay_ket_thuc - ngay_bat_dau).days
+    ds_nv = qs_nv.iterator(chunk_size=TONG_HOP_THANG_EXPORT_CHUNK)
+    while True:
+        batch = list(islice(ds_nv, TONG_HOP_THANG_EXPORT_CHUNK))
+        if not batch:
+            return
+        batch_ids = {nv['nhanvien_id'] for nv in batch}
+
+        cong_theo_ngay = defaultdict(dict)
+        rows = (
+            cc_thang.filter(nhanvien_id__in=batch_ids)
+            .values('nhanvien_id', 'ngaylamviec')
+            .annotate(cong=Sum(Coalesce('conglamviec', 0.0, output_field=FloatField())))
+            .order_by()
+        )
+        for row in rows:
+            cong_theo_ngay[row['nhanvien_id']][row['ngaylamviec'].day] = row['cong']
+        totals = _tong_hop_thang_totals(batch_ids, ngay_bat_dau, ngay_ket_thuc)
+
+        for nv in batch:
+            cong_nv = cong_theo_ngay.get(nv['nhanvien_id'], {})
+            tong_gio, tong_cong = totals.get(nv['nhanvien_id'], (0, 0))
+            yield (
+                [nv['ma_nv'], nv['ten_nv'], nv['ten_cv'], nv['loai_chamcong']]
+                + [cong_nv.get(ngay) for ngay in range(1, so_ngay + 1)]
+                + [tong_gio, tong_cong]
+            )
 
-    return JsonResponse({'success': True, 'data': result, 'total': len(result)}, status=200)
+
+def export_tong_hop_cham_cong_thang(params):
+    """
+    Producer xuất Excel bảng tổng hợp chấm công tháng (dùng cho API export đồng bộ và job xuất nền).
+    Raises: ValueError nếu tháng / phòng ban không hợp lệ
+    """
+    ngay_bat_dau, ngay_ket_thuc, cc_thang, qs_nv = _tong_hop_thang_query(params)
+
+    so_ngay = (ngay_ket_thuc - ngay_bat_dau).days
+    headers = (
+        ['Mã NV', 'Họ và tên', 'Chức vụ', 'Loại chấm công']
+        + [f"{ngay:02d}" for ngay in range(1, so_ngay + 1)]
+        + ['Tổng giờ', 'Tổng công']
+    )
+    sheet = XlsxSheet(
+        f"Tháng {ngay_bat_dau.strftime('%m-%Y')}",
+        headers,
+        _tong_hop_thang_export_rows(qs_nv, cc_thang, ngay_bat_dau, ngay_ket_thuc),
+        bold_columns=(-2, -1),
+    )
+    return [sheet], f"TongHopChamCong_{ngay_bat_dau.strftime('%Y%m')}.xlsx"
+
+
+@login_required
+@require_api_permission('access_control.view_cham_cong')
+@require_http_methods(["GET"])
+def api_tong_hop_cham_cong_thang_export(request):
+    """
+    Xuất Excel bảng tổng hợp chấm công tháng (toàn bộ nhân viên theo bộ lọc, không phân trang).
+    ✅ TỐI ƯU: Ghi streaming qua bộ xuất dùng chung, nhân viên đọc theo lô.
+    """
+    try:
+        sheets, filename = export_tong_hop_cham_cong_thang(request.GET)
+    except ValueError as exc:
+        return JsonResponse({'success': False, 'message': str(exc)}, status=400)
+    return xlsx_streaming_response(sheets, filename)
 
 
 @login_required
@@ -1121,7 +1405,10 @@ def api_tong_hop_cham_cong_cong_viec(request):
         return JsonResponse({'success': False, 'message': 'Ngày không hợp lệ'}, status=400)
 
     phongban_id = request.GET.get('phongban_id')
-    pb_ids = get_all_child_department_ids(phongban_id, isnclude_root=True) if phongban_id else None
+    try:
+        pb_filter = department_subtree_q('phongban_id', [phongban_id]) if phongban_id else None
+    except ValueError:
+        return JsonResponse({'success': False, 'message': 'Phòng ban không hợp lệ'}, status=400)
     search = request.GET.get('search')
     loai_cc = request.GET.get('loai_chamcong', 'all')
 
@@ -1136,8 +1423,8 @@ def api_tong_hop_cham_cong_cong_viec(request):
 
     # Filter nhân viên theo phòng ban + search
     qs_nv = Lichsucongtac.objects.filter(trangthai='active')
-    if pb_ids is not None:
-        qs_nv = qs_nv.filter(phongban_id__in=pb_ids)
+    if pb_filter is not None:
+        qs_nv = qs_nv.filter(pb_filter)
     if search:
         qs_nv = qs_nv.filter(Q(nhanvien__hovaten__icontains=search) | Q(nhanvien__manhanvien__icontains=search))
 
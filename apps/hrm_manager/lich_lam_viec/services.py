@@ -6,15 +6,22 @@ from django.db.models import Q
 from calendar import monthrange
 from datetime import date, timedelta, datetime
 from collections import OrderedDict, defaultdict
+from itertools import islice
 import logging
 import json
 from django.utils import timezone
-from django.db import transaction
+from django.db import connection, transaction
 from django.core.exceptions import ValidationError
-from django.db.models import Prefetch
+from django.db.models import Max, Prefetch
 from apps.hrm_manager.__core__.models import *
 from .validators import validate_shift_details, validate_schedule_time_overlap
-from apps.hrm_manager.to_chuc_nhan_su.views import get_all_child_department_ids
+from apps.hrm_manager.utils.assignment_resolver import (
+    KIND_LICH_LAM_VIEC, get_assignment_resolver, invalidate_assignments,
+)
+from apps.hrm_manager.utils.department_tree import get_department_tree
+from apps.hrm_manager.utils.shift_snapshot_cache import (
+    KIND_LICH, get_shift_snapshots, invalidate_shift_snapshot, shift_version,
+)
 
 
 logger = logging.getLogger(__name__)
@@ -26,6 +33,229 @@ class ConflictException(Exception):
         super().__init__(f"Có {emp_count} nhân viên đang thuộc lịch làm việc khác")
         self.conflicts = conflicts
 
+# Các cột ghi khi sinh lịch thực tế (thứ tự = thứ tự giá trị trong từng dòng COPY)
+_LLVTT_COPY_FIELDS = (
+    'created_at', 'ngaylamviec', 'nhanvien', 'calamviec', 'cophaingaynghi',
+    'chophepghide', 'lichlamviec', 'nguongoc', 'snapshot_ca',
+)
+_LLVTT_COPY_CHUNK_ROWS = 5000
+
+
+class _CopyStream:
+    """File-like đọc dần dữ liệu CSV cho COPY FROM STDIN (sinh từng lô, không dựng toàn bộ trong bộ nhớ)."""
+
+    def __init__(self, lines):
+        self._lines = lines
+        self._buffer = b''
+
+    def read(self, size=-1):
+        while size < 0 or len(self._buffer) < size:
+            chunk = ''.join(islice(self._lines, _LLVTT_COPY_CHUNK_ROWS))
+            if not chunk:
+                break
+            self._buffer += chunk.encode('utf-8')
+        if size < 0:
+            size = len(self._buffer)
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+
+def _csv_value(value):
+    if value is None:
+        return ''
+    if value is True:
+        return 't'
+    if value is False:
+        return 'f'
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    value = str(value)
+    if not value or any(c in value for c in ',"\n\r'):
+        return '"' + value.replace('"', '""') + '"'
+    return value
+
+
+def bulk_insert_lich_lam_viec_thuc_te(lich_id, nguongoc, rows, created_at=None):
+    """
+    Ghi hàng loạt Lịch làm việc thực tế, không dựng model instance.
+    rows: iterable (nhanvien_id, ngaylamviec, calamviec_id, snapshot_ca); calamviec_id None → ngày nghỉ.
+    PostgreSQL: stream thẳng vào bảng bằng COPY ... FROM STDIN (CSV); DB khác: bulk_create theo lô.
+    Trả về số dòng đã ghi.
+    """
+    created_at = created_at or timezone.now()
+    records = (
+        (created_at, ngay, nv_id, ca_id, ca_id is None, False, lich_id, nguongoc, snapshot if ca_id else None)
+        for nv_id, ngay, ca_id, snapshot in rows
+    )
+
+    if connection.vendor != 'postgresql':
+        count = 0
+        while True:
+            batch = [
+                Lichlamviecthucte(**{
+                    (f"{name}_id" if name in ('nhanvien', 'calamviec', 'lichlamviec') else name): value
+                    for name, value in zip(_LLVTT_COPY_FIELDS, record)
+                })
+                for record in islice(records, _LLVTT_COPY_CHUNK_ROWS)
+            ]
+            if not batch:
+                return count
+            Lichlamviecthucte.objects.bulk_create(batch)
+            count += len(batch)
+
+    count = 0
+
+    def lines():
+        nonlocal count
+        for record in records:
+            count += 1
+            yield ','.join(_csv_value(v) for v in record) + '\n'
+
+    opts = Lichlamviecthucte._meta
+    columns = ', '.join(connection.ops.quote_name(opts.get_field(name).column) for name in _LLVTT_COPY_FIELDS)
+    sql = f"COPY {opts.db_table} ({columns}) FROM STDIN WITH (FORMAT csv)"
+    with connection.cursor() as cursor:
+        cursor.copy_expert(sql, _CopyStream(lines()))
+    return count
+
+
+def delete_lich_lam_viec_thuc_te_pairs(lich_id, pairs):
+    """
+    Xóa Lịch làm việc thực tế (không cho phép ghi đè) của 1 lịch theo danh sách cặp (nhanvien_id, ngày).
+    PostgreSQL: 1 câu DELETE ... USING unnest(bigint[], date[]); DB khác: 1 DELETE / nhân viên.
+    Trả về số dòng đã xóa.
+    """
+    if not pairs:
+        return 0
+
+    if connection.vendor != 'postgresql':
+        dates_by_emp = defaultdict(list)
+        for nv_id, ngay in pairs:
+            dates_by_emp[nv_id].append(ngay)
+        deleted = 0
+        for nv_id, dates in dates_by_emp.items():
+            deleted += Lichlamviecthucte.objects.filter(
+                lichlamviec_id=lich_id,
+                nhanvien_id=nv_id,
+                ngaylamviec__in=dates,
+                chophepghide=False
+            ).delete()[0]
+        return deleted
+
+    opts = Lichlamviecthucte._meta
+    qn = connection.ops.quote_name
+    col = lambda name: qn(opts.get_field(name).column)
+    sql = f"""
+        DELETE FROM {opts.db_table} t
+        USING unnest(%s::bigint[], %s::date[]) AS p(nhanvien_id, ngay)
+        WHERE t.{col('lichlamviec')} = %s
+          AND t.{col('nhanvien')} = p.nhanvien_id
+          AND t.{col('ngaylamviec')} = p.ngay
+          AND t.{col('chophepghide')} = false
+    """
+    nv_ids, dates = zip(*pairs)
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [list(nv_ids), list(dates), lich_id])
+        return cursor.rowcount
+
+
+def expand_fixed_schedule_in_db(lich_id, nhanvien_ids, start_date, end_date, snapshot_map, created_at=None):
+    """
+    Sinh Lịch làm việc thực tế CO_DINH bằng 1 câu INSERT ... SELECT trong PostgreSQL:
+    generate_series(ngày) × tập nhân viên × LichLamViec_CoDinh (khớp thứ theo isodow),
+    ngày không có ca → 1 dòng ngày nghỉ. snapshot_map: {ca_id: snapshot JSON}.
+    Trả về số dòng đã ghi.
+    """
+    opts = Lichlamviecthucte._meta
+    codinh_opts = LichlamviecCodinh._meta
+    qn = connection.ops.quote_name
+    columns = ', '.join(qn(opts.get_field(name).column) for name in _LLVTT_COPY_FIELDS)
+    cd_lich = qn(codinh_opts.get_field('lichlamviec').column)
+    cd_ca = qn(codinh_opts.get_field('calamviec').column)
+    cd_thu = qn(codinh_opts.get_field('ngaytrongtuan').column)
+    # NgayTrongTuan: 0 = Thứ 2 ... 6 = Chủ nhật (= isodow - 1)
+    ca_cua_ngay = f"""
+        SELECT cd.{cd_ca} FROM {codinh_opts.db_table} cd
+        WHERE cd.{cd_lich} = %(lich_id)s AND cd.{cd_ca} IS NOT NULL
+          AND cd.{cd_thu} = EXTRACT(ISODOW FROM g.ngay)::int - 1
+    """
+    sql = f"""
+        INSERT INTO {opts.db_table} ({columns})
+        SELECT %(created_at)s, g.ngay::date, e.nhanvien_id, s.ca_id, s.ca_id IS NULL, false,
+               %(lich_id)s, %(nguongoc)s, snap.snapshot
+        FROM generate_series(%(start_date)s::date, %(end_date)s::date, interval '1 day') AS g(ngay)
+        CROSS JOIN unnest(%(nhanvien_ids)s::bigint[]) AS e(nhanvien_id)
+        CROSS JOIN LATERAL (
+            {ca_cua_ngay}
+            UNION ALL
+            SELECT NULL::bigint WHERE NOT EXISTS ({ca_cua_ngay})
+        ) AS s(ca_id)
+        LEFT JOIN unnest(%(ca_ids)s::bigint[], %(snapshots)s::text[]) AS snap(ca_id, snapshot)
+               ON snap.ca_id = s.ca_id
+    """
+    ca_ids = list(snapshot_map)
+    with connection.cursor() as cursor:
+        cursor.execute(sql, {
+            'created_at': created_at or timezone.now(),
+            'lich_id': lich_id,
+            'nguongoc': 'CO_DINH',
+            'start_date': start_date,
+            'end_date': end_date,
+            'nhanvien_ids': list(nhanvien_ids),
+            'ca_ids': ca_ids,
+            'snapshots': [snapshot_map[ca_id] for ca_id in ca_ids],
+        })
+        return cursor.rowcount
+
+
+def reconcile_lich_lam_viec_thuc_te(lich_id, nguongoc, rows, existing_qs):
+    """
+    Đồng bộ Lịch làm việc thực tế theo diff thay vì xóa hết rồi tạo lại.
+    rows: tập dòng mong muốn (nhanvien_id, ngaylamviec, calamviec_id, snapshot_ca);
+    existing_qs: các dòng hiện có trong cùng phạm vi (NV × khoảng ngày).
+    Dòng trùng khóa (NV, ngày, ca) được giữ nguyên (chỉ cập nhật snapshot nếu đổi),
+    dòng thiếu được thêm, dòng thừa bị xóa.
+    Trả về {'inserted', 'updated', 'deleted', 'unchanged'}.
+    """
+    existing = defaultdict(list)
+    for rec_id, nv_id, ngay, ca_id, snapshot in existing_qs.values_list(
+        'id', 'nhanvien_id', 'ngaylamviec', 'calamviec_id', 'snapshot_ca'
+    ):
+        existing[(nv_id, ngay, ca_id)].append((rec_id, snapshot))
+
+    to_insert = []
+    to_update = []
+    unchanged = 0
+    for nv_id, ngay, ca_id, snapshot in rows:
+        snapshot = snapshot if ca_id else None
+        matches = existing.get((nv_id, ngay, ca_id))
+        if not matches:
+            to_insert.append((nv_id, ngay, ca_id, snapshot))
+            continue
+        rec_id, old_snapshot = matches.pop()
+        if old_snapshot != snapshot:
+            to_update.append((rec_id, snapshot))
+        else:
+            unchanged += 1
+
+    to_delete = [rec_id for matches in existing.values() for rec_id, _ in matches]
+
+    with transaction.atomic():
+        deleted = 0
+        if to_delete:
+            deleted, _ = Lichlamviecthucte.objects.filter(id__in=to_delete).delete()
+        if to_update:
+            now = timezone.now()
+            Lichlamviecthucte.objects.bulk_update(
+                [Lichlamviecthucte(id=rec_id, snapshot_ca=snapshot, updated_at=now) for rec_id, snapshot in to_update],
+                ['snapshot_ca', 'updated_at'],
+                batch_size=500,
+            )
+        inserted = bulk_insert_lich_lam_viec_thuc_te(lich_id, nguongoc, to_insert) if to_insert else 0
+
+    return {'inserted': inserted, 'updated': len(to_update), 'deleted': deleted, 'unchanged': unchanged}
+
+
 class CaLamViecService:
     """
     Service xử lý logic CRUD cho Ca làm việc
@@ -36,63 +266,76 @@ class CaLamViecService:
         """
         Reverse validation: Kiểm tra Ca mới có gây xung đột 
         trong các lịch CO_DINH và LICH_TRINH đang dùng Ca này không.
+        ✅ TỐI ƯU: Nạp chi tiết mọi lịch/chu kỳ liên quan trong 1 lượt, tính khoảng phút mỗi ca 1 lần
+        (ca đang sửa dùng dữ liệu mới), rồi quét sweep-line từng lịch.
         
         Returns: str error message nếu xung đột, None nếu OK.
         """
-        from .validators import validate_schedule_time_overlap, _validate_lichtrinh_cycle_overlap
+        from .validators import (
+            build_shift_interval_index, validate_schedule_time_overlap, _validate_lichtrinh_cycle_overlap,
+        )
 
-        # ── 1. Kiểm tra lịch CO_DINH ──
+        # ── 1. Nạp chi tiết các lịch CO_DINH đang dùng Ca (1 query) ──
         lich_ids_co_dinh = LichlamviecCodinh.objects.filter(
             calamviec_id=ca_instance.id,
             lichlamviec__trangthai='active'
         ).filter(
             Q(lichlamviec__is_deleted=False) | Q(lichlamviec__is_deleted__isnull=True)
-        ).values_list('lichlamviec_id', flat=True).distinct()
+        ).values('lichlamviec_id')
+        co_dinh_rows = LichlamviecCodinh.objects.filter(
+            lichlamviec_id__in=lich_ids_co_dinh
+        ).order_by('lichlamviec_id').values_list(
+            'lichlamviec_id', 'lichlamviec__tenlichlamviec', 'ngaytrongtuan', 'calamviec_id'
+        )
 
-        for lich_id in lich_ids_co_dinh:
-            # Lấy toàn bộ chi tiết ca trong lịch
-            chi_tiet_raw = list(LichlamviecCodinh.objects.filter(
-                lichlamviec_id=lich_id
-            ).values('ngaytrongtuan', 'calamviec_id'))
+        # ── 2. Nạp chi tiết các chu kỳ LICH_TRINH đang dùng Ca (1 query) ──
+        chu_ky_ids = CtlichlamviecLichtrinh.objects.filter(
+            calamviec_id=ca_instance.id,
+            lichlamviec_lichtrinh__lichlamviec__trangthai='active'
+        ).values('lichlamviec_lichtrinh_id')
+        lich_trinh_rows = CtlichlamviecLichtrinh.objects.filter(
+            lichlamviec_lichtrinh_id__in=chu_ky_ids
+        ).order_by('lichlamviec_lichtrinh_id', 'calamviectungngay').values_list(
+            'lichlamviec_lichtrinh_id', 'lichlamviec_lichtrinh__tenchuky', 'lichlamviec_lichtrinh__songaylap',
+            'lichlamviec_lichtrinh__lichlamviec__tenlichlamviec', 'calamviectungngay', 'calamviec_id'
+        )
 
-            # Chuyển sang format mà validate_schedule_time_overlap yêu cầu
-            chi_tiet_ca = [
-                {'NgayTrongTuan': ct['ngaytrongtuan'], 'CaID': ct['calamviec_id']}
-                for ct in chi_tiet_raw
-            ]
+        co_dinh_map = OrderedDict()
+        for lich_id, ten_lich, ngay, ca_id in co_dinh_rows:
+            entry = co_dinh_map.setdefault(lich_id, {'ten_lich': ten_lich or f"ID={lich_id}", 'chi_tiet': []})
+            entry['chi_tiet'].append({'NgayTrongTuan': ngay, 'CaID': ca_id})
+
+        chu_ky_map = OrderedDict()
+        for chu_ky_id, ten_chu_ky, songaylap, ten_lich, ngay, ca_id in lich_trinh_rows:
+            entry = chu_ky_map.setdefault(chu_ky_id, {
+                'ten_chu_ky': ten_chu_ky, 'songaylap': songaylap, 'ten_lich': ten_lich or '', 'items': [],
+            })
+            entry['items'].append((ngay, ca_id))
+
+        if not co_dinh_map and not chu_ky_map:
+            return None
 
-            is_valid, msg = validate_schedule_time_overlap(chi_tiet_ca)
+        # ── 3. Chỉ mục khoảng phút của mọi ca liên quan (1 query khung giờ) ──
+        ca_ids = {item['CaID'] for entry in co_dinh_map.values() for item in entry['chi_tiet']}
+        ca_ids.update(ca_id for entry in chu_ky_map.values() for _, ca_id in entry['items'])
+        interval_index = build_shift_interval_index(ca_ids, overrides={ca_instance.id: new_data})
+
+        for entry in co_dinh_map.values():
+            is_valid, msg = validate_schedule_time_overlap(entry['chi_tiet'], interval_index)
             if not is_valid:
-                lich = Lichlamviec.objects.filter(id=lich_id).first()
-                ten_lich = lich.tenlichlamviec if lich else f"ID={lich_id}"
                 return (
                     f"Không thể sửa Ca vì gây xung đột thời gian "
-                    f"trong lịch cố định '{ten_lich}': {msg}"
+                    f"trong lịch cố định '{entry['ten_lich']}': {msg}"
                 )
 
-        # ── 2. Kiểm tra lịch LICH_TRINH ──
-        chu_ky_ids = CtlichlamviecLichtrinh.objects.filter(
-            calamviec_id=ca_instance.id,
-            lichlamviec_lichtrinh__lichlamviec__trangthai='active'
-        ).values_list('lichlamviec_lichtrinh_id', flat=True).distinct()
-
-        for chu_ky_id in chu_ky_ids:
-            chu_ky = LichlamviecLichtrinh.objects.filter(id=chu_ky_id).first()
-            if not chu_ky:
-                continue
-
-            all_ct = list(CtlichlamviecLichtrinh.objects.filter(
-                lichlamviec_lichtrinh=chu_ky
-            ).select_related('calamviec').order_by('calamviectungngay'))
-
+        for entry in chu_ky_map.values():
             conflict_msg = _validate_lichtrinh_cycle_overlap(
-                all_ct, chu_ky.songaylap, ca_instance.id, new_data
+                entry['items'], entry['songaylap'], interval_index
             )
             if conflict_msg:
-                ten_lich = chu_ky.lichlamviec.tenlichlamviec if chu_ky.lichlamviec else ''
                 return (
                     f"Không thể sửa Ca vì gây xung đột thời gian "
-                    f"trong lịch trình '{ten_lich}', chu kỳ '{chu_ky.tenchuky}': {conflict_msg}"
+                    f"trong lịch trình '{entry['ten_lich']}', chu kỳ '{entry['ten_chu_ky']}': {conflict_msg}"
                 )
 
         return None
@@ -143,21 +386,45 @@ class CaLamViecService:
             except Lichlamviec.DoesNotExist:
                 continue
 
-            Lichlamviecthucte.objects.filter(
+            # ✅ TỐI ƯU: Không xóa - tạo lại; đồng bộ diff tới ngày xa nhất đã sinh của ca này
+            # (chỉ các dòng có snapshot ca thay đổi bị ghi lại)
+            _, last_day = monthrange(today.year, today.month)
+            end_date = date(today.year, today.month, last_day)
+            last_generated = Lichlamviecthucte.objects.filter(
                 lichlamviec=lich,
                 calamviec_id=ca_instance.id,
                 ngaylamviec__gte=today,
                 chophepghide=False
-            ).delete()
+            ).aggregate(last=Max('ngaylamviec'))['last']
+            if last_generated and last_generated > end_date:
+                end_date = last_generated
 
             LichLamViecService.generate_actual_schedule_for_fixed(
-                lich, start_date=today
+                lich, start_date=today, end_date=end_date
+            )
+
+    @staticmethod
+    def _load_snapshot_ca(ca_ids):
+        """Loader cho cache snapshot: dựng snapshot JSON của nhiều ca trong 1 lần (3 query)."""
+        return {
+            ca_obj.id: (
+                shift_version(ca_obj.updated_at, ca_obj.created_at),
+                json.dumps(CaLamViecService._build_snapshot_ca(ca_obj), ensure_ascii=False),
             )
+            for ca_obj in Calamviec.objects.filter(id__in=ca_ids).prefetch_related(
+                'khunggiolamviec_set', 'khunggionghitrua_set'
+            )
+        }
+
+    @staticmethod
+    def get_snapshot_map(ca_ids):
+        """Snapshot JSON (dạng lưu vào snapshot_ca) của các ca: {ca_id: json_str}, đọc qua cache."""
+        return get_shift_snapshots(KIND_LICH, ca_ids, CaLamViecService._load_snapshot_ca)
 
     @staticmethod
     def _build_snapshot_ca(ca_obj):
         khung_gio_list = []
-        for kg in ca_obj.khunggiolamviec_set.order_by('id'):
+        for kg in sorted(ca_obj.khunggiolamviec_set.all(), key=lambda kg: kg.id):
             khung_gio_list.append({
                 'thoigianbatdau': kg.thoigianbatdau.strftime('%H:%M') if kg.thoigianbatdau else None,
                 'thoigianketthuc': kg.thoigianketthuc.strftime('%H:%M') if kg.thoigianketthuc else None,
@@ -346,13 +613,14 @@ class CaLamViecService:
             ca_instance.khunggionghitrua_set.all().delete()
             
             CaLamViecService._save_shift_details(ca_instance, data)
+            invalidate_shift_snapshot(ca_instance.id)
 
             # ── 6. Re-generate lịch thực tế tương lai ──
             CaLamViecService._regenerate_future_schedules(ca_instance)
 
             # ── 6.1. Cập nhật snapshot cho các lịch tương lai còn lại (Lịch trình, ghi đè...) ──
             today = date.today()
-            new_snapshot = json.dumps(CaLamViecService._build_snapshot_ca(ca_instance), ensure_ascii=False)
+            new_snapshot = CaLamViecService.get_snapshot_map([ca_instance.id]).get(ca_instance.id)
             Lichlamviecthucte.objects.filter(
                 calamviec_id=ca_instance.id,
                 ngaylamviec__gte=today
@@ -456,6 +724,7 @@ class CaLamViecService:
 
         try:
             with transaction.atomic():
+                invalidate_shift_snapshot(ca_instance.id)
                 if has_actual_data:
                     # Case: Xóa mềm
                     if hasattr(ca_instance, 'is_deleted'):
@@ -505,42 +774,16 @@ class LichLamViecService:
             Q(ngayketthuc__isnull=True) | Q(ngayketthuc__date__gte=start_date)
         )
 
-    @staticmethod
-    def _dt_rank(value):
-        if value is None:
-            return float('-inf')
-        return value.timestamp()
-
     @staticmethod
     def _get_effective_direct_assignment_map(start_date=None, end_date=None):
         """
         Trả về map {nhanvien_id: lichlamviec_id} cho direct assignment hiệu lực trong kỳ.
         Nếu dữ liệu bị chồng direct assignment, ưu tiên record có ngayapdung/created_at mới hơn.
+        ✅ TỐI ƯU: Map dựng 1 lần cho mỗi kỳ và dùng chung qua resolver (cache theo phiên bản phân công),
+        không quét lại LichlamviecNhanvien cho từng lịch.
         """
-        query = LichlamviecNhanvien.objects.filter(
-            trangthai='active'
-        ).filter(
-            Q(lichlamviec__is_deleted=False) | Q(lichlamviec__is_deleted__isnull=True),
-            lichlamviec__trangthai='active'
-        )
-        query = LichLamViecService._apply_relation_effective_filter(query, start_date, end_date)
-
-        winners = {}
-        for row in query.values('id', 'nhanvien_id', 'lichlamviec_id', 'ngayapdung', 'created_at'):
-            nhanvien_id = row.get('nhanvien_id')
-            if not nhanvien_id:
-                continue
-
-            rank = (
-                LichLamViecService._dt_rank(row.get('ngayapdung')),
-                LichLamViecService._dt_rank(row.get('created_at')),
-                row.get('id') or 0,
-            )
-            current = winners.get(nhanvien_id)
-            if current is None or rank > current[0]:
-                winners[nhanvien_id] = (rank, row.get('lichlamviec_id'))
-
-        return {nhanvien_id: item[1] for nhanvien_id, item in winners.items()}
+        start_date, end_date = LichLamViecService._normalize_period_bounds(start_date, end_date)
+        return get_assignment_resolver(KIND_LICH_LAM_VIEC, start_date, end_date).direct_map()
     
     @staticmethod
     def get_employees_from_departments(dept_ids, start_date=None, end_date=None):
@@ -668,52 +911,18 @@ class LichLamViecService:
 
     @staticmethod
     def _expand_dept_ids(dept_ids):
-        """Mở rộng danh sách bộ phận sử dụng Helper có sẵn từ View"""
+        """
+        Mở rộng danh sách bộ phận (gồm cả bộ phận con cháu).
+        ✅ TỐI ƯU: Tra tất cả gốc trong 1 lần trên chỉ mục cây phòng ban đã cache.
+        """
         if not dept_ids: return set()
-        
-        final_ids = set()
-        # dept_ids có thể là list string hoặc int
-        for root_id in dept_ids:
-            # Tái sử dụng hàm logic có sẵn, không viết lại đệ quy
-            children = get_all_child_department_ids(root_id, isnclude_root=True)
-            final_ids.update(children)
-            
-        return final_ids
+        return get_department_tree().descendants(dept_ids, include_root=True)
 
     @staticmethod
     def get_consolidated_dept_ids(all_dept_ids):
         """Lấy danh sách bộ phận đã được hợp nhất (loại bỏ con nếu cha đã được chọn)"""
         if not all_dept_ids: return []
-        all_dept_ids = set(map(int, all_dept_ids))
-        
-        dept_map = {}
-        all_depts = Phongban.objects.filter(trangthai='active').values('id', 'phongbancha_id')
-        
-        children_map = {}
-        for d in all_depts:
-            pid = d['phongbancha_id']
-            if pid: 
-                if pid not in children_map: children_map[pid] = []
-                children_map[pid].append(d['id'])
-        
-        for d in all_depts: 
-            dept_map[d['id']] = {'parent_id': d['phongbancha_id'], 'children_ids': children_map.get(d['id'], [])}
-        
-        result = set()
-        def is_ancestor_selected(dept_id):
-            current = dept_id
-            while current: 
-                info = dept_map.get(current)
-                if not info: break
-                parent_id = info.get('parent_id')
-                if parent_id and parent_id in all_dept_ids: return True
-                current = parent_id
-            return False
-        
-        for dept_id in all_dept_ids:
-            if not is_ancestor_selected(dept_id):
-                result.add(dept_id)
-        return list(result)
+        return get_department_tree().consolidate(all_dept_ids)
 
     @staticmethod
     def get_detail_for_form(lich):
@@ -1059,13 +1268,16 @@ class LichLamViecService:
         #    Thay vào đó, xóa TẤT CẢ lịch thực tế tương lai, exclude lịch mới.
         # ---------------------------------------------------------
         if all_emp_ids:
-            Lichlamviecthucte.objects.filter(
+            deleted, _ = Lichlamviecthucte.objects.filter(
                 nhanvien_id__in=all_emp_ids,
                 ngaylamviec__gte=effective_date,
                 chophepghide=False
             ).exclude(
                 lichlamviec=lich
             ).delete()
+            logger.info("Chuyển lịch %s: xóa %s dòng lịch thực tế tương lai của lịch cũ", lich.id, deleted)
+
+        invalidate_assignments(KIND_LICH_LAM_VIEC)
 
         return transferred
 
@@ -1184,9 +1396,11 @@ class LichLamViecService:
                 CtlichlamviecLichtrinh.objects.bulk_create(ct_objs)
 
     @staticmethod
-    def generate_actual_schedule_for_fixed(lich, start_date=None, end_date=None):
+    def generate_actual_schedule_for_fixed(lich, start_date=None, end_date=None, reconcile=True):
         """
         ✅ TỐI ƯU: Giảm memory footprint, batch insert
+        reconcile=True: nếu phạm vi đã có lịch thì chỉ ghi phần chênh lệch thay vì xóa - tạo lại.
+        Trả về số dòng đã ghi {'inserted', 'updated', 'deleted', 'unchanged'} (None nếu không sinh).
         """
         if lich.loaikichbanlamviec != 'CO_DINH':
             return
@@ -1210,84 +1424,48 @@ class LichLamViecService:
         
         # ✅ TỐI ƯU:  Chỉ lấy fields cần thiết
         day_shifts_map = {}
-        days_with_shifts = set()
         codinh_list = lich.lichlamvieccodinh_set.values_list('ngaytrongtuan', 'calamviec_id')
         for ngay, ca_id in codinh_list:
             if ca_id: 
                 if ngay not in day_shifts_map:
                     day_shifts_map[ngay] = []
                 day_shifts_map[ngay].append(ca_id)
-                days_with_shifts.add(ngay)
         
-        # ✅ XÓA lịch cũ TRƯỚC khi tạo mới (1 query)
-        Lichlamviecthucte.objects.filter(
+        # Pre-build snapshot map: {ca_id: snapshot_dict}
+        snapshot_map = CaLamViecService.get_snapshot_map(ca_id for ca_ids in day_shifts_map.values() for ca_id in ca_ids)
+
+        def rows():
+            for i in range((end_date - start_date).days + 1):
+                current_date = start_date + timedelta(days=i)
+                # Ngày không có ca → 1 dòng ngày nghỉ (ca None)
+                ca_ids = day_shifts_map.get(current_date.weekday()) or (None,)
+                for emp_id in all_emp_ids:
+                    for ca_id in ca_ids:
+                        yield emp_id, current_date, ca_id, snapshot_map.get(ca_id)
+
+        existing_qs = Lichlamviecthucte.objects.filter(
             lichlamviec=lich,
             nhanvien_id__in=all_emp_ids,
             ngaylamviec__gte=start_date,
             ngaylamviec__lte=end_date,
             chophepghide=False
-        ).delete()
-        
-        # ✅ TỐI ƯU: Batch insert với generator để giảm memory
-        BATCH_SIZE = 2000
-        records_batch = []
-        created_at = timezone.now()
-        
-        # Pre-build snapshot map: {ca_id: snapshot_dict}
-        snapshot_map = {}
-        for ca_id in set(ca_id for ca_ids in day_shifts_map.values() for ca_id in ca_ids):
-            ca_obj = Calamviec.objects.filter(id=ca_id).prefetch_related(
-                'khunggiolamviec_set', 'khunggionghitrua_set'
-            ).first()
-            if ca_obj:
-                snapshot_map[ca_id] = json.dumps(CaLamViecService._build_snapshot_ca(ca_obj), ensure_ascii=False)
-
-        # Tối ưu vòng lặp: Tính trước số ngày
-        delta = (end_date - start_date).days + 1
+        )
 
-        for i in range(delta):
-            current_date = start_date + timedelta(days=i)
-            weekday = current_date.weekday()
-            
-            # Pre-create object mẫu để copy nhanh (micro-optimization)
-            base_kwargs = {
-                'ngaylamviec': current_date,
-                'chophepghide': False,
-                'lichlamviec': lich,
-                'nguongoc': 'CO_DINH',
-                'created_at': created_at
-            }
-
-            if weekday in days_with_shifts:
-                # Có ca làm việc
-                ca_ids = day_shifts_map[weekday]
-                # Sử dụng itertools.product để flat loop nếu cần, nhưng ở đây logic đơn giản
-                for emp_id in all_emp_ids:
-                    for ca_id in ca_ids:
-                        records_batch.append(Lichlamviecthucte(
-                            calamviec_id=ca_id,
-                            cophaingaynghi=False,
-                            nhanvien_id=emp_id,
-                            snapshot_ca=snapshot_map.get(ca_id),
-                            **base_kwargs
-                        ))
+        # ✅ TỐI ƯU: Đã có lịch trong phạm vi → chỉ ghi phần chênh lệch (thêm / sửa snapshot / xóa)
+        if reconcile and existing_qs.exists():
+            stats = reconcile_lich_lam_viec_thuc_te(lich.id, 'CO_DINH', rows(), existing_qs)
+        else:
+            # Sinh mới toàn bộ: xóa lịch cũ (reconcile=False) rồi ghi hàng loạt
+            deleted = 0 if reconcile else existing_qs.delete()[0]
+            if connection.vendor == 'postgresql':
+                # ✅ TỐI ƯU: Toàn bộ phép nhân ngày × NV × ca chạy trong DB (1 câu INSERT ... SELECT)
+                inserted = expand_fixed_schedule_in_db(lich.id, all_emp_ids, start_date, end_date, snapshot_map)
             else:
-                # Ngày nghỉ
-                for emp_id in all_emp_ids:
-                    records_batch.append(Lichlamviecthucte(
-                        calamviec_id=None,
-                        cophaingaynghi=True,
-                        nhanvien_id=emp_id,
-                        **base_kwargs
-                    ))
-            
-            # Check batch size bên ngoài loop nhân viên để giảm số lần check
-            if len(records_batch) >= BATCH_SIZE:
-                Lichlamviecthucte.objects.bulk_create(records_batch, batch_size=BATCH_SIZE)
-                records_batch = [] # Reset list mới nhanh hơn clear()
-        
-        if records_batch:
-            Lichlamviecthucte.objects.bulk_create(records_batch, batch_size=BATCH_SIZE)
+                inserted = bulk_insert_lich_lam_viec_thuc_te(lich.id, 'CO_DINH', rows())
+            stats = {'inserted': inserted, 'updated': 0, 'deleted': deleted, 'unchanged': 0}
+
+        logger.info("Sinh lịch cố định %s (%s → %s): %s", lich.id, start_date, end_date, stats)
+        return stats
 
     @staticmethod
     def generate_actual_schedule_for_lichtrinh(lich, schedule_data, start_date=None, end_date=None):
@@ -1314,7 +1492,7 @@ class LichLamViecService:
         if not all_emp_ids:
             return
         
-        records_to_create = []
+        rows_to_create = []
         map_emp_dates_to_clear = defaultdict(list)
         
         # Pre-build snapshot map cho LICH_TRINH
@@ -1326,13 +1504,7 @@ class LichLamViecService:
                     if ca_id and ca_id != 0:
                         unique_ca_ids.add(ca_id)
         
-        snapshot_map = {}
-        for ca_id in unique_ca_ids:
-            ca_obj = Calamviec.objects.filter(id=ca_id).prefetch_related(
-                'khunggiolamviec_set', 'khunggionghitrua_set'
-            ).first()
-            if ca_obj:
-                snapshot_map[ca_id] = json.dumps(CaLamViecService._build_snapshot_ca(ca_obj), ensure_ascii=False)
+        snapshot_map = CaLamViecService.get_snapshot_map(unique_ca_ids)
 
         for key, shifts in schedule_data.items():
             parts = key.split('_')
@@ -1361,59 +1533,20 @@ class LichLamViecService:
             # Gom lại để xóa sau
             map_emp_dates_to_clear[emp_id].append(schedule_date)
 
-            # Logic tạo object (Giữ nguyên logic nghiệp vụ)
-            base_kwargs = {
-                'ngaylamviec': schedule_date,
-                'chophepghide': False,
-                'lichlamviec': lich,
-                'nguongoc': 'LICH_TRINH',
-                'created_at': timezone.now()
-            }
-
-            if shifts and len(shifts) > 0:
-                has_valid_shift = False
-                for shift in shifts: 
-                    ca_id = shift.get('id')
-                    if ca_id and ca_id != 0:
-                        has_valid_shift = True
-                        records_to_create.append(Lichlamviecthucte(
-                            nhanvien_id=emp_id,
-                            cophaingaynghi=False,
-                            calamviec_id=ca_id,
-                            snapshot_ca=snapshot_map.get(ca_id),
-                            **base_kwargs
-                        ))
-                
-                if not has_valid_shift:
-                    records_to_create.append(Lichlamviecthucte(
-                        nhanvien_id=emp_id,
-                        cophaingaynghi=True,
-                        calamviec_id=None,
-                        **base_kwargs
-                    ))
-            else:
-                records_to_create.append(Lichlamviecthucte(
-                    nhanvien_id=emp_id,
-                    cophaingaynghi=True,
-                    calamviec_id=None,
-                    **base_kwargs
-                ))
-        
-        # === TỐI ƯU ĐOẠN XÓA (Fix N+1) ===
-        # Thay vì loop và delete từng dòng, ta delete theo từng nhân viên (Giảm từ N*D query xuống N query)
-        # Nếu DB hỗ trợ cú pháp tuple IN (Postgres, MySQL mới) thì có thể gom 1 query, nhưng Django ORM chuẩn an toàn nhất là loop emp
-        if map_emp_dates_to_clear:
-            with transaction.atomic():
-                for emp_id, dates in map_emp_dates_to_clear.items():
-                    Lichlamviecthucte.objects.filter(
-                        lichlamviec=lich,
-                        nhanvien_id=emp_id,
-                        ngaylamviec__in=dates, # Xóa 1 lần cho nhiều ngày của 1 nhân viên
-                        chophepghide=False
-                    ).delete()
-        
-        if records_to_create: 
-            Lichlamviecthucte.objects.bulk_create(records_to_create, batch_size=1000)
+            # Logic tạo dòng (Giữ nguyên logic nghiệp vụ): không có ca hợp lệ → 1 dòng ngày nghỉ
+            valid_ca_ids = [shift.get('id') for shift in (shifts or []) if shift.get('id') and shift.get('id') != 0]
+            for ca_id in valid_ca_ids or [None]:
+                rows_to_create.append((emp_id, schedule_date, ca_id, snapshot_map.get(int(ca_id)) if ca_id else None))
+
+        # ✅ TỐI ƯU: Xóa toàn bộ cặp (NV, ngày) cần thay bằng 1 câu lệnh rồi ghi hàng loạt
+        # → số round trip cố định, không phụ thuộc số nhân viên
+        with transaction.atomic():
+            if map_emp_dates_to_clear:
+                delete_lich_lam_viec_thuc_te_pairs(lich.id, [
+                    (emp_id, d) for emp_id, dates in map_emp_dates_to_clear.items() for d in dates
+                ])
+            if rows_to_create:
+                bulk_insert_lich_lam_viec_thuc_te(lich.id, 'LICH_TRINH', rows_to_create)
 
     @staticmethod
     def _get_all_employee_ids_for_schedule(lich, start_date=None, end_date=None):
@@ -1477,53 +1610,74 @@ class LichLamViecService:
         return direct_emp_ids.union(dept_emp_ids)
     
     @staticmethod
-    def generate_next_month_schedules():
-        """
-        ✅ NEW: Cron job - Generate lịch làm việc cho tháng tiếp theo
-        CHỈ ÁP DỤNG CHO KỊCH BẢN CỐ ĐỊNH (LỊCH TRÌNH do user tự setup)
-        Chạy vào cuối tháng (ví dụ: ngày 25-28)
-        """
-        
-        today = date.today()
-        
-        # Tính ngày đầu tháng sau
+    def get_next_month_period(today=None):
+        """Trả về (ngày đầu, ngày cuối) của tháng kế tiếp."""
+        today = today or date.today()
         if today.month == 12:
             next_month_start = date(today.year + 1, 1, 1)
         else: 
             next_month_start = date(today.year, today.month + 1, 1)
-        
-        # Tính ngày cuối tháng sau
-        if next_month_start.month == 12:
-            next_month_end = date(next_month_start.year + 1, 1, 1) - timedelta(days=1)
-        else: 
-            next_month_end = date(next_month_start.year, next_month_start.month + 1, 1) - timedelta(days=1)
-        
-        # ✅ CHỈ lấy lịch CỐ ĐỊNH đang active
-        active_fixed_schedules = Lichlamviec.objects.filter(
+        _, last_day = monthrange(next_month_start.year, next_month_start.month)
+        return next_month_start, date(next_month_start.year, next_month_start.month, last_day)
+
+    @staticmethod
+    def get_active_fixed_schedule_ids():
+        """ID các lịch CỐ ĐỊNH đang active (đầu vào của job sinh lịch cuối tháng)."""
+        return list(Lichlamviec.objects.filter(
             Q(is_deleted=False) | Q(is_deleted__isnull=True),
             trangthai='active',
             loaikichbanlamviec='CO_DINH'
-        )
-        
-        generated_count = 0
-        error_count = 0
-        
-        for lich in active_fixed_schedules: 
+        ).order_by('id').values_list('id', flat=True))
+
+    @staticmethod
+    def generate_fixed_schedules_for_period(lich_ids, start_date, end_date):
+        """
+        Sinh lịch thực tế cho danh sách lịch cố định trong kỳ, mỗi lịch 1 transaction riêng
+        (1 lịch lỗi không ảnh hưởng các lịch khác).
+        Returns: (generated_ids, errors) với errors = {lich_id: thông báo lỗi}
+        """
+        generated_ids = []
+        errors = {}
+        lich_map = Lichlamviec.objects.in_bulk(lich_ids)
+        # Dựng sẵn map phân công trực tiếp của kỳ (dùng chung cho mọi lịch trong lô)
+        get_assignment_resolver(KIND_LICH_LAM_VIEC, start_date, end_date)
+        for lich_id in lich_ids:
+            lich = lich_map.get(lich_id)
+            if lich is None:
+                continue
             try:
-                LichLamViecService.generate_actual_schedule_for_fixed(
-                    lich,
-                    start_date=next_month_start,
-                    end_date=next_month_end
-                )
-                generated_count += 1
+                with transaction.atomic():
+                    LichLamViecService.generate_actual_schedule_for_fixed(
+                        lich,
+                        start_date=start_date,
+                        end_date=end_date
+                    )
+                generated_ids.append(lich_id)
             except Exception as e:
-                error_count += 1
-                print(f"Error generating schedule for {lich.id}: {str(e)}")
+                logger.exception("Error generating schedule for %s", lich_id)
+                errors[lich_id] = str(e)
+        return generated_ids, errors
+
+    @staticmethod
+    def generate_next_month_schedules():
+        """
+        ✅ NEW: Cron job - Generate lịch làm việc cho tháng tiếp theo
+        CHỈ ÁP DỤNG CHO KỊCH BẢN CỐ ĐỊNH (LỊCH TRÌNH do user tự setup)
+        Chạy vào cuối tháng (ví dụ: ngày 25-28)
+        Chạy tuần tự trong 1 process; job Celery chia song song qua generate_fixed_schedules_for_period.
+        """
+        next_month_start, next_month_end = LichLamViecService.get_next_month_period()
+
+        generated_ids, errors = LichLamViecService.generate_fixed_schedules_for_period(
+            LichLamViecService.get_active_fixed_schedule_ids(),
+            next_month_start,
+            next_month_end
+        )
         
         return {
             'success': True,
-            'generated':  generated_count,
-            'errors': error_count,
+            'generated':  len(generated_ids),
+            'errors': len(errors),
             'period': f"{next_month_start} -> {next_month_end}"
         }
 
@@ -1765,6 +1919,7 @@ class LichLamViecService:
                 lich_instance.is_deleted = True
                 lich_instance.deleted_at = now
                 lich_instance.save(update_fields=['is_deleted', 'deleted_at', 'trangthai'])
+                invalidate_assignments(KIND_LICH_LAM_VIEC)
                 
             return True, "Xóa thành công."
         except Exception as e:
@@ -1,6 +1,7 @@
 import logging
+from datetime import date
 
-from celery import shared_task
+from celery import chord, group, shared_task
 from django.core.cache import cache
 from django.utils import timezone
 
@@ -8,6 +9,15 @@ from .services import LichLamViecService
 
 logger = logging.getLogger(__name__)
 
+# Số subtask sinh lịch chạy song song tối đa cho 1 kỳ (mỗi subtask xử lý 1 lô lịch cố định)
+LLV_MONTH_END_MAX_PARALLEL = 8
+# Lock giữ suốt từ lúc chia job tới khi chord callback tổng hợp xong (callback tự giải phóng)
+LLV_AUTO_LOCK_TIMEOUT = 3600
+LLV_AUTO_LOCK_KEY = "llv:auto:lock:{period_key}"
+LLV_AUTO_DONE_KEY = "llv:auto:done:{period_key}"
+LLV_AUTO_DONE_TTL = 120 * 24 * 3600
+LLV_BATCH_MAX_RETRIES = 3
+
 
 def _next_month_period_key(today):
     if today.month == 12:
@@ -17,6 +27,83 @@ def _next_month_period_key(today):
     return f"{y:04d}-{m:02d}"
 
 
+def _split_batches(items, max_batches):
+    """Chia đều items thành tối đa max_batches lô (giữ thứ tự)."""
+    if not items:
+        return []
+    n = min(max_batches, len(items))
+    size, extra = divmod(len(items), n)
+    batches, start = [], 0
+    for i in range(n):
+        end = start + size + (1 if i < extra else 0)
+        batches.append(items[start:end])
+        start = end
+    return batches
+
+
+@shared_task(
+    bind=True,
+    autoretry_for=(Exception,),
+    retry_backoff=True,
+    retry_jitter=True,
+    max_retries=LLV_BATCH_MAX_RETRIES,
+)
+def generate_fixed_schedule_batch_task(self, lich_ids, start_date, end_date, generated_ids=None):
+    """
+    Sinh lịch thực tế cho 1 lô lịch cố định. Lịch lỗi được retry riêng
+    (chỉ chạy lại các lịch lỗi, giữ kết quả các lịch đã xong qua generated_ids).
+    """
+    generated, errors = LichLamViecService.generate_fixed_schedules_for_period(
+        lich_ids, date.fromisoformat(start_date), date.fromisoformat(end_date)
+    )
+    generated_ids = list(generated_ids or []) + generated
+
+    if errors and self.request.retries < self.max_retries:
+        logger.warning(
+            "LLV batch retry. failed=%s retries=%s", list(errors), self.request.retries,
+        )
+        raise self.retry(
+            args=(list(errors), start_date, end_date),
+            kwargs={"generated_ids": generated_ids},
+            countdown=30 * 2 ** self.request.retries,
+        )
+
+    return {
+        "generated": generated_ids,
+        "errors": {str(lich_id): message for lich_id, message in errors.items()},
+    }
+
+
+@shared_task
+def finalize_next_month_schedule_task(results, period_key, lock_key, period):
+    """Chord callback: gộp kết quả các lô, đánh dấu done cho kỳ nếu không lỗi, giải phóng lock."""
+    generated = sum(len(r.get("generated", [])) for r in results)
+    errors = {}
+    for r in results:
+        errors.update(r.get("errors", {}))
+
+    try:
+        if not errors:
+            cache.set(LLV_AUTO_DONE_KEY.format(period_key=period_key), timezone.now().isoformat(), timeout=LLV_AUTO_DONE_TTL)
+        else:
+            logger.error("LLV task errors. period_key=%s errors=%s", period_key, errors)
+    finally:
+        cache.delete(lock_key)
+
+    logger.info(
+        "LLV task finished. period_key=%s generated=%s errors=%s", period_key, generated, len(errors),
+    )
+    return {
+        "success": True,
+        "skipped": False,
+        "generated": generated,
+        "errors": len(errors),
+        "failed": errors,
+        "period": period,
+        "period_key": period_key,
+    }
+
+
 @shared_task(
     bind=True,
     autoretry_for=(Exception,),
@@ -39,10 +126,10 @@ def generate_next_month_schedule_task(self, force_run=False):
         }
 
     period_key = _next_month_period_key(today)
-    lock_key = f"llv:auto:lock:{period_key}"
-    done_key = f"llv:auto:done:{period_key}"
+    lock_key = LLV_AUTO_LOCK_KEY.format(period_key=period_key)
+    done_key = LLV_AUTO_DONE_KEY.format(period_key=period_key)
 
-    lock = cache.lock(lock_key, timeout=1800, blocking_timeout=0)
+    lock = cache.lock(lock_key, timeout=LLV_AUTO_LOCK_TIMEOUT, blocking_timeout=0)
     acquired = lock.acquire(blocking=False)
     if not acquired:
         logger.warning("LLV task skipped: lock not acquired. period_key=%s", period_key)
@@ -53,6 +140,7 @@ def generate_next_month_schedule_task(self, force_run=False):
             "period_key": period_key,
         }
 
+    dispatched = False
     try:
         if cache.get(done_key):
             logger.info("LLV task skipped: already done for period_key=%s", period_key)
@@ -63,26 +151,52 @@ def generate_next_month_schedule_task(self, force_run=False):
                 "period_key": period_key,
             }
 
-        result = LichLamViecService.generate_next_month_schedules()
+        start_date, end_date = LichLamViecService.get_next_month_period(today)
+        period = f"{start_date} -> {end_date}"
+        lich_ids = LichLamViecService.get_active_fixed_schedule_ids()
+        if not lich_ids:
+            cache.set(done_key, timezone.now().isoformat(), timeout=LLV_AUTO_DONE_TTL)
+            logger.info("LLV task finished: no active fixed schedules. period_key=%s", period_key)
+            return {
+                "success": True,
+                "skipped": False,
+                "generated": 0,
+                "errors": 0,
+                "period": period,
+                "period_key": period_key,
+            }
 
-        # Đánh dấu đã chạy thành công cho kỳ này để chống duplicate
-        if result.get("errors", 0) == 0:
-            cache.set(done_key, timezone.now().isoformat(), timeout=120 * 24 * 3600)
+        # Chia lịch thành tối đa LLV_MONTH_END_MAX_PARALLEL lô chạy song song trên các worker;
+        # lock được giữ tới khi finalize_next_month_schedule_task gộp xong kết quả
+        batches = _split_batches(lich_ids, LLV_MONTH_END_MAX_PARALLEL)
+        header = group(
+            generate_fixed_schedule_batch_task.s(batch, start_date.isoformat(), end_date.isoformat())
+            for batch in batches
+        )
+        chord(header)(finalize_next_month_schedule_task.s(
+            period_key=period_key, lock_key=lock_key, period=period,
+        ))
+        dispatched = True
 
-        result["period_key"] = period_key
-        result["skipped"] = False
         logger.info(
-            "LLV task finished. period_key=%s generated=%s errors=%s",
-            period_key,
-            result.get("generated", 0),
-            result.get("errors", 0),
+            "LLV task dispatched. period_key=%s schedules=%s batches=%s",
+            period_key, len(lich_ids), len(batches),
         )
-        return result
+        return {
+            "success": True,
+            "skipped": False,
+            "dispatched": True,
+            "schedules": len(lich_ids),
+            "batches": len(batches),
+            "period": period,
+            "period_key": period_key,
+        }
     except Exception:
         logger.exception("LLV task failed. period_key=%s", period_key)
         raise
     finally:
-        try:
-            lock.release()
-        except Exception:
-            logger.warning("LLV task lock release warning. period_key=%s", period_key)
\ No newline at end of file
+        if not dispatched:
+            try:
+                lock.release()
+            except Exception:
+                logger.warning("LLV task lock release warning. period_key=%s", period_key)
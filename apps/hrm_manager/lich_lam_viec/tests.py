@@ -33,38 +33,68 @@ class LichLamViecCeleryTaskTests(SimpleTestCase):
 		self.assertEqual(result["reason"], "locked")
 
 	@patch("apps.hrm_manager.lich_lam_viec.tasks.timezone.localdate", return_value=date(2026, 4, 25))
-	@patch("apps.hrm_manager.lich_lam_viec.tasks.timezone.now")
-	@patch("apps.hrm_manager.lich_lam_viec.tasks.LichLamViecService.generate_next_month_schedules")
+	@patch("apps.hrm_manager.lich_lam_viec.tasks.chord")
+	@patch("apps.hrm_manager.lich_lam_viec.tasks.LichLamViecService.get_active_fixed_schedule_ids")
 	@patch("apps.hrm_manager.lich_lam_viec.tasks.cache")
-	def test_task_runs_success_and_marks_done(
+	def test_task_fans_out_batches_and_keeps_lock(
 		self,
 		mock_cache,
-		mock_generate,
-		mock_now,
+		mock_schedule_ids,
+		mock_chord,
 		mock_today,
 	):
-		from apps.hrm_manager.lich_lam_viec.tasks import generate_next_month_schedule_task
+		from apps.hrm_manager.lich_lam_viec import tasks
 
 		lock = MagicMock()
 		lock.acquire.return_value = True
 		mock_cache.lock.return_value = lock
 		mock_cache.get.return_value = None
-		mock_now.return_value.isoformat.return_value = "2026-04-25T00:15:00+07:00"
-
-		mock_generate.return_value = {
-			"success": True,
-			"generated": 3,
-			"errors": 0,
-			"period": "2026-05-01 -> 2026-05-31",
-		}
+		mock_schedule_ids.return_value = list(range(1, 21))
 
-		result = generate_next_month_schedule_task.run(force_run=False)
+		result = tasks.generate_next_month_schedule_task.run(force_run=False)
 
 		self.assertTrue(result["success"])
 		self.assertFalse(result["skipped"])
 		self.assertEqual(result["period_key"], "2026-05")
+		self.assertEqual(result["batches"], tasks.LLV_MONTH_END_MAX_PARALLEL)
+		header = list(mock_chord.call_args[0][0].tasks)
+		self.assertEqual(sorted(i for sig in header for i in sig.args[0]), list(range(1, 21)))
+		self.assertEqual(header[0].args[1:], ("2026-05-01", "2026-05-31"))
+		# Lock được giữ tới khi chord callback chạy xong
+		lock.release.assert_not_called()
+		mock_cache.set.assert_not_called()
+
+	@patch("apps.hrm_manager.lich_lam_viec.tasks.timezone.now")
+	@patch("apps.hrm_manager.lich_lam_viec.tasks.cache")
+	def test_finalize_marks_done_and_releases_lock(self, mock_cache, mock_now):
+		from apps.hrm_manager.lich_lam_viec.tasks import finalize_next_month_schedule_task
+
+		mock_now.return_value.isoformat.return_value = "2026-04-25T00:15:00+07:00"
+
+		result = finalize_next_month_schedule_task.run(
+			[{"generated": [1, 2], "errors": {}}, {"generated": [3], "errors": {}}],
+			period_key="2026-05", lock_key="llv:auto:lock:2026-05", period="2026-05-01 -> 2026-05-31",
+		)
+
+		self.assertEqual((result["generated"], result["errors"]), (3, 0))
 		mock_cache.set.assert_called_once()
-		lock.release.assert_called_once()
+		self.assertEqual(mock_cache.set.call_args[0][0], "llv:auto:done:2026-05")
+		mock_cache.delete.assert_called_once_with("llv:auto:lock:2026-05")
+
+	@patch("apps.hrm_manager.lich_lam_viec.tasks.LichLamViecService.generate_fixed_schedules_for_period")
+	def test_batch_retries_only_failed_schedules(self, mock_generate):
+		from celery.exceptions import Retry
+		from apps.hrm_manager.lich_lam_viec.tasks import generate_fixed_schedule_batch_task
+
+		mock_generate.return_value = ([1, 3], {2: "boom"})
+
+		with patch.object(generate_fixed_schedule_batch_task, "retry", side_effect=Retry()) as mock_retry:
+			with self.assertRaises(Retry):
+				generate_fixed_schedule_batch_task.run([1, 2, 3], "2026-05-01", "2026-05-31")
+
+		mock_generate.assert_called_once_with([1, 2, 3], date(2026, 5, 1), date(2026, 5, 31))
+		self.assertEqual(mock_retry.call_args.kwargs["args"], ([2], "2026-05-01", "2026-05-31"))
+		self.assertEqual(mock_retry.call_args.kwargs["kwargs"], {"generated_ids": [1, 3]})
 
 
 class LichLamViecServiceEmployeeScopeTests(SimpleTestCase):
@@ -166,3 +196,279 @@ class LichLamViecServiceEmployeeScopeTests(SimpleTestCase):
 
 		self.assertEqual(result_1, {201})
 		self.assertEqual(result_2, {202})
+
+
+class BulkInsertLichLamViecThucTeTests(SimpleTestCase):
+	def test_copy_stream_encodes_csv_rows(self):
+		from apps.hrm_manager.lich_lam_viec.services import _CopyStream, _csv_value
+
+		snapshot = '{"tenca": "Ca sáng, 1"}'
+		line = ','.join(_csv_value(v) for v in (None, True, False, date(2026, 5, 1), snapshot, '')) + '\n'
+		self.assertEqual(line, ',t,f,2026-05-01,"{""tenca"": ""Ca sáng, 1""}",""\n')
+
+		stream = _CopyStream(iter(['a,b\n', 'c,d\n']))
+		self.assertEqual(stream.read(3), b'a,b')
+		self.assertEqual(stream.read(), b'\nc,d\n')
+		self.assertEqual(stream.read(), b'')
+
+	@patch("apps.hrm_manager.lich_lam_viec.services.Lichlamviecthucte.objects.bulk_create")
+	@patch("apps.hrm_manager.lich_lam_viec.services.connection")
+	def test_non_postgres_falls_back_to_bulk_create(self, mock_connection, mock_bulk_create):
+		from apps.hrm_manager.lich_lam_viec.services import bulk_insert_lich_lam_viec_thuc_te
+
+		mock_connection.vendor = 'sqlite'
+		rows = [(1, date(2026, 5, 1), 7, '{"tenca": "A"}'), (1, date(2026, 5, 2), None, 'ignored')]
+
+		count = bulk_insert_lich_lam_viec_thuc_te(3, 'CO_DINH', iter(rows))
+
+		self.assertEqual(count, 2)
+		mock_connection.cursor.assert_not_called()
+		objs = mock_bulk_create.call_args[0][0]
+		self.assertEqual([(o.calamviec_id, o.cophaingaynghi, o.snapshot_ca) for o in objs], [
+			(7, False, '{"tenca": "A"}'),
+			(None, True, None),
+		])
+		self.assertTrue(all(o.lichlamviec_id == 3 and o.nguongoc == 'CO_DINH' for o in objs))
+
+	@patch("apps.hrm_manager.lich_lam_viec.services.connection")
+	def test_fixed_schedule_expanded_with_single_insert_select(self, mock_connection):
+		from apps.hrm_manager.lich_lam_viec.services import expand_fixed_schedule_in_db
+
+		mock_connection.ops.quote_name.side_effect = lambda name: f'"{name}"'
+		cursor = mock_connection.cursor.return_value.__enter__.return_value
+		cursor.rowcount = 62
+
+		count = expand_fixed_schedule_in_db(3, {101, 102}, date(2026, 5, 1), date(2026, 5, 31), {7: '{"tenca": "A"}'})
+
+		self.assertEqual(count, 62)
+		cursor.execute.assert_called_once()
+		sql, params = cursor.execute.call_args[0]
+		self.assertIn('INSERT INTO "hrm"."LichLamViecThucTe"', sql)
+		self.assertIn('generate_series', sql)
+		self.assertIn('ISODOW', sql)
+		self.assertEqual(sorted(params['nhanvien_ids']), [101, 102])
+		self.assertEqual((params['ca_ids'], params['snapshots']), ([7], ['{"tenca": "A"}']))
+		self.assertEqual((params['lich_id'], params['nguongoc']), (3, 'CO_DINH'))
+
+	@patch("apps.hrm_manager.lich_lam_viec.services.connection")
+	def test_lichtrinh_pairs_deleted_with_single_statement(self, mock_connection):
+		from apps.hrm_manager.lich_lam_viec.services import delete_lich_lam_viec_thuc_te_pairs
+
+		mock_connection.vendor = 'postgresql'
+		mock_connection.ops.quote_name.side_effect = lambda name: f'"{name}"'
+		cursor = mock_connection.cursor.return_value.__enter__.return_value
+		cursor.rowcount = 3
+		pairs = [(101, date(2026, 5, 4)), (101, date(2026, 5, 5)), (102, date(2026, 5, 4))]
+
+		self.assertEqual(delete_lich_lam_viec_thuc_te_pairs(9, pairs), 3)
+
+		cursor.execute.assert_called_once()
+		sql, params = cursor.execute.call_args[0]
+		self.assertIn('USING unnest(%s::bigint[], %s::date[])', sql)
+		self.assertEqual(params, [[101, 101, 102], [date(2026, 5, 4), date(2026, 5, 5), date(2026, 5, 4)], 9])
+
+class ReconcileLichLamViecThucTeTests(SimpleTestCase):
+	@patch("apps.hrm_manager.lich_lam_viec.services.transaction.atomic", return_value=MagicMock())
+	@patch("apps.hrm_manager.lich_lam_viec.services.bulk_insert_lich_lam_viec_thuc_te", side_effect=lambda lich_id, nguongoc, rows: len(rows))
+	@patch("apps.hrm_manager.lich_lam_viec.services.Lichlamviecthucte.objects")
+	def test_only_changed_rows_are_written(self, mock_objects, mock_insert, mock_atomic):
+		from apps.hrm_manager.lich_lam_viec.services import reconcile_lich_lam_viec_thuc_te
+
+		d1, d2 = date(2026, 5, 4), date(2026, 5, 5)
+		existing_qs = MagicMock()
+		existing_qs.values_list.return_value = [
+			(1, 101, d1, 7, 'snap-v1'),   # giữ nguyên
+			(2, 101, d2, 7, 'snap-v1'),   # snapshot đổi → update
+			(3, 102, d1, 7, 'snap-v1'),   # NV 102 không còn ca ngày d1 → xóa
+		]
+		mock_objects.filter.return_value.delete.return_value = (1, {})
+
+		stats = reconcile_lich_lam_viec_thuc_te(9, 'CO_DINH', [
+			(101, d1, 7, 'snap-v1'),
+			(101, d2, 7, 'snap-v2'),
+			(102, d1, None, 'ignored'),   # ngày nghỉ mới → insert
+		], existing_qs)
+
+		self.assertEqual(stats, {'inserted': 1, 'updated': 1, 'deleted': 1, 'unchanged': 1})
+		mock_objects.filter.assert_called_once_with(id__in=[3])
+		updated = mock_objects.bulk_update.call_args[0][0]
+		self.assertEqual([(o.id, o.snapshot_ca) for o in updated], [(2, 'snap-v2')])
+		mock_insert.assert_called_once_with(9, 'CO_DINH', [(102, d1, None, None)])
+
+
+class ShiftSnapshotCacheTests(SimpleTestCase):
+	def setUp(self):
+		from apps.hrm_manager.utils import shift_snapshot_cache
+
+		shift_snapshot_cache._local.clear()
+
+	@patch("apps.hrm_manager.utils.shift_snapshot_cache.transaction.on_commit", side_effect=lambda func: func())
+	@patch("apps.hrm_manager.utils.shift_snapshot_cache.cache")
+	def test_loads_missing_shifts_once_then_serves_from_cache(self, mock_cache, mock_on_commit):
+		from apps.hrm_manager.utils.shift_snapshot_cache import (
+			KIND_LICH, get_shift_snapshots, invalidate_shift_snapshot,
+		)
+
+		loader = MagicMock(return_value={7: ("v1", '{"tenca": "A"}'), 8: ("v1", '{"tenca": "B"}')})
+		mock_cache.get_many.return_value = {}
+
+		first = get_shift_snapshots(KIND_LICH, [7, 8, None], loader)
+
+		self.assertEqual(first, {7: '{"tenca": "A"}', 8: '{"tenca": "B"}'})
+		loader.assert_called_once_with({7, 8})
+		written = mock_cache.set_many.call_args[0][0]
+		self.assertEqual(written["llv:ca:ver:7"], "v1")
+		self.assertEqual(written["llv:ca:snap:lich:7:v1"], '{"tenca": "A"}')
+
+		# Lần sau: Redis còn tem phiên bản → đọc từ LRU trong process, không chạm DB
+		mock_cache.get_many.return_value = {"llv:ca:ver:7": "v1", "llv:ca:ver:8": "v1"}
+		second = get_shift_snapshots(KIND_LICH, {7, 8}, loader)
+
+		self.assertEqual(second, first)
+		loader.assert_called_once()
+
+		invalidate_shift_snapshot(7)
+		mock_cache.delete.assert_called_with("llv:ca:ver:7")
+
+
+class AssignmentResolverTests(SimpleTestCase):
+	def setUp(self):
+		from apps.hrm_manager.utils import assignment_resolver
+
+		assignment_resolver._local.clear()
+
+	@patch("apps.hrm_manager.utils.assignment_resolver.transaction")
+	@patch("apps.hrm_manager.utils.assignment_resolver._load_direct_map", return_value={1: 10, 2: 10, 3: 20})
+	@patch("apps.hrm_manager.utils.assignment_resolver.cache")
+	def test_resolves_period_once_and_reuses_until_invalidated(self, mock_cache, mock_load, mock_transaction):
+		from apps.hrm_manager.utils.assignment_resolver import (
+			KIND_LICH_LAM_VIEC, get_assignment_resolver, invalidate_assignments,
+		)
+
+		mock_transaction.get_connection.return_value.in_atomic_block = False
+		mock_transaction.on_commit.side_effect = lambda func: func()
+		mock_cache.get.side_effect = lambda key: "v1" if key.startswith("assign:ver:") else None
+
+		first = get_assignment_resolver(KIND_LICH_LAM_VIEC, date(2026, 5, 1), date(2026, 5, 31))
+
+		self.assertEqual(first.direct_map(), {1: 10, 2: 10, 3: 20})
+		mock_load.assert_called_once_with(KIND_LICH_LAM_VIEC, date(2026, 5, 1), date(2026, 5, 31))
+		mock_cache.set.assert_called_once_with(
+			"assign:map:lichlamviec:v1:2026-05-01:2026-05-31", {1: 10, 2: 10, 3: 20}, timeout=600,
+		)
+
+		# Cùng phiên bản → dùng lại resolver trong process, không đọc lại DB
+		second = get_assignment_resolver(KIND_LICH_LAM_VIEC, date(2026, 5, 1), date(2026, 5, 31))
+		self.assertIs(second, first)
+		mock_load.assert_called_once()
+
+		invalidate_assignments(KIND_LICH_LAM_VIEC)
+		version_writes = [c for c in mock_cache.set.call_args_list if c[0][0] == "assign:ver:lichlamviec"]
+		self.assertEqual(len(version_writes), 2)
+
+
+class DepartmentTreeTests(SimpleTestCase):
+	def setUp(self):
+		from apps.hrm_manager.utils.department_tree import DepartmentTree
+
+		# 1 ─┬─ 2 ── 4
+		#    └─ 3 (inactive) ── 5
+		# 6 (gốc riêng)
+		self.tree = DepartmentTree([
+			(1, None, 'active'),
+			(2, 1, 'active'),
+			(3, 1, 'inactive'),
+			(4, 2, 'active'),
+			(5, 3, 'active'),
+			(6, None, 'active'),
+		])
+
+	def test_descendants_of_many_roots_in_one_lookup(self):
+		self.assertEqual(self.tree.descendants([1]), {2, 3, 4, 5})
+		self.assertEqual(self.tree.descendants(["2", 6], include_root=True), {2, 4, 6})
+		# Phòng ban không tồn tại: chỉ trả lại chính nó khi include_root
+		self.assertEqual(self.tree.descendants([99], include_root=True), {99})
+
+	def test_consolidate_drops_departments_with_selected_ancestor(self):
+		self.assertEqual(sorted(self.tree.consolidate([1, 2, 4, 6])), [1, 6])
+		# Chuỗi cha dừng sau phòng ban cha không active (giữ hành vi cũ chỉ xét phòng ban active)
+		self.assertEqual(sorted(self.tree.consolidate([1, 5])), [1, 5])
+		self.assertEqual(sorted(self.tree.consolidate([3, 5])), [3])
+
+	@patch("apps.hrm_manager.utils.department_tree._load_rows", return_value=[(1, None, 'active'), (2, 1, 'active')])
+	@patch("apps.hrm_manager.utils.department_tree.cache")
+	def test_tree_is_cached_per_version(self, mock_cache, mock_load):
+		from apps.hrm_manager.utils import department_tree
+
+		department_tree._local.clear()
+		mock_cache.get.side_effect = lambda key: "v1" if key == "dept:tree:ver" else None
+
+		first = department_tree.get_department_tree()
+		second = department_tree.get_department_tree()
+
+		self.assertIs(first, second)
+		mock_load.assert_called_once()
+		mock_cache.set.assert_called_once_with("dept:tree:v1", [(1, None, 'active'), (2, 1, 'active')], timeout=24 * 3600)
+
+	def test_subtree_filter_is_one_recursive_cte_with_array_param(self):
+		from apps.hrm_manager.__core__.models import Lichsucongtac
+		from apps.hrm_manager.utils.department_tree import department_subtree_q
+
+		with patch("apps.hrm_manager.utils.department_tree.connection") as mock_connection:
+			mock_connection.vendor = "postgresql"
+			q = department_subtree_q("phongban_id", ["5", 3, None])
+		sql, params = Lichsucongtac.objects.filter(q).query.sql_with_params()
+
+		self.assertIn('"phongban_id" IN (WITH RECURSIVE pb_subtree(id) AS (', sql)
+		self.assertIn("JOIN pb_subtree s ON c.phongbancha_id = s.id", sql)
+		self.assertEqual(params, ([3, 5],))
+
+		with self.assertRaises(ValueError):
+			department_subtree_q("phongban_id", ["abc"])
+
+
+class ShiftIntervalOverlapTests(SimpleTestCase):
+	def test_sweep_line_detects_overlap_with_earlier_long_interval(self):
+		from apps.hrm_manager.lich_lam_viec.validators import find_first_overlap
+
+		# Khoảng dài [0, 600) chồng với [500, 550) dù khoảng liền kề [100, 200) thì không
+		intervals = [{'start': 0, 'end': 600}, {'start': 100, 'end': 200}, {'start': 500, 'end': 550}]
+		self.assertIsNotNone(find_first_overlap(intervals))
+		self.assertIsNone(find_first_overlap([{'start': 0, 'end': 100}, {'start': 100, 'end': 200}]))
+
+	def test_overrides_build_intervals_without_db_and_apply_day_jump(self):
+		from apps.hrm_manager.lich_lam_viec.validators import build_shift_interval_index
+
+		index = build_shift_interval_index([7], overrides={7: {
+			'TenCa': 'Ca đêm',
+			'ChiTietKhungGio': [
+				{'GioBatDau': '18:00', 'GioKetThuc': '23:00'},
+				{'GioBatDau': '01:00', 'GioKetThuc': '05:00'},
+			],
+		}})
+
+		self.assertEqual(index[7]['name'], 'Ca đêm')
+		self.assertEqual(
+			[(start, end) for start, end, _ in index[7]['intervals']],
+			[(1080, 1380), (1500, 1740)],
+		)
+
+	def test_fixed_week_and_cycle_checks_use_shared_index(self):
+		from apps.hrm_manager.lich_lam_viec.validators import (
+			_validate_lichtrinh_cycle_overlap, validate_schedule_time_overlap,
+		)
+
+		index = {
+			1: {'name': 'Ca đêm', 'intervals': [(1320, 1920, '22:00 - 08:00')]},
+			2: {'name': 'Ca sáng', 'intervals': [(420, 960, '07:00 - 16:00')]},
+		}
+
+		is_valid, msg = validate_schedule_time_overlap(
+			[{'NgayTrongTuan': 0, 'CaID': 1}, {'NgayTrongTuan': 1, 'CaID': 2}], index,
+		)
+		self.assertFalse(is_valid)
+		self.assertIn("'Ca đêm' (22:00 - 08:00) trùng với 'Ca sáng'", msg)
+
+		# Wrap-around: ca đêm ngày cuối chu kỳ chồng ca sáng ngày đầu chu kỳ kế
+		self.assertIsNotNone(_validate_lichtrinh_cycle_overlap([('0', 2), ('2', 1)], 3, index))
+		self.assertIsNone(_validate_lichtrinh_cycle_overlap([('0', 2), ('1', 1)], 3, index))
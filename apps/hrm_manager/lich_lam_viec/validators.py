@@ -4,7 +4,7 @@ Mô tả: Validators cho Ca làm việc (HRM Business Logic)
 """
 from apps.hrm_manager.utils.view_helpers import parse_time_to_minutes as parse_time
 from collections import defaultdict
-from apps.hrm_manager.__core__.models import Calamviec
+from apps.hrm_manager.__core__.models import Calamviec, Khunggiolamviec
 
 
 def validate_shift_details(data):
@@ -177,9 +177,102 @@ def validate_shift_details(data):
 
     return True, None
 
-def validate_schedule_time_overlap(chi_tiet_ca):
+def _khung_gio_minute_intervals(pairs):
+    """
+    Đổi chuỗi khung giờ (phút trong ngày, theo thứ tự) của 1 ca thành khoảng phút tuyệt đối
+    tính từ 00:00 ngày bắt đầu ca, xử lý nhảy ngày giữa các khung và qua đêm trong 1 khung.
+
+    Args:
+        pairs (list): [(start, end, raw_text)] - start/end là phút trong ngày (None = bỏ qua)
+
+    Returns:
+        list: [(abs_start, abs_end, raw_text)]
+    """
+    intervals = []
+    current_day_offset = 0  # 0=Ngày 1, 1440=Ngày 2
+    previous_end_minute = -1
+    for start, end, raw_text in pairs:
+        if start is None or end is None:
+            continue
+
+        # Nếu Start < End của khung trước -> Sang ngày hôm sau
+        if previous_end_minute != -1 and start < previous_end_minute:
+            current_day_offset += 1440
+
+        abs_start = current_day_offset + start
+        abs_end = current_day_offset + end
+        # Qua đêm nội bộ (VD: 22:00 -> 02:00)
+        if end <= start:
+            abs_end += 1440
+
+        intervals.append((abs_start, abs_end, raw_text))
+        previous_end_minute = abs_end % 1440
+    return intervals
+
+
+def _time_to_minutes(value):
+    return value.hour * 60 + value.minute if value else None
+
+
+def build_shift_interval_index(ca_ids, overrides=None):
+    """
+    Chỉ mục khoảng phút của các ca: tính 1 lần cho mỗi ca từ 1 query khung giờ (theo lô).
+
+    Args:
+        ca_ids (iterable): ID ca cần nạp
+        overrides (dict): {ca_id: payload ca (TenCa, ChiTietKhungGio)} - dùng dữ liệu mới thay cho DB
+            (VD: ca đang được sửa)
+
+    Returns:
+        dict: {ca_id: {'name': tên ca, 'intervals': [(abs_start, abs_end, raw_text)]}}
+    """
+    overrides = overrides or {}
+    db_ids = {int(ca_id) for ca_id in ca_ids if ca_id} - set(overrides)
+
+    index = {}
+    if db_ids:
+        names = dict(Calamviec.objects.filter(id__in=db_ids).values_list('id', 'tencalamviec'))
+        pairs_map = defaultdict(list)
+        rows = Khunggiolamviec.objects.filter(
+            calamviec_id__in=db_ids
+        ).order_by('calamviec_id', 'id').values_list('calamviec_id', 'thoigianbatdau', 'thoigianketthuc')
+        for ca_id, bat_dau, ket_thuc in rows:
+            start_str = bat_dau.strftime('%H:%M') if bat_dau else None
+            end_str = ket_thuc.strftime('%H:%M') if ket_thuc else None
+            pairs_map[ca_id].append((_time_to_minutes(bat_dau), _time_to_minutes(ket_thuc), f"{start_str} - {end_str}"))
+        for ca_id, name in names.items():
+            index[ca_id] = {'name': name, 'intervals': _khung_gio_minute_intervals(pairs_map.get(ca_id, []))}
+
+    for ca_id, ca_data in overrides.items():
+        pairs = [
+            (parse_time(kg.get('GioBatDau')), parse_time(kg.get('GioKetThuc')), f"{kg.get('GioBatDau')} - {kg.get('GioKetThuc')}")
+            for kg in ca_data.get('ChiTietKhungGio', [])
+        ]
+        index[int(ca_id)] = {'name': ca_data.get('TenCa', ''), 'intervals': _khung_gio_minute_intervals(pairs)}
+    return index
+
+
+def find_first_overlap(intervals):
+    """
+    Sweep-line: sắp theo thời điểm bắt đầu, giữ khoảng có điểm kết thúc xa nhất đã quét.
+    intervals: list dict có 'start', 'end'. Trả về (a, b) chồng nhau đầu tiên hoặc None.
+    """
+    if len(intervals) < 2:
+        return None
+    ordered = sorted(intervals, key=lambda x: x['start'])
+    reach = ordered[0]
+    for item in ordered[1:]:
+        if reach['end'] > item['start']:
+            return reach, item
+        if item['end'] > reach['end']:
+            reach = item
+    return None
+
+
+def validate_schedule_time_overlap(chi_tiet_ca, interval_index=None):
     """
     ✅ Check overlap theo timeline tuần (cross-day), xử lý ca qua đêm.
+    ✅ TỐI ƯU: interval_index (build_shift_interval_index) truyền vào để dùng chung khi kiểm tra nhiều lịch.
     """
     if not chi_tiet_ca:
         return True, None
@@ -199,146 +292,81 @@ def validate_schedule_time_overlap(chi_tiet_ca):
     if not all_ca_ids:
         return True, None
 
-    cas = Calamviec.objects.filter(id__in=all_ca_ids).prefetch_related('khunggiolamviec_set')
-
-    ca_intervals_cache = {}
-    for ca in cas:
-        intervals = []
-        
-        # --- LOGIC MỚI: Theo dõi offset ngày trong chuỗi khung giờ ---
-        current_day_offset = 0 # 0=Ngày 1, 1440=Ngày 2
-        previous_end_minute = -1
-        
-        for kg in ca.khunggiolamviec_set.order_by('id'):
-            start_str = kg.thoigianbatdau.strftime('%H:%M') if kg.thoigianbatdau else None
-            end_str = kg.thoigianketthuc.strftime('%H:%M') if kg.thoigianketthuc else None
-            
-            start = parse_time(start_str)
-            end = parse_time(end_str)
-            
-            if start is None or end is None:
-                continue
-
-            # 1.Logic nhảy ngày: Nếu Start < End của khung trước -> Sang ngày hôm sau
-            if previous_end_minute != -1 and start < previous_end_minute:
-                current_day_offset += 1440
-
-            # 2.Tính thời gian tuyệt đối
-            abs_start = current_day_offset + start
-            abs_end = current_day_offset + end
-
-            # 3.Xử lý qua đêm nội bộ (VD: 22:00 -> 02:00)
-            if end <= start:
-                abs_end += 1440
-
-            intervals.append({
-                'start': abs_start,
-                'end': abs_end,
-                'ca_name': ca.tencalamviec,
-                'raw_text': f"{start_str} - {end_str}"
-            })
-            
-            # 4.Cập nhật mốc so sánh (lấy phần dư để về giờ trong ngày 0-1440)
-            previous_end_minute = abs_end % 1440
-            
-        ca_intervals_cache[ca.id] = intervals
+    if interval_index is None:
+        interval_index = build_shift_interval_index(all_ca_ids)
 
     # build week timeline
     all_week = []
     for day, ca_ids in day_ca_map.items():
         day_offset = int(day) * 1440
         for ca_id in ca_ids:
-            for it in ca_intervals_cache.get(ca_id, []):
+            ca_info = interval_index.get(int(ca_id))
+            if not ca_info:
+                continue
+            for start, end, raw_text in ca_info['intervals']:
                 all_week.append({
-                    'start': day_offset + it['start'],
-                    'end': day_offset + it['end'],
+                    'start': day_offset + start,
+                    'end': day_offset + end,
                     'day': day,
-                    'ca_name': it['ca_name'],
-                    'raw_text': it['raw_text']
+                    'ca_name': ca_info['name'],
+                    'raw_text': raw_text
                 })
 
-    if len(all_week) < 2:
-        return True, None
-
-    all_week.sort(key=lambda x: x['start'])
-    for i in range(len(all_week) - 1):
-        cur = all_week[i]
-        nxt = all_week[i + 1]
-        if cur['end'] > nxt['start']:
-            d1 = DAY_NAMES[cur['day']] if 0 <= cur['day'] < len(DAY_NAMES) else f"Ngày {cur['day']}"
-            d2 = DAY_NAMES[nxt['day']] if 0 <= nxt['day'] < len(DAY_NAMES) else f"Ngày {nxt['day']}"
-            return False, (
-                f"Xung đột thời gian giữa {d1} và {d2}: "
-                f"'{cur['ca_name']}' ({cur['raw_text']}) trùng với "
-                f"'{nxt['ca_name']}' ({nxt['raw_text']})"
-            )
+    overlap = find_first_overlap(all_week)
+    if overlap:
+        cur, nxt = overlap
+        d1 = DAY_NAMES[cur['day']] if 0 <= cur['day'] < len(DAY_NAMES) else f"Ngày {cur['day']}"
+        d2 = DAY_NAMES[nxt['day']] if 0 <= nxt['day'] < len(DAY_NAMES) else f"Ngày {nxt['day']}"
+        return False, (
+            f"Xung đột thời gian giữa {d1} và {d2}: "
+            f"'{cur['ca_name']}' ({cur['raw_text']}) trùng với "
+            f"'{nxt['ca_name']}' ({nxt['raw_text']})"
+        )
 
     return True, None
 
 
-def _validate_lichtrinh_cycle_overlap(all_ct_in_cycle, songaylap, editing_ca_id, new_ca_data):
+def _validate_lichtrinh_cycle_overlap(cycle_items, songaylap, interval_index):
     """
     Kiểm tra xung đột thời gian trong 1 chu kỳ lịch trình,
     bao gồm cả wrap-around (ngày cuối → ngày đầu chu kỳ kế).
+
+    Args:
+        cycle_items (list): [(calamviectungngay, calamviec_id)] của chu kỳ
+        songaylap (int): Số ngày lặp của chu kỳ
+        interval_index (dict): build_shift_interval_index (đã áp dữ liệu mới của ca đang sửa)
     """
     all_intervals = []
-    for ct in all_ct_in_cycle:
-        ngay = int(ct.calamviectungngay) if ct.calamviectungngay else 0
+    for calamviectungngay, ca_id in cycle_items:
+        ngay = int(calamviectungngay) if calamviectungngay else 0
         day_offset = ngay * 1440  # offset phút theo ngày trong chu kỳ
-
-        if ct.calamviec_id == editing_ca_id:
-            # Dùng payload mới
-            khung_gios = new_ca_data.get('ChiTietKhungGio', [])
-            for kg in khung_gios:
-                start = parse_time(kg.get('GioBatDau'))
-                end = parse_time(kg.get('GioKetThuc'))
-                if start is None or end is None:
-                    continue
-                abs_start = day_offset + start
-                abs_end = day_offset + end
-                if end <= start:
-                    abs_end += 1440
-                all_intervals.append({
-                    'start': abs_start, 'end': abs_end,
-                    'ca_name': new_ca_data.get('TenCa', ''),
-                    'ngay': ngay
-                })
-        elif ct.calamviec:
-            # Đọc từ DB
-            for kg in ct.calamviec.khunggiolamviec_set.order_by('id'):
-                start = parse_time(kg.thoigianbatdau.strftime('%H:%M'))
-                end = parse_time(kg.thoigianketthuc.strftime('%H:%M'))
-                if start is None or end is None:
-                    continue
-                abs_start = day_offset + start
-                abs_end = day_offset + end
-                if end <= start:
-                    abs_end += 1440
-                all_intervals.append({
-                    'start': abs_start, 'end': abs_end,
-                    'ca_name': ct.calamviec.tencalamviec,
-                    'ngay': ngay
-                })
+        ca_info = interval_index.get(ca_id) if ca_id else None
+        if not ca_info:
+            continue
+        for start, end, _ in ca_info['intervals']:
+            all_intervals.append({
+                'start': day_offset + start, 'end': day_offset + end,
+                'ca_name': ca_info['name'],
+                'ngay': ngay
+            })
 
     # ── Wrap-around check ──
-    cycle_total_minutes = songaylap * 1440
-    first_day_intervals = [iv for iv in all_intervals if iv['ngay'] == 0]
-    for iv in first_day_intervals:
-        all_intervals.append({
-            **iv,
-            'start': iv['start'] + cycle_total_minutes,
-            'end': iv['end'] + cycle_total_minutes,
-        })
-
-    # Sort và check overlap
-    all_intervals.sort(key=lambda x: x['start'])
-    for i in range(len(all_intervals) - 1):
-        cur = all_intervals[i]
-        nxt = all_intervals[i + 1]
-        if cur['end'] > nxt['start']:
-            return (
-                f"'{cur['ca_name']}' (Ngày {cur['ngay']+1}) "
-                f"trùng với '{nxt['ca_name']}' (Ngày {nxt['ngay']+1})"
-            )
-
-    return None
\ No newline at end of file
+    if songaylap:
+        cycle_total_minutes = songaylap * 1440
+        first_day_intervals = [iv for iv in all_intervals if iv['ngay'] == 0]
+        for iv in first_day_intervals:
+            all_intervals.append({
+                **iv,
+                'start': iv['start'] + cycle_total_minutes,
+                'end': iv['end'] + cycle_total_minutes,
+            })
+
+    overlap = find_first_overlap(all_intervals)
+    if overlap:
+        cur, nxt = overlap
+        return (
+            f"'{cur['ca_name']}' (Ngày {cur['ngay']+1}) "
+            f"trùng với '{nxt['ca_name']}' (Ngày {nxt['ngay']+1})"
+        )
+
+    return None
@@ -14,7 +14,7 @@ from django.utils import timezone
 from django.db import transaction
 from .services import CaLamViecService, LichLamViecService, ConflictException
 from apps.hrm_manager.utils.permissions import require_api_permission, require_view_permission
-from apps.hrm_manager.to_chuc_nhan_su.views import get_all_child_department_ids
+from apps.hrm_manager.utils.department_tree import department_subtree_q
 
 from apps.hrm_manager.utils.view_helpers import (
     get_list_context, 
@@ -89,11 +89,6 @@ def _parse_positive_int(raw_value, default_value, min_value=1, max_value=None):
     return value
 
 
-def _format_time_range(start_time, end_time):
-    if not start_time or not end_time:
-        return ""
-    return f"{start_time.strftime('%H:%M')} - {end_time.strftime('%H:%M')}"
-
 # --- 1.VIEWS: THIẾT KẾ LỊCH LÀM VIỆC ---
 
 @login_required
@@ -583,10 +578,11 @@ def api_tong_hop_lichlamviec(request):
             return json_error('Nhóm lịch không hợp lệ')
 
     dept_filter_raw = request.GET.get('phongban_id')
-    dept_ids = set()
+    dept_filter = None
     if dept_filter_raw:
         try:
-            dept_ids = set(get_all_child_department_ids(int(dept_filter_raw), isnclude_root=True))
+            # ✅ TỐI ƯU: Lọc cây con phòng ban ngay trong câu SQL (WITH RECURSIVE), không bung list ID
+            dept_filter = department_subtree_q('phongban_id', [dept_filter_raw])
         except ValueError:
             return json_error('Phòng ban không hợp lệ')
 
@@ -596,8 +592,8 @@ def api_tong_hop_lichlamviec(request):
         nhanvien_id__isnull=False
     )
 
-    if dept_ids:
-        history_qs = history_qs.filter(phongban_id__in=dept_ids)
+    if dept_filter is not None:
+        history_qs = history_qs.filter(dept_filter)
 
     if search_query:
         history_qs = history_qs.filter(
@@ -655,17 +651,24 @@ def api_tong_hop_lichlamviec(request):
     ).filter(
         Q(is_deleted=False) | Q(is_deleted__isnull=True)
     ).select_related(
-        'calamviec',
         'lichlamviec'
-    ).prefetch_related(
-        Prefetch('calamviec__khunggiolamviec_set', queryset=Khunggiolamviec.objects.order_by('id'))
     ).order_by('nhanvien_id', 'ngaylamviec', 'id')
 
     if schedule_filter_id:
         schedule_qs = schedule_qs.filter(lichlamviec_id=schedule_filter_id)
 
+    schedule_items = list(schedule_qs)
+
+    # ✅ TỐI ƯU: Thông tin ca hiện tại đọc từ cache snapshot (không JOIN/prefetch Ca + Khung giờ)
+    ca_snapshots = {
+        ca_id: json.loads(snapshot)
+        for ca_id, snapshot in CaLamViecService.get_snapshot_map(
+            {item.calamviec_id for item in schedule_items if item.calamviec_id}
+        ).items()
+    }
+
     schedule_map = defaultdict(lambda: defaultdict(list))
-    for item in schedule_qs:
+    for item in schedule_items:
         if not item.ngaylamviec:
             continue
 
@@ -673,8 +676,9 @@ def api_tong_hop_lichlamviec(request):
         khung_gio = []
         ten_ca = 'Ngày nghỉ'
 
-        if item.calamviec:
-            ten_ca = item.calamviec.tencalamviec or 'Ca làm việc'
+        current_ca = ca_snapshots.get(item.calamviec_id) if item.calamviec_id else None
+        if current_ca is not None:
+            ten_ca = current_ca.get('tencalamviec') or 'Ca làm việc'
             
             # Đọc từ snapshot_ca nếu có để đảm bảo tính nhất quán dữ liệu quá khứ
             if item.snapshot_ca:
@@ -693,12 +697,13 @@ def api_tong_hop_lichlamviec(request):
                 except (json.JSONDecodeError, TypeError):
                     pass
             
-            # Fallback nếu không có snapshot
+            # Fallback nếu không có snapshot: khung giờ hiện tại của ca
             if not khung_gio:
-                for frame in item.calamviec.khunggiolamviec_set.all():
-                    display = _format_time_range(frame.thoigianbatdau, frame.thoigianketthuc)
-                    if display:
-                        khung_gio.append(display)
+                for kg in current_ca.get('khunggio', []):
+                    start = kg.get('thoigianbatdau')
+                    end = kg.get('thoigianketthuc')
+                    if start and end:
+                        khung_gio.append(f"{start} - {end}")
 
         schedule_map[item.nhanvien_id][date_key].append({
             'ca_id': item.calamviec_id,
@@ -0,0 +1,125 @@
+import datetime as dt
+import json
+from calendar import monthrange
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import RequestFactory
+from django.utils import timezone
+
+from apps.dich_vu_dien_nuoc.views import get_filtered_revenue_data
+from apps.hrm_manager.__core__.models import Bangchamcong, Bangluong, Lichlamviec
+from apps.hrm_manager.cham_cong.views import (
+    _build_payload_rows_from_saved_record, api_tong_hop_cham_cong_thang,
+    build_cham_cong_data_for_update, calculate_bang_cham_cong_objects,
+)
+from apps.hrm_manager.lich_lam_viec.services import LichLamViecService
+from apps.hrm_manager.quan_ly_luong.views import genarate_phieu_luong_from_bang_luong
+from apps.hrm_manager.utils.benchmark import BENCHMARK_PREFIX, compare_with_baseline, measure
+
+
+BENCHMARK_NAMES = ('phieu_luong', 'cham_cong_objects', 'lich_co_dinh', 'tong_hop_thang', 'doanh_thu')
+
+
+class Command(BaseCommand):
+    help = "Time payroll / attendance / schedule / revenue hot paths on seeded data (wall time, SQL queries, peak memory)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--prefix", default=BENCHMARK_PREFIX, help="Code prefix used by seed_benchmark_data")
+        parser.add_argument("--month", default=timezone.localdate().strftime("%Y-%m"), help="Seeded month (YYYY-MM)")
+        parser.add_argument("--repeat", type=int, default=3, help="Runs per benchmark")
+        parser.add_argument("--only", nargs="*", choices=BENCHMARK_NAMES, help="Run only these benchmarks")
+        parser.add_argument("--output", help="Write results as JSON to this file")
+        parser.add_argument("--baseline", help="JSON results of a previous run to compare against")
+        parser.add_argument("--max-regression", type=float, default=20.0, help="Allowed median slowdown vs baseline (%%)")
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError("Benchmarks must run against PostgreSQL.")
+
+        try:
+            month_start = dt.datetime.strptime(options["month"], "%Y-%m").date()
+        except ValueError:
+            raise CommandError(f"Tháng không hợp lệ: {options['month']} (định dạng YYYY-MM)")
+        month_end = month_start.replace(day=monthrange(month_start.year, month_start.month)[1])
+        prefix = options["prefix"]
+
+        bangluong = Bangluong.objects.filter(mabangluong=f"{prefix}-BL-{month_start:%Y%m}").first()
+        if bangluong is None:
+            raise CommandError(f"Chưa có dữ liệu benchmark cho {month_start:%Y-%m}. Chạy seed_benchmark_data trước.")
+
+        selected = options["only"] or BENCHMARK_NAMES
+        repeat = options["repeat"]
+        results = []
+
+        if 'phieu_luong' in selected:
+            results.append(measure(
+                'phieu_luong', genarate_phieu_luong_from_bang_luong, bangluong.id, repeat=repeat,
+            ))
+
+        if 'cham_cong_objects' in selected:
+            # Payload 1 ngày làm việc đầy đủ (chuẩn bị ngoài phần đo)
+            ngay = (
+                Bangchamcong.objects
+                .filter(nhanvien__manhanvien__startswith=prefix, ngaylamviec__range=[month_start, month_end])
+                .order_by('ngaylamviec').values_list('ngaylamviec', flat=True).first()
+            )
+            payload = [
+                row
+                for record in build_cham_cong_data_for_update(ngay)
+                for row in _build_payload_rows_from_saved_record(record)
+            ] if ngay else []
+            # Tên cố định để so với baseline giữa các lần chạy; kích thước payload ghi riêng
+            result = measure('cham_cong_objects', calculate_bang_cham_cong_objects, payload, repeat=repeat)
+            result['payload_rows'] = len(payload)
+            results.append(result)
+
+        if 'lich_co_dinh' in selected:
+            # Sinh lịch thực tế cho tháng kế tiếp của các lịch cố định benchmark (rollback sau mỗi lần)
+            next_start = month_end + dt.timedelta(days=1)
+            next_end = next_start.replace(day=monthrange(next_start.year, next_start.month)[1])
+            lich_list = list(Lichlamviec.objects.filter(malichlamviec__startswith=prefix, loaikichbanlamviec='CO_DINH'))
+
+            def generate_fixed_schedules():
+                for lich in lich_list:
+                    LichLamViecService.generate_actual_schedule_for_fixed(lich, start_date=next_start, end_date=next_end)
+
+            results.append(measure('lich_co_dinh', generate_fixed_schedules, repeat=repeat))
+
+        if 'tong_hop_thang' in selected:
+            request = RequestFactory().get('/', {'thang': month_start.strftime("%Y-%m")})
+            request.user = get_user_model()(username='benchmark', is_superuser=True, is_active=True)
+            results.append(measure('tong_hop_thang', api_tong_hop_cham_cong_thang, request, repeat=repeat))
+
+        if 'doanh_thu' in selected:
+            start_date = (month_start - dt.timedelta(days=365)).replace(day=1)
+            results.append(measure(
+                'doanh_thu', get_filtered_revenue_data, start_date=start_date, end_date=month_end, repeat=repeat,
+            ))
+
+        self._print(results)
+
+        if options["output"]:
+            with open(options["output"], "w", encoding="utf-8") as f:
+                json.dump(results, f, ensure_ascii=False, indent=2)
+
+        if options["baseline"]:
+            with open(options["baseline"], encoding="utf-8") as f:
+                regressions = compare_with_baseline(results, json.load(f), options["max_regression"])
+            if regressions:
+                raise CommandError("Performance regressions:\n  " + "\n  ".join(regressions))
+            self.stdout.write(self.style.SUCCESS("No regressions vs baseline."))
+
+    def _print(self, results):
+        header = (
+            f"{'benchmark':<28}{'runs':>6}{'min ms':>12}{'median ms':>12}{'queries':>10}{'peak KB':>12}"
+            f"{'payload':>10}"
+        )
+        self.stdout.write(header)
+        self.stdout.write("-" * len(header))
+        for r in results:
+            self.stdout.write(
+                f"{r['name']:<28}{r['runs']:>6}{r['wall_ms_min']:>12}{r['wall_ms_median']:>12}"
+                f"{r['queries']:>10}{r['peak_mem_kb']:>12}{r.get('payload_rows', ''):>10}"
+            )
@@ -0,0 +1,449 @@
+import datetime as dt
+import json
+import random
+from calendar import monthrange
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+
+from apps.dich_vu_dien_nuoc.models import (
+    CtThanhtoanDichvu, Dichvu, Hopdong as HopdongDichvu, Loaidichvu, ThanhtoanDichvu, TonghopDoanhthuThang,
+)
+from apps.dich_vu_dien_nuoc.services import DoanhThuThangService
+from apps.hrm_manager.__core__.models import (
+    Bangchamcong, Bangluong, Calamviec, Chedoluong, Congty, Congviec, Khunggiolamviec, Khunggionghitrua,
+    Kyluong, Lichlamviec, LichlamviecCodinh, LichlamviecPhongban, Lichlamviecthucte, Lichsucongtac,
+    Loainhanvien, Nhanvien, NhanvienChedoluong, Phantuluong, Phieuluong, Ctphieuluong, Phongban,
+    PhongbanChedoluong, Quytacchedoluong, Thietlapsolieucodinh, Tonghopchamcong,
+)
+from apps.hrm_manager.cham_cong.services import TongHopChamCongService
+from apps.hrm_manager.lich_lam_viec.services import CaLamViecService
+from apps.hrm_manager.quan_ly_luong.services import BangLuongService, KyLuongService
+from apps.hrm_manager.utils.benchmark import BENCHMARK_PREFIX
+from apps.hrm_manager.utils.department_tree import invalidate_department_tree
+
+
+BATCH_SIZE = 2000
+# Số tháng thông báo dịch vụ (tính lùi từ tháng benchmark)
+REVENUE_MONTHS = 12
+
+# (mã, tên, loại chấm công, khung giờ [(bắt đầu, kết thúc, công)], nghỉ trưa [(bắt đầu, kết thúc)])
+SHIFTS = [
+    ('HC', 'Hành chính', 'CO_DINH', [('08:00', '12:00', 0.5), ('13:00', '17:00', 0.5)], [('12:00', '13:00')]),
+    ('SANG', 'Ca sáng', 'CO_DINH', [('06:00', '14:00', 1)], [('10:00', '10:30')]),
+    ('DEM', 'Ca đêm', 'LINH_DONG', [('22:00', '06:00', 1)], [('02:00', '02:30')]),
+]
+
+# (mã quy tắc, loại phần tử, nguồn dữ liệu, nguồn chi tiết / biểu thức)
+PAYROLL_RULES = [
+    ('LUONG_CO_BAN', 'THU_NHAP', 'system', 'thietlapsolieucodinh.giatrimacdinh'),
+    ('CONG_THUC_TE', 'THU_NHAP', 'system', 'bangchamcong.tong_cong_lamviec'),
+    ('CONG_CHUAN', 'THU_NHAP', 'system', 'lichlamviecthucte.tong_cong_lamviec_thucte'),
+    ('SO_LUONG_AN', 'THU_NHAP', 'system', 'bangchamcong.tong_so_luong_an'),
+    ('PHUT_DI_MUON', 'KHAU_TRU', 'system', 'bangchamcong.tong_di_muon_phut'),
+    ('LUONG_THUC_TE', 'THU_NHAP', 'system', 'bangluong.luong_thuc_te_phan_bo'),
+    ('PHU_CAP_AN', 'THU_NHAP', 'formula', 'SO_LUONG_AN * 30000'),
+    ('PHAT_DI_MUON', 'KHAU_TRU', 'formula', 'ROUND(PHUT_DI_MUON * LUONG_CO_BAN / (CONG_CHUAN * 480), 0) if CONG_CHUAN > 0 else 0'),
+    ('TONG_THU_NHAP', 'THU_NHAP', 'formula', 'LUONG_THUC_TE + PHU_CAP_AN'),
+    ('BHXH', 'KHAU_TRU', 'formula', 'LUONG_CO_BAN * 0.105'),
+    ('THU_NHAP_TINH_THUE', 'THU_NHAP', 'formula', 'TONG_THU_NHAP - BHXH - 11000000'),
+    ('THUE_TNCN', 'KHAU_TRU', 'formula', 'IF(THU_NHAP_TINH_THUE > 0, THU_NHAP_TINH_THUE * 0.1, 0)'),
+    ('TB_THU_NHAP_NHOM', 'THU_NHAP', 'formula', 'AVG(TONG_THU_NHAP)'),
+    ('THUC_LINH', 'THU_NHAP', 'formula', 'TONG_THU_NHAP - BHXH - THUE_TNCN - PHAT_DI_MUON'),
+]
+
+
+def _parse_month(value):
+    try:
+        return dt.datetime.strptime(value, "%Y-%m").date()
+    except ValueError:
+        raise CommandError(f"Tháng không hợp lệ: {value} (định dạng YYYY-MM)")
+
+
+def _hm(value):
+    return dt.datetime.strptime(value, "%H:%M").time()
+
+
+class Command(BaseCommand):
+    help = "Seed a synthetic organisation (companies, department tree, employees, shifts, a month of schedules/attendance, payroll rules, service revenue) for benchmarks"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--companies", type=int, default=2, help="Number of companies")
+        parser.add_argument("--depth", type=int, default=4, help="Department tree depth per company")
+        parser.add_argument("--fanout", type=int, default=3, help="Child departments per department")
+        parser.add_argument("--employees", type=int, default=3000, help="Total number of employees")
+        parser.add_argument("--team-size", type=int, default=12, help="Employees sharing one team job per shift")
+        parser.add_argument("--contracts", type=int, default=200, help="Service contracts for revenue data")
+        parser.add_argument("--month", default=timezone.localdate().strftime("%Y-%m"), help="Month to seed (YYYY-MM)")
+        parser.add_argument("--seed", type=int, default=42, help="Random seed (deterministic data)")
+        parser.add_argument("--prefix", default=BENCHMARK_PREFIX, help="Code prefix marking synthetic rows")
+        parser.add_argument("--flush", action="store_true", help="Only delete previously seeded rows with this prefix")
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError("Benchmark data requires PostgreSQL (schema hrm).")
+
+        self.prefix = options["prefix"]
+        self.rng = random.Random(options["seed"])
+        self.now = timezone.now()
+
+        with transaction.atomic():
+            deleted = self._flush()
+            # Cây phòng ban thay đổi (xóa + sinh lại) → bỏ chỉ mục cây đã cache
+            invalidate_department_tree()
+            self.stdout.write(f"Deleted {deleted} previously seeded rows (prefix={self.prefix}).")
+            if options["flush"]:
+                return
+
+            month_start = _parse_month(options["month"])
+            month_end = month_start.replace(day=monthrange(month_start.year, month_start.month)[1])
+
+            departments = self._seed_departments(options["companies"], options["depth"], options["fanout"])
+            employees = self._seed_employees(options["employees"], departments)
+            shifts = self._seed_shifts()
+            self._seed_schedules(departments, shifts, month_start)
+            self._seed_actual_schedules(employees, shifts, month_start, month_end)
+            jobs = self._seed_jobs()
+            attendance_count = self._seed_attendance(employees, shifts, jobs, month_start, month_end, options["team_size"])
+            rollup_count = TongHopChamCongService.rebuild(thang_tu=month_start, thang_den=month_start)
+            bangluong = self._seed_payroll(employees, month_start, month_end)
+            payments = self._seed_revenue(options["contracts"], month_start)
+            revenue_from = self._month_back(month_start, REVENUE_MONTHS - 1)
+            revenue_rollup_count = DoanhThuThangService.rebuild(thang_tu=revenue_from, thang_den=month_start)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Seeded {len(departments)} departments, {len(employees)} employees, {len(shifts)} shifts, "
+            f"{attendance_count} attendance rows ({rollup_count} rollup rows), "
+            f"bangluong_id={bangluong.id}, {payments} service payments ({revenue_rollup_count} revenue rollup rows) "
+            f"for {month_start:%Y-%m}."
+        ))
+
+    # ── Xóa dữ liệu benchmark cũ (theo prefix) ──
+    def _flush(self):
+        p = self.prefix
+        nv_ids = Nhanvien.objects.filter(manhanvien__startswith=p).values('id')
+        ca_ids = Calamviec.objects.filter(macalamviec__startswith=p).values('id')
+        pb_ids = Phongban.objects.filter(maphongban__startswith=p).values('id')
+        cdl_ids = Chedoluong.objects.filter(machedo__startswith=p).values('id')
+        lich_ids = Lichlamviec.objects.filter(malichlamviec__startswith=p).values('id')
+        bl_qs = Bangluong.objects.filter(mabangluong__startswith=p)
+        hd_ids = HopdongDichvu.objects.filter(sohd__startswith=p).values('id_hopdong')
+        tt_ids = ThanhtoanDichvu.objects.filter(sotbdv__startswith=p).values('id')
+
+        querysets = [
+            Ctphieuluong.objects.filter(phieuluong__bangluong__in=bl_qs),
+            Phieuluong.objects.filter(bangluong__in=bl_qs),
+            bl_qs,
+            Thietlapsolieucodinh.objects.filter(nhanvien_id__in=nv_ids),
+            Quytacchedoluong.objects.filter(chedoluong_id__in=cdl_ids),
+            NhanvienChedoluong.objects.filter(chedoluong_id__in=cdl_ids),
+            PhongbanChedoluong.objects.filter(chedoluong_id__in=cdl_ids),
+            Chedoluong.objects.filter(id__in=cdl_ids),
+            Phantuluong.objects.filter(maphantu__startswith=p),
+            Tonghopchamcong.objects.filter(nhanvien_id__in=nv_ids),
+            Bangchamcong.objects.filter(nhanvien_id__in=nv_ids),
+            Lichlamviecthucte.objects.filter(nhanvien_id__in=nv_ids),
+            LichlamviecCodinh.objects.filter(lichlamviec_id__in=lich_ids),
+            LichlamviecPhongban.objects.filter(lichlamviec_id__in=lich_ids),
+            Lichlamviec.objects.filter(id__in=lich_ids),
+            Khunggiolamviec.objects.filter(calamviec_id__in=ca_ids),
+            Khunggionghitrua.objects.filter(calamviec_id__in=ca_ids),
+            Calamviec.objects.filter(id__in=ca_ids),
+            Congviec.objects.filter(macongviec__startswith=p),
+            Lichsucongtac.objects.filter(nhanvien_id__in=nv_ids),
+            Nhanvien.objects.filter(manhanvien__startswith=p),
+            Loainhanvien.objects.filter(maloainv__startswith=p),
+            Phongban.objects.filter(id__in=pb_ids),
+            Congty.objects.filter(macongty__startswith=p),
+            TonghopDoanhthuThang.objects.filter(id_hopdong_id__in=hd_ids),
+            CtThanhtoanDichvu.objects.filter(id_thanhtoan_dichvu_id__in=tt_ids),
+            ThanhtoanDichvu.objects.filter(id__in=tt_ids),
+            HopdongDichvu.objects.filter(id_hopdong__in=hd_ids),
+            Dichvu.objects.filter(tendichvu__startswith=p),
+            Loaidichvu.objects.filter(tenloaidichvu__startswith=p),
+        ]
+        # Xóa theo thứ tự con → cha (FK DO_NOTHING, không cascade). Kỳ lương được dùng chung nên giữ lại.
+        return sum(qs.delete()[0] for qs in querysets)
+
+    # ── Công ty & cây phòng ban ──
+    def _seed_departments(self, companies, depth, fanout):
+        departments = []
+        for c in range(1, companies + 1):
+            congty = Congty.objects.create(
+                macongty=f"{self.prefix}-CT{c}", tencongty_vi=f"Công ty benchmark {c}", created_at=self.now
+            )
+            level_nodes = Phongban.objects.bulk_create([Phongban(
+                maphongban=f"{self.prefix}-CT{c}-PB", tenphongban=f"Khối {c}", level=1,
+                trangthai='active', congty=congty, created_at=self.now,
+            )])
+            departments.extend(level_nodes)
+            for level in range(2, depth + 1):
+                children = [
+                    Phongban(
+                        maphongban=f"{parent.maphongban}.{i}", tenphongban=f"Phòng {parent.maphongban[len(self.prefix) + 1:]}.{i}",
+                        level=level, trangthai='active', congty=congty, phongbancha_id=parent.id, created_at=self.now,
+                    )
+                    for parent in level_nodes for i in range(1, fanout + 1)
+                ]
+                level_nodes = Phongban.objects.bulk_create(children, batch_size=BATCH_SIZE)
+                departments.extend(level_nodes)
+        return departments
+
+    # ── Nhân viên (phân bổ đều vào các phòng ban lá) ──
+    def _seed_employees(self, count, departments):
+        loai_daily, loai_monthly = Loainhanvien.objects.bulk_create([
+            Loainhanvien(maloainv=f"{self.prefix}-SX", tenloainv="Công nhân sản xuất", phuongthuctinhluong='daily',
+                         trangthai='active', created_at=self.now),
+            Loainhanvien(maloainv=f"{self.prefix}-VP", tenloainv="Nhân viên văn phòng", phuongthuctinhluong='monthly',
+                         trangthai='active', created_at=self.now),
+        ])
+        parent_ids = {d.phongbancha_id for d in departments if d.phongbancha_id}
+        leaves = [d for d in departments if d.id not in parent_ids]
+
+        employees = Nhanvien.objects.bulk_create([
+            Nhanvien(
+                manhanvien=f"{self.prefix}-NV{i:06d}", hovaten=f"Nhân viên {i}",
+                loainv=loai_monthly if i % 5 == 0 else loai_daily,
+                ngayvaolam=dt.date(2020, 1, 1), trangthainv='Đang làm việc', trangthai='active', created_at=self.now,
+            )
+            for i in range(1, count + 1)
+        ], batch_size=BATCH_SIZE)
+
+        Lichsucongtac.objects.bulk_create([
+            Lichsucongtac(nhanvien=nv, phongban=leaves[idx % len(leaves)], batdau=dt.date(2020, 1, 1),
+                          trangthai='active', created_at=self.now)
+            for idx, nv in enumerate(employees)
+        ], batch_size=BATCH_SIZE)
+        for nv in employees:
+            nv.is_monthly = nv.loainv_id == loai_monthly.id
+        return employees
+
+    # ── Ca làm việc + khung giờ + nghỉ trưa ──
+    def _seed_shifts(self):
+        shifts = []
+        for code, name, loai, frames, breaks in SHIFTS:
+            ca = Calamviec.objects.create(
+                macalamviec=f"{self.prefix}-{code}", tencalamviec=name, loaichamcong=loai,
+                sokhunggiotrongca=len(frames), solanchamcongtrongngay=len(frames), conghitrua=bool(breaks),
+                congcuacalamviec=sum(f[2] for f in frames), cocancheckout=True, tongthoigianlamvieccuaca=480,
+                trangthai='active', is_deleted=False, created_at=self.now,
+            )
+            Khunggiolamviec.objects.bulk_create([
+                Khunggiolamviec(
+                    calamviec=ca, thoigianbatdau=_hm(start), thoigianketthuc=_hm(end), congcuakhunggio=cong,
+                    thoigianchophepdenmuon=5, thoigianchophepvesomnhat=5, thoigiandimuonkhongtinhchamcong=120,
+                    thoigianvesomkhongtinhchamcong=120, thoigianlamviectoithieu=60, yeucauchamcong=True,
+                    sophutdenmuon=30, sophutdensom=30, created_at=self.now,
+                )
+                for start, end, cong in frames
+            ])
+            Khunggionghitrua.objects.bulk_create([
+                Khunggionghitrua(calamviec=ca, giobatdau=_hm(start), gioketthuc=_hm(end), created_at=self.now)
+                for start, end in breaks
+            ])
+            ca.frames = frames
+            ca.snapshot = json.dumps(CaLamViecService._build_snapshot_ca(ca), ensure_ascii=False)
+            shifts.append(ca)
+        return shifts
+
+    # ── Lịch làm việc cố định (T2-T7) gán cho phòng ban gốc của mỗi công ty ──
+    def _seed_schedules(self, departments, shifts, month_start):
+        for root in (d for d in departments if d.level == 1):
+            lich = Lichlamviec.objects.create(
+                malichlamviec=f"{root.maphongban}-LLV", tenlichlamviec=f"Lịch cố định {root.tenphongban}",
+                loaikichbanlamviec='CO_DINH', trangthai='active', is_deleted=False, created_at=self.now,
+            )
+            LichlamviecCodinh.objects.bulk_create([
+                LichlamviecCodinh(lichlamviec=lich, ngaytrongtuan=weekday, calamviec=shifts[0], created_at=self.now)
+                for weekday in range(6)
+            ])
+            LichlamviecPhongban.objects.create(
+                lichlamviec=lich, phongban=root, trangthai='active', created_at=self.now,
+                ngayapdung=timezone.make_aware(dt.datetime.combine(month_start, dt.time.min)),
+            )
+
+    @staticmethod
+    def _shift_for(nv, shifts):
+        return shifts[0] if nv.is_monthly else shifts[1 + nv.id % (len(shifts) - 1)]
+
+    # ── Lịch làm việc thực tế cả tháng ──
+    def _seed_actual_schedules(self, employees, shifts, month_start, month_end):
+        batch = []
+        day = month_start
+        while day <= month_end:
+            is_day_off = day.weekday() == 6
+            for nv in employees:
+                ca = None if is_day_off else self._shift_for(nv, shifts)
+                batch.append(Lichlamviecthucte(
+                    ngaylamviec=day, nhanvien_id=nv.id, calamviec=ca, cophaingaynghi=is_day_off,
+                    chophepghide=False, is_deleted=False, nguongoc='CO_DINH',
+                    snapshot_ca=ca.snapshot if ca else None, created_at=self.now,
+                ))
+            if len(batch) >= BATCH_SIZE:
+                Lichlamviecthucte.objects.bulk_create(batch, batch_size=BATCH_SIZE)
+                batch = []
+            day += dt.timedelta(days=1)
+        if batch:
+            Lichlamviecthucte.objects.bulk_create(batch, batch_size=BATCH_SIZE)
+
+    # ── Công việc khoán (cá nhân & nhóm) ──
+    def _seed_jobs(self):
+        return Congviec.objects.bulk_create([
+            Congviec(
+                macongviec=f"{self.prefix}-CV{i}", tencongviec=f"Công việc {i}", loaicongviec='nhom' if i % 2 else 'canhan',
+                bieuthuctinhtoan='SAN_LUONG * DON_GIA', trangthaicv='active', created_at=self.now,
+            )
+            for i in range(1, 21)
+        ])
+
+    # ── Bảng chấm công cả tháng (có job nhóm chung giữa các nhân viên cùng ca) ──
+    def _seed_attendance(self, employees, shifts, jobs, month_start, month_end, team_size):
+        team_jobs = [j for j in jobs if j.loaicongviec == 'nhom']
+        solo_jobs = [j for j in jobs if j.loaicongviec != 'nhom']
+        count = 0
+        batch = []
+        day = month_start
+        while day <= month_end:
+            if day.weekday() == 6:
+                day += dt.timedelta(days=1)
+                continue
+            for idx, nv in enumerate(employees):
+                ca = self._shift_for(nv, shifts)
+                start, end = ca.frames[0][0], ca.frames[-1][1]
+                co_di_lam = self.rng.random() >= 0.04
+                late = self.rng.choice((0, 0, 0, 0, 3, 10, 25)) if co_di_lam else 0
+                vao = (dt.datetime.combine(day, _hm(start)) + dt.timedelta(minutes=late)).time()
+
+                details = []
+                if co_di_lam and not nv.is_monthly:
+                    is_team = idx % 3 != 0
+                    job = team_jobs[(idx // team_size) % len(team_jobs)] if is_team else solo_jobs[idx % len(solo_jobs)]
+                    details.append({
+                        'congviec_id': job.id, 'tencongviec': job.tencongviec, 'pay_role': 'member',
+                        'thamsotinhluong': {
+                            'loaicv': 'nhom' if is_team else 'canhan', 'bieu_thuc': job.bieuthuctinhtoan,
+                            'tham_so': {'SAN_LUONG': self.rng.randint(50, 150), 'DON_GIA': 2500},
+                        },
+                        'thanhtien': 0,
+                    })
+                thanhtien = self.rng.randint(250, 450) * 1000 if details else 0
+                batch.append(Bangchamcong(
+                    ngaylamviec=day, nhanvien_id=nv.id, calamviec_id=ca.id,
+                    congviec_id=details[0]['congviec_id'] if details else None,
+                    thoigianchamcongvao=vao if co_di_lam else None, thoigianchamcongra=_hm(end) if co_di_lam else None,
+                    codilam=co_di_lam, conglamviec=(1 if late <= 5 else 0.95) if co_di_lam else 0,
+                    thoigianlamviec=(480 - late) if co_di_lam else 0, thoigianlamthem=0, cotinhlamthem=False,
+                    coantrua=co_di_lam, coandem=co_di_lam and ca is shifts[-1], coanchunhat=False,
+                    thoigiandimuon=late if late > 5 else 0, thoigianvesom=0, thoigiandisom=0, thoigianvemuon=0,
+                    loaichamcong='VP' if nv.is_monthly else 'SX', tencongviec=details[0]['tencongviec'] if details else '',
+                    cophaingaynghi=False, thanhtien=thanhtien,
+                    thamsotinhluong=json.dumps({'mode': 'single_task', 'details': details}, ensure_ascii=False),
+                    thanhtienthanhphan=json.dumps({'tien_base': thanhtien, 'tien_ot': 0, 'tien_extra': 0}),
+                    ghichu='', created_at=self.now,
+                ))
+            if len(batch) >= BATCH_SIZE:
+                Bangchamcong.objects.bulk_create(batch, batch_size=BATCH_SIZE)
+                count += len(batch)
+                batch = []
+            day += dt.timedelta(days=1)
+        if batch:
+            Bangchamcong.objects.bulk_create(batch, batch_size=BATCH_SIZE)
+            count += len(batch)
+        return count
+
+    # ── Chế độ lương + quy tắc công thức + kỳ lương / bảng lương ──
+    def _seed_payroll(self, employees, month_start, month_end):
+        chedoluong = Chedoluong.objects.create(
+            machedo=f"{self.prefix}-CDL", tenchedo="Chế độ lương benchmark", ngayapdung=month_start,
+            trangthai='active', is_deleted=False, created_at=self.now,
+        )
+        phantu_map = {
+            code: pt for code, pt in zip(
+                [r[0] for r in PAYROLL_RULES],
+                Phantuluong.objects.bulk_create([
+                    Phantuluong(maphantu=f"{self.prefix}-{code}", tenphantu=code, loaiphantu=loai,
+                                trangthai='active', created_at=self.now)
+                    for code, loai, _, _ in PAYROLL_RULES
+                ]),
+            )
+        }
+        Quytacchedoluong.objects.bulk_create([
+            Quytacchedoluong(
+                chedoluong=chedoluong, phantuluong=phantu_map[code], maquytac=code, tenquytac=code,
+                nguondulieu=src, nguondulieuchitiet=detail if src == 'system' else None,
+                bieuthuctinhtoan=detail if src == 'formula' else None,
+                thutuhienthi=order, trangthai='active', created_at=self.now,
+            )
+            for order, (code, _, src, detail) in enumerate(PAYROLL_RULES, start=1)
+        ])
+        NhanvienChedoluong.objects.bulk_create([
+            NhanvienChedoluong(chedoluong=chedoluong, nhanvien_id=nv.id, trangthai='active', created_at=self.now)
+            for nv in employees
+        ], batch_size=BATCH_SIZE)
+        Thietlapsolieucodinh.objects.bulk_create([
+            Thietlapsolieucodinh(
+                nhanvien_id=nv.id, phantuluong=phantu_map['LUONG_CO_BAN'], trangthai='active',
+                giatrimacdinh=self.rng.randrange(6_000_000, 25_000_000, 500_000), created_at=self.now,
+            )
+            for nv in employees
+        ], batch_size=BATCH_SIZE)
+
+        # Dùng lại kỳ lương của tháng nếu đã có (không tạo kỳ trùng lặp với dữ liệu thật)
+        kyluong = Kyluong.objects.filter(ngaybatdau=month_start, ngayketthuc=month_end).first()
+        if kyluong is None:
+            kyluong = Kyluong.objects.create(
+                thang=month_start.month, ngaybatdau=month_start, ngayketthuc=month_end,
+                trangthai=KyLuongService.STATUS_DRAFT, created_at=self.now,
+            )
+        return Bangluong.objects.create(
+            mabangluong=f"{self.prefix}-BL-{month_start:%Y%m}", tenbangluong=f"Bảng lương benchmark {month_start:%m/%Y}",
+            kyluong=kyluong, chedoluong=chedoluong, ngaytao=month_start, trangthai=BangLuongService.STATUS_DRAFT,
+            created_at=self.now,
+        )
+
+    # ── Doanh thu dịch vụ điện nước (12 tháng gần nhất) ──
+    @staticmethod
+    def _month_back(month_start, back):
+        year, month = divmod(month_start.year * 12 + month_start.month - 1 - back, 12)
+        return dt.date(year, month + 1, 1)
+
+    def _seed_revenue(self, contracts, month_start):
+        loai_dien, loai_nuoc = Loaidichvu.objects.bulk_create([
+            Loaidichvu(tenloaidichvu=f"{self.prefix} Điện"), Loaidichvu(tenloaidichvu=f"{self.prefix} Nước"),
+        ])
+        dv_dien, dv_nuoc = Dichvu.objects.bulk_create([
+            Dichvu(id_loaidichvu=loai_dien, tendichvu=f"{self.prefix} Tiền điện"),
+            Dichvu(id_loaidichvu=loai_nuoc, tendichvu=f"{self.prefix} Tiền nước"),
+        ])
+        hopdongs = HopdongDichvu.objects.bulk_create([
+            HopdongDichvu(tencongty=f"Khách hàng {i}", sohd=f"{self.prefix}-HD{i:05d}", trangthai=1,
+                          kythanhtoan=1, ngaytaohopdong=dt.date(2020, 1, 1))
+            for i in range(1, contracts + 1)
+        ], batch_size=BATCH_SIZE)
+
+        payments = []
+        for back in range(REVENUE_MONTHS):
+            thang = self._month_back(month_start, back)
+            thoigiantao = timezone.make_aware(dt.datetime(thang.year, thang.month, 5, 9, 0))
+            for hd in hopdongs:
+                payments.append(ThanhtoanDichvu(
+                    thoigiantao=thoigiantao, sotbdv=f"{self.prefix}-TB{hd.id_hopdong}-{thang:%Y%m}",
+                    id_hopdong=hd, giamtru=0, tongtientruocthue=0, tongtiensauthue=0,
+                ))
+        payments = ThanhtoanDichvu.objects.bulk_create(payments, batch_size=BATCH_SIZE)
+
+        details = []
+        for tt in payments:
+            for dv, don_gia in ((dv_dien, 3000), (dv_nuoc, 15000)):
+                so_su_dung = self.rng.randint(100, 5000) if dv is dv_dien else self.rng.randint(10, 300)
+                truoc_thue = so_su_dung * don_gia
+                details.append(CtThanhtoanDichvu(
+                    id_thanhtoan_dichvu=tt, id_dichvu=dv, tendichvu=dv.tendichvu, dongia=don_gia, heso=1,
+                    sosudung=so_su_dung, tientruocthue=truoc_thue, thue=truoc_thue * 0.1, tiensauthue=truoc_thue * 1.1,
+                ))
+            tt.tongtientruocthue = sum(d.tientruocthue for d in details[-2:])
+            tt.tongtiensauthue = sum(d.tiensauthue for d in details[-2:])
+        CtThanhtoanDichvu.objects.bulk_create(details, batch_size=BATCH_SIZE)
+        ThanhtoanDichvu.objects.bulk_update(payments, ['tongtientruocthue', 'tongtiensauthue'], batch_size=BATCH_SIZE)
+        return len(payments)
@@ -10,6 +10,8 @@ from django.db.models import Count, Q, Exists, OuterRef
 from datetime import date, timedelta, datetime
 from apps.hrm_manager.__core__.models import *
 from calendar import monthrange
+from apps.hrm_manager.utils.department_tree import get_department_tree
+from apps.hrm_manager.utils.report_export_jobs import DATA_PHIEU_LUONG, invalidate_report_data
 
 
 class PayrollPeriodLockException(Exception):
@@ -276,18 +278,11 @@ class CheDoLuongService:
     
     @staticmethod
     def _expand_dept_ids(dept_ids):
-        """Mở rộng danh sách phòng ban bao gồm cả phòng ban con"""
+        """Mở rộng danh sách phòng ban bao gồm cả phòng ban con (1 lần tra trên cây phòng ban đã cache)"""
         if not dept_ids:
             return set()
         
-        from apps.hrm_manager.to_chuc_nhan_su.views import get_all_child_department_ids
-        
-        final_ids = set()
-        for root_id in dept_ids:
-            children = get_all_child_department_ids(root_id, isnclude_root=True)
-            final_ids.update(children)
-        
-        return final_ids
+        return get_department_tree().descendants(dept_ids, include_root=True)
     
     @staticmethod
     def get_consolidated_dept_ids(all_dept_ids):
@@ -295,41 +290,7 @@ class CheDoLuongService:
         if not all_dept_ids:
             return []
         
-        all_dept_ids = set(map(int, all_dept_ids))
-        
-        all_depts = Phongban.objects.filter(trangthai='active').values('id', 'phongbancha_id')
-        
-        children_map = {}
-        for d in all_depts:
-            pid = d['phongbancha_id']
-            if pid:
-                if pid not in children_map:
-                    children_map[pid] = []
-                children_map[pid].append(d['id'])
-        
-        dept_map = {}
-        for d in all_depts:
-            dept_map[d['id']] = {'parent_id': d['phongbancha_id']}
-        
-        result = set()
-        
-        def is_ancestor_selected(dept_id):
-            current = dept_id
-            while current:
-                info = dept_map.get(current)
-                if not info:
-                    break
-                parent_id = info.get('parent_id')
-                if parent_id and parent_id in all_dept_ids:
-                    return True
-                current = parent_id
-            return False
-        
-        for dept_id in all_dept_ids:
-            if not is_ancestor_selected(dept_id):
-                result.add(dept_id)
-        
-        return list(result)
+        return get_department_tree().consolidate(all_dept_ids)
     
     # ============================================================
     # ACTIVE COUNTS
@@ -1830,6 +1791,7 @@ class BangLuongService:
             return False, msg
         
         bang_luong.delete()
+        invalidate_report_data(DATA_PHIEU_LUONG)
         return True, "Xóa bảng lương thành công"
     
     @classmethod
@@ -0,0 +1,71 @@
+import logging
+
+from celery import shared_task
+from django.core.cache import cache
+from django.db import transaction
+
+logger = logging.getLogger(__name__)
+
+# Khóa chống 2 job sinh phiếu lương chạy song song trên cùng 1 bảng lương
+PHIEU_LUONG_LOCK_KEY = "qll:phieuluong:lock:{bangluong_id}"
+# Job id đang/đã chạy gần nhất của bảng lương (để client gửi lại không đẩy trùng job)
+PHIEU_LUONG_JOB_KEY = "qll:phieuluong:job:{bangluong_id}"
+PHIEU_LUONG_JOB_TTL = 1800
+# Phiếu lương nháp do job sinh ra (chưa lưu lần đầu) - giữ trong cache thay vì lưu vào kết quả Celery
+PHIEU_LUONG_DRAFT_KEY = "qll:phieuluong:draft:{job_id}"
+
+
+@shared_task(bind=True)
+def generate_phieu_luong_task(self, bangluong_id, recalculate=False):
+    # Import muộn: views import ngược lại task này để đẩy job
+    from .views import run_phieu_luong_generation
+
+    logger.info("Payslip task started. bangluong_id=%s recalculate=%s", bangluong_id, recalculate)
+
+    lock_key = PHIEU_LUONG_LOCK_KEY.format(bangluong_id=bangluong_id)
+    lock = cache.lock(lock_key, timeout=PHIEU_LUONG_JOB_TTL, blocking_timeout=0)
+    acquired = lock.acquire(blocking=False)
+    if not acquired:
+        logger.warning("Payslip task skipped: lock not acquired. bangluong_id=%s", bangluong_id)
+        return {
+            "success": False,
+            "skipped": True,
+            "reason": "locked",
+            "message": "Bảng lương đang được sinh phiếu lương bởi một yêu cầu khác",
+        }
+
+    progress = {"total": 0}
+
+    def _report_progress(processed, total):
+        progress["total"] = total
+        self.update_state(state="PROGRESS", meta={"processed": processed, "total": total})
+
+    try:
+        with transaction.atomic():
+            data, message = run_phieu_luong_generation(
+                bangluong_id, recalculate=recalculate, progress_callback=_report_progress
+            )
+
+        if data:
+            cache.set(PHIEU_LUONG_DRAFT_KEY.format(job_id=self.request.id), data, timeout=PHIEU_LUONG_JOB_TTL)
+
+        logger.info(
+            "Payslip task finished. bangluong_id=%s success=%s total=%s",
+            bangluong_id, bool(data), progress["total"],
+        )
+        # Kết quả Celery (lưu lâu dài ở result backend) chỉ gồm trạng thái, không chứa dữ liệu lương
+        return {
+            "success": bool(data),
+            "skipped": False,
+            "message": message,
+            "total": progress["total"],
+            "bangluong_id": bangluong_id,
+        }
+    except Exception:
+        logger.exception("Payslip task failed. bangluong_id=%s", bangluong_id)
+        raise
+    finally:
+        try:
+            lock.release()
+        except Exception:
+            logger.warning("Payslip task lock release warning. bangluong_id=%s", bangluong_id)
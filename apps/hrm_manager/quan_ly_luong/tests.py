@@ -1,3 +1,81 @@
-from django.test import TestCase
+from unittest.mock import MagicMock, patch
 
-# Create your tests here.
+from django.test import SimpleTestCase
+
+
+class PhieuLuongCeleryTaskTests(SimpleTestCase):
+	@patch("apps.hrm_manager.quan_ly_luong.views.run_phieu_luong_generation")
+	@patch("apps.hrm_manager.quan_ly_luong.tasks.cache")
+	def test_task_skips_when_lock_is_held(self, mock_cache, mock_generate):
+		from apps.hrm_manager.quan_ly_luong.tasks import generate_phieu_luong_task
+
+		lock = MagicMock()
+		lock.acquire.return_value = False
+		mock_cache.lock.return_value = lock
+
+		result = generate_phieu_luong_task.run(7)
+
+		self.assertFalse(result["success"])
+		self.assertEqual(result["reason"], "locked")
+		self.assertEqual(mock_cache.lock.call_args[0][0], "qll:phieuluong:lock:7")
+		mock_generate.assert_not_called()
+
+	@patch("apps.hrm_manager.quan_ly_luong.tasks.transaction")
+	@patch("apps.hrm_manager.quan_ly_luong.views.run_phieu_luong_generation")
+	@patch("apps.hrm_manager.quan_ly_luong.tasks.cache")
+	def test_task_reports_progress_and_returns_payslips(self, mock_cache, mock_generate, mock_transaction):
+		from apps.hrm_manager.quan_ly_luong.tasks import generate_phieu_luong_task
+
+		lock = MagicMock()
+		lock.acquire.return_value = True
+		mock_cache.lock.return_value = lock
+
+		def fake_generate(bangluong_id, recalculate=False, progress_callback=None):
+			progress_callback(0, 2)
+			progress_callback(2, 2)
+			return {"phan_tu_luong": [1], "phieu_luong": {1: {}, 2: {}}}, "OK"
+
+		mock_generate.side_effect = fake_generate
+
+		generate_phieu_luong_task.push_request(id="job-1")
+		self.addCleanup(generate_phieu_luong_task.pop_request)
+		with patch.object(generate_phieu_luong_task, "update_state") as mock_update_state:
+			result = generate_phieu_luong_task.run(7, recalculate=True)
+
+		self.assertTrue(result["success"])
+		self.assertEqual(result["total"], 2)
+		# Dữ liệu lương không nằm trong kết quả Celery, phiếu nháp giữ trong cache theo job
+		self.assertNotIn("data", result)
+		mock_cache.set.assert_called_once()
+		self.assertEqual(mock_cache.set.call_args[0][0], "qll:phieuluong:draft:job-1")
+		self.assertEqual(mock_cache.set.call_args[0][1]["phieu_luong"], {1: {}, 2: {}})
+		mock_update_state.assert_called_with(state="PROGRESS", meta={"processed": 2, "total": 2})
+		self.assertTrue(mock_generate.call_args.kwargs["recalculate"])
+		lock.release.assert_called_once()
+
+	@patch("apps.hrm_manager.utils.celery_jobs.AsyncResult")
+	@patch("apps.hrm_manager.quan_ly_luong.views.generate_phieu_luong_task")
+	def test_failed_enqueue_leaves_no_reusable_job(self, mock_task, mock_async_result):
+		from django.test import override_settings
+
+		from apps.hrm_manager.quan_ly_luong.views import _submit_phieu_luong_job
+		from apps.hrm_manager.utils.celery_jobs import get_job_state
+
+		mock_async_result.return_value.state = "PENDING"
+		mock_task.apply_async.side_effect = ConnectionError("broker down")
+		locmem = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "phieu-luong-job-tests"}}
+		with override_settings(CACHES=locmem), \
+				patch("django.db.transaction.on_commit", side_effect=lambda func, *args, **kwargs: func()):
+			failed = _submit_phieu_luong_job(7)
+			self.assertIsNone(get_job_state(failed["job_id"]))
+
+			mock_task.apply_async.side_effect = None
+			retried = _submit_phieu_luong_job(7)
+			self.assertFalse(retried["reused"])
+			self.assertNotEqual(retried["job_id"], failed["job_id"])
+			self.assertEqual(get_job_state(retried["job_id"]), "PENDING")
+
+			reused = _submit_phieu_luong_job(7)
+			self.assertTrue(reused["reused"])
+			self.assertEqual(reused["job_id"], retried["job_id"])
+			self.assertEqual(mock_task.apply_async.call_count, 2)
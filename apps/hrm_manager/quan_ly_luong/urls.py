@@ -27,6 +27,10 @@ urlpatterns = [
     # -------------------------------- PHIẾU LƯƠNG ------------------------------
     path("api/phieu-luong/list", views.api_phieu_luong_list, name="api_phieu_luong_list"),
     path("api/phieu-luong/recalculate", views.api_phieu_luong_recalculate, name="api_phieu_luong_recalculate"),
+    path("api/phieu-luong/ngay-cham-cong", views.api_phieu_luong_ngay_cham_cong, name="api_phieu_luong_ngay_cham_cong"),
+    path("api/phieu-luong/generate-job", views.api_phieu_luong_generate_job, name="api_phieu_luong_generate_job"),
+    path("api/phieu-luong/generate-job/<uuid:job_id>", views.api_phieu_luong_generate_job_status, name="api_phieu_luong_generate_job_status"),
+    path("api/phieu-luong/generate-job/<uuid:job_id>/result", views.api_phieu_luong_generate_job_result, name="api_phieu_luong_generate_job_result"),
 
     # ------------------------------ CHẾ ĐỘ LƯƠNG -----------------------------
     path('che-do-luong/', views.view_che_do_luong, name='che_do_luong'),
@@ -5,18 +5,21 @@ from django.views.decorators.http import require_http_methods
 from django.views.decorators.csrf import csrf_exempt
 from django.utils.timezone import now
 from django.db import transaction
-from django.db.models import F, Q, Sum, Count, Exists, OuterRef, FloatField, Min
+from django.db.models import F, Q, Sum, Count, Exists, OuterRef, Min
 from django.urls import reverse
-from django.db.models.functions import Coalesce
 
 from apps.hrm_manager.__core__.models import (Bangluong, Phantuluong, Nhomphantuluong, Thietlapsolieucodinh, Phieuluong, Quytacchedoluong, Bangchamcong, 
                                               Lichsucongtac, Ctphieuluong, NhanvienChedoluong, Chedoluong, Kyluong, PhongbanChedoluong, Phongban, Lichlamviecthucte)
 
+from django.core.cache import cache
+from celery.result import AsyncResult
+
 from json import loads, dumps
 from collections import defaultdict
+from itertools import islice
 import logging
 from datetime import date, datetime, timedelta
-from apps.hrm_manager.cham_cong.services import PayrollCalculator
+from apps.hrm_manager.cham_cong.services import PayrollCalculator, RulePlan, FormulaCycleError, TongHopChamCongService
 from apps.hrm_manager.utils.view_helpers import (
     get_list_context,
     json_response,
@@ -33,6 +36,10 @@ from apps.hrm_manager.utils.view_helpers import (
     search_queryset, filter_by_field, filter_by_status
 )
 
+from apps.hrm_manager.utils.celery_jobs import enqueue_on_commit, get_active_job, get_job_state
+from apps.hrm_manager.utils.report_export_jobs import DATA_PHIEU_LUONG, invalidate_report_data
+from apps.hrm_manager.utils.xlsx_export import XlsxSheet
+from .tasks import generate_phieu_luong_task, PHIEU_LUONG_DRAFT_KEY, PHIEU_LUONG_JOB_KEY, PHIEU_LUONG_JOB_TTL
 from .services import ( 
     CheDoLuongService, 
     PayrollPeriodLockException, 
@@ -107,9 +114,37 @@ def _normalize_system_source_key(source_key):
     return normalized_key
 
 
-def genarate_phieu_luong_from_bang_luong(bang_luong_id):
+def _aggregate_bang_cham_cong(nhanvien_ids, thoigian_batdau, thoigian_ketthuc):
+    """
+    Tổng hợp chấm công theo nhân viên trong kỳ (đọc bảng tổng hợp tháng nếu kỳ tròn tháng, ngược lại GROUP BY trong DB).
+    Quy đổi phút -> giờ cho thời gian làm việc/làm thêm (giữ đúng quy ước cũ khi cộng dồn trong Python).
+    """
+    totals = TongHopChamCongService.get_period_totals(nhanvien_ids, thoigian_batdau, thoigian_ketthuc)
+    for nv_id, row in totals.items():
+        yield {
+            'nhanvien_id': nv_id,
+            'tong_so_luong_an': row['tongsoluongan'] or 0,
+            'tong_thoigian_lamviec': _safe_float(row['tongphutlamviec']) / 60.0,
+            'tong_thoigian_lamthem': _safe_float(row['tongphutlamthem']) / 60.0,
+            'tong_cong_lamviec': _safe_float(row['tongconglamviec']),
+            'tong_cong_vp_thucte': _safe_float(row['tongcongvp']),
+            'tong_tien_sx': _safe_float(row['tongtiensx']),
+            'tong_an_chu_nhat': row['tonganchunhat'] or 0,
+            'tong_an_dem': row['tongandem'] or 0,
+            'tong_di_muon_phut': _safe_float(row['tongphutdimuon']),
+            'tong_ve_som_phut': _safe_float(row['tongphutvesom']),
+            'tong_ngay_vang': row['tongngayvang'] or 0,
+        }
+
+
+# Số nhân viên xử lý giữa 2 lần báo tiến độ (progress_callback)
+PHIEU_LUONG_PROGRESS_STEP = 100
+
+
+def genarate_phieu_luong_from_bang_luong(bang_luong_id, progress_callback=None):
     """
     Sinh phiếu lương cho bảng lương, gom dữ liệu, áp dụng công thức động.
+    - progress_callback(processed, total): báo tiến độ theo số nhân viên đã xử lý (dùng cho Celery task)
     """
     # 1. Lấy thông tin bảng lương
     try:
@@ -132,6 +167,10 @@ def genarate_phieu_luong_from_bang_luong(bang_luong_id):
     if not nhanvien_ids:
         return None, "Không có nhân viên nào cấu hình chế độ lương này."
 
+    total_nhanvien = len(nhanvien_ids)
+    if progress_callback:
+        progress_callback(0, total_nhanvien)
+
     # 2. Lấy danh sách quy tắc tính lương active
     rules_list = list(
         Quytacchedoluong.objects
@@ -144,65 +183,23 @@ def genarate_phieu_luong_from_bang_luong(bang_luong_id):
     if not rules_list:
         return None, "Chế độ lương chưa có quy tắc tính lương nào."
 
-    formula_keys = [r['maquytac'] for r in rules_list if r['nguondulieu'] == 'formula']
-
-    # 3. Lấy dữ liệu chấm công: 1 query duy nhất cho cả tổng hợp lẫn chi tiết
-    bcc_all_records = list(Bangchamcong.objects.filter(
-        nhanvien_id__in=nhanvien_ids,
-        ngaylamviec__range=[thoigian_batdau, thoigian_ketthuc]
-    ).values())
+    # 2a. Lập đồ thị phụ thuộc giữa các quy tắc công thức 1 lần cho cả bảng lương, báo lỗi tham chiếu vòng ngay từ đầu
+    try:
+        rule_plan = RulePlan({
+            r['maquytac']: r['bieuthuctinhtoan'] for r in rules_list if r['nguondulieu'] == 'formula'
+        })
+    except FormulaCycleError as e:
+        return None, f"Quy tắc tính lương không hợp lệ. {e}"
+
+    # 3. Tổng hợp chấm công theo nhân viên ngay trong DB (1 query GROUP BY + aggregate có điều kiện)
+    # Chi tiết từng ngày (Nhật ký chấm công) lấy riêng qua api_phieu_luong_ngay_cham_cong (phân trang)
+    bcc_dict = {
+        row['nhanvien_id']: row
+        for row in _aggregate_bang_cham_cong(nhanvien_ids, thoigian_batdau, thoigian_ketthuc)
+    }
 
-    if not bcc_all_records:
+    if not bcc_dict:
         return None, "Chưa có dữ liệu chấm công trong kỳ lương"
-
-    # 3a. Tính aggregate trong Python từ dữ liệu đã load (thay vì query DB thêm lần nữa)
-    bcc_dict = {}
-    bcc_detail_map = defaultdict(list)
-
-    for record in bcc_all_records:
-        nv_id = record['nhanvien_id']
-
-        # Tích lũy aggregate theo nhân viên
-        if nv_id not in bcc_dict:
-            bcc_dict[nv_id] = {
-                'tong_so_luong_an': 0,
-                'tong_thoigian_lamviec': 0.0,
-                'tong_thoigian_lamthem': 0.0,
-                'tong_cong_lamviec': 0.0,
-                'tong_cong_vp_thucte': 0.0,
-                'tong_tien_sx': 0.0,
-                'tong_an_chu_nhat': 0,
-                'tong_an_dem': 0,
-                'tong_di_muon_phut': 0.0,
-                'tong_ve_som_phut': 0.0,
-                'tong_ngay_vang': 0,
-            }
-
-        agg = bcc_dict[nv_id]
-        if record.get('coantrua'):
-            agg['tong_so_luong_an'] += 1
-        agg['tong_thoigian_lamviec'] += (
-            _safe_float(record.get('thoigianlamviec')) +
-            _safe_float(record.get('thoigiandisom')) +
-            _safe_float(record.get('thoigianvemuon'))
-        ) / 60.0
-        agg['tong_thoigian_lamthem'] += _safe_float(record.get('thoigianlamthem')) / 60.0
-        agg['tong_cong_lamviec'] += _safe_float(record.get('conglamviec'))
-        if record.get('loaichamcong') == 'VP':
-            agg['tong_cong_vp_thucte'] += _safe_float(record.get('conglamviec'))
-        agg['tong_tien_sx'] += _safe_float(record.get('thanhtien'))
-        if record.get('coanchunhat'):
-            agg['tong_an_chu_nhat'] += 1
-        if record.get('coandem'):
-            agg['tong_an_dem'] += 1
-        agg['tong_di_muon_phut'] += _safe_float(record.get('thoigiandimuon'))
-        agg['tong_ve_som_phut'] += _safe_float(record.get('thoigianvesom'))
-        if not record.get('codilam') and not record.get('cophaingaynghi'):
-            agg['tong_ngay_vang'] += 1
-
-        # 3b. Chi tiết chấm công (chỉ ngày có đi làm) — dùng cho Nhật ký Chấm công
-        if record.get('codilam'):
-            bcc_detail_map[str(nv_id)].append(record)
         
     # 4. Lấy số ngày/giờ làm chuẩn từ Lịch làm việc thực tế
     # ✅ REFACTOR: Ưu tiên đọc snapshot_ca, fallback JOIN Ca nếu chưa có snapshot
@@ -319,48 +316,72 @@ def genarate_phieu_luong_from_bang_luong(bang_luong_id):
         }]
 
     # 7. Khởi tạo model xử lý công thức động của nhân viên đồng loạt (PayrollCalculator)
+    # Mỗi quy tắc công thức được tính 1 lần theo cột cho từng lô PHIEU_LUONG_PROGRESS_STEP nhân viên
+    # (thay vì từng nhân viên × từng quy tắc); hàm tổng hợp vẫn lấy context theo group_id nên chia lô không đổi kết quả,
+    # đồng thời báo tiến độ thật sau mỗi lô thay vì nhảy thẳng 0 -> 100%
     payroll_calculator = PayrollCalculator(data_groups_map)
+    group_ids = list(data_groups_map.keys())
     phieu_luong_final = {}
-    
-    for nv_id_str, members in data_groups_map.items():
-        params = members[0]['tham_so']
-        
-        # Parse chuỗi String công thức và đánh giá hàm dựa trên Params input tương ứng của Nhân viên (Batch Calc)
-        calculated_results = payroll_calculator.calculate_batch_fields(
-            field_keys=formula_keys,
-            params=params,
-            group_id=nv_id_str
-        )
-        params.update(calculated_results)
-        
-        # 8. Định dạng Object kết quả đầu ra theo format Template yêu cầu 
-        # Cấu trúc: { nvID: { "Phần tử": { "value":.., "type":.., "status":.. } } }
-        nv_id = int(nv_id_str)
-        nv_dict = {}
-        for rule in rules_list:
-            val = params.get(rule['maquytac'])
-            nv_dict[rule['phantuluong']] = {
-                "value": round(val, 2) if val is not None else None,
-                "type": rule['phantuluong__loaiphantu'],
-                "status": "calculated" if val is not None else rule['nguondulieu'],
-                "formula": rule['bieuthuctinhtoan'],
-                "source_key": rule['nguondulieuchitiet'],
-                "display_order": rule.get('thutuhienthi')
-            }
-        phieu_luong_final[nv_id] = nv_dict
 
-    # Serialize chi tiết chấm công từng nhân viên để frontend hiển thị Nhật ký Chấm công
-    ngaychamcong_map = {}
-    for nv_id_str, records in bcc_detail_map.items():
-        ngaychamcong_map[nv_id_str] = loads(dumps(records, default=str))
+    for chunk_start in range(0, total_nhanvien, PHIEU_LUONG_PROGRESS_STEP):
+        chunk_ids = group_ids[chunk_start:chunk_start + PHIEU_LUONG_PROGRESS_STEP]
+        params_list = [data_groups_map[nv_id_str][0]['tham_so'] for nv_id_str in chunk_ids]
+        calculated_columns = payroll_calculator.calculate_columns(rule_plan, params_list, chunk_ids)
+
+        for idx, nv_id_str in enumerate(chunk_ids):
+            params = params_list[idx]
+            params.update({key: column[idx] for key, column in calculated_columns.items()})
+
+            # 8. Định dạng Object kết quả đầu ra theo format Template yêu cầu 
+            # Cấu trúc: { nvID: { "Phần tử": { "value":.., "type":.., "status":.. } } }
+            nv_id = int(nv_id_str)
+            nv_dict = {}
+            for rule in rules_list:
+                val = params.get(rule['maquytac'])
+                nv_dict[rule['phantuluong']] = {
+                    "value": round(val, 2) if val is not None else None,
+                    "type": rule['phantuluong__loaiphantu'],
+                    "status": "calculated" if val is not None else rule['nguondulieu'],
+                    "formula": rule['bieuthuctinhtoan'],
+                    "source_key": rule['nguondulieuchitiet'],
+                    "display_order": rule.get('thutuhienthi')
+                }
+            phieu_luong_final[nv_id] = nv_dict
+
+        if progress_callback:
+            progress_callback(chunk_start + len(chunk_ids), total_nhanvien)
 
     return {
         "phan_tu_luong": [r['phantuluong'] for r in rules_list],
         "phieu_luong": phieu_luong_final,
-        "ngaychamcong": ngaychamcong_map
     }, "Tạo phiếu lương thành công"
 
 
+def run_phieu_luong_generation(bang_luong_id, recalculate=False, progress_callback=None):
+    """
+    Sinh phiếu lương và cập nhật trạng thái bảng lương (dùng chung cho API đồng bộ và Celery task).
+    - recalculate=True: xóa phiếu lương cũ rồi sinh lại từ đầu, bảng lương chuyển về processing
+    - recalculate=False: chỉ chuyển bảng lương draft -> processing khi sinh thành công
+    Caller chịu trách nhiệm bọc transaction.
+    """
+    if recalculate:
+        old_phieu_ids = list(Phieuluong.objects.filter(bangluong_id=bang_luong_id).values_list('id', flat=True))
+        if old_phieu_ids:
+            Ctphieuluong.objects.filter(phieuluong_id__in=old_phieu_ids).delete()
+            Phieuluong.objects.filter(id__in=old_phieu_ids).delete()
+
+    data, message = genarate_phieu_luong_from_bang_luong(bang_luong_id, progress_callback=progress_callback)
+    if not data:
+        return data, message
+    invalidate_report_data(DATA_PHIEU_LUONG)
+
+    bang_luong_qs = Bangluong.objects.filter(id=bang_luong_id)
+    if not recalculate:
+        bang_luong_qs = bang_luong_qs.filter(trangthai='draft')
+    bang_luong_qs.update(trangthai='processing', updated_at=now())
+    return data, message
+
+
 # ============================================================================
 # VIEW URLS - TRANG CHÍNH
 # ============================================================================
@@ -877,6 +898,42 @@ def api_phan_tu_luong_setup_params(request):
         return json_success('Lưu thiết lập số liệu cố định phần tử lương thành công')
 
 
+def _get_saved_phieu_luong_payload(bang_luong_id):
+    """Phiếu lương đã lưu của bảng lương (format {phan_tu_luong, phieu_luong} dùng cho màn hình phiếu lương)."""
+    phieu_luong_data = list(Phieuluong.objects.filter(bangluong_id=bang_luong_id).select_related('nhanvien').values())
+    phieu_luong_ids = [item['id'] for item in phieu_luong_data]
+    ct_phieu_luong_data = Ctphieuluong.objects.filter(phieuluong_id__in=phieu_luong_ids).select_related('phantuluong').order_by('thutuhienthi').values()
+    ordered_phan_tu_luong = list(
+        Ctphieuluong.objects
+        .filter(phieuluong_id__in=phieu_luong_ids)
+        .values('phantuluong_id')
+        .annotate(min_order=Min('thutuhienthi'))
+        .order_by('min_order', 'phantuluong_id')
+        .values_list('phantuluong_id', flat=True)
+    )
+    ct_phieu_luong_map = defaultdict()
+    for item in ct_phieu_luong_data:
+        if item['phieuluong_id'] not in ct_phieu_luong_map:
+            ct_phieu_luong_map[item['phieuluong_id']] = {}
+
+        ct_phieu_luong_map[item['phieuluong_id']][item['phantuluong_id']] = {
+            "value": item['giatritinhduoc'],
+            "type": item['loaiphantu'],
+            "status": 'calculated',
+            "formula": item['bieuthuctinhtoan'],
+            "input_value": item['giatridauvao'],
+            "code": item['maphantuluong']
+        }
+
+    for item in phieu_luong_data:
+        item['ct_phieu_luong'] = ct_phieu_luong_map.get(item['id'], {})
+
+    return {
+        'phan_tu_luong': ordered_phan_tu_luong,
+        'phieu_luong': phieu_luong_data,
+    }
+
+
 # ------------------------------ PHIẾU LƯƠNG ------------------------------
 @login_required
 @require_http_methods(["GET", "POST"])
@@ -901,50 +958,18 @@ def api_phieu_luong_list(request):
             return json_error('Bảng lương không tồn tại', status=400)
         
         if not Phieuluong.objects.filter(bangluong_id=bang_luong_id).exists():
-            data, message = genarate_phieu_luong_from_bang_luong(bang_luong_id)
+            # async=1: đẩy việc sinh phiếu sang Celery, client theo dõi qua API generate-job
+            if request.GET.get('async') in ('1', 'true'):
+                job = _submit_phieu_luong_job(bang_luong_id, recalculate=False)
+                return json_success('Đang sinh phiếu lương', data=job)
+
+            # Chuyển bảng lương sang processing khi sinh phiếu thành công
+            data, message = run_phieu_luong_generation(bang_luong_id)
             if data:
-                # ✅ THÊM: Chuyển bảng lương sang processing khi bắt đầu sinh phiếu
-                Bangluong.objects.filter(
-                    id=bang_luong_id, 
-                    trangthai='draft'
-                ).update(
-                    trangthai='processing',
-                    updated_at=now()
-                )
                 return json_success(message, data=data)
             return json_error(message, data=data)
         else:
-            phieu_luong_data = Phieuluong.objects.filter(bangluong_id=bang_luong_id).select_related('nhanvien').values()
-            ct_phieu_luong_data = Ctphieuluong.objects.filter(phieuluong_id__in=phieu_luong_data.values_list('id', flat=True)).select_related('phantuluong').order_by('thutuhienthi').values()
-            ordered_phan_tu_luong = list(
-                Ctphieuluong.objects
-                .filter(phieuluong_id__in=phieu_luong_data.values_list('id', flat=True))
-                .values('phantuluong_id')
-                .annotate(min_order=Min('thutuhienthi'))
-                .order_by('min_order', 'phantuluong_id')
-                .values_list('phantuluong_id', flat=True)
-            )
-            ct_phieu_luong_map = defaultdict()
-            for item in ct_phieu_luong_data:
-                if item['phieuluong_id'] not in ct_phieu_luong_map:
-                    ct_phieu_luong_map[item['phieuluong_id']] = {}
-
-                ct_phieu_luong_map[item['phieuluong_id']][item['phantuluong_id']] = {
-                    "value": item['giatritinhduoc'],
-                    "type": item['loaiphantu'],
-                    "status": 'calculated',
-                    "formula": item['bieuthuctinhtoan'],
-                    "input_value": item['giatridauvao'],
-                    "code": item['maphantuluong']
-                }
-            
-            for item in phieu_luong_data:
-                item['ct_phieu_luong'] = ct_phieu_luong_map.get(item['id'], {})
-
-            return json_success('Lấy danh sách phiếu lương thành công', data={
-                'phan_tu_luong': ordered_phan_tu_luong,
-                'phieu_luong': list(phieu_luong_data),
-            })
+            return json_success('Lấy danh sách phiếu lương thành công', data=_get_saved_phieu_luong_payload(bang_luong_id))
     
     elif request.method == 'POST':
         try:
@@ -1205,12 +1230,69 @@ def api_phieu_luong_list(request):
         bang_luong_obj.tongtienluong = _safe_float(payroll_summary.get('total_salary'), 0.0)
         bang_luong_obj.updated_at = now()
         bang_luong_obj.save(update_fields=['trangthai', 'tongsoluongnhanvien', 'tongtienluong', 'updated_at'])
+        invalidate_report_data(DATA_PHIEU_LUONG)
 
         return json_success('Lưu phiếu lương thành công')
     
     return json_success('Lấy danh sách phiếu lương thành công')
 
 
+# Các cột chấm công hiển thị trong Nhật ký chấm công / sheet Chấm công của phiếu lương
+NGAY_CHAM_CONG_FIELDS = (
+    'id', 'nhanvien_id', 'ngaylamviec', 'loaichamcong', 'thoigianchamcongvao', 'thoigianchamcongra',
+    'thoigianlamviec', 'conglamviec', 'tencongviec', 'thamsotinhluong', 'thanhtien',
+)
+
+
+@login_required
+@require_http_methods(["GET"])
+def api_phieu_luong_ngay_cham_cong(request):
+    """
+    API Nhật ký chấm công (các ngày có đi làm) trong kỳ của bảng lương, phân trang.
+    Query params: bangluong_id (bắt buộc), nhanvien_ids (danh sách id, phân tách dấu phẩy), page, page_size
+    """
+    bang_luong_id = request.GET.get('bangluong_id')
+    if not bang_luong_id:
+        return json_error('Thiếu tham số bangluong_id', status=400)
+
+    try:
+        bang_luong_obj = Bangluong.objects.select_related('kyluong').get(id=bang_luong_id)
+    except (Bangluong.DoesNotExist, ValueError):
+        return json_error('Bảng lương không tồn tại', status=400)
+
+    bcc_qs = Bangchamcong.objects.filter(
+        ngaylamviec__range=[bang_luong_obj.kyluong.ngaybatdau, bang_luong_obj.kyluong.ngayketthuc],
+        codilam=True,
+        nhanvien_id__in=NhanvienChedoluong.objects.filter(
+            chedoluong_id=bang_luong_obj.chedoluong_id, trangthai='active'
+        ).values('nhanvien_id'),
+    )
+
+    nhanvien_ids_raw = request.GET.get('nhanvien_ids')
+    if nhanvien_ids_raw:
+        try:
+            nhanvien_ids = [int(x) for x in nhanvien_ids_raw.split(',') if x.strip()]
+        except ValueError:
+            return json_error('Dữ liệu ID không hợp lệ', status=400)
+        bcc_qs = bcc_qs.filter(nhanvien_id__in=nhanvien_ids)
+
+    bcc_qs = bcc_qs.values(*NGAY_CHAM_CONG_FIELDS).order_by('nhanvien_id', 'ngaylamviec', 'id')
+    page_obj, paginator = paginate_queryset(request, bcc_qs, default_page_size=200)
+
+    return json_success(
+        'Lấy nhật ký chấm công thành công',
+        data=list(page_obj),
+        pagination={
+            'page': page_obj.number,
+            'page_size': paginator.per_page,
+            'total': paginator.count,
+            'total_pages': paginator.num_pages,
+            'has_next': page_obj.has_next(),
+            'has_prev': page_obj.has_previous()
+        }
+    )
+
+
 # ------------------------------ TÍNH LẠI LƯƠNG ------------------------------
 @require_http_methods(["POST"])
 @transaction.atomic
@@ -1240,24 +1322,208 @@ def api_phieu_luong_recalculate(request):
             status=400
         )
 
-    # 3. Xóa phiếu lương cũ
-    old_phieu_ids = list(Phieuluong.objects.filter(bangluong_id=bang_luong_id).values_list('id', flat=True))
-    if old_phieu_ids:
-        Ctphieuluong.objects.filter(phieuluong_id__in=old_phieu_ids).delete()
-        Phieuluong.objects.filter(id__in=old_phieu_ids).delete()
-
-    # 4. Sinh lại phiếu lương
-    result_data, message = genarate_phieu_luong_from_bang_luong(bang_luong_id)
+    # 3. Xóa phiếu lương cũ, sinh lại phiếu lương và chuyển bảng lương về processing
+    result_data, message = run_phieu_luong_generation(bang_luong_id, recalculate=True)
     if not result_data:
         return json_error(message or 'Không thể tính lại lương')
 
-    # 5. Cập nhật trạng thái bảng lương về processing
-    bang_luong_obj.trangthai = 'processing'
-    bang_luong_obj.updated_at = now()
-    bang_luong_obj.save(update_fields=['trangthai', 'updated_at'])
-
     return json_success('Tính lại lương thành công', data=result_data)
 
+
+# ------------------------------ XUẤT EXCEL PHIẾU LƯƠNG ------------------------------
+# Số phiếu lương mỗi lô khi xuất Excel
+PHIEU_LUONG_EXPORT_CHUNK = 500
+
+
+def _phieu_luong_export_rows(bang_luong_id, phan_tu_ids):
+    """Sinh từng dòng Excel của 1 bảng lương: đọc phiếu lương theo lô, mỗi lô 1 query chi tiết."""
+    ds_phieu = (
+        Phieuluong.objects.filter(bangluong_id=bang_luong_id)
+        .values('id', 'maphieuluong', 'tennhanvien', 'tenphongban', 'tenchucvu',
+                'tongthunhap', 'tongkhautru', 'sotienthuetncn', 'luongthuclinh')
+        .order_by('tennhanvien', 'id')
+        .iterator(chunk_size=PHIEU_LUONG_EXPORT_CHUNK)
+    )
+    while True:
+        batch = list(islice(ds_phieu, PHIEU_LUONG_EXPORT_CHUNK))
+        if not batch:
+            return
+
+        gia_tri_map = defaultdict(dict)
+        ct_rows = Ctphieuluong.objects.filter(
+            phieuluong_id__in=[phieu['id'] for phieu in batch]
+        ).values_list('phieuluong_id', 'phantuluong_id', 'giatritinhduoc')
+        for phieuluong_id, phantuluong_id, gia_tri in ct_rows:
+            gia_tri_map[phieuluong_id][phantuluong_id] = gia_tri
+
+        for phieu in batch:
+            gia_tri_phieu = gia_tri_map.get(phieu['id'], {})
+            yield (
+                [phieu['maphieuluong'], phieu['tennhanvien'], phieu['tenphongban'], phieu['tenchucvu']]
+                + [gia_tri_phieu.get(pt_id) for pt_id in phan_tu_ids]
+                + [phieu['tongthunhap'], phieu['tongkhautru'], phieu['sotienthuetncn'], phieu['luongthuclinh']]
+            )
+
+
+def export_phieu_luong(params):
+    """
+    Producer xuất Excel phiếu lương (job xuất nền): 1 sheet cho mỗi bảng lương (mỗi chế độ lương).
+    params: bangluong_id (1 bảng lương) hoặc kyluong_id (mọi bảng lương của kỳ).
+    Raises: ValueError nếu thiếu/sai tham số hoặc không có bảng lương
+    """
+    bang_luong_id = params.get('bangluong_id')
+    ky_luong_id = params.get('kyluong_id')
+    if not bang_luong_id and not ky_luong_id:
+        raise ValueError('Thiếu tham số bangluong_id hoặc kyluong_id')
+    try:
+        if bang_luong_id:
+            bang_luong_qs = Bangluong.objects.filter(id=int(bang_luong_id))
+            file_suffix = bang_luong_id
+        else:
+            bang_luong_qs = Bangluong.objects.filter(kyluong_id=int(ky_luong_id))
+            file_suffix = f"Ky{ky_luong_id}"
+    except (TypeError, ValueError):
+        raise ValueError('Tham số không hợp lệ')
+
+    ds_bang_luong = list(bang_luong_qs.order_by('id').values('id', 'mabangluong', 'tenbangluong'))
+    if not ds_bang_luong:
+        raise ValueError('Bảng lương không tồn tại')
+
+    sheets = []
+    for bang_luong in ds_bang_luong:
+        # Cột phần tử lương theo thứ tự hiển thị (giống màn hình phiếu lương)
+        ds_phan_tu = list(
+            Ctphieuluong.objects
+            .filter(phieuluong__bangluong_id=bang_luong['id'])
+            .values('phantuluong_id')
+            .annotate(min_order=Min('thutuhienthi'), ten=Min('tenphantuluong'))
+            .order_by('min_order', 'phantuluong_id')
+        )
+        headers = (
+            ['Mã phiếu', 'Nhân viên', 'Phòng ban', 'Chức vụ']
+            + [pt['ten'] or str(pt['phantuluong_id']) for pt in ds_phan_tu]
+            + ['Tổng thu nhập', 'Tổng khấu trừ', 'Thuế TNCN', 'Lương thực lĩnh']
+        )
+        sheets.append(XlsxSheet(
+            bang_luong['tenbangluong'] or bang_luong['mabangluong'] or f"Bảng lương {bang_luong['id']}",
+            headers,
+            _phieu_luong_export_rows(bang_luong['id'], [pt['phantuluong_id'] for pt in ds_phan_tu]),
+            bold_columns=(-1,),
+        ))
+    return sheets, f"PhieuLuong_{file_suffix}.xlsx"
+
+
+# ------------------------------ SINH PHIẾU LƯƠNG NỀN (CELERY) ------------------------------
+PHIEU_LUONG_JOB_ACTIVE_STATES = {'PENDING', 'RECEIVED', 'STARTED', 'PROGRESS', 'RETRY'}
+
+
+def _submit_phieu_luong_job(bang_luong_id, recalculate=False):
+    """
+    Đẩy job sinh phiếu lương sang Celery. Nếu bảng lương đang có job chạy thì trả về job đó (không đẩy trùng).
+    """
+    job_key = PHIEU_LUONG_JOB_KEY.format(bangluong_id=bang_luong_id)
+    active_job = get_active_job(job_key, PHIEU_LUONG_JOB_ACTIVE_STATES)
+    if active_job:
+        return {'job_id': active_job[0], 'status': active_job[1], 'reused': True}
+
+    # Đẩy job sau khi transaction hiện tại commit để worker thấy đúng dữ liệu
+    job_id = enqueue_on_commit(
+        generate_phieu_luong_task, job_key, PHIEU_LUONG_JOB_TTL,
+        args=[int(bang_luong_id)], kwargs={'recalculate': recalculate},
+    )
+    return {'job_id': job_id, 'status': 'PENDING', 'reused': False}
+
+
+@login_required
+@require_http_methods(["POST"])
+@csrf_exempt
+def api_phieu_luong_generate_job(request):
+    """API đẩy job sinh/tính lại phiếu lương chạy nền. Body: {bangluong_id, recalculate}"""
+    try:
+        data = loads(request.body)
+        bang_luong_id = int(data.get('bangluong_id'))
+        recalculate = data.get('recalculate') is True
+    except Exception:
+        return json_error('Dữ liệu không hợp lệ', status=400)
+
+    try:
+        bang_luong_obj = Bangluong.objects.get(id=bang_luong_id)
+    except Bangluong.DoesNotExist:
+        return json_error('Bảng lương không tồn tại', status=400)
+
+    has_payslips = Phieuluong.objects.filter(bangluong_id=bang_luong_id).exists()
+    if recalculate:
+        if bang_luong_obj.trangthai in ['approved', 'paid']:
+            return json_error(
+                f'Không thể tính lại: Bảng lương đã ở trạng thái "{BangLuongService.get_status_display(bang_luong_obj.trangthai)}"',
+                status=400
+            )
+    else:
+        if has_payslips:
+            return json_error('Bảng lương đã có phiếu lương, dùng chức năng tính lại lương', status=400)
+        if bang_luong_obj.trangthai in ['approved', 'paid', 'cancelled']:
+            return json_error(
+                f'Bảng lương đã ở trạng thái "{BangLuongService.get_status_display(bang_luong_obj.trangthai)}", không thể sinh phiếu lương mới'
+            )
+
+    job = _submit_phieu_luong_job(bang_luong_id, recalculate=recalculate)
+    return json_success('Đã tiếp nhận yêu cầu sinh phiếu lương', data=job)
+
+
+@login_required
+@require_http_methods(["GET"])
+def api_phieu_luong_generate_job_status(request, job_id):
+    """API theo dõi tiến độ job sinh phiếu lương: trạng thái, số nhân viên đã xử lý / tổng."""
+    state = get_job_state(job_id)
+    payload = {'job_id': str(job_id), 'status': state, 'processed': 0, 'total': 0}
+    if state is None:
+        return json_error('Job sinh phiếu lương không tồn tại hoặc đã hết hạn', status=404, data=payload)
+
+    result = AsyncResult(str(job_id))
+
+    if state == 'PROGRESS' and isinstance(result.info, dict):
+        payload['processed'] = result.info.get('processed', 0)
+        payload['total'] = result.info.get('total', 0)
+    elif state == 'SUCCESS':
+        task_result = result.result or {}
+        payload['processed'] = payload['total'] = task_result.get('total', 0)
+        if not task_result.get('success'):
+            payload['status'] = 'FAILURE'
+            return json_error(task_result.get('message') or 'Không thể sinh phiếu lương', data=payload)
+        payload['message'] = task_result.get('message')
+    elif state == 'FAILURE':
+        return json_error('Job sinh phiếu lương bị lỗi', data=payload)
+
+    return json_success('Lấy tiến độ sinh phiếu lương thành công', data=payload)
+
+
+@login_required
+@require_http_methods(["GET"])
+def api_phieu_luong_generate_job_result(request, job_id):
+    """
+    API lấy kết quả job sinh phiếu lương (cùng format với GET api_phieu_luong_list).
+    Kết quả job chỉ gồm {success, message, total}: phiếu đã lưu đọc lại từ DB,
+    phiếu nháp (chưa lưu lần đầu) lấy từ cache theo job trong thời hạn PHIEU_LUONG_JOB_TTL.
+    """
+    state = get_job_state(job_id)
+    if state is None:
+        return json_error('Job sinh phiếu lương không tồn tại hoặc đã hết hạn', status=404)
+    if state != 'SUCCESS':
+        return json_error('Job sinh phiếu lương chưa hoàn tất', status=409, data={'status': state})
+
+    task_result = AsyncResult(str(job_id)).result or {}
+    if not task_result.get('success'):
+        return json_error(task_result.get('message') or 'Không thể sinh phiếu lương')
+
+    bang_luong_id = task_result.get('bangluong_id')
+    if bang_luong_id and Phieuluong.objects.filter(bangluong_id=bang_luong_id).exists():
+        return json_success(task_result.get('message'), data=_get_saved_phieu_luong_payload(bang_luong_id))
+
+    draft = cache.get(PHIEU_LUONG_DRAFT_KEY.format(job_id=job_id))
+    if draft is None:
+        return json_error('Kết quả sinh phiếu lương đã hết hạn, vui lòng sinh lại', status=410)
+    return json_success(task_result.get('message'), data=draft)
+
         
 # ===================================================================================       
 #------------------------------------CHE DO LUONG------------------------------------
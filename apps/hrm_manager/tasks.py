@@ -0,0 +1,28 @@
+import logging
+
+from celery import shared_task
+
+from apps.hrm_manager.utils.report_export_jobs import run_report_export
+
+logger = logging.getLogger(__name__)
+
+
+@shared_task(bind=True)
+def generate_report_export_task(self, report, params, artifact_key):
+    logger.info("Report export task started. report=%s params=%s", report, params)
+
+    try:
+        artifact = run_report_export(report, params, artifact_key)
+    except ValueError as exc:
+        logger.warning("Report export task rejected. report=%s reason=%s", report, exc)
+        return {"success": False, "message": str(exc)}
+    except Exception:
+        logger.exception("Report export task failed. report=%s", report)
+        raise
+
+    logger.info("Report export task finished. report=%s file=%s", report, artifact["file"])
+    return {
+        "success": True,
+        "token": artifact["token"],
+        "filename": artifact["filename"],
+    }
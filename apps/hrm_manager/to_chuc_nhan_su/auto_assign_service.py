@@ -26,8 +26,9 @@ from apps.hrm_manager.__core__.models import (
     Thietlapsolieucodinh,
 )
 
-import json
-from apps.hrm_manager.__core__.models import Calamviec
+from apps.hrm_manager.utils.assignment_resolver import (
+    KIND_LICH_LAM_VIEC, invalidate_assignments,
+)
 
 logger = logging.getLogger(__name__)
 
@@ -198,6 +199,7 @@ class EmployeeAutoAssignService:
             nhanvien_id=nhanvien_id,
             trangthai='active',
         ).update(trangthai='inactive', ngayketthuc=now, updated_at=now)
+        invalidate_assignments(KIND_LICH_LAM_VIEC)
 
         # 4. Deactivate Thietlapsolieucodinh
         Thietlapsolieucodinh.objects.filter(
@@ -270,6 +272,7 @@ class EmployeeAutoAssignService:
             # Chuyển phòng ban -> Vô hiệu hóa lịch làm việc riêng (ngoại lệ) cũ
             now = timezone.now()
             has_direct.update(trangthai='inactive', ngayketthuc=now, updated_at=now)
+            invalidate_assignments(KIND_LICH_LAM_VIEC)
             warnings.append(
                 "Nhân viên có lịch làm việc riêng ở phòng ban cũ. "
                 "Hệ thống đã tự động gỡ lịch cũ và áp dụng lịch của phòng ban mới."
@@ -335,24 +338,16 @@ class EmployeeAutoAssignService:
         Logic tái sử dụng từ LichLamViecService.generate_actual_schedule_for_fixed
         nhưng chỉ cho 1 NV.
         """
-        from apps.hrm_manager.lich_lam_viec.services import CaLamViecService
+        from apps.hrm_manager.lich_lam_viec.services import CaLamViecService, bulk_insert_lich_lam_viec_thuc_te
 
         # Build day_shifts_map: {weekday: [ca_id, ...]}
         day_shifts_map = {}
-        days_with_shifts = set()
         for ngay, ca_id in lich.lichlamvieccodinh_set.values_list('ngaytrongtuan', 'calamviec_id'):
             if ca_id:
                 day_shifts_map.setdefault(ngay, []).append(ca_id)
-                days_with_shifts.add(ngay)
         
         # Pre-build snapshot map
-        snapshot_map = {}
-        for ca_id in set(ca_id for ca_ids in day_shifts_map.values() for ca_id in ca_ids):
-            ca_obj = Calamviec.objects.filter(id=ca_id).prefetch_related(
-                'khunggiolamviec_set', 'khunggionghitrua_set'
-            ).first()
-            if ca_obj:
-                snapshot_map[ca_id] = json.dumps(CaLamViecService._build_snapshot_ca(ca_obj), ensure_ascii=False)
+        snapshot_map = CaLamViecService.get_snapshot_map(ca_id for ca_ids in day_shifts_map.values() for ca_id in ca_ids)
 
         # Xóa lịch cũ tương lai của NV này thuộc lịch này (không cho phép ghi đè)
         Lichlamviecthucte.objects.filter(
@@ -363,41 +358,14 @@ class EmployeeAutoAssignService:
             chophepghide=False,
         ).delete()
 
-        # Sinh records
-        records = []
-        created_at = timezone.now()
-        delta = (end_date - start_date).days + 1
-
-        for i in range(delta):
-            current_date = start_date + timedelta(days=i)
-            weekday = current_date.weekday()
-
-            base_kwargs = {
-                'ngaylamviec': current_date,
-                'chophepghide': False,
-                'lichlamviec': lich,
-                'nguongoc': 'CO_DINH',
-                'created_at': created_at,
-                'nhanvien_id': nhanvien_id,
-            }
+        # Sinh records: stream thẳng vào DB (COPY), ngày không có ca → 1 dòng ngày nghỉ
+        def rows():
+            for i in range((end_date - start_date).days + 1):
+                current_date = start_date + timedelta(days=i)
+                for ca_id in day_shifts_map.get(current_date.weekday()) or (None,):
+                    yield nhanvien_id, current_date, ca_id, snapshot_map.get(ca_id)
 
-            if weekday in days_with_shifts:
-                for ca_id in day_shifts_map[weekday]:
-                    records.append(Lichlamviecthucte(
-                        calamviec_id=ca_id,
-                        cophaingaynghi=False,
-                        snapshot_ca=snapshot_map.get(ca_id),
-                        **base_kwargs,
-                    ))
-            else:
-                records.append(Lichlamviecthucte(
-                    calamviec_id=None,
-                    cophaingaynghi=True,
-                    **base_kwargs,
-                ))
-
-        if records:
-            Lichlamviecthucte.objects.bulk_create(records, batch_size=500)
+        bulk_insert_lich_lam_viec_thuc_te(lich.id, 'CO_DINH', rows())
 
     # ------------------------------------------------------------------
     # PRIVATE: Assign chế độ lương
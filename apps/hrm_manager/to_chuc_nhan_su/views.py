@@ -14,10 +14,12 @@ import json
 import re
 from datetime import datetime, timedelta
 from json import loads
-from collections import defaultdict
 
 from apps.hrm_manager.__core__.models import *
 from apps.hrm_manager.to_chuc_nhan_su.auto_assign_service import EmployeeAutoAssignService
+from apps.hrm_manager.utils.department_tree import (
+    department_subtree_q, get_department_tree, invalidate_department_tree,
+)
 
 from apps.hrm_manager.utils.view_helpers import (
     get_list_context,
@@ -315,6 +317,7 @@ def api_phong_ban_list(request):
                 phongbancha_id=phong_ban_cha.id if phong_ban_cha else None,
                 created_at=datetime.now()
             )
+            invalidate_department_tree()
             
             return JsonResponse({
                 'success': True,
@@ -386,6 +389,7 @@ def api_phong_ban_detail(request, id):
 
             phong_ban.updated_at = datetime.now()
             phong_ban.save()
+            invalidate_department_tree()
             
             return JsonResponse({
                 'success': True,
@@ -454,6 +458,7 @@ def api_phong_ban_detail(request, id):
             phong_ban_con_list.delete() # Xóa các phòng ban con trước
 
             phong_ban.delete() # Xóa phòng ban hiện tại
+            invalidate_department_tree()
 
             return JsonResponse({
                 'success': True,
@@ -485,26 +490,16 @@ def api_phong_ban_nhan_vien(request):
     single_id = param_query.pop('phongban_id', None)
     multiple_ids = param_query.pop('phongban_ids', '')  # Format: "1,2,3"
 
-    phongban_ids = set()
-    
-    # Xử lý phongban_id đơn lẻ (backward compatible)
-    if single_id:
-        child_ids = get_all_child_department_ids(single_id, isnclude_root=True)
-        phongban_ids.update(child_ids)
-    
-    # ✅ NEW: Xử lý phongban_ids (batch)
-    if multiple_ids: 
-        for pid in multiple_ids.split(','):
-            pid = pid.strip()
-            if pid:
-                child_ids = get_all_child_department_ids(pid, isnclude_root=True)
-                phongban_ids.update(child_ids)
+    # ✅ TỐI ƯU: Gom phongban_id + phongban_ids, lọc cây con của tất cả gốc ngay trong câu SQL (WITH RECURSIVE)
+    root_ids = [single_id] if single_id else []
+    root_ids.extend(pid.strip() for pid in multiple_ids.split(',') if pid.strip())
+    phongban_filter = department_subtree_q('phongban_id', root_ids) if root_ids else None
 
     try:        
         # Build filters từ Lichsucongtac
         filters = Q()
-        if phongban_ids:
-            filters &= Q(phongban__id__in=phongban_ids)
+        if phongban_filter is not None:
+            filters &= phongban_filter
         elif congty_id:
             filters &= Q(phongban__congty_id=congty_id)
         
@@ -649,38 +644,12 @@ def api_phong_ban_tree(request):
 def get_all_child_department_ids(root_id, isnclude_root=False):
     """
     Trả về list tất cả ID con, cháu, chắt...của một phòng ban.
-    Tối ưu: Chỉ tốn đúng 1 câu lệnh truy vấn Database.
+    ✅ TỐI ƯU: Tra trên chỉ mục cây phòng ban đã cache (không query lại toàn bảng mỗi lần gọi).
     """
     if not root_id:
         return []
-    
-    # Lấy dữ liệu thô (Chỉ lấy cột cần thiết để tối ưu bộ nhớ)
-    all_nodes = Phongban.objects.values_list('id', 'phongbancha_id')
-
-    # Xây dựng bản đồ Cha-Con
-    parent_map = defaultdict(list)
-    for ID, parent_ID in all_nodes:
-        if parent_ID: # Nếu có cha
-            parent_map[parent_ID].append(ID)
-    
-    # Thu thập kết quả
-    results = []
-    stack = [int(root_id)]  # Bắt đầu từ node gốc
-    
-    while stack:
-        current_id = stack.pop()
-        
-        # Tìm các con trực tiếp của node đang xét
-        direct_children = parent_map.get(current_id, [])
-        
-        if direct_children:
-            results.extend(direct_children) # Thêm vào kết quả
-            stack.extend(direct_children)   # Thêm vào stack để tiếp tục tìm con của chúng
-
-    if isnclude_root:
-        results.append(int(root_id))
 
-    return results
+    return list(get_department_tree().descendants([root_id], include_root=isnclude_root))
 
 # ==================== API NHÂN VIÊN ====================
 
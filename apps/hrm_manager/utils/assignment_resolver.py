@@ -0,0 +1,164 @@
+"""
+File: assignment_resolver.py
+Resolver phân công trực tiếp hiệu lực theo kỳ: nhân viên → lịch làm việc.
+Dựng 1 lần cho mỗi kỳ, dùng lại cho mọi lịch trong cùng lượt chạy và cache qua Redis giữa các request.
+"""
+
+from collections import OrderedDict
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Q
+import logging
+import threading
+import time
+
+from apps.hrm_manager.__core__.models import LichlamviecNhanvien
+
+
+logger = logging.getLogger(__name__)
+
+KIND_LICH_LAM_VIEC = 'lichlamviec'
+
+# kind → (model phân công trực tiếp, tên FK tới đối tượng áp dụng)
+_SPECS = {
+    KIND_LICH_LAM_VIEC: (LichlamviecNhanvien, 'lichlamviec'),
+}
+
+# Phiên bản dữ liệu phân công - đổi mỗi khi gán/gỡ/chuyển nhân viên hoặc bật/tắt/xóa lịch
+ASSIGNMENT_VERSION_KEY = "assign:ver:{kind}"
+ASSIGNMENT_MAP_KEY = "assign:map:{kind}:{version}:{start}:{end}"
+# TTL ngắn: lưới an toàn nếu có chỗ ghi dữ liệu phân công quên báo invalidate
+ASSIGNMENT_MAP_TTL = 600
+ASSIGNMENT_LOCAL_SIZE = 32
+
+_local = OrderedDict()
+_local_lock = threading.Lock()
+
+
+def _dt_rank(value):
+    if value is None:
+        return float('-inf')
+    return value.timestamp()
+
+
+def _load_direct_map(kind, start_date, end_date):
+    """
+    Đọc DB: {nhanvien_id: target_id} cho phân công trực tiếp hiệu lực trong kỳ.
+    Nếu 1 nhân viên có nhiều phân công chồng nhau, ưu tiên record có ngayapdung/created_at/id mới hơn.
+    """
+    model, target = _SPECS[kind]
+    query = model.objects.filter(
+        trangthai='active'
+    ).filter(
+        Q(**{f'{target}__is_deleted': False}) | Q(**{f'{target}__is_deleted__isnull': True}),
+        **{f'{target}__trangthai': 'active'}
+    )
+    if start_date is not None:
+        query = query.filter(
+            Q(ngayapdung__isnull=True) | Q(ngayapdung__date__lte=end_date)
+        ).filter(
+            Q(ngayketthuc__isnull=True) | Q(ngayketthuc__date__gte=start_date)
+        )
+
+    winners = {}
+    for row in query.values('id', 'nhanvien_id', f'{target}_id', 'ngayapdung', 'created_at'):
+        nhanvien_id = row.get('nhanvien_id')
+        if not nhanvien_id:
+            continue
+
+        rank = (
+            _dt_rank(row.get('ngayapdung')),
+            _dt_rank(row.get('created_at')),
+            row.get('id') or 0,
+        )
+        current = winners.get(nhanvien_id)
+        if current is None or rank > current[0]:
+            winners[nhanvien_id] = (rank, row.get(f'{target}_id'))
+
+    return {nhanvien_id: item[1] for nhanvien_id, item in winners.items()}
+
+
+def _current_version(kind):
+    """Tem phiên bản hiện tại; chưa có (mới khởi động / bị evict) thì tạo tem mới để không đọc nhầm map cũ."""
+    key = ASSIGNMENT_VERSION_KEY.format(kind=kind)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, str(time.time_ns()), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+class EffectiveAssignmentResolver:
+    """Map phân công trực tiếp hiệu lực của 1 kỳ (nhân viên → lịch)."""
+
+    def __init__(self, kind, start_date, end_date, direct_map):
+        self.kind = kind
+        self.start_date = start_date
+        self.end_date = end_date
+        self._direct_map = direct_map
+
+    def direct_map(self):
+        """{nhanvien_id: target_id} (bản dùng chung - không sửa trực tiếp)."""
+        return self._direct_map
+
+
+def get_assignment_resolver(kind, start_date=None, end_date=None):
+    """
+    Lấy resolver của kỳ [start_date, end_date] (None = không giới hạn kỳ).
+    Thứ tự: bộ nhớ process (cùng phiên bản) → Redis → DB (1 query quét toàn bộ phân công).
+    """
+    try:
+        version = _current_version(kind)
+    except Exception:
+        logger.warning("Assignment cache unavailable, loading from DB", exc_info=True)
+        return EffectiveAssignmentResolver(kind, start_date, end_date, _load_direct_map(kind, start_date, end_date))
+
+    map_key = ASSIGNMENT_MAP_KEY.format(
+        kind=kind,
+        version=version,
+        start=start_date.isoformat() if start_date else '-',
+        end=end_date.isoformat() if end_date else '-',
+    )
+    with _local_lock:
+        entry = _local.get(map_key)
+        if entry is not None and entry[0] > time.monotonic():
+            _local.move_to_end(map_key)
+            return entry[1]
+
+    try:
+        direct_map = cache.get(map_key)
+    except Exception:
+        direct_map = None
+    # Trong transaction có thể đang đọc dữ liệu phân công chưa commit → không lưu vào cache dùng chung
+    shareable = not transaction.get_connection().in_atomic_block
+    if direct_map is None:
+        direct_map = _load_direct_map(kind, start_date, end_date)
+        if shareable:
+            try:
+                cache.set(map_key, direct_map, timeout=ASSIGNMENT_MAP_TTL)
+            except Exception:
+                logger.warning("Assignment cache write failed", exc_info=True)
+
+    resolver = EffectiveAssignmentResolver(kind, start_date, end_date, direct_map)
+    if shareable:
+        with _local_lock:
+            _local[map_key] = (time.monotonic() + ASSIGNMENT_MAP_TTL, resolver)
+            _local.move_to_end(map_key)
+            while len(_local) > ASSIGNMENT_LOCAL_SIZE:
+                _local.popitem(last=False)
+    return resolver
+
+
+def invalidate_assignments(kind):
+    """
+    Gọi sau khi thay đổi dữ liệu phân công: đổi tem phiên bản (ngay và sau commit)
+    để mọi process bỏ map cũ.
+    """
+    def _bump():
+        try:
+            cache.set(ASSIGNMENT_VERSION_KEY.format(kind=kind), str(time.time_ns()), timeout=None)
+        except Exception:
+            logger.warning("Assignment cache invalidation failed. kind=%s", kind, exc_info=True)
+
+    _bump()
+    transaction.on_commit(_bump)
@@ -0,0 +1,84 @@
+"""
+File: benchmark.py
+Helper đo hiệu năng cho các management command seed_benchmark_data / run_benchmarks
+"""
+
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+import statistics
+import time
+import tracemalloc
+
+
+# Tiền tố mã (manhanvien, maphongban, macalamviec...) đánh dấu dữ liệu tổng hợp sinh ra để benchmark
+BENCHMARK_PREFIX = 'BENCH'
+
+
+def _run_once(func, args, kwargs, rollback):
+    # 1 lần chạy trong transaction (rollback nếu cần): trả về (thời gian ms, số query SQL)
+    with transaction.atomic(), CaptureQueriesContext(connection) as captured:
+        started = time.perf_counter()
+        func(*args, **kwargs)
+        elapsed = (time.perf_counter() - started) * 1000
+        if rollback:
+            transaction.set_rollback(True)
+    return elapsed, len(captured.captured_queries)
+
+
+def measure(name, func, *args, repeat=1, rollback=True, **kwargs):
+    """
+    Chạy func(*args, **kwargs) `repeat` lần và đo thời gian (wall), số query SQL, bộ nhớ Python cấp phát đỉnh.
+    tracemalloc làm chậm code cấp phát nhiều gấp vài lần nên chỉ bật ở 1 lần chạy thêm (không tính giờ)
+    sau các lần đo thời gian.
+
+    Args:
+        name (str): Tên kịch bản benchmark
+        func (callable): Hàm cần đo
+        repeat (int): Số lần chạy đo thời gian (lấy min/median, số query của lần chạy cuối)
+        rollback (bool): Chạy trong transaction và rollback sau mỗi lần (cho các hàm có ghi DB)
+
+    Returns:
+        dict: {name, runs, wall_ms_min, wall_ms_median, queries, peak_mem_kb}
+    """
+    timings = []
+    queries = 0
+    for _ in range(max(1, repeat)):
+        elapsed, queries = _run_once(func, args, kwargs, rollback)
+        timings.append(elapsed)
+
+    tracemalloc.start()
+    try:
+        _run_once(func, args, kwargs, rollback)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'name': name,
+        'runs': len(timings),
+        'wall_ms_min': round(min(timings), 2),
+        'wall_ms_median': round(statistics.median(timings), 2),
+        'queries': queries,
+        'peak_mem_kb': round(peak / 1024, 1),
+    }
+
+
+def compare_with_baseline(results, baseline, max_regression_pct):
+    """
+    So sánh kết quả với baseline (cùng format measure). Trả về danh sách thông báo hồi quy:
+    thời gian median tăng quá max_regression_pct % hoặc số query tăng.
+    """
+    baseline_map = {item['name']: item for item in baseline}
+    regressions = []
+    for item in results:
+        base = baseline_map.get(item['name'])
+        if not base:
+            continue
+        limit_ms = base['wall_ms_median'] * (1 + max_regression_pct / 100)
+        if item['wall_ms_median'] > limit_ms:
+            regressions.append(
+                f"{item['name']}: {item['wall_ms_median']}ms > {base['wall_ms_median']}ms (+{max_regression_pct}%)"
+            )
+        if item['queries'] > base['queries']:
+            regressions.append(f"{item['name']}: {item['queries']} queries > {base['queries']}")
+    return regressions
@@ -0,0 +1,59 @@
+"""
+File: celery_jobs.py
+Đẩy job Celery sau khi transaction commit và theo dõi job đang chạy qua cache (chống đẩy trùng).
+Khóa job chỉ được ghi sau khi apply_async thành công: broker lỗi hoặc transaction rollback
+không để lại job "ma" mà các request sau dùng lại.
+"""
+
+from celery.result import AsyncResult
+from django.core.cache import cache
+from django.db import transaction
+from uuid import uuid4
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+# Đánh dấu job id đã thực sự vào hàng đợi (Celery trả PENDING cho cả id chưa từng tồn tại)
+JOB_QUEUED_KEY = "celery:job:queued:{job_id}"
+
+
+def enqueue_on_commit(task, job_key, timeout, args=None, kwargs=None):
+    """
+    Đẩy task sau khi transaction hiện tại commit, trả về job id.
+    Chỉ khi apply_async thành công mới ghi job_key -> job id (để request sau dùng lại);
+    đẩy lỗi thì xóa job_key, job id trả về sẽ được báo là không tồn tại (get_job_state -> None).
+    """
+    job_id = str(uuid4())
+
+    def _enqueue():
+        try:
+            task.apply_async(args=args or [], kwargs=kwargs or {}, task_id=job_id)
+        except Exception:
+            logger.exception("Enqueue failed. task=%s job_id=%s", task.name, job_id)
+            cache.delete(job_key)
+            return
+        cache.set(JOB_QUEUED_KEY.format(job_id=job_id), 1, timeout=timeout)
+        cache.set(job_key, job_id, timeout=timeout)
+
+    transaction.on_commit(_enqueue)
+    return job_id
+
+
+def get_job_state(job_id):
+    """Trạng thái Celery của job; None nếu job id chưa từng được đưa vào hàng đợi (hoặc đã hết hạn theo dõi)."""
+    state = AsyncResult(str(job_id)).state
+    if state == 'PENDING' and cache.get(JOB_QUEUED_KEY.format(job_id=job_id)) is None:
+        return None
+    return state
+
+
+def get_active_job(job_key, active_states):
+    """(job_id, state) của job đang chạy ghi ở job_key, None nếu không có."""
+    job_id = cache.get(job_key)
+    if not job_id:
+        return None
+    state = get_job_state(job_id)
+    if state not in active_states:
+        return None
+    return job_id, state
@@ -0,0 +1,224 @@
+"""
+File: department_tree.py
+Chỉ mục cây Phòng ban (bao đóng tổ tiên / con cháu) dựng 1 lần từ bảng PhongBan,
+cache qua Redis + bộ nhớ process theo phiên bản, đổi phiên bản mỗi khi thêm/sửa/xóa phòng ban.
+"""
+
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+import logging
+import threading
+import time
+
+from apps.hrm_manager.__core__.models import Phongban
+
+
+logger = logging.getLogger(__name__)
+
+DEPT_TREE_VERSION_KEY = "dept:tree:ver"
+DEPT_TREE_KEY = "dept:tree:{version}"
+DEPT_TREE_TTL = 24 * 3600
+
+_local = {}
+_local_lock = threading.Lock()
+# Đánh dấu transaction hiện tại (theo thread) đã sửa cây phòng ban → không cache bản chưa commit
+_state = threading.local()
+
+
+class DepartmentTree:
+    """
+    Bao đóng của cây phòng ban:
+    - Con cháu: thứ tự duyệt trước (preorder) + khoảng [tin, tout) của mỗi node → con cháu là 1 lát cắt liên tục.
+    - Tổ tiên: chuỗi cha lần lượt của mỗi node (dùng khi kiểm tra "có tổ tiên nào được chọn").
+    """
+
+    def __init__(self, rows):
+        """rows: iterable (id, phongbancha_id, trangthai)"""
+        parent_of = {}
+        active = set()
+        children = {}
+        for dept_id, parent_id, trangthai in rows:
+            parent_of[dept_id] = parent_id
+            if trangthai == 'active':
+                active.add(dept_id)
+            if parent_id:
+                children.setdefault(parent_id, []).append(dept_id)
+
+        order = []
+        tin = {}
+        tout = {}
+        # Gốc: node không có cha / cha không tồn tại; node thuộc chu trình (dữ liệu lỗi) được duyệt sau cùng
+        roots = [dept_id for dept_id, parent_id in parent_of.items() if not parent_id or parent_id not in parent_of]
+        pending = roots + list(parent_of)
+        for root in pending:
+            if root in tin:
+                continue
+            tin[root] = len(order)
+            order.append(root)
+            stack = [(root, iter(children.get(root, ())))]
+            while stack:
+                node, it = stack[-1]
+                child = next(it, None)
+                if child is None:
+                    tout[node] = len(order)
+                    stack.pop()
+                elif child not in tin:
+                    tin[child] = len(order)
+                    order.append(child)
+                    stack.append((child, iter(children.get(child, ()))))
+
+        self._parent_of = parent_of
+        self._active = active
+        self._order = order
+        self._tin = tin
+        self._tout = tout
+        self._active_ancestors = {}
+
+    def descendants(self, root_ids, include_root=False):
+        """Tất cả con, cháu, chắt... của các phòng ban gốc (mọi trạng thái)."""
+        result = set()
+        for root_id in root_ids:
+            if not root_id:
+                continue
+            root_id = int(root_id)
+            start = self._tin.get(root_id)
+            if start is not None:
+                result.update(self._order[start + 1:self._tout[root_id]])
+            if include_root:
+                result.add(root_id)
+        return result
+
+    def _active_ancestor_chain(self, dept_id):
+        """
+        Chuỗi cha của 1 phòng ban active, đi lên tới khi gặp cha không active (cha đó vẫn được tính).
+        Giữ đúng cách kiểm tra cũ trên tập phòng ban active.
+        """
+        chain = self._active_ancestors.get(dept_id)
+        if chain is None:
+            chain = []
+            seen = {dept_id}
+            current = dept_id if dept_id in self._active else None
+            while current:
+                parent_id = self._parent_of.get(current)
+                if not parent_id or parent_id in seen:
+                    break
+                chain.append(parent_id)
+                seen.add(parent_id)
+                current = parent_id if parent_id in self._active else None
+            chain = tuple(chain)
+            self._active_ancestors[dept_id] = chain
+        return chain
+
+    def consolidate(self, dept_ids):
+        """Loại bỏ phòng ban có tổ tiên cũng nằm trong danh sách chọn (chỉ giữ phòng ban cao nhất)."""
+        selected = {int(dept_id) for dept_id in dept_ids}
+        return [
+            dept_id for dept_id in selected
+            if selected.isdisjoint(self._active_ancestor_chain(dept_id))
+        ]
+
+
+def _load_rows():
+    return list(Phongban.objects.values_list('id', 'phongbancha_id', 'trangthai'))
+
+
+def _current_version():
+    version = cache.get(DEPT_TREE_VERSION_KEY)
+    if version is None:
+        cache.add(DEPT_TREE_VERSION_KEY, str(time.time_ns()), timeout=None)
+        version = cache.get(DEPT_TREE_VERSION_KEY)
+    return version
+
+
+def get_department_tree():
+    """
+    Lấy chỉ mục cây phòng ban: bộ nhớ process (cùng phiên bản) → Redis → DB (1 query toàn bảng).
+    Trong transaction đã sửa phòng ban thì luôn đọc DB và không cache.
+    """
+    connection_atomic = transaction.get_connection().in_atomic_block
+    if not connection_atomic:
+        _state.dirty = False
+    if connection_atomic and getattr(_state, 'dirty', False):
+        return DepartmentTree(_load_rows())
+
+    try:
+        version = _current_version()
+    except Exception:
+        logger.warning("Department tree cache unavailable, loading from DB", exc_info=True)
+        return DepartmentTree(_load_rows())
+
+    with _local_lock:
+        tree = _local.get(version)
+    if tree is not None:
+        return tree
+
+    key = DEPT_TREE_KEY.format(version=version)
+    try:
+        rows = cache.get(key)
+    except Exception:
+        rows = None
+    if rows is None:
+        rows = _load_rows()
+        try:
+            cache.set(key, rows, timeout=DEPT_TREE_TTL)
+        except Exception:
+            logger.warning("Department tree cache write failed", exc_info=True)
+
+    tree = DepartmentTree(rows)
+    with _local_lock:
+        # Chỉ giữ bản của phiên bản mới nhất
+        _local.clear()
+        _local[version] = tree
+    return tree
+
+
+def invalidate_department_tree():
+    """Gọi sau khi thêm/sửa/xóa phòng ban: đổi tem phiên bản (ngay và sau commit)."""
+    def _bump():
+        try:
+            cache.set(DEPT_TREE_VERSION_KEY, str(time.time_ns()), timeout=None)
+        except Exception:
+            logger.warning("Department tree cache invalidation failed", exc_info=True)
+
+    def _after_commit():
+        _state.dirty = False
+        _bump()
+
+    if transaction.get_connection().in_atomic_block:
+        _state.dirty = True
+    _bump()
+    transaction.on_commit(_after_commit)
+
+
+def _subtree_sql(include_root):
+    table = Phongban._meta.db_table
+    seed = 'pb.id = ANY(%s::bigint[])' if include_root else 'pb.phongbancha_id = ANY(%s::bigint[])'
+    return (
+        "WITH RECURSIVE pb_subtree(id) AS ("
+        f"SELECT pb.id FROM {table} pb WHERE {seed} "
+        # UNION (không ALL) loại trùng → dừng được cả khi dữ liệu cha-con bị vòng lặp
+        f"UNION SELECT c.id FROM {table} c JOIN pb_subtree s ON c.phongbancha_id = s.id"
+        ") SELECT id FROM pb_subtree"
+    )
+
+
+def department_subtree_q(field, root_ids, include_root=True):
+    """
+    Q lọc `field` (ID phòng ban) thuộc cây con của các phòng ban gốc, ngay trong cùng câu SQL.
+    PostgreSQL: `field IN (WITH RECURSIVE ...)` với 1 tham số mảng (không bung danh sách ID).
+    DB khác: tra cây đã cache rồi lọc `__in`.
+
+    Args:
+        field (str): Đường dẫn lookup tới ID phòng ban, VD 'phongban_id', 'lichsucongtac__phongban_id'
+        root_ids (iterable): ID phòng ban gốc (int/str, ID không hợp lệ → ValueError)
+        include_root (bool): Gồm cả phòng ban gốc
+
+    Usage:
+        qs.filter(department_subtree_q('phongban_id', [phongban_id]))
+    """
+    root_ids = sorted({int(root_id) for root_id in root_ids if root_id})
+    if connection.vendor != 'postgresql':
+        return Q(**{f'{field}__in': get_department_tree().descendants(root_ids, include_root=include_root)})
+    return Q(**{f'{field}__in': RawSQL(_subtree_sql(include_root), (root_ids,))})
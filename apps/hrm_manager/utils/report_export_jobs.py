@@ -0,0 +1,191 @@
+"""
+File: report_export_jobs.py
+Xuất báo cáo lớn chạy nền (Celery): file xlsx ghi ra thư mục REPORT_EXPORT_DIR, tải về qua token.
+Cùng báo cáo + cùng bộ lọc + dữ liệu chưa đổi → dùng lại file đã xuất (không chạy lại job).
+
+Mỗi báo cáo đăng ký 1 producer: producer(params) -> (danh sách XlsxSheet, tên file tải về),
+params sai → ValueError (message trả về cho người dùng).
+"""
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from pathlib import Path
+from uuid import uuid4
+import hashlib
+import json
+import logging
+import os
+import time
+
+from apps.hrm_manager.utils.xlsx_export import write_xlsx
+
+
+logger = logging.getLogger(__name__)
+
+# Nhóm dữ liệu nguồn - đổi phiên bản nhóm nào thì mọi file báo cáo dựa trên nhóm đó bị bỏ
+DATA_DOANH_THU = 'doanh_thu'
+DATA_CHAM_CONG = 'cham_cong'
+DATA_PHIEU_LUONG = 'phieu_luong'
+
+# Giá trị bộ lọc nghĩa là "không lọc" (producer xử lý như khi bỏ trống)
+REPORT_PARAM_ALL = 'all'
+
+
+def _current_month():
+    return timezone.localdate().strftime('%Y-%m')
+
+
+# Báo cáo hỗ trợ xuất nền: producer (dotted path, import muộn), quyền cần có, bộ lọc nhận,
+# giá trị mặc định producer tự dùng khi bỏ trống (callable), nhóm dữ liệu nguồn
+REPORT_EXPORTS = {
+    'doanh_thu': {
+        'producer': 'apps.dich_vu_dien_nuoc.views.export_revenue_report',
+        'permission': None,
+        'params': ('start_date', 'end_date', 'customer', 'service'),
+        'data': (DATA_DOANH_THU,),
+    },
+    'tong_hop_cham_cong_thang': {
+        'producer': 'apps.hrm_manager.cham_cong.views.export_tong_hop_cham_cong_thang',
+        'permission': 'access_control.view_cham_cong',
+        'params': ('thang', 'phongban_id', 'search', 'loai_chamcong'),
+        'defaults': {'thang': _current_month},
+        'data': (DATA_CHAM_CONG,),
+    },
+    'phieu_luong': {
+        'producer': 'apps.hrm_manager.quan_ly_luong.views.export_phieu_luong',
+        'permission': None,
+        'params': ('kyluong_id', 'bangluong_id'),
+        'data': (DATA_PHIEU_LUONG,),
+    },
+}
+
+REPORT_DATA_VERSION_KEY = "export:data:ver:{domain}"
+# File đã xuất của 1 bộ (báo cáo, bộ lọc, phiên bản dữ liệu) và token tải về
+REPORT_ARTIFACT_KEY = "export:artifact:{artifact_key}"
+REPORT_TOKEN_KEY = "export:token:{token}"
+# Job đang/đã chạy gần nhất của 1 bộ (báo cáo, bộ lọc, phiên bản dữ liệu) - tránh đẩy trùng job
+REPORT_JOB_KEY = "export:job:{artifact_key}"
+REPORT_JOB_TTL = 1800
+
+
+def normalize_report_params(report, params):
+    """
+    Chỉ giữ các bộ lọc báo cáo nhận, bỏ giá trị rỗng / 'all', điền giá trị mặc định producer sẽ dùng
+    (VD tháng hiện tại) → cùng 1 báo cáo thực tế luôn ra cùng 1 dict (cùng khóa file).
+    """
+    config = REPORT_EXPORTS[report]
+    defaults = config.get('defaults', {})
+    normalized = {}
+    for name in config['params']:
+        value = params.get(name)
+        value = '' if value is None else str(value).strip()
+        if value and value != REPORT_PARAM_ALL:
+            normalized[name] = value
+        elif name in defaults:
+            normalized[name] = defaults[name]()
+    return normalized
+
+
+def _data_version(domain):
+    key = REPORT_DATA_VERSION_KEY.format(domain=domain)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, str(time.time_ns()), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def report_artifact_key(report, params):
+    """Khóa file báo cáo: hash của (báo cáo, bộ lọc đã chuẩn hóa, phiên bản các nhóm dữ liệu nguồn)."""
+    versions = [_data_version(domain) for domain in REPORT_EXPORTS[report]['data']]
+    raw = json.dumps([report, params, versions], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+def invalidate_report_data(domain):
+    """
+    Gọi sau khi dữ liệu nguồn của báo cáo thay đổi: đổi tem phiên bản (ngay và sau commit)
+    để lần xuất sau không dùng lại file cũ.
+    """
+    def _bump():
+        try:
+            cache.set(REPORT_DATA_VERSION_KEY.format(domain=domain), str(time.time_ns()), timeout=None)
+        except Exception:
+            logger.warning("Report export invalidation failed. domain=%s", domain, exc_info=True)
+
+    _bump()
+    transaction.on_commit(_bump)
+
+
+def _export_dir():
+    return Path(settings.REPORT_EXPORT_DIR)
+
+
+def get_report_artifact(artifact_key):
+    """File đã xuất (còn trên đĩa) của 1 bộ (báo cáo, bộ lọc, phiên bản dữ liệu), không có → None."""
+    artifact = cache.get(REPORT_ARTIFACT_KEY.format(artifact_key=artifact_key))
+    if artifact and (_export_dir() / artifact['file']).exists():
+        return artifact
+    return None
+
+
+def open_report_artifact(token):
+    """
+    Tra token tải về → (đường dẫn file, thông tin file) hoặc None nếu token sai / file đã hết hạn.
+    """
+    artifact = cache.get(REPORT_TOKEN_KEY.format(token=token))
+    if not artifact:
+        return None
+    path = _export_dir() / artifact['file']
+    if not path.exists():
+        return None
+    return path, artifact
+
+
+def _purge_expired_files(export_dir):
+    """Xóa file báo cáo (và file tạm bị bỏ dở) quá hạn giữ."""
+    expired_before = time.time() - settings.REPORT_EXPORT_TTL
+    for path in export_dir.iterdir():
+        try:
+            if path.is_file() and path.stat().st_mtime < expired_before:
+                path.unlink()
+        except OSError:
+            logger.warning("Report export purge failed. path=%s", path, exc_info=True)
+
+
+def run_report_export(report, params, artifact_key):
+    """
+    Chạy producer của báo cáo, ghi file xlsx vào REPORT_EXPORT_DIR rồi cấp token tải về (dùng trong Celery task).
+
+    Returns:
+        dict: {'token', 'file', 'filename', 'report'}
+
+    Raises:
+        ValueError: Bộ lọc không hợp lệ (từ producer)
+    """
+    producer = import_string(REPORT_EXPORTS[report]['producer'])
+    sheets, filename = producer(params)
+
+    export_dir = _export_dir()
+    export_dir.mkdir(parents=True, exist_ok=True)
+    file_name = f"{artifact_key}.xlsx"
+    # Ghi ra file tạm rồi đổi tên → request tải về không bao giờ thấy file ghi dở
+    tmp_path = export_dir / f".{artifact_key}.{uuid4().hex}.tmp"
+    try:
+        write_xlsx(sheets, str(tmp_path))
+        os.replace(tmp_path, export_dir / file_name)
+    except Exception:
+        tmp_path.unlink(missing_ok=True)
+        raise
+
+    artifact = {'token': uuid4().hex, 'file': file_name, 'filename': filename, 'report': report}
+    cache.set_many({
+        REPORT_ARTIFACT_KEY.format(artifact_key=artifact_key): artifact,
+        REPORT_TOKEN_KEY.format(token=artifact['token']): artifact,
+    }, timeout=settings.REPORT_EXPORT_TTL)
+
+    _purge_expired_files(export_dir)
+    return artifact
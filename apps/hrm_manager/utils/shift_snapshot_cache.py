@@ -0,0 +1,137 @@
+"""
+File: shift_snapshot_cache.py
+Cache snapshot Ca làm việc (Redis + LRU trong process) theo phiên bản ca (updated_at)
+"""
+
+from collections import OrderedDict
+from django.core.cache import cache
+from django.db import transaction
+import logging
+import threading
+
+
+logger = logging.getLogger(__name__)
+
+# Phiên bản hiện tại của ca (updated_at/created_at ISO) - đổi khi sửa/xóa ca
+SHIFT_VERSION_KEY = "llv:ca:ver:{ca_id}"
+# Dữ liệu snapshot theo loại + phiên bản (phiên bản cũ tự hết hạn)
+SHIFT_SNAPSHOT_KEY = "llv:ca:snap:{kind}:{ca_id}:{version}"
+SHIFT_SNAPSHOT_TTL = 7 * 24 * 3600
+SHIFT_SNAPSHOT_LOCAL_SIZE = 1024
+
+# Loại snapshot
+KIND_LICH = 'lich'           # JSON string snapshot_ca ghi vào Lịch làm việc thực tế
+KIND_CHAM_CONG = 'chamcong'  # Metadata ca (khung giờ + nghỉ trưa) dùng khi dựng dữ liệu chấm công
+
+_local = OrderedDict()
+_local_lock = threading.Lock()
+
+
+def shift_version(updated_at, created_at):
+    """Tem phiên bản của ca: updated_at, chưa sửa lần nào thì created_at."""
+    stamp = updated_at or created_at
+    return stamp.isoformat() if stamp else '0'
+
+
+def _local_get(key):
+    with _local_lock:
+        if key in _local:
+            _local.move_to_end(key)
+            return True, _local[key]
+    return False, None
+
+
+def _local_set(key, value):
+    with _local_lock:
+        _local[key] = value
+        _local.move_to_end(key)
+        while len(_local) > SHIFT_SNAPSHOT_LOCAL_SIZE:
+            _local.popitem(last=False)
+
+
+def get_shift_snapshots(kind, ca_ids, loader):
+    """
+    Lấy snapshot của nhiều ca: LRU trong process → Redis → DB (loader, 1 lần cho tất cả ca còn thiếu).
+
+    Args:
+        kind (str): Loại snapshot (KIND_LICH / KIND_CHAM_CONG)
+        ca_ids (iterable): ID ca làm việc
+        loader (callable): loader(ids) -> {ca_id: (version, data)}, đọc DB theo lô
+
+    Returns:
+        dict: {ca_id: data} (ca không tồn tại sẽ không có trong kết quả)
+    """
+    ca_ids = {int(ca_id) for ca_id in ca_ids if ca_id}
+    if not ca_ids:
+        return {}
+
+    result = {}
+    try:
+        versions = cache.get_many([SHIFT_VERSION_KEY.format(ca_id=ca_id) for ca_id in ca_ids])
+    except Exception:
+        logger.warning("Shift snapshot cache unavailable, loading from DB", exc_info=True)
+        versions = None
+
+    missing = set(ca_ids)
+    if versions:
+        data_keys = {}
+        for ca_id in ca_ids:
+            version = versions.get(SHIFT_VERSION_KEY.format(ca_id=ca_id))
+            if version is None:
+                continue
+            data_key = SHIFT_SNAPSHOT_KEY.format(kind=kind, ca_id=ca_id, version=version)
+            found, value = _local_get(data_key)
+            if found:
+                result[ca_id] = value
+                missing.discard(ca_id)
+            else:
+                data_keys[data_key] = ca_id
+
+        if data_keys:
+            try:
+                cached = cache.get_many(list(data_keys))
+            except Exception:
+                cached = {}
+            for data_key, value in cached.items():
+                ca_id = data_keys[data_key]
+                _local_set(data_key, value)
+                result[ca_id] = value
+                missing.discard(ca_id)
+
+    if missing:
+        loaded = loader(missing)
+        to_cache = {}
+        for ca_id, (version, value) in loaded.items():
+            data_key = SHIFT_SNAPSHOT_KEY.format(kind=kind, ca_id=ca_id, version=version)
+            _local_set(data_key, value)
+            result[ca_id] = value
+            to_cache[SHIFT_VERSION_KEY.format(ca_id=ca_id)] = version
+            to_cache[data_key] = value
+        if to_cache and versions is not None:
+            # Chỉ đẩy lên Redis sau khi transaction hiện tại commit (tránh cache dữ liệu bị rollback)
+            transaction.on_commit(lambda: _write_cache(to_cache))
+
+    return result
+
+
+def _write_cache(values):
+    try:
+        cache.set_many(values, timeout=SHIFT_SNAPSHOT_TTL)
+    except Exception:
+        logger.warning("Shift snapshot cache write failed", exc_info=True)
+
+
+def invalidate_shift_snapshot(ca_id):
+    """
+    Gọi sau khi sửa/xóa ca: bỏ tem phiên bản trên Redis để mọi process đọc lại từ DB
+    (xóa ngay và xóa lại sau commit, tránh process khác nạp lại bản cũ trong lúc chờ commit).
+    LRU trong process giữ theo (ca, phiên bản) nên bản cũ không còn được trỏ tới.
+    """
+    def _delete():
+        try:
+            cache.delete(SHIFT_VERSION_KEY.format(ca_id=ca_id))
+        except Exception:
+            logger.warning("Shift snapshot cache invalidation failed. ca_id=%s", ca_id, exc_info=True)
+
+    _delete()
+    transaction.on_commit(_delete)
@@ -0,0 +1,153 @@
+"""
+File: xlsx_export.py
+Xuất báo cáo Excel dạng streaming: openpyxl write-only (ghi từng dòng, không giữ cả sheet trong bộ nhớ),
+độ rộng cột tính ngay khi ghi, file tạm trên đĩa được trả về theo từng khối (StreamingHttpResponse).
+
+Mỗi báo cáo chỉ cần mô tả các sheet (tiêu đề + header + iterable dòng), VD:
+
+    sheets = [XlsxSheet("Danh sách", ["Mã", "Tên"], ((r.ma, r.ten) for r in qs.iterator()))]
+    return xlsx_streaming_response(sheets, "BaoCao.xlsx")
+"""
+
+from django.http import FileResponse
+from itertools import chain, islice
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font
+from openpyxl.utils import get_column_letter
+import datetime as dt
+import re
+import tempfile
+
+
+XLSX_CONTENT_TYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+# Write-only phải khai báo độ rộng cột trước dòng đầu tiên → tính trên header + N dòng đầu (buffer có giới hạn)
+XLSX_WIDTH_SAMPLE_ROWS = 500
+XLSX_MAX_COLUMN_WIDTH = 60
+
+_BOLD = Font(bold=True)
+# Ký tự Excel không cho phép trong tên sheet, tên tối đa 31 ký tự
+_INVALID_TITLE_CHARS = re.compile(r'[\[\]:*?/\\]')
+_MAX_TITLE_LENGTH = 31
+
+
+class XlsxSheet:
+    """
+    Mô tả 1 sheet cần xuất.
+
+    Args:
+        title (str): Tên sheet
+        headers (list): Dòng tiêu đề (in đậm)
+        rows (iterable): Các dòng dữ liệu (list/tuple), nên là generator / queryset.iterator() để không nạp hết vào bộ nhớ
+        bold_columns (iterable): Vị trí cột in đậm ở mọi dòng (cho phép số âm, VD -1 = cột cuối)
+    """
+
+    def __init__(self, title, headers, rows, bold_columns=()):
+        self.title = title
+        self.headers = list(headers)
+        self.rows = rows
+        self.bold_columns = tuple(bold_columns)
+
+
+def _display_len(value):
+    """Độ dài hiển thị ước lượng của 1 ô."""
+    if value is None:
+        return 0
+    if isinstance(value, dt.datetime):
+        return 16
+    if isinstance(value, dt.date):
+        return 10
+    if isinstance(value, str):
+        return max((len(line) for line in value.split('\n')), default=0)
+    return len(str(value))
+
+
+class _ColumnWidths:
+    """Theo dõi độ dài lớn nhất của từng cột khi các dòng đi qua."""
+
+    def __init__(self):
+        self.max_lengths = []
+
+    def track(self, row):
+        for idx, value in enumerate(row):
+            length = _display_len(value)
+            if idx >= len(self.max_lengths):
+                self.max_lengths.append(length)
+            elif length > self.max_lengths[idx]:
+                self.max_lengths[idx] = length
+
+    def apply(self, worksheet):
+        for idx, length in enumerate(self.max_lengths, 1):
+            if length:
+                worksheet.column_dimensions[get_column_letter(idx)].width = min(length + 2, XLSX_MAX_COLUMN_WIDTH)
+
+
+def _bold_row(worksheet, row, bold_columns):
+    """Thay giá trị ở các cột cần in đậm bằng WriteOnlyCell có font đậm."""
+    if not bold_columns:
+        return row
+    row = list(row)
+    size = len(row)
+    for col in bold_columns:
+        idx = col if col >= 0 else size + col
+        if 0 <= idx < size and row[idx] is not None:
+            cell = WriteOnlyCell(worksheet, value=row[idx])
+            cell.font = _BOLD
+            row[idx] = cell
+    return row
+
+
+def _sheet_title(title):
+    title = _INVALID_TITLE_CHARS.sub('-', str(title or '')).strip() or 'Sheet'
+    return title[:_MAX_TITLE_LENGTH]
+
+
+def _write_sheet(workbook, sheet):
+    # Trùng tên → openpyxl tự thêm số vào cuối
+    worksheet = workbook.create_sheet(title=_sheet_title(sheet.title))
+    rows = iter(sheet.rows)
+
+    # Độ rộng cột: header + các dòng đầu (chỉ giữ tối đa XLSX_WIDTH_SAMPLE_ROWS dòng trong bộ nhớ)
+    sample = [list(row) for row in islice(rows, XLSX_WIDTH_SAMPLE_ROWS)]
+    widths = _ColumnWidths()
+    widths.track(sheet.headers)
+    for row in sample:
+        widths.track(row)
+    widths.apply(worksheet)
+
+    header_cells = []
+    for value in sheet.headers:
+        cell = WriteOnlyCell(worksheet, value=value)
+        cell.font = _BOLD
+        header_cells.append(cell)
+    worksheet.append(header_cells)
+
+    for row in chain(sample, rows):
+        worksheet.append(_bold_row(worksheet, row, sheet.bold_columns))
+
+
+def write_xlsx(sheets, target):
+    """
+    Ghi các sheet ra file xlsx (đường dẫn hoặc file object có seek).
+    Mỗi sheet được ghi tuần tự, dòng nào ghi xong thì bỏ khỏi bộ nhớ.
+    """
+    workbook = Workbook(write_only=True)
+    for sheet in sheets:
+        _write_sheet(workbook, sheet)
+    workbook.save(target)
+
+
+def xlsx_streaming_response(sheets, filename):
+    """
+    Xuất các sheet ra file tạm trên đĩa rồi trả về FileResponse (StreamingHttpResponse, gửi theo từng khối).
+    File tạm tự xóa khi response đóng.
+    """
+    buffer = tempfile.TemporaryFile(suffix='.xlsx')
+    try:
+        write_xlsx(sheets, buffer)
+        buffer.seek(0)
+    except Exception:
+        buffer.close()
+        raise
+    return FileResponse(buffer, as_attachment=True, filename=filename, content_type=XLSX_CONTENT_TYPE)
@@ -348,4 +348,9 @@ CACHES = {
             "CLIENT_CLASS": "django_redis.client.DefaultClient",
         }
     }
-}
\ No newline at end of file
+}
+
+# Thư mục lưu file báo cáo xuất nền (Celery) - dùng chung giữa web và worker
+REPORT_EXPORT_DIR = Path(os.getenv("REPORT_EXPORT_DIR") or BASE_DIR / 'storage' / 'exports')
+# Thời gian giữ file báo cáo đã xuất (giây)
+REPORT_EXPORT_TTL = int(os.getenv("REPORT_EXPORT_TTL") or 24 * 3600)
@@ -26,6 +26,7 @@ class TimekeepingSummaryManager {
             searchInput: document.getElementById('search-input'),
             tabNav: document.querySelector('#tab-container nav'),
             employeeCount: document.getElementById('employee-count'),
+            exportSummaryBtn: document.getElementById('export-summary-btn'),
             jobSummaryBody: document.getElementById('job-summary-body'),
             panes: {
                 '#tab-tong-hop': document.getElementById('tab-tong-hop'),
@@ -812,6 +813,22 @@ class TimekeepingSummaryManager {
         return tenCa;
     }
 
+    async exportSummary() {
+        const btn = this.els.exportSummaryBtn;
+        if (!btn || btn.disabled) return;
+        const { thang, phongban_id, search, loai_chamcong } = this.getFilterParams();
+        btn.disabled = true;
+        try {
+            AppUtils.Notify.info('Đang xuất bảng tổng hợp, file sẽ tự tải về khi xong...');
+            await AppUtils.ReportExport.run('tong_hop_cham_cong_thang', { thang, phongban_id, search, loai_chamcong });
+        } catch (error) {
+            console.error('Export Error:', error);
+            AppUtils.Notify.error(error.message);
+        } finally {
+            btn.disabled = false;
+        }
+    }
+
     initEventListeners() {
         // 1. Filter Form Changes
         this.els.filterForm.querySelectorAll('input, select').forEach(input => {
@@ -828,6 +845,11 @@ class TimekeepingSummaryManager {
             });
         });
 
+        // Xuất Excel bảng tổng hợp tháng (job chạy nền, theo bộ lọc hiện tại)
+        if (this.els.exportSummaryBtn) {
+            this.eventManager.add(this.els.exportSummaryBtn, 'click', () => this.exportSummary());
+        }
+
         // 2. Search Input Changes (Debounced using AppUtils)
         if (this.els.searchInput) {
             const debouncedSearch = AppUtils.Helper.debounce(() => {
@@ -55,27 +55,19 @@ $(document).ready(function() {
         }
     }
 
+    // Xuất Excel chạy nền (Celery): web worker không bị giữ trong lúc dựng file cho khoảng thời gian lớn
     async function api_exportExcel(filters = {}) {
+        const $btn = $('#export-report-btn');
+        if ($btn.prop('disabled')) return;
+        $btn.prop('disabled', true).addClass('opacity-50 cursor-not-allowed');
         try {
-            const queryParams = new URLSearchParams(filters).toString();
-            const response = await fetch(`/dichvudiennuoc/api/baocaodoanhthu/export/?${queryParams}`);
-            
-            if (response.ok) {
-                const blob = await response.blob();
-                const url = window.URL.createObjectURL(blob);
-                const a = document.createElement('a');
-                a.href = url;
-                a.download = `BaoCaoDoanhThu_${new Date().toISOString().split('T')[0]}.xlsx`;
-                document.body.appendChild(a);
-                a.click();
-                window.URL.revokeObjectURL(url);
-                document.body.removeChild(a);
-            } else {
-                alert('Lỗi xuất Excel');
-            }
+            AppUtils.Notify.info('Đang xuất báo cáo, file sẽ tự tải về khi xong...');
+            await AppUtils.ReportExport.run('doanh_thu', filters);
         } catch (error) {
             console.error('Export Error:', error);
-            alert('Lỗi xuất file');
+            alert('Lỗi xuất file: ' + error.message);
+        } finally {
+            $btn.prop('disabled', false).removeClass('opacity-50 cursor-not-allowed');
         }
     }
 
@@ -94,19 +94,26 @@ class PayrollDetailManager {
 
     // --- 2. DATA HANDLING ---
 
-    async loadCombinedData() {
+    async loadCombinedData(payrollResOverride = null) {
         this.toggleLoading(true);
         try {
-            const [employeeRes, payrollRes] = await Promise.all([
+            const [employeeRes, payrollListRes] = await Promise.all([
                 AppUtils.API.get('/hrm/to-chuc-nhan-su/api/v1/phong-ban/employee/', { 
                     page_size: 1000, 
                     ordering: 'ten_nhanvien' 
                 }),
-                AppUtils.API.get('/hrm/quan-ly-luong/api/phieu-luong/list', { 
-                    bangluong_id: this.currentPayrollId
+                payrollResOverride || AppUtils.API.get('/hrm/quan-ly-luong/api/phieu-luong/list', { 
+                    bangluong_id: this.currentPayrollId,
+                    async: 1
                 })
             ]);
 
+            // Chưa có phiếu lương: server sinh phiếu chạy nền, chờ job hoàn tất rồi lấy kết quả
+            let payrollRes = payrollListRes;
+            if (payrollRes?.success && payrollRes.data?.job_id) {
+                payrollRes = await this.waitPayrollJob(payrollRes.data.job_id);
+            }
+
             if (!payrollRes.success) throw new Error(payrollRes.message || 'Lỗi tải dữ liệu lương');
             
             let allEmployees = employeeRes.data || (Array.isArray(employeeRes) ? employeeRes : []);
@@ -169,6 +176,46 @@ class PayrollDetailManager {
         }
     }
 
+    // Mặc định chờ tối đa 1200 × 1.5s = 30 phút (bằng thời hạn khóa job phía server)
+    async waitPayrollJob(jobId, intervalMs = 1500, maxAttempts = 1200) {
+        const baseUrl = `/hrm/quan-ly-luong/api/phieu-luong/generate-job/${jobId}`;
+        for (let attempt = 0; attempt < maxAttempts; attempt++) {
+            const statusRes = await AppUtils.API.get(baseUrl);
+            if (statusRes?.success === false) throw new Error(statusRes.message || 'Lỗi sinh phiếu lương');
+
+            const job = statusRes.data || {};
+            if (job.status === 'SUCCESS') return AppUtils.API.get(`${baseUrl}/result`);
+            await new Promise(resolve => setTimeout(resolve, intervalMs));
+        }
+        throw new Error('Quá thời gian chờ sinh phiếu lương, vui lòng tải lại trang và thử lại');
+    }
+
+    async ensureTimesheets(employees, pageSize = 1000, maxPages = 500) {
+        const pending = employees.filter(emp => emp.extra_data && emp.extra_data.ngaychamcong === undefined);
+        if (pending.length === 0) return;
+
+        const timesheetMap = {};
+        pending.forEach(emp => { timesheetMap[String(emp.id)] = []; });
+
+        // Danh sách lớn (xuất tất cả): lấy theo cả bảng lương thay vì gửi hàng nghìn id trên URL
+        const params = { bangluong_id: this.currentPayrollId, page_size: pageSize };
+        if (pending.length <= 200) params.nhanvien_ids = Object.keys(timesheetMap).join(',');
+
+        // Dừng theo total_pages của trang đầu (và trần maxPages) để không lặp vô hạn nếu server trả sai has_next
+        let totalPages = maxPages;
+        for (let page = 1; page <= totalPages; page++) {
+            const res = await AppUtils.API.get('/hrm/quan-ly-luong/api/phieu-luong/ngay-cham-cong', { ...params, page });
+            if (res?.success === false) throw new Error(res.message || 'Lỗi tải nhật ký chấm công');
+
+            (res.data || []).forEach(ts => timesheetMap[String(ts.nhanvien_id)]?.push(ts));
+            if (!res.pagination?.has_next) break;
+            if (page === 1 && res.pagination.total_pages) totalPages = Math.min(res.pagination.total_pages, maxPages);
+            if (page >= totalPages) throw new Error('Nhật ký chấm công vượt quá số trang cho phép, vui lòng thu hẹp danh sách nhân viên');
+        }
+
+        pending.forEach(emp => { emp.extra_data.ngaychamcong = timesheetMap[String(emp.id)]; });
+    }
+
     normalizePayrollData(data) {
         let columnIds = [];
         let valuesMap = {}; 
@@ -186,14 +233,14 @@ class PayrollDetailManager {
             });
         } else if (typeof data.phieu_luong === 'object') {
             // Chế độ draft: phieu_luong là dict {empId: {phantu_id: {...}}}
-            const ngaychamcongMap = data.ngaychamcong || {};
+            // Nhật ký chấm công được tải lười qua ensureTimesheets khi cần (mở chi tiết / xuất Excel)
             isDraft = true;
             Object.keys(data.phieu_luong).forEach(empId => {
                 valuesMap[empId] = data.phieu_luong[empId];
                 extraDataMap[empId] = {
                     nhanvien_id: empId,
                     is_draft: true,
-                    ngaychamcong: ngaychamcongMap[empId] || []
+                    ngaychamcong: undefined
                 };
             });
         }
@@ -255,11 +302,22 @@ class PayrollDetailManager {
      * @param {string} scope - 'all' | 'selected' | 'single'
      * @param {string|number} singleId - ID nhân viên nếu scope là 'single'
      */
-    exportExcel(scope, singleId = null) {
+    async exportExcel(scope, singleId = null) {
         if (typeof XLSX === 'undefined') {
             return AppUtils.Notify.error('Thư viện Excel chưa được tải. Vui lòng tải lại trang.');
         }
 
+        try {
+            const selectedIds = this.excelManager.state.selectedItems;
+            await this.ensureTimesheets(this.allEmployeesData.filter(e => (
+                scope === 'all'
+                || (scope === 'selected' && selectedIds.has(String(e.id)))
+                || (scope === 'single' && String(e.id) === String(singleId))
+            )));
+        } catch (err) {
+            return AppUtils.Notify.error(err?.message || 'Lỗi tải nhật ký chấm công');
+        }
+
         if (scope === 'all') {
             // Case 1: Xuất 1 file tổng hợp cho tất cả (như cũ)
             const employees = this.allEmployeesData;
@@ -482,10 +540,16 @@ class PayrollDetailManager {
         if (this.excelManager) isLoading ? this.excelManager.showLoading?.() : this.excelManager.hideLoading?.();
     }
 
-    openDetailModal(employeeId) {
+    async openDetailModal(employeeId) {
         const row = this.excelManager.state.data.find(r => String(r.id) === String(employeeId));
         if (!row) return;
 
+        try {
+            await this.ensureTimesheets([row]);
+        } catch (err) {
+            AppUtils.Notify.error(err?.message || 'Lỗi tải nhật ký chấm công');
+        }
+
         const modalForm = document.querySelector('#detail-modal form');
         if (modalForm && this.modalTemplate) {
             modalForm.innerHTML = ''; 
@@ -948,13 +1012,16 @@ class PayrollDetailManager {
                 btn.innerHTML = '<i class="fas fa-spinner fa-spin mr-2"></i>Đang tính lại...';
 
                 try {
-                    const res = await AppUtils.API.post('/hrm/quan-ly-luong/api/phieu-luong/recalculate', {
-                        bangluong_id: String(this.currentPayrollId)
+                    const jobRes = await AppUtils.API.post('/hrm/quan-ly-luong/api/phieu-luong/generate-job', {
+                        bangluong_id: String(this.currentPayrollId),
+                        recalculate: true
                     });
+                    if (jobRes?.success === false) throw new Error(jobRes.message || 'Lỗi tính lại lương');
 
+                    const res = await this.waitPayrollJob(jobRes.data.job_id);
                     if (res?.success === false) throw new Error(res.message || 'Lỗi tính lại lương');
                     
-                    AppUtils.Notify.success(res?.message || 'Tính lại lương thành công');
+                    AppUtils.Notify.success('Tính lại lương thành công');
                     
                     // Update payroll status
                     this.payrollStatus = 'processing';
@@ -962,7 +1029,7 @@ class PayrollDetailManager {
                     if (statusInput) statusInput.value = 'processing';
 
                     // Reload table with new data
-                    await this.loadCombinedData();
+                    await this.loadCombinedData(res);
                 } catch (err) {
                     AppUtils.Notify.error(err?.message || 'Lỗi tính lại lương');
                 } finally {
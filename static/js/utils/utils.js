@@ -1278,6 +1278,52 @@ const AppUtils = (() => {
         };
     })();
 
+    // ============================================================
+    // REPORT EXPORT - Xuất báo cáo Excel chạy nền (Celery): gửi job → theo dõi trạng thái → tải file
+    // ============================================================
+    const ReportExport = {
+        JOB_URL: '/hrm/core/api/report-export/job',
+        POLL_INTERVAL_MS: 2000,
+        // Dừng theo dõi sau ~10 phút (job id không tồn tại ở PENDING mãi / worker ngừng chạy)
+        MAX_POLL_ATTEMPTS: 300,
+
+        /**
+         * @param {string} report - Mã báo cáo (REPORT_EXPORTS ở backend), VD 'doanh_thu'
+         * @param {Object} params - Bộ lọc của báo cáo
+         * @returns {Promise<Object>} Thông tin job đã xong (token, filename, download_url)
+         */
+        async run(report, params = {}, options = {}) {
+            const { intervalMs = this.POLL_INTERVAL_MS, maxAttempts = this.MAX_POLL_ATTEMPTS } = options;
+
+            const submitRes = await API.post(this.JOB_URL, { report, params });
+            if (submitRes?.success === false) throw new Error(submitRes.message || 'Không thể xuất báo cáo');
+
+            // File đã có sẵn cho cùng bộ lọc → có download_url ngay, không cần theo dõi
+            let job = submitRes.data || {};
+            for (let attempt = 0; !job.download_url; attempt++) {
+                if (!job.job_id || attempt >= maxAttempts) {
+                    throw new Error('Quá thời gian chờ xuất báo cáo, vui lòng thử lại sau');
+                }
+                await new Promise(resolve => setTimeout(resolve, intervalMs));
+                const statusRes = await API.get(`${this.JOB_URL}/${job.job_id}`);
+                if (statusRes?.success === false) throw new Error(statusRes.message || 'Không thể xuất báo cáo');
+                job = statusRes.data || {};
+            }
+
+            this.download(job.download_url, job.filename);
+            return job;
+        },
+
+        download(url, filename) {
+            const a = document.createElement('a');
+            a.href = url;
+            if (filename) a.download = filename;
+            document.body.appendChild(a);
+            a.click();
+            document.body.removeChild(a);
+        }
+    };
+
     // ============================================================
     // PUBLIC API
     // ============================================================
@@ -1298,6 +1344,7 @@ const AppUtils = (() => {
         TimeUtils,
         DeleteOperations,
         Formula,
+        ReportExport,
         get config() { return { ...config }; },
         get csrfToken() { return csrfToken; }
     };